@@ -0,0 +1,478 @@
+"""
+A counting engine for index reads, for triaging the undetermined reads of a lane. Barcodes are read from the FASTQ title lines, or from the sequences of
+I1 (and I2) index read files, 2-bit encoded with NumPy, and counted in a BarcodeTable of distinct codes and their counts. Header and single index file
+scans run across worker processes with fastq_mapreduce.scan(), and the per-worker tables are merged. Barcodes that can't be encoded, because they
+contain an N or aren't the expected length, are counted separately by their text.
+
+A BarcodeCollapser assigns the counted barcodes to the expected barcodes of a sample sheet, allowing one mismatch. A barcode one mismatch away from
+two expected barcodes is ambiguous and isn't assigned, and writeReport() lists the pairs of expected barcodes that are close enough to collide.
+"""
+
+import itertools
+import collections
+
+import numpy as np
+
+from gbsc_utils import codec
+from gbsc_utils import nucleic
+from gbsc_utils.fastq import fastq_utils
+from gbsc_utils.fastq import fastq_mapreduce
+from gbsc_utils.illumina import demux
+
+#: Longest barcode that can be 2-bit encoded in a uint64.
+MAX_LENGTH = 32
+#: Barcodes up to this long are counted per batch with np.bincount rather than by sorting.
+DENSE_MAX_LENGTH = 10
+#: Number of codes a BarcodeTable buffers before merging them into its counts.
+COMPACT_SIZE = 1 << 21
+#: Number of records counted at a time.
+BATCH_SIZE = 100000
+#: Number of records read to infer the barcode length.
+SNIFF_SIZE = 1000
+#: Assignment of a barcode that is one mismatch from more than one expected barcode.
+AMBIGUOUS = -2
+
+#: Maps each byte to a 2-bit base code, or to 4 for anything other than ACGT.
+_ENCODE = np.frombuffer(nucleic.BASE_CODES,dtype=np.uint8)
+
+def headerBarcode(attLine):
+    """
+    Function : Finds the barcode at the end of the title line of a FASTQ record, e.g. CGTACTAG for '@MONK:315:C2PWKACXX:6:1101:1458:1967 1:N:0:CGTACTAG'.
+               The '+' between the two indices of a dual-indexed read is removed.
+    Args     : attLine - bytes. The title line.
+    Returns  : bytes, or None if the title line doesn't end with a barcode.
+    """
+    barcode = attLine.rstrip().rsplit(b":",1)[-1].replace(b"+",b"")
+    if barcode and not barcode.strip(b"ACGTN"):
+        return barcode
+    return None
+
+def encode(barcodes,length):
+    """
+    Function : 2-bit encodes barcodes, with A, C, G, T as 0 to 3 and the first base in the highest bits.
+    Args     : barcodes - list of bytes.
+               length - int. The barcode length, at most MAX_LENGTH.
+    Returns  : two item tuple of the uint64 numpy.ndarray of codes, and the list of barcodes that couldn't be encoded because of their length or bases.
+    """
+    if not 0 < length <= MAX_LENGTH:
+        raise ValueError("Barcodes must be 1 to {} bases long, not {}.".format(MAX_LENGTH,length))
+    others = [x for x in barcodes if len(x) != length]
+    sized = [x for x in barcodes if len(x) == length] if others else barcodes
+    bases = _ENCODE[np.frombuffer(b"".join(sized),dtype=np.uint8)].reshape(-1,length)
+    bad = (bases > 3).any(axis=1)
+    if bad.any():
+        others.extend(itertools.compress(sized,bad))
+        bases = bases[~bad]
+    codes = np.zeros(len(bases),dtype=np.uint64)
+    for column in bases.T:
+        codes <<= np.uint64(2)
+        codes |= column
+    return codes,others
+
+def decode(code,length):
+    """
+    Function : Decodes a barcode encoded by encode().
+    Returns  : str.
+    """
+    code = int(code)
+    return "".join("ACGT"[(code >> (2 * i)) & 3] for i in range(length - 1,-1,-1))
+
+def _countCodes(codes,length):
+    """
+    Function : Counts the distinct codes in an array.
+    Returns  : two item tuple of the sorted distinct codes and their int64 counts.
+    """
+    if length <= DENSE_MAX_LENGTH:
+        counts = np.bincount(codes.astype(np.intp))
+        distinct = np.flatnonzero(counts)
+        return distinct.astype(np.uint64),counts[distinct]
+    distinct,counts = np.unique(codes,return_counts=True)
+    return distinct,counts.astype(np.int64)
+
+class BarcodeTable:
+    """
+    Counts of the barcodes of one length. Encoded barcodes are held as a sorted array of distinct codes and an array of counts, and the barcodes that
+    couldn't be encoded are held in a collections.Counter of their text. Tables are picklable, so workers can count and return them to be merged.
+    """
+    def __init__(self,length):
+        """
+        Args : length - int. The barcode length, at most MAX_LENGTH.
+        """
+        if not 0 < length <= MAX_LENGTH:
+            raise ValueError("Barcodes must be 1 to {} bases long, not {}.".format(MAX_LENGTH,length))
+        self.length = length
+        self._codes = np.zeros(0,dtype=np.uint64)
+        self._counts = np.zeros(0,dtype=np.int64)
+        self._pending = []
+        self._numPending = 0
+        self.others = collections.Counter()
+
+    def add(self,barcodes):
+        """
+        Function : Counts a batch of barcodes.
+        Args     : barcodes - iterable of bytes. None items are skipped.
+        Returns  : self.
+        """
+        codes,others = encode([x for x in barcodes if x is not None],self.length)
+        self.others.update(x.decode() for x in others)
+        if len(codes):
+            self._addCounts(*_countCodes(codes,self.length))
+        return self
+
+    def merge(self,other):
+        """
+        Function : Adds the counts of another table of the same barcode length.
+        Returns  : self.
+        """
+        if other.length != self.length:
+            raise ValueError("Can't merge tables of {}bp and {}bp barcodes.".format(self.length,other.length))
+        codes,counts = other.counts()
+        self._addCounts(codes,counts)
+        self.others.update(other.others)
+        return self
+
+    def _addCounts(self,codes,counts):
+        self._pending.append((codes,counts))
+        self._numPending += len(codes)
+        if self._numPending > COMPACT_SIZE:
+            self._compact()
+
+    def _compact(self):
+        if not self._pending:
+            return
+        codes = np.concatenate([self._codes] + [x[0] for x in self._pending])
+        counts = np.concatenate([self._counts] + [x[1] for x in self._pending])
+        self._codes,inverse = np.unique(codes,return_inverse=True)
+        self._counts = np.zeros(len(self._codes),dtype=np.int64)
+        np.add.at(self._counts,inverse.ravel(),counts)
+        self._pending = []
+        self._numPending = 0
+
+    def __getstate__(self):
+        self._compact()
+        return self.__dict__
+
+    def counts(self):
+        """
+        Function : Gets the counts of the encoded barcodes.
+        Returns  : two item tuple of the sorted uint64 numpy.ndarray of distinct codes, and the int64 numpy.ndarray of their counts.
+        """
+        self._compact()
+        return self._codes,self._counts
+
+    def total(self):
+        """
+        Function : Gets the number of barcodes counted, including those that couldn't be encoded.
+        Returns  : int.
+        """
+        return int(self.counts()[1].sum()) + sum(self.others.values())
+
+    def ranked(self,top=None):
+        """
+        Function : Ranks the barcodes by their counts, with ties in barcode order.
+        Args     : top - int. If set, only this many of the most common barcodes are returned.
+        Returns  : list of two item tuples of (barcode,count), where barcode is a str.
+        """
+        codes,counts = self.counts()
+        order = np.argsort(-counts,kind="stable")
+        if top is not None:
+            order = order[:top]
+        ranked = [(decode(codes[i],self.length),int(counts[i])) for i in order]
+        ranked.extend(self.others.items())
+        ranked.sort(key=lambda x: (-x[1],x[0]))
+        return ranked[:top] if top is not None else ranked
+
+def mergeTables(table,other):
+    """
+    Function : A reducer and merge function for fastq_mapreduce.scan() that adds one BarcodeTable to another.
+    """
+    return table.merge(other)
+
+class _HeaderBarcodes:
+    """
+    A picklable mapper for fastq_mapreduce.scan() that counts the barcodes in the title lines of a batch of records.
+    """
+    def __init__(self,length):
+        self.length = length
+
+    def __call__(self,recs):
+        return BarcodeTable(self.length).add([headerBarcode(rec[0]) for rec in recs])
+
+class _SequenceBarcodes(_HeaderBarcodes):
+    """
+    A picklable mapper for fastq_mapreduce.scan() that counts the sequences of a batch of index read records.
+    """
+    def __call__(self,recs):
+        return BarcodeTable(self.length).add([rec[1].rstrip() for rec in recs])
+
+def _indexBarcodes(indexFiles):
+    """
+    Function : Yields the barcode of each read in one or two index read files, with the I2 sequence appended to the I1 sequence.
+    """
+    handles = [codec.openRead(x) for x in indexFiles]
+    try:
+        for recs in itertools.zip_longest(*[fastq_utils.blockparse(fh) for fh in handles]):
+            if None in recs:
+                raise ValueError("Index read files {} don't have the same number of records.".format(", ".join(indexFiles)))
+            yield b"".join(rec[1].rstrip() for rec in recs)
+    finally:
+        for fh in handles:
+            fh.close()
+
+def sniffLength(fqFiles,fromHeader=False):
+    """
+    Function : Infers the barcode length as the most common one among the first records.
+    Args     : fqFiles - list of FASTQ files. For index read files, the lengths of their reads are added up.
+               fromHeader - bool. True means that the barcodes are read from the title lines of the first file.
+    Returns  : int.
+    """
+    if fromHeader:
+        with codec.openRead(fqFiles[0]) as fh:
+            barcodes = [headerBarcode(rec[0]) for rec in itertools.islice(fastq_utils.blockparse(fh),SNIFF_SIZE)]
+    else:
+        barcodes = list(itertools.islice(_indexBarcodes(fqFiles),SNIFF_SIZE))
+    lengths = collections.Counter(len(x) for x in barcodes if x)
+    if not lengths:
+        raise ValueError("No barcodes found in the first records of {}.".format(fqFiles[0]))
+    return lengths.most_common(1)[0][0]
+
+def countHeaders(fqFile,length=None,batchSize=BATCH_SIZE,numProcs=None):
+    """
+    Function : Counts, in parallel, the barcodes at the ends of the title lines of a FASTQ file. Reads without a barcode aren't counted.
+    Args     : fqFile - A FASTQ file.
+               length - int. The barcode length. Inferred from the first records by default.
+               batchSize - int. The number of records counted at a time.
+               numProcs - int. The number of worker processes. Defaults to the number of CPUs.
+    Returns  : BarcodeTable.
+    """
+    length = length or sniffLength([fqFile],fromHeader=True)
+    return fastq_mapreduce.scan(fqFile,_HeaderBarcodes(length),mergeTables,BarcodeTable(length),batchSize=batchSize,numProcs=numProcs)
+
+def countIndexReads(indexFiles,length=None,batchSize=BATCH_SIZE,numProcs=None):
+    """
+    Function : Counts the barcodes of the reads in an I1 index read file, or of the read pairs in I1 and I2 files, where the barcode is the I1 sequence
+               followed by the I2 sequence. A single file is counted in parallel. A pair of files is read in step, and counted in batches in this process.
+    Args     : indexFiles - list of one or two FASTQ files.
+               length - int. The barcode length. Inferred from the first records by default.
+               batchSize - int. The number of records counted at a time.
+               numProcs - int. For a single file, the number of worker processes. Defaults to the number of CPUs.
+    Returns  : BarcodeTable.
+    """
+    length = length or sniffLength(indexFiles)
+    if len(indexFiles) == 1:
+        return fastq_mapreduce.scan(indexFiles[0],_SequenceBarcodes(length),mergeTables,BarcodeTable(length),batchSize=batchSize,numProcs=numProcs)
+    table = BarcodeTable(length)
+    barcodes = _indexBarcodes(indexFiles)
+    while True:
+        batch = list(itertools.islice(barcodes,batchSize))
+        if not batch:
+            return table
+        table.add(batch)
+
+def countLines(barcodesFile,length=None):
+    """
+    Function : Counts the barcodes in a text file with one barcode per line, such as is written by extract_barcodes.sh.
+    Args     : barcodesFile - The barcodes file.
+               length - int. The barcode length. Defaults to that of the first barcode.
+    Returns  : BarcodeTable.
+    """
+    table = None
+    with codec.openRead(barcodesFile) as fh:
+        while True:
+            lines = list(itertools.islice(fh,BATCH_SIZE))
+            if not lines:
+                break
+            batch = [x.strip().replace(b"+",b"") for x in lines if x.strip()]
+            if not batch:
+                continue
+            if table is None:
+                table = BarcodeTable(length or len(batch[0]))
+            table.add(batch)
+    return table or BarcodeTable(length or 1)
+
+def sampleSheetBarcodes(sampleSheet,lane=None):
+    """
+    Function : Reads the expected barcodes from the [Data] section of a bcl2fastq2 sample sheet. A sample's barcode is its index followed by its index2.
+               A barcode that is used by several samples, such as in different lanes, is named after all of them.
+    Args     : sampleSheet - path to the SampleSheet.
+               lane - int. If set, only the samples in this lane are read.
+    Returns  : dict of barcode (str) to sample name, in sample sheet order.
+    """
+    names = collections.OrderedDict()
+    for row in demux.readSampleSheet(sampleSheet):
+        if lane is not None and row["Lane"] not in (lane,None):
+            continue
+        barcode = row["index"] + row["index2"]
+        if barcode:
+            sampleNames = names.setdefault(barcode,[])
+            name = row["Sample_ID"] or row["Sample_Name"]
+            if name not in sampleNames:
+                sampleNames.append(name)
+    return collections.OrderedDict((barcode,"/".join(x)) for barcode,x in names.items())
+
+Tally = collections.namedtuple("Tally",["exact","oneMismatch","ambiguous","unassigned","pairReads"])
+
+class BarcodeCollapser:
+    """
+    Assigns barcodes to a set of expected barcodes, allowing one mismatch. The one mismatch neighbourhoods of the expected barcodes are built up front,
+    and a neighbour shared by two expected barcodes, or that is itself an expected barcode, is marked ambiguous. Lookups are then a binary search
+    of a sorted array of codes.
+    """
+    def __init__(self,barcodes,names=None):
+        """
+        Args : barcodes - list of str. The expected barcodes, all of the same length and made up of A, C, G and T.
+               names - list of str. The sample names of the barcodes. Defaults to the barcodes.
+        """
+        self.barcodes = [x.upper() for x in barcodes]
+        self.names = list(names) if names is not None else list(self.barcodes)
+        lengths = set(len(x) for x in self.barcodes)
+        if len(lengths) != 1:
+            raise ValueError("The expected barcodes must all have the same length, not lengths {}.".format(sorted(lengths)))
+        self.length = lengths.pop()
+        self.codes,bad = encode([x.encode() for x in self.barcodes],self.length)
+        if bad:
+            raise ValueError("Expected barcodes can only contain A, C, G and T: {}.".format(", ".join(x.decode() for x in bad)))
+        if len(np.unique(self.codes)) != len(self.codes):
+            raise ValueError("The expected barcodes aren't unique.")
+        numBarcodes = len(self.codes)
+        #XOR-ing the 2 bits of a base with 1, 2 or 3 gives the three other bases.
+        shifts = np.repeat(np.arange(self.length - 1,-1,-1,dtype=np.uint64) * np.uint64(2),3)
+        deltas = np.tile(np.array([1,2,3],dtype=np.uint64),self.length) << shifts
+        neighbours = (self.codes[:,None] ^ deltas[None,:]).ravel()
+        owners = np.repeat(np.arange(numBarcodes),3 * self.length)
+        distinct,inverse,counts = np.unique(neighbours,return_inverse=True,return_counts=True)
+        inverse = inverse.ravel()
+        shared = (counts > 1) | np.isin(distinct,self.codes)
+        #The expected barcodes that each shared neighbour is one mismatch from.
+        self._sharedOwners = collections.defaultdict(set)
+        for i in np.flatnonzero(shared[inverse]):
+            self._sharedOwners[int(neighbours[i])].add(int(owners[i]))
+        unique = ~shared[inverse]
+        ambiguous = distinct[shared & ~np.isin(distinct,self.codes)]
+        lookupCodes = np.concatenate([self.codes,neighbours[unique],ambiguous])
+        lookupOwners = np.concatenate([np.arange(numBarcodes),owners[unique],np.full(len(ambiguous),AMBIGUOUS)])
+        lookupMismatches = np.concatenate([np.zeros(numBarcodes,dtype=np.int8),np.ones(len(lookupCodes) - numBarcodes,dtype=np.int8)])
+        order = np.argsort(lookupCodes)
+        self._lookupCodes = lookupCodes[order]
+        self._lookupOwners = lookupOwners[order]
+        self._lookupMismatches = lookupMismatches[order]
+
+    @classmethod
+    def fromSampleSheet(cls,sampleSheet,lane=None):
+        """
+        Function : Makes a collapser for the expected barcodes of a sample sheet. See sampleSheetBarcodes().
+        Returns  : BarcodeCollapser.
+        """
+        barcodes = sampleSheetBarcodes(sampleSheet,lane)
+        if not barcodes:
+            raise ValueError("SampleSheet {} doesn't have any indexed samples.".format(sampleSheet))
+        return cls(list(barcodes),list(barcodes.values()))
+
+    def assign(self,codes):
+        """
+        Function : Assigns encoded barcodes to the expected barcodes.
+        Args     : codes - uint64 numpy.ndarray of codes of barcodes of the collapser's length.
+        Returns  : two item tuple of numpy.ndarrays. The first has the index of the assigned expected barcode for each code, or -1 for a code that
+                   isn't within one mismatch of any, or AMBIGUOUS. The second has the number of mismatches to the assigned barcode.
+        """
+        pos = np.searchsorted(self._lookupCodes,codes)
+        pos[pos == len(self._lookupCodes)] = 0
+        found = self._lookupCodes[pos] == codes
+        owners = np.where(found,self._lookupOwners[pos],-1)
+        mismatches = np.where(found,self._lookupMismatches[pos],0)
+        return owners,mismatches
+
+    def closePairs(self,maxDistance=2):
+        """
+        Function : Finds the pairs of expected barcodes within a Hamming distance of each other. Barcodes two mismatches apart share two one mismatch
+                   neighbours, and barcodes one mismatch apart can't be told apart at all with one mismatch allowed.
+        Args     : maxDistance - int.
+        Returns  : list of three item tuples of (index,index,distance), where the first index is the lesser.
+        """
+        bases = np.array([list(x) for x in self.barcodes]).reshape(len(self.barcodes),-1)
+        pairs = []
+        for i in range(len(bases) - 1):
+            distances = (bases[i + 1:] != bases[i]).sum(axis=1)
+            for j in np.flatnonzero(distances <= maxDistance):
+                pairs.append((i,i + 1 + int(j),int(distances[j])))
+        return pairs
+
+    def tally(self,table):
+        """
+        Function : Totals the counts of a table by expected barcode.
+        Args     : table - BarcodeTable of barcodes of the collapser's length.
+        Returns  : Tally, whose exact and oneMismatch are int64 numpy.ndarrays of the counts assigned to each expected barcode, ambiguous and unassigned
+                   are the total counts of ambiguous and unassigned barcodes, and pairReads is a collections.Counter of the counts of ambiguous barcodes
+                   for each pair of expected barcodes (as a sorted tuple of their indices) that they are close to.
+        """
+        if table.length != self.length:
+            raise ValueError("The table has {}bp barcodes, but the expected barcodes are {}bp.".format(table.length,self.length))
+        codes,counts = table.counts()
+        owners,mismatches = self.assign(codes)
+        numBarcodes = len(self.codes)
+        assigned = owners >= 0
+        exact = np.bincount(owners[assigned & (mismatches == 0)],weights=counts[assigned & (mismatches == 0)],minlength=numBarcodes).astype(np.int64)
+        oneMismatch = np.bincount(owners[assigned & (mismatches == 1)],weights=counts[assigned & (mismatches == 1)],minlength=numBarcodes).astype(np.int64)
+        isAmbiguous = owners == AMBIGUOUS
+        pairReads = collections.Counter()
+        for code,count in zip(codes[isAmbiguous],counts[isAmbiguous]):
+            for pair in itertools.combinations(sorted(self._sharedOwners[int(code)]),2):
+                pairReads[pair] += int(count)
+        unassigned = int(counts[owners == -1].sum()) + sum(table.others.values())
+        return Tally(exact,oneMismatch,int(counts[isAmbiguous].sum()),unassigned,pairReads)
+
+    def describe(self,barcode):
+        """
+        Function : Describes the assignment of a barcode, for the ranked table of writeReport().
+        Args     : barcode - str.
+        Returns  : two item tuple of the sample name (or a description of the ambiguity, or the empty string) and the number of mismatches (or the empty string).
+        """
+        codes,bad = encode([barcode.encode()],self.length)
+        if bad:
+            return "",""
+        owners,mismatches = self.assign(codes)
+        owner = int(owners[0])
+        if owner == AMBIGUOUS:
+            return "ambiguous: " + ",".join(self.names[i] for i in sorted(self._sharedOwners[int(codes[0])])),1
+        if owner < 0:
+            return "",""
+        return self.names[owner],int(mismatches[0])
+
+def _percent(count,total):
+    return "{:.2f}".format(100.0 * count / total) if total else "0.00"
+
+def writeReport(fout,table,collapser=None,top=50):
+    """
+    Function : Writes a tab-delimited report of barcode counts. With a collapser, there is first a summary of the reads assigned to each sample and a
+               collision analysis of the expected barcodes that are two or fewer mismatches apart, with the number of reads that were left unassigned
+               because they are one mismatch from both. The report ends with the ranked table of the most common barcodes.
+    Args     : fout - A text file handle.
+               table - BarcodeTable.
+               collapser - BarcodeCollapser. If not set, the barcodes are only ranked.
+               top - int. The number of barcodes in the ranked table. None means all of them.
+    """
+    total = table.total()
+    fout.write("Reads\t{}\n".format(total))
+    fout.write("Distinct barcodes\t{}\n".format(len(table.counts()[0]) + len(table.others)))
+    fout.write("Reads with an N or a barcode that isn't {}bp\t{}\n".format(table.length,sum(table.others.values())))
+    if collapser is not None:
+        tally = collapser.tally(table)
+        fout.write("\n#Samples\n")
+        fout.write("Sample\tBarcode\tExact\tOne mismatch\tTotal\tPercent\n")
+        for i,name in enumerate(collapser.names):
+            assigned = int(tally.exact[i] + tally.oneMismatch[i])
+            fout.write("\t".join([name,collapser.barcodes[i],str(tally.exact[i]),str(tally.oneMismatch[i]),str(assigned),_percent(assigned,total)]) + "\n")
+        fout.write("Ambiguous\t\t\t{}\t{}\t{}\n".format(tally.ambiguous,tally.ambiguous,_percent(tally.ambiguous,total)))
+        fout.write("Undetermined\t\t\t\t{}\t{}\n".format(tally.unassigned,_percent(tally.unassigned,total)))
+        fout.write("\n#Collisions\n")
+        fout.write("Sample\tSample\tBarcode\tBarcode\tMismatches\tAmbiguous reads\n")
+        for i,j,distance in collapser.closePairs():
+            fout.write("\t".join([collapser.names[i],collapser.names[j],collapser.barcodes[i],collapser.barcodes[j],str(distance),str(tally.pairReads[(i,j)])]) + "\n")
+    fout.write("\n#Barcodes\n")
+    fout.write("Barcode\tCount\tPercent")
+    fout.write("\tSample\tMismatches\n" if collapser is not None else "\n")
+    for barcode,count in table.ranked(top):
+        fields = [barcode,str(count),_percent(count,total)]
+        if collapser is not None:
+            fields.extend(str(x) for x in collapser.describe(barcode))
+        fout.write("\t".join(fields) + "\n")
@@ -1,29 +1,80 @@
 #!/usr/bin/env python
 
 from optparse import OptionParser
-import operator
+import sys
+
+from gbsc_utils.barcodecounter import barcode_table
+
+def headerBarcode(rec):
+    """
+    Returns the barcode at the end of the title line of a FASTQ record, e.g. CGTACTAG for
+    '@MONK:315:C2PWKACXX:6:1101:1458:1967 1:N:0:CGTACTAG', or None if there isn't one.
+    """
+    barcode = barcode_table.headerBarcode(rec[0])
+    if barcode is not None:
+        return barcode.decode()
+    return None
 
 class BarcodeCounter(object):
-    def __init__(self, barcodesfile):
+    def __init__(self, barcodesfile, fastq=False, procs=None, indexfiles=None, samplesheet=None, lane=None, length=None, top=50):
         self.barcodesfile = barcodesfile
-        self.barcodes = {}
-    def count(self):
-        with open(self.barcodesfile) as f:
-            for line in f:
-                barcode = line.strip()
-                self.barcodes.setdefault(barcode,0)
-                self.barcodes[barcode] += 1
-        sorted_barcodes = sorted(self.barcodes.iteritems(), key=operator.itemgetter(1), reverse=True)
-        common=sorted_barcodes[0:49]
-        for barcode in common:
-            print "%s %s" % barcode
+        self.fastq = fastq
+        self.procs = procs
+        self.indexfiles = indexfiles
+        self.collapser = None
+        if samplesheet:
+            self.collapser = barcode_table.BarcodeCollapser.fromSampleSheet(samplesheet, lane)
+            length = length or self.collapser.length
+        self.length = length
+        self.top = top
+        self.table = None
+    def count(self, fout=sys.stdout):
+        if self.indexfiles:
+            self.table = barcode_table.countIndexReads(self.indexfiles, self.length, numProcs=self.procs)
+        elif self.fastq:
+            self.table = barcode_table.countHeaders(self.barcodesfile, self.length, numProcs=self.procs)
+        else:
+            self.table = barcode_table.countLines(self.barcodesfile, self.length)
+        barcode_table.writeReport(fout, self.table, self.collapser, self.top)
 
 if __name__=='__main__':
-    usage = '%prog barcodesfile.txt'
+    usage = '%prog [options] barcodesfile.txt | --fastq input.fastq | --index I1.fastq [--index I2.fastq]'
     parser = OptionParser(usage)
+    parser.add_option('--fastq',
+                      action='store_true',
+                      default=False,
+                      help='The input is a FASTQ file, and the barcodes are read from the title lines in parallel, rather than from a file written by extract_barcodes.sh')
+    parser.add_option('--index',
+                      action='append',
+                      dest='indexfiles',
+                      help='An I1 index read FASTQ file to read the barcodes from. Give twice, for I1 and then I2, for dual-indexed runs.')
+    parser.add_option('-s',
+                      '--sample-sheet',
+                      help='A bcl2fastq2 sample sheet. Barcodes within one mismatch of its indices are assigned to its samples, and the expected barcodes that can collide are reported.')
+    parser.add_option('-l',
+                      '--lane',
+                      type='int',
+                      help='With --sample-sheet, only the samples in this lane are expected.')
+    parser.add_option('-k',
+                      '--length',
+                      type='int',
+                      help='The barcode length. Barcodes of other lengths are counted by their text. Defaults to the sample sheet barcode length, or the most common length in the first reads.')
+    parser.add_option('-n',
+                      '--top',
+                      type='int',
+                      default=50,
+                      help='The number of the most common barcodes to list. Default is %default.')
+    parser.add_option('-p',
+                      '--procs',
+                      type='int',
+                      help='With --fastq or a single --index file, the number of processes to use. Defaults to the number of CPUs.')
     (opts, args) = parser.parse_args()
-    if len(args) != 1:
+    if opts.indexfiles:
+        if args or len(opts.indexfiles) > 2:
+            parser.error("give one or two --index files and no other arguments")
+    elif len(args) != 1:
         parser.error("incorrect number of arguments")
 
-    bc = BarcodeCounter(args[0])
+    bc = BarcodeCounter(args[0] if args else None, fastq=opts.fastq, procs=opts.procs, indexfiles=opts.indexfiles,
+                        samplesheet=opts.sample_sheet, lane=opts.lane, length=opts.length, top=opts.top)
     bc.count()
@@ -0,0 +1,125 @@
+import io
+import unittest
+
+import numpy as np
+
+from gbsc_utils.barcodecounter import barcode_table
+from gbsc_utils.fastq.test import helpers
+
+SAMPLE_SHEET = """[Header]
+Date,2016-03-11
+
+[Data]
+Sample_Project,Lane,Sample_ID,Sample_Name,index,index2
+P1,1,S1,n1,ACGTAC,GGTT
+P1,1,S2,n2,ACGTTT,GGTT
+P1,1,S3,n3,TTTTTT,AAAA
+P1,2,S4,n4,CCCCCC,CCCC
+"""
+
+class TestBarcodeTable(unittest.TestCase):
+
+    def test_encode(self):
+        codes,others = barcode_table.encode([b"ACGT",b"acgn",b"TTTT",b"AC"],4)
+        self.assertEqual(list(codes),[0b00011011,255])
+        self.assertEqual(others,[b"AC",b"acgn"])
+        self.assertEqual(barcode_table.decode(codes[0],4),"ACGT")
+
+    def test_counts_and_merge(self):
+        for length in (4,12):
+            table = barcode_table.BarcodeTable(length)
+            table.add([b"A" * length,b"C" * length,b"A" * length,None,b"N" * length])
+            other = barcode_table.BarcodeTable(length).add([b"C" * length,b"C" * length])
+            table.merge(other)
+            self.assertEqual(table.total(),6)
+            self.assertEqual(table.ranked(),[("C" * length,3),("A" * length,2),("N" * length,1)])
+            self.assertEqual(table.ranked(1),[("C" * length,3)])
+
+    def test_compact(self):
+        rand = np.random.default_rng(4)
+        barcodes = [bytes(x) for x in rand.choice(list(b"ACGT"),size=(3000,5)).astype(np.uint8)]
+        table = barcode_table.BarcodeTable(5)
+        for i in range(0,3000,100):
+            table.add(barcodes[i:i + 100])
+        expected = {}
+        for x in barcodes:
+            expected[x.decode()] = expected.get(x.decode(),0) + 1
+        self.assertEqual(dict(table.ranked()),expected)
+
+class TestBarcodeCollapser(unittest.TestCase):
+
+    def setUp(self):
+        self.collapser = barcode_table.BarcodeCollapser(["ACGTAC","ACGTTT","GGGGGG"],["s1","s2","s3"])
+
+    def test_assign(self):
+        codes,others = barcode_table.encode([b"ACGTAC",b"ACGTAA",b"ACGTAT",b"GGGAGG",b"TTTTTT",b"ACGTTT"],6)
+        owners,mismatches = self.collapser.assign(codes)
+        #ACGTAT is one mismatch from both ACGTAC and ACGTTT.
+        self.assertEqual(list(owners),[0,0,barcode_table.AMBIGUOUS,2,-1,1])
+        self.assertEqual(list(mismatches),[0,1,1,1,0,0])
+
+    def test_tally(self):
+        table = barcode_table.BarcodeTable(6).add([b"ACGTAC"] * 5 + [b"ACGTAA"] * 2 + [b"ACGTAT"] * 3 + [b"GGGGGN",b"TTTTTT"])
+        tally = self.collapser.tally(table)
+        self.assertEqual(list(tally.exact),[5,0,0])
+        self.assertEqual(list(tally.oneMismatch),[2,0,0])
+        self.assertEqual((tally.ambiguous,tally.unassigned),(3,2))
+        self.assertEqual(tally.pairReads,{(0,1): 3})
+        self.assertEqual(self.collapser.closePairs(),[(0,1,2)])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError,barcode_table.BarcodeCollapser,["ACGT","ACG"])
+        self.assertRaises(ValueError,barcode_table.BarcodeCollapser,["ACGN"])
+        self.assertRaises(ValueError,barcode_table.BarcodeCollapser,["ACGT","acgt"])
+
+class TestCounting(helpers.TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sampleSheet = self.write("SampleSheet.csv",SAMPLE_SHEET)
+        self.indices = [("ACGTAC","GGTT")] * 40 + [("ACGTAA","GGTT")] * 7 + [("ACGTAT","GGTT")] * 2 + [("NTTTTT","AAAA")] * 3 + [("GATTAC","AAAA")] * 8
+
+    def test_sampleSheetBarcodes(self):
+        self.assertEqual(list(barcode_table.sampleSheetBarcodes(self.sampleSheet,lane=1).items()),[("ACGTACGGTT","S1"),("ACGTTTGGTT","S2"),("TTTTTTAAAA","S3")])
+        self.assertEqual(len(barcode_table.sampleSheetBarcodes(self.sampleSheet)),4)
+
+    def test_headers(self):
+        infile = self.write("in.fq",[("@r{} 1:N:0:{}+{}".format(i,i1,i2),"ACGT","+","IIII") for i,(i1,i2) in enumerate(self.indices)])
+        table = barcode_table.countHeaders(infile,numProcs=2)
+        self.assertEqual(table.length,10)
+        self.assertEqual(table.ranked(2),[("ACGTACGGTT",40),("GATTACAAAA",8)])
+        self.assertEqual(table.others,{"NTTTTTAAAA": 3})
+        collapser = barcode_table.BarcodeCollapser.fromSampleSheet(self.sampleSheet,lane=1)
+        report = io.StringIO()
+        barcode_table.writeReport(report,table,collapser,top=3)
+        lines = report.getvalue().splitlines()
+        self.assertIn("S1\tACGTACGGTT\t40\t7\t47\t78.33",lines)
+        self.assertIn("Ambiguous\t\t\t2\t2\t3.33",lines)
+        self.assertIn("Undetermined\t\t\t\t11\t18.33",lines)
+        self.assertIn("S1\tS2\tACGTACGGTT\tACGTTTGGTT\t2\t2",lines)
+        self.assertEqual(lines[-3:],["ACGTACGGTT\t40\t66.67\tS1\t0","GATTACAAAA\t8\t13.33\t\t","ACGTAAGGTT\t7\t11.67\tS1\t1"])
+
+    def test_index_files(self):
+        i1 = self.write("i1.fq",[("@r{}".format(i),x[0],"+","IIIIII") for i,x in enumerate(self.indices)])
+        i2 = self.write("i2.fq",[("@r{}".format(i),x[1],"+","IIII") for i,x in enumerate(self.indices)])
+        table = barcode_table.countIndexReads([i1,i2],batchSize=7)
+        self.assertEqual(table.total(),60)
+        self.assertEqual(table.ranked(1),[("ACGTACGGTT",40)])
+        single = barcode_table.countIndexReads([i1],numProcs=2)
+        self.assertEqual(single.ranked(2),[("ACGTAC",40),("GATTAC",8)])
+        short = self.write("short.fq",[("@r0","GGTT","+","IIII")])
+        self.assertRaises(ValueError,barcode_table.countIndexReads,[i1,short])
+
+    def test_lines(self):
+        infile = self.write("barcodes.txt","\n\n\nACGT\nAC+GT\n\nGGTT\n")
+        batchSize = barcode_table.BATCH_SIZE
+        barcode_table.BATCH_SIZE = 2
+        try:
+            table = barcode_table.countLines(infile)
+        finally:
+            barcode_table.BATCH_SIZE = batchSize
+        self.assertEqual(table.ranked(),[("ACGT",2),("GGTT",1)])
+        self.assertEqual(barcode_table.countLines(self.write("empty.txt","\n")).total(),0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,456 @@
+"""
+Reading and writing of BGZF, the blocked gzip format used by samtools/htslib (see the SAM specification). A BGZF file is a series of gzip members, each
+holding at most 64 KB of uncompressed data and recording its own compressed size in a 'BC' extra subfield. A position in the uncompressed stream is
+given as a virtual offset, which is the compressed offset of the block shifted left 16 bits, OR'd with the offset within the uncompressed block.
+Seeking to a virtual offset only requires inflating the single block it points into, unlike a plain gzip stream, which has to be re-inflated from the
+start of the file whenever a seek goes backwards.
+
+Since every BGZF file is also a valid gzip file, recompress() can be used to convert existing gzip'd FASTQ and FASTA files so that they benefit from
+random access without breaking any tools that read them.
+"""
+
+from argparse import ArgumentParser
+import io
+import os
+import gzip
+import collections
+import concurrent.futures
+import struct
+import zlib
+
+#: The maximum number of uncompressed bytes put in a block, as used by htslib, which ensures that the compressed block fits in 64 KB.
+MAX_BLOCK_DATA = 0xff00
+#: The maximum size of a compressed block, including its header and footer.
+MAX_BLOCK_SIZE = 0x10000
+#: The empty block that terminates a BGZF file.
+EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+#: Fixed gzip member header, up to and including XLEN.
+_GZIP_HEADER = struct.Struct("<BBBBIBBH")
+#: BGZF block header for a block having just the 'BC' extra subfield: ID1, ID2, CM, FLG, MTIME, XFL, OS, XLEN, SI1, SI2, SLEN, BSIZE.
+_BGZF_HEADER = struct.Struct("<BBBBIBBHBBHH")
+#: Block footer: CRC32 and ISIZE.
+_FOOTER = struct.Struct("<II")
+
+def isBlockHeader(data,pos=0):
+	"""
+	Function : Determines whether a BGZF block header, with just the 'BC' extra subfield as written by BgzfWriter and htslib, starts at the given position.
+	Args     : data - bytes.
+	           pos - int.
+	Returns  : bool.
+	"""
+	if len(data) < pos + _BGZF_HEADER.size:
+		return False
+	id1,id2,cm,flg,mtime,xfl,osId,xlen,si1,si2,slen,bsize = _BGZF_HEADER.unpack_from(data,pos)
+	return id1 == 31 and id2 == 139 and cm == 8 and flg == 4 and xlen == 6 and si1 == 66 and si2 == 67 and slen == 2
+
+def findBlockStart(infile,offset):
+	"""
+	Function : Finds the compressed offset of the first BGZF block that starts at or after the given offset, by searching for a block header followed
+	           by either another block header or the end of the file.
+	Args     : infile - str. A BGZF file.
+	           offset - int. A compressed offset.
+	Returns  : int, or None if there isn't a block after offset.
+	"""
+	fh = open(infile,'rb')
+	fh.seek(offset)
+	#A block is at most MAX_BLOCK_SIZE long, so a window of twice that holds a whole block and the header of the next.
+	window = fh.read(MAX_BLOCK_SIZE * 2 + _BGZF_HEADER.size)
+	fileSize = os.fstat(fh.fileno()).st_size
+	fh.close()
+	pos = window.find(b"\x1f\x8b\x08\x04")
+	while pos != -1:
+		if isBlockHeader(window,pos):
+			nextPos = pos + _BGZF_HEADER.unpack_from(window,pos)[-1] + 1
+			if offset + nextPos == fileSize or isBlockHeader(window,nextPos):
+				return offset + pos
+		pos = window.find(b"\x1f\x8b\x08\x04",pos + 1)
+	return None
+
+def isBgzf(infile):
+	"""
+	Function : Determines whether a file is BGZF compressed by checking that the first gzip member header has the 'BC' extra subfield.
+	Args     : infile - str. A file path.
+	Returns  : bool.
+	"""
+	fh = open(infile,'rb')
+	header = fh.read(18)
+	fh.close()
+	if len(header) < 18:
+		return False
+	id1,id2,cm,flg,mtime,xfl,osId,xlen = _GZIP_HEADER.unpack_from(header,0)
+	return id1 == 31 and id2 == 139 and cm == 8 and bool(flg & 4) and xlen >= 6 and header[12:14] == b"BC"
+
+def makeVirtualOffset(blockStart,withinBlock):
+	"""
+	Function : Combines the compressed offset of a block and an offset into the block's uncompressed data into a virtual offset.
+	Returns  : int.
+	"""
+	return (blockStart << 16) | withinBlock
+
+def splitVirtualOffset(virtualOffset):
+	"""
+	Function : Splits a virtual offset into the compressed offset of its block and the offset into the block's uncompressed data.
+	Returns  : two item tuple of ints.
+	"""
+	return virtualOffset >> 16,virtualOffset & 0xffff
+
+def compressBlock(data,level=6):
+	"""
+	Function : Compresses up to MAX_BLOCK_DATA bytes into a single BGZF block. If the data doesn't compress well enough to fit in a block, it is stored
+	           uncompressed instead.
+	Args     : data - bytes.
+	           level - int. The zlib compression level.
+	Returns  : bytes.
+	"""
+	if len(data) > MAX_BLOCK_DATA:
+		raise ValueError("Can't put {num} bytes into one BGZF block; the maximum is {max}.".format(num=len(data),max=MAX_BLOCK_DATA))
+	compressor = zlib.compressobj(level,zlib.DEFLATED,-15)
+	cdata = compressor.compress(data) + compressor.flush()
+	if len(cdata) + _BGZF_HEADER.size + _FOOTER.size > MAX_BLOCK_SIZE:
+		compressor = zlib.compressobj(0,zlib.DEFLATED,-15)
+		cdata = compressor.compress(data) + compressor.flush()
+	bsize = len(cdata) + _BGZF_HEADER.size + _FOOTER.size
+	header = _BGZF_HEADER.pack(31,139,8,4,0,0,255,6,66,67,2,bsize - 1)
+	return header + cdata + _FOOTER.pack(zlib.crc32(data),len(data))
+
+class BgzfReader:
+	"""
+	A read-only, seekable file object over a BGZF file. read() and readline() return bytes, and tell() and seek() work with virtual offsets. Only the
+	block being read is held in memory.
+
+	While the file is read sequentially, the uncompressed and compressed start of each block is recorded, so that virtualOffset() can afterwards convert
+	a position in the uncompressed stream into a virtual offset. This lets indexers find record boundaries in the uncompressed data with fast block
+	reads and convert them at the end.
+	"""
+	def __init__(self,infile):
+		self.name = infile
+		self.fh = open(infile,'rb')
+		self._blockStart = 0
+		self._blockSize = 0
+		self._data = b""
+		self._within = 0
+		#The uncompressed and compressed start of each block seen so far while reading forward from the start of the file.
+		self._ustarts = [0]
+		self._cstarts = [0]
+		self._loadBlock(0)
+
+	def __iter__(self):
+		while True:
+			line = self.readline()
+			if not line:
+				return
+			yield line
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*exc):
+		self.close()
+
+	def close(self):
+		self.fh.close()
+
+	def _loadBlock(self,blockStart):
+		"""
+		Function : Reads and inflates the block that starts at the given compressed offset. Empty blocks, such as the EOF marker, are skipped over.
+		           At the end of the file, the current block is left empty.
+		"""
+		while True:
+			self.fh.seek(blockStart)
+			header = self.fh.read(_GZIP_HEADER.size)
+			if not header:
+				self._blockStart = blockStart
+				self._blockSize = 0
+				self._data = b""
+				self._within = 0
+				return
+			id1,id2,cm,flg,mtime,xfl,osId,xlen = _GZIP_HEADER.unpack(header)
+			if id1 != 31 or id2 != 139 or not flg & 4:
+				raise ValueError("Invalid BGZF block at offset {offset} in file {infile}.".format(offset=blockStart,infile=self.name))
+			extra = self.fh.read(xlen)
+			bsize = None
+			pos = 0
+			while pos < xlen:
+				si1,si2,slen = struct.unpack_from("<BBH",extra,pos)
+				if si1 == 66 and si2 == 67:
+					bsize = struct.unpack_from("<H",extra,pos + 4)[0] + 1
+				pos += 4 + slen
+			if bsize is None:
+				raise ValueError("Missing BGZF block size at offset {offset} in file {infile}.".format(offset=blockStart,infile=self.name))
+			rest = self.fh.read(bsize - _GZIP_HEADER.size - xlen)
+			crc,isize = _FOOTER.unpack(rest[-_FOOTER.size:])
+			data = zlib.decompress(rest[:-_FOOTER.size],-15) if isize else b""
+			if len(data) != isize:
+				raise ValueError("Corrupt BGZF block at offset {offset} in file {infile}.".format(offset=blockStart,infile=self.name))
+			if blockStart > self._cstarts[-1]:
+				#The uncompressed start is only known when this block directly follows the last one recorded.
+				sequential = self._ustarts[-1] is not None and self._cstarts[-1] == self._blockStart and blockStart == self._blockStart + self._blockSize
+				self._cstarts.append(blockStart)
+				self._ustarts.append(self._ustarts[-1] + len(self._data) if sequential else None)
+			self._blockStart = blockStart
+			self._blockSize = bsize
+			self._data = data
+			self._within = 0
+			if data:
+				return
+			blockStart += bsize
+
+	def _nextBlock(self):
+		self._loadBlock(self._blockStart + self._blockSize)
+
+	def tell(self):
+		"""
+		Function : Returns the virtual offset of the current position.
+		"""
+		return makeVirtualOffset(self._blockStart,self._within)
+
+	def seek(self,virtualOffset,whence=0):
+		"""
+		Function : Moves to the given virtual offset. Only absolute seeks are supported.
+		"""
+		if whence != 0:
+			raise ValueError("BgzfReader only supports seeking to an absolute virtual offset.")
+		blockStart,within = splitVirtualOffset(virtualOffset)
+		if blockStart != self._blockStart or not self._data:
+			self._loadBlock(blockStart)
+		if within > len(self._data):
+			raise ValueError("Virtual offset {offset} is past the end of its block in file {infile}.".format(offset=virtualOffset,infile=self.name))
+		self._within = within
+		if self._within == len(self._data) and self._data:
+			self._nextBlock()
+		return virtualOffset
+
+	def read(self,size=-1):
+		"""
+		Function : Reads up to size uncompressed bytes from the current position, or the rest of the file when size is negative.
+		Returns  : bytes.
+		"""
+		chunks = []
+		while self._data and size != 0:
+			avail = len(self._data) - self._within
+			take = avail if size < 0 or size >= avail else size
+			chunks.append(self._data[self._within:self._within + take])
+			self._within += take
+			if size > 0:
+				size -= take
+			if self._within == len(self._data):
+				self._nextBlock()
+		return b"".join(chunks)
+
+	def readline(self):
+		"""
+		Function : Reads up to and including the next newline.
+		Returns  : bytes. Empty at the end of the file.
+		"""
+		chunks = []
+		while self._data:
+			nl = self._data.find(b"\n",self._within)
+			end = len(self._data) if nl == -1 else nl + 1
+			chunks.append(self._data[self._within:end])
+			self._within = end
+			if self._within == len(self._data):
+				self._nextBlock()
+			if nl != -1:
+				break
+		return b"".join(chunks)
+
+	def readRange(self,start,end):
+		"""
+		Function : Reads the uncompressed bytes between two virtual offsets, inflating only the blocks that they span.
+		Args     : start - int. The virtual offset of the first byte.
+		           end - int. The virtual offset just past the last byte.
+		Returns  : bytes.
+		"""
+		self.seek(start)
+		endBlock,endWithin = splitVirtualOffset(end)
+		chunks = []
+		while self._data:
+			if self._blockStart == endBlock:
+				chunks.append(self._data[self._within:endWithin])
+				self._within = endWithin
+				break
+			if self._blockStart > endBlock:
+				break
+			chunks.append(self._data[self._within:])
+			self._nextBlock()
+		return b"".join(chunks)
+
+	def readBlock(self,end=None):
+		"""
+		Function : Reads the rest of the current block's uncompressed data and moves on to the next block. This is the cheapest way to stream through
+		           a range of the file.
+		Args     : end - int. A virtual offset at which to stop. If it lies in the current block, only the data up to it is returned, and all further
+		           calls return empty bytes.
+		Returns  : bytes. Empty at the end of the file or range.
+		"""
+		if end is not None:
+			endBlock,endWithin = splitVirtualOffset(end)
+			if self._blockStart > endBlock:
+				return b""
+			if self._blockStart == endBlock:
+				data = self._data[self._within:endWithin]
+				self._within = max(self._within,endWithin)
+				return data
+		data = self._data[self._within:]
+		if data:
+			self._nextBlock()
+		return data
+
+	def virtualOffset(self,upos):
+		"""
+		Function : Converts a position in the uncompressed stream into a virtual offset. Only positions within blocks that have already been read
+		           sequentially from the start of the file can be converted.
+		Args     : upos - int. The number of uncompressed bytes from the start of the file.
+		Returns  : int.
+		"""
+		lo = 0
+		hi = len(self._ustarts)
+		#Find the last block whose uncompressed start is <= upos.
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if self._ustarts[mid] is None:
+				raise ValueError("Uncompressed position {upos} isn't in a block that was read sequentially.".format(upos=upos))
+			if self._ustarts[mid] <= upos:
+				lo = mid + 1
+			else:
+				hi = mid
+		i = lo - 1
+		within = upos - self._ustarts[i]
+		if within >= 0x10000:
+			raise ValueError("Uncompressed position {upos} isn't in a block that was read sequentially.".format(upos=upos))
+		return makeVirtualOffset(self._cstarts[i],within)
+
+	def writeGzi(self,gziFile):
+		"""
+		Function : Writes the block offsets recorded so far to a .gzi index, as used by samtools faidx for BGZF files. This is a count followed by
+		           the compressed and uncompressed start of each block after the first, all as little-endian unsigned 64-bit ints. The whole file
+		           should have been read sequentially first.
+		Args     : gziFile - str.
+		"""
+		if None in self._ustarts:
+			raise ValueError("Can't write a .gzi index for {infile} since it wasn't read sequentially.".format(infile=self.name))
+		with open(gziFile,'wb') as fout:
+			fout.write(struct.pack("<Q",len(self._cstarts) - 1))
+			for cstart,ustart in zip(self._cstarts[1:],self._ustarts[1:]):
+				fout.write(struct.pack("<QQ",cstart,ustart))
+
+	def readGzi(self,gziFile):
+		"""
+		Function : Loads the block offsets from a .gzi index (see writeGzi()), so that virtualOffset() can convert any position in the file without
+		           reading it first.
+		Args     : gziFile - str.
+		"""
+		with open(gziFile,'rb') as fh:
+			data = fh.read()
+		count = struct.unpack_from("<Q",data)[0]
+		offsets = struct.unpack_from("<{}Q".format(2 * count),data,8)
+		self._cstarts = [0] + list(offsets[0::2])
+		self._ustarts = [0] + list(offsets[1::2])
+
+class BgzfWriter(io.RawIOBase):
+	"""
+	A write-only file object that compresses its input into BGZF blocks. Accepts both bytes and str (which is UTF-8 encoded).
+
+	With threads > 1, blocks are compressed in a pool of threads, in the manner of pigz. zlib releases the GIL while compressing, so the blocks are
+	compressed concurrently, while still being written out in order. Up to PENDING_PER_THREAD blocks per thread are in flight at a time.
+	"""
+	PENDING_PER_THREAD = 4
+
+	def __init__(self,outfile,level=6,threads=1):
+		"""
+		Args : outfile - str. The output file name.
+		       level - int. The zlib compression level.
+		       threads - int. The number of compression threads.
+		"""
+		super().__init__()
+		self.name = outfile
+		self.level = level
+		self.fh = open(outfile,'wb')
+		self._buf = bytearray()
+		self._executor = None
+		self._pending = collections.deque()
+		if threads > 1:
+			self._executor = concurrent.futures.ThreadPoolExecutor(threads)
+			self._maxPending = threads * self.PENDING_PER_THREAD
+
+	def writable(self):
+		return True
+
+	def write(self,data):
+		if isinstance(data,str):
+			data = data.encode()
+		numBytes = memoryview(data).nbytes
+		self._buf += data
+		while len(self._buf) >= MAX_BLOCK_DATA:
+			self._writeBlock(bytes(self._buf[:MAX_BLOCK_DATA]))
+			del self._buf[:MAX_BLOCK_DATA]
+		return numBytes
+
+	def writelines(self,lines):
+		for line in lines:
+			self.write(line)
+
+	def _writeBlock(self,data):
+		"""
+		Function : Compresses a block, either inline or in the thread pool, and writes out any compressed blocks that are due.
+		"""
+		if not self._executor:
+			self.fh.write(compressBlock(data,self.level))
+			return
+		self._pending.append(self._executor.submit(compressBlock,data,self.level))
+		while len(self._pending) > self._maxPending:
+			self.fh.write(self._pending.popleft().result())
+
+	def flush(self):
+		"""
+		Function : Flushes the underlying file. Data that doesn't fill a block yet stays buffered until more is written or the file is closed, so that
+		           frequent flushes don't produce lots of small blocks.
+		"""
+		if not self.fh.closed:
+			self.fh.flush()
+
+	def close(self):
+		if self.fh.closed:
+			return
+		if self._buf:
+			self._writeBlock(bytes(self._buf))
+			self._buf = bytearray()
+		while self._pending:
+			self.fh.write(self._pending.popleft().result())
+		if self._executor:
+			self._executor.shutdown()
+		self.fh.write(EOF_BLOCK)
+		self.fh.close()
+		super().close()
+
+def recompress(infile,outfile,level=6,threads=1,chunkSize=4 * 1024 * 1024):
+	"""
+	Function : Recompresses a plain gzip (or uncompressed) file into BGZF. The output is still a valid gzip file.
+	Args     : infile - str. The input file. Read with gzip when it has a '.gz' extension, otherwise as uncompressed.
+	           outfile - str. The output BGZF file.
+	           level - int. The zlib compression level.
+	           threads - int. The number of compression threads.
+	           chunkSize - int. The number of bytes read from the input at a time.
+	"""
+	if infile.endswith(".gz"):
+		fh = gzip.open(infile,'rb')
+	else:
+		fh = open(infile,'rb')
+	fout = BgzfWriter(outfile,level=level,threads=threads)
+	while True:
+		chunk = fh.read(chunkSize)
+		if not chunk:
+			break
+		fout.write(chunk)
+	fout.close()
+	fh.close()
+
+if __name__ == "__main__":
+	description = "Recompresses a gzip'd (or uncompressed) FASTQ or FASTA file into BGZF, so that fastq_utils.Index and fasta.ByteIndex can seek into it without decompressing from the start of the file."
+	parser = ArgumentParser(description=description)
+	parser.add_argument('-i','--infile',required=True,help="The input file. Treated as gzip'd if it has a .gz extension.")
+	parser.add_argument('-o','--outfile',required=True,help="The output BGZF file.")
+	parser.add_argument('-l','--level',type=int,default=6,choices=range(0,10),help="The compression level. Default is %(default)s.")
+	parser.add_argument('-t','--threads',type=int,default=1,help="The number of compression threads. Default is %(default)s.")
+	args = parser.parse_args()
+	recompress(args.infile,args.outfile,level=args.level,threads=args.threads)
@@ -0,0 +1,238 @@
+"""
+Opens sequence files for reading and writing through the appropriate compression codec, so that callers don't have to special-case compressed files.
+
+For reading, the codec is chosen by the file's magic bytes rather than by its extension, and decompression happens in a background read-ahead thread
+(see ReadAheadReader), so that it overlaps with the caller's parsing. zlib and bz2 release the GIL while decompressing.
+
+For writing, the codec is chosen by the file extension. gzip output is written as BGZF, which any gzip reader can read, with the blocks compressed
+in a pool of threads (see bgzf.BgzfWriter). bz2 output is compressed on the calling thread, unless the file object is wrapped in a BackgroundWriter.
+"""
+
+import io
+import bz2
+import gzip
+import queue
+import threading
+import multiprocessing
+
+from gbsc_utils import bgzf
+
+PLAIN = "plain"
+GZIP = "gzip"
+BGZF = "bgzf"
+BZ2 = "bz2"
+
+#: File extensions mapped to the codec used for writing.
+WRITE_EXTENSIONS = {
+	".gz": BGZF,
+	".gzip": BGZF,
+	".bgz": BGZF,
+	".bz2": BZ2,
+}
+
+#: Number of uncompressed bytes that ReadAheadReader decompresses at a time.
+READ_AHEAD_CHUNK = 1024 * 1024
+
+def detectFormat(infile):
+	"""
+	Function : Determines the compression of a file from its magic bytes.
+	Args     : infile - str. A file path.
+	Returns  : str. One of PLAIN, GZIP, BGZF or BZ2.
+	"""
+	fh = open(infile,'rb')
+	magic = fh.read(3)
+	fh.close()
+	if magic[:2] == b"\x1f\x8b":
+		if bgzf.isBgzf(infile):
+			return BGZF
+		return GZIP
+	if magic == b"BZh":
+		return BZ2
+	return PLAIN
+
+def formatFromExtension(outfile):
+	"""
+	Function : Determines the codec to write a file with from its extension.
+	Args     : outfile - str. A file path.
+	Returns  : str. One of PLAIN, BGZF or BZ2.
+	"""
+	for ext,fmt in WRITE_EXTENSIONS.items():
+		if outfile.endswith(ext):
+			return fmt
+	return PLAIN
+
+class ReadAheadReader(io.RawIOBase):
+	"""
+	A read-only raw stream that reads a decompressing file object in a background thread, keeping up to 'depth' chunks queued ahead of the consumer.
+	"""
+	def __init__(self,fh,chunkSize=READ_AHEAD_CHUNK,depth=4):
+		"""
+		Args : fh - A binary file object, such as a gzip.GzipFile.
+		       chunkSize - int. The number of bytes to read from fh at a time.
+		       depth - int. The maximum number of chunks to queue.
+		"""
+		super().__init__()
+		self.fh = fh
+		self.name = getattr(fh,"name",None)
+		self.chunkSize = chunkSize
+		self._queue = queue.Queue(depth)
+		self._chunk = b""
+		self._pos = 0
+		self._eof = False
+		self._stop = False
+		self._thread = threading.Thread(target=self._fill,daemon=True)
+		self._thread.start()
+
+	def _fill(self):
+		"""
+		Function : Body of the read-ahead thread. Queues chunks until the end of the file, which is marked by an empty chunk. An exception raised while
+		           reading is queued too, to be raised in the consumer.
+		"""
+		try:
+			while not self._stop:
+				data = self.fh.read(self.chunkSize)
+				self._queue.put(data)
+				if not data:
+					break
+		except Exception as e:
+			self._queue.put(e)
+
+	def readable(self):
+		return True
+
+	def readinto(self,b):
+		view = memoryview(b).cast("B")
+		while self._pos == len(self._chunk):
+			if self._eof:
+				return 0
+			chunk = self._queue.get()
+			if isinstance(chunk,Exception):
+				self._eof = True
+				raise chunk
+			if not chunk:
+				self._eof = True
+				return 0
+			self._chunk = chunk
+			self._pos = 0
+		numBytes = min(len(view),len(self._chunk) - self._pos)
+		view[:numBytes] = self._chunk[self._pos:self._pos + numBytes]
+		self._pos += numBytes
+		return numBytes
+
+	def close(self):
+		if self.closed:
+			return
+		self._stop = True
+		#Unblock the thread if it's waiting to queue a chunk.
+		while self._thread.is_alive():
+			try:
+				self._queue.get(timeout=0.1)
+			except queue.Empty:
+				pass
+		self.fh.close()
+		super().close()
+
+class BackgroundWriter:
+	"""
+	Writes to a binary file object in a background thread, so that compression and disk writes overlap with the caller's work. Data is handed over in
+	batches with writelines(), and up to 'depth' batches are queued before writelines() blocks. The batch items are written as they are, so they mustn't be
+	changed after being handed over. zlib, bz2 and file writes release the GIL.
+	"""
+	def __init__(self,fh,depth=4):
+		"""
+		Args : fh - A binary file object, such as one returned by openWrite().
+		       depth - int. The maximum number of batches to queue.
+		"""
+		self.fh = fh
+		self.name = getattr(fh,"name",None)
+		self._queue = queue.Queue(depth)
+		self._error = None
+		self.closed = False
+		self._thread = threading.Thread(target=self._drain,daemon=True)
+		self._thread.start()
+
+	def _drain(self):
+		"""
+		Function : Body of the writer thread. Writes batches until the None that marks the end. After an error, batches are taken off the queue 
+		           but not written, so that the caller doesn't block, and the error is raised in the caller on the next call.
+		"""
+		while True:
+			batch = self._queue.get()
+			if batch is None:
+				break
+			if self._error:
+				continue
+			try:
+				self.fh.writelines(batch)
+			except Exception as e:
+				self._error = e
+
+	def _checkError(self):
+		if self._error:
+			raise self._error
+
+	def write(self,data):
+		self.writelines([data])
+
+	def writelines(self,lines):
+		"""
+		Function : Queues a batch of bytes-like objects for writing.
+		Args     : lines - list of bytes-like objects.
+		"""
+		self._checkError()
+		self._queue.put(lines)
+
+	def close(self):
+		"""
+		Function : Waits for the queued batches to be written, then closes the file object.
+		Raises   : Any exception raised while writing.
+		"""
+		if self.closed:
+			return
+		self.closed = True
+		self._queue.put(None)
+		self._thread.join()
+		self.fh.close()
+		self._checkError()
+
+def openRead(infile,text=False,readAhead=True):
+	"""
+	Function : Opens a file for reading, decompressing it according to its magic bytes.
+	Args     : infile - str. A file path.
+	           text - bool. True means to return a text-mode file object rather than a binary one.
+	           readAhead - bool. True means to decompress in a background thread.
+	Returns  : A file object.
+	"""
+	fmt = detectFormat(infile)
+	if fmt == PLAIN:
+		return open(infile,'r' if text else 'rb')
+	if fmt == BZ2:
+		fh = bz2.BZ2File(infile,'rb')
+	else:
+		fh = gzip.open(infile,'rb')
+	if readAhead:
+		fh = io.BufferedReader(ReadAheadReader(fh),READ_AHEAD_CHUNK)
+	if text:
+		fh = io.TextIOWrapper(fh)
+	return fh
+
+def openWrite(outfile,fmt=None,text=False,threads=None,level=6):
+	"""
+	Function : Opens a file for writing, compressing it according to fmt or, when fmt isn't given, to its extension (see WRITE_EXTENSIONS).
+	Args     : outfile - str. A file path.
+	           fmt - str. One of PLAIN, GZIP, BGZF or BZ2. GZIP is written as BGZF.
+	           text - bool. True means to return a text-mode file object rather than a binary one.
+	           threads - int. The number of BGZF compression threads. Defaults to the number of CPUs.
+	           level - int. The compression level.
+	Returns  : A file object.
+	"""
+	fmt = fmt or formatFromExtension(outfile)
+	if fmt in (GZIP,BGZF):
+		fh = io.BufferedWriter(bgzf.BgzfWriter(outfile,level=level,threads=threads or multiprocessing.cpu_count()),bgzf.MAX_BLOCK_DATA)
+	elif fmt == BZ2:
+		fh = bz2.BZ2File(outfile,'wb',compresslevel=max(level,1))
+	else:
+		fh = open(outfile,'wb')
+	if text:
+		fh = io.TextIOWrapper(fh)
+	return fh
@@ -0,0 +1,253 @@
+"""
+Sequence composition: mono-, di- and trinucleotide counts, GC content, and the CpG observed/expected ratio. A sequence is encoded once with kmers.encode(),
+and its dinucleotides and trinucleotides are the k-mer codes of kmers.kmerCodes(), as KmerCounter counts them, so overlapping occurrences, such as the
+two AA's in AAA, are all counted.
+
+For whole genomes, gcTrack() writes a bedGraph of the GC content (or CpG observed/expected) of fixed-size windows. Within a chromosome, the values of a
+batch of windows are differences of cumulative sums, so no window is scanned separately. Chromosomes are read in chunks from a FASTA file (through its
+.fai index, see fasta.ByteIndex) or a .2bit file (see twobit.py), and are processed in a pool of worker processes.
+
+Run the command-line interface as 'python -m gbsc_utils.fasta.composition'.
+"""
+
+from argparse import ArgumentParser
+import itertools
+import multiprocessing
+import sys
+
+import numpy as np
+
+from gbsc_utils import kmers
+from gbsc_utils.fasta import fasta
+from gbsc_utils.fasta import twobit
+
+#: The number of bases that are counted, or fetched for windows, at a time.
+CHUNK_SIZE = 1 << 24
+#: The values that gcTrack() can write.
+TRACK_VALUES = ("gc","cpg")
+
+#: The codes of kmers.encode() for C and G.
+_C = 1
+_G = 2
+
+def _kmerLabels(k):
+    return ["".join(x) for x in itertools.product("ACGT",repeat=k)]
+
+class Composition:
+    """
+    Mono-, di- and trinucleotide counts of one or more sequences. Dinucleotides and trinucleotides aren't counted across the ends of sequences, nor where
+    they contain an N or any other base than ACGT.
+    """
+    def __init__(self):
+        #: Counts of A, C, G, T and other bases.
+        self.mono = np.zeros(5,dtype=np.int64)
+        #: Counts of the 16 dinucleotides, indexed by their 2-bit codes (see kmers.kmerCodes()).
+        self.di = np.zeros(16,dtype=np.int64)
+        #: Counts of the 64 trinucleotides, indexed by their 2-bit codes.
+        self.tri = np.zeros(64,dtype=np.int64)
+
+    def add(self,seq):
+        """
+        Function : Counts a sequence.
+        Args     : seq - bytes, str, or a uint8 numpy.ndarray as returned by kmers.encode().
+        Returns  : self.
+        """
+        codes = seq if isinstance(seq,np.ndarray) else kmers.encode(seq)
+        for start in range(0,len(codes),CHUNK_SIZE):
+            #Two more bases than the chunk, for the dinucleotides and trinucleotides that start in it.
+            chunk = codes[start:start + CHUNK_SIZE + 2]
+            numBases = min(CHUNK_SIZE,len(codes) - start)
+            self.mono += np.bincount(chunk[:numBases],minlength=5)
+            self.di += np.bincount(kmers.kmerCodes(chunk[:numBases + 1],2).astype(np.intp),minlength=16)
+            self.tri += np.bincount(kmers.kmerCodes(chunk[:numBases + 2],3).astype(np.intp),minlength=64)
+        return self
+
+    def merge(self,other):
+        """
+        Function : Adds the counts of another Composition.
+        Returns  : self.
+        """
+        self.mono += other.mono
+        self.di += other.di
+        self.tri += other.tri
+        return self
+
+    def length(self):
+        """
+        Function : Returns the number of bases counted, including N's.
+        """
+        return int(self.mono.sum())
+
+    def numACGT(self):
+        """
+        Function : Returns the number of A, C, G and T bases counted.
+        """
+        return int(self.mono[:4].sum())
+
+    def gcContent(self):
+        """
+        Function : Returns the fraction of the A, C, G and T bases that are G or C, or None if there are none.
+        """
+        numACGT = self.numACGT()
+        if not numACGT:
+            return None
+        return float(self.mono[_C] + self.mono[_G]) / numACGT
+
+    def cpgObservedExpected(self):
+        """
+        Function : Returns the CpG observed/expected ratio of Gardiner-Garden and Frommer, i.e. CG count * number of bases / (C count * G count), with
+                   only A, C, G and T bases counted. None if there are no C's or G's.
+        """
+        numC,numG = int(self.mono[_C]),int(self.mono[_G])
+        if not numC or not numG:
+            return None
+        return float(self.di[_C * 4 + _G]) * self.numACGT() / (numC * numG)
+
+    def freqs(self,k):
+        """
+        Function : Returns the counts of the k-mers of a length from 1 to 3. N's and other bases aren't included.
+        Args     : k - int.
+        Returns  : dict of each k-mer to its count.
+        """
+        counts = {1: self.mono[:4],2: self.di,3: self.tri}[k]
+        return dict(zip(_kmerLabels(k),counts.tolist()))
+
+def composition(seq):
+    """
+    Function : Counts the composition of a sequence.
+    Args     : seq - bytes, str, or a uint8 numpy.ndarray as returned by kmers.encode().
+    Returns  : Composition.
+    """
+    return Composition().add(seq)
+
+def windowValues(codes,starts,size,value="gc"):
+    """
+    Function : Computes the GC content or CpG observed/expected ratio of windows of an encoded sequence, from the cumulative counts of the bases. Windows
+               are clipped to the end of the sequence.
+    Args     : codes - uint8 numpy.ndarray as returned by kmers.encode().
+               starts - int numpy.ndarray. The starts of the windows.
+               size - int. The window length.
+               value - str. One of TRACK_VALUES.
+    Returns  : float64 numpy.ndarray, with NaN for windows whose value is undefined, e.g. windows of only N.
+    """
+    if value not in TRACK_VALUES:
+        raise ValueError("Unknown window value {value}. Expected one of {values}.".format(value=value,values=", ".join(TRACK_VALUES)))
+    ends = np.minimum(starts + size,len(codes))
+    def windowSums(flags):
+        cumulative = np.concatenate([[0],np.cumsum(flags,dtype=np.int64)])
+        return cumulative[ends] - cumulative[starts]
+    numACGT = windowSums(codes < 4).astype(np.float64)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        if value == "gc":
+            values = windowSums((codes == _C) | (codes == _G)) / numACGT
+        else:
+            numC = windowSums(codes == _C)
+            numG = windowSums(codes == _G)
+            #A CpG is counted in a window when both of its bases are, i.e. by the C, over all but the last base of the window.
+            isCpG = np.concatenate([(codes[:-1] == _C) & (codes[1:] == _G),[False]])
+            cumulative = np.concatenate([[0],np.cumsum(isCpG,dtype=np.int64)])
+            numCpG = cumulative[np.maximum(ends - 1,starts)] - cumulative[starts]
+            values = numCpG * numACGT / (numC * numG)
+    values[~np.isfinite(values)] = np.nan
+    return values
+
+def openReference(infile):
+    """
+    Function : Opens a reference for random access: a .2bit file as a twobit.TwoBitFile, and anything else as a FASTA file through a fasta.ByteIndex.
+    Args     : infile - str.
+    """
+    if infile.endswith(".2bit"):
+        return twobit.TwoBitFile(infile)
+    return fasta.ByteIndex(infile)
+
+def fetchCodes(reference,name,start=0,end=None):
+    """
+    Function : Retrieves a range of a record's sequence, encoded as by kmers.encode().
+    Args     : reference - twobit.TwoBitFile or fasta.ByteIndex.
+    Returns  : uint8 numpy.ndarray.
+    """
+    if isinstance(reference,twobit.TwoBitFile):
+        return reference.fetchArray(name,start,end)
+    return kmers.encode(reference.fetch(name,start,end))
+
+_worker = {}
+
+def _initWorker(infile,size,step,value):
+    _worker["reference"] = openReference(infile)
+    _worker["size"] = size
+    _worker["step"] = step
+    _worker["value"] = value
+
+def _chromTrack(name):
+    """
+    Function : Computes the bedGraph lines of the windows of a chromosome, a chunk of windows at a time. Runs in a worker process set up by _initWorker().
+    Args     : name - str. The record name.
+    Returns  : str.
+    """
+    reference = _worker["reference"]
+    size,step,value = _worker["size"],_worker["step"],_worker["value"]
+    length = reference.getLength(name)
+    starts = np.arange(0,length,step,dtype=np.int64)
+    windowsPerChunk = max(CHUNK_SIZE // step,1)
+    lines = []
+    for i in range(0,len(starts),windowsPerChunk):
+        chunkStarts = starts[i:i + windowsPerChunk]
+        offset = int(chunkStarts[0])
+        codes = fetchCodes(reference,name,offset,int(chunkStarts[-1]) + size)
+        values = windowValues(codes,chunkStarts - offset,size,value)
+        ends = np.minimum(chunkStarts + size,length)
+        keep = ~np.isnan(values)
+        lines.extend("{}\t{}\t{}\t{:.4f}\n".format(name,start,end,x) for start,end,x in zip(chunkStarts[keep].tolist(),ends[keep].tolist(),values[keep].tolist()))
+    return "".join(lines)
+
+def gcTrack(infile,fout,size,step=None,value="gc",names=None,numProcs=None):
+    """
+    Function : Writes a bedGraph of the GC content, or the CpG observed/expected ratio, of windows along each record of a reference. Windows whose value
+               is undefined, such as runs of N, are left out. Records are processed in parallel, and written in order.
+    Args     : infile - str. A FASTA file, which may be gzip'd or BGZF, or a .2bit file.
+               fout - A file object open for writing text.
+               size - int. The window length.
+               step - int. The distance between the starts of consecutive windows. Defaults to size.
+               value - str. One of TRACK_VALUES.
+               names - list of record names. Defaults to all records, in file order.
+               numProcs - int. The number of worker processes. Defaults to the number of CPUs.
+    """
+    step = step or size
+    if size <= 0 or step <= 0:
+        raise ValueError("The window size and step must be positive.")
+    if value not in TRACK_VALUES:
+        raise ValueError("Unknown window value {value}. Expected one of {values}.".format(value=value,values=", ".join(TRACK_VALUES)))
+    #Opening the reference here builds any missing .fai index once, before the workers load it.
+    reference = openReference(infile)
+    names = names or reference.names()
+    numProcs = min(numProcs or multiprocessing.cpu_count(),len(names)) or 1
+    pool = None
+    if numProcs == 1:
+        _initWorker(infile,size,step,value)
+        results = map(_chromTrack,names)
+    else:
+        pool = multiprocessing.Pool(numProcs,initializer=_initWorker,initargs=(infile,size,step,value))
+        results = pool.imap(_chromTrack,names)
+    try:
+        for text in results:
+            fout.write(text)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+if __name__ == "__main__":
+    description = "Writes a bedGraph of the GC content, or CpG observed/expected ratio, of fixed-size windows along a reference genome. Run as python -m gbsc_utils.fasta.composition."
+    parser = ArgumentParser(description=description)
+    parser.add_argument('-i','--infile',required=True,help="The reference FASTA file, which may be gzip'd, or a .2bit file built with python -m gbsc_utils.fasta.twobit.")
+    parser.add_argument('-o','--outfile',help="The bedGraph file to write. Defaults to stdout.")
+    parser.add_argument('-w','--window',type=int,required=True,help="The window length.")
+    parser.add_argument('-s','--step',type=int,help="The distance between the starts of consecutive windows. Defaults to the window length.")
+    parser.add_argument('-v','--value',choices=TRACK_VALUES,default="gc",help="The value of each window: its GC content, or its CpG observed/expected ratio. Default is %(default)s.")
+    parser.add_argument('-n','--names',nargs="+",help="The records to include. Defaults to all of them.")
+    parser.add_argument('-p','--num-procs',type=int,help="The number of worker processes. Defaults to the number of CPUs.")
+    args = parser.parse_args()
+    fout = open(args.outfile,'w') if args.outfile else sys.stdout
+    gcTrack(args.infile,fout,args.window,args.step,args.value,args.names,args.num_procs)
+    if args.outfile:
+        fout.close()
@@ -7,7 +7,12 @@
 ###
 
 import sys
+import os
 import gzip
+import mmap
+import collections
+
+from gbsc_utils import bgzf
 
 def getFastaIdFromHeader(header):
     """
@@ -18,44 +23,425 @@ def getFastaIdFromHeader(header):
     header = header.lstrip(">")
     return header.strip().split()[0]
 
+#: One line of a samtools .fai index. offset is the uncompressed byte offset of the first base, lineBases the number of bases on each full line, and
+#: lineWidth the number of bytes on each full line, including the line terminator.
+FaiRecord = collections.namedtuple("FaiRecord",["name","length","offset","lineBases","lineWidth"])
+
+def scanRecords(fh):
+    """
+    Function : Scans a FASTA file and works out the .fai index line of each record, without failing on records whose lines differ in length. As with
+               samtools faidx, a record has a regular line layout when all of its lines except the last have the same length.
+    Args     : fh - A file object opened in binary mode, or a bgzf.BgzfReader.
+    Returns  : list of three item tuples, in file order, being the FaiRecord, the byte offset just past the record's last non-blank line, and None for a
+               record with a regular line layout, or otherwise a message saying where it isn't. The line lengths of an irregular record's FaiRecord
+               are None.
+    Raises   : ValueError if a record name is repeated, or there are sequence lines before the first title line.
+    """
+    records = []
+    seen = set()
+    pos = 0
+    name = None
+    def finish():
+        rec = FaiRecord(name,length,offset,None,None) if irregular else FaiRecord(name,length,offset,lineBases,lineWidth)
+        records.append((rec,seqEnd,irregular))
+    for line in fh:
+        lineStart = pos
+        pos += len(line)
+        if line.startswith(b">"):
+            if name is not None:
+                finish()
+            name = getFastaIdFromHeader(line.decode())
+            if name in seen:
+                raise ValueError("Duplicate record name {name} in FASTA file {infile}.".format(name=name,infile=getattr(fh,"name",fh)))
+            seen.add(name)
+            length = lineBases = lineWidth = 0
+            offset = seqEnd = pos
+            shortLine = False
+            irregular = None
+            continue
+        numBases = len(line.rstrip(b"\r\n"))
+        if name is None:
+            if numBases:
+                raise ValueError("Sequence before the first title line at byte {pos} of FASTA file {infile}.".format(pos=lineStart,infile=getattr(fh,"name",fh)))
+            continue
+        if not numBases:
+            shortLine = True
+            continue
+        if not lineBases:
+            lineBases = numBases
+            lineWidth = len(line)
+        elif (shortLine or numBases > lineBases) and not irregular:
+            irregular = "Different line length in record {name} at byte {pos} of FASTA file {infile}.".format(name=name,pos=lineStart,infile=getattr(fh,"name",fh))
+        elif numBases < lineBases:
+            shortLine = True
+        length += numBases
+        seqEnd = pos
+    if name is not None:
+        finish()
+    return records
+
+def buildFai(fh):
+    """
+    Function : Scans a FASTA file and works out the .fai index line of each record (see scanRecords()).
+    Args     : fh - A file object opened in binary mode, or a bgzf.BgzfReader.
+    Returns  : list of FaiRecord objects, in file order.
+    Raises   : ValueError if the line lengths within a record differ, a record name is repeated, or there are sequence lines before the first title line.
+    """
+    records = []
+    for rec,seqEnd,irregular in scanRecords(fh):
+        if irregular:
+            raise ValueError(irregular)
+        records.append(rec)
+    return records
+
+def readFai(faiFile):
+    """
+    Function : Reads a .fai index, as written by writeFai() or samtools faidx.
+    Args     : faiFile - str.
+    Returns  : list of FaiRecord objects.
+    """
+    records = []
+    with open(faiFile) as fh:
+        for line in fh:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            name,length,offset,lineBases,lineWidth = line.split("\t")[:5]
+            records.append(FaiRecord(name,int(length),int(offset),int(lineBases),int(lineWidth)))
+    return records
+
+def writeFai(faiFile,records):
+    """
+    Function : Writes a .fai index.
+    Args     : faiFile - str.
+               records - iterable of FaiRecord objects.
+    """
+    with open(faiFile,'w') as fout:
+        for rec in records:
+            fout.write("\t".join([str(x) for x in rec]) + "\n")
+
+def parseRegion(region):
+    """
+    Function : Parses a samtools style region, i.e. 'name', 'name:start' or 'name:start-end', where the positions are 1-based and inclusive, and may
+               contain commas.
+    Args     : region - str.
+    Returns  : tuple of the record name, the 0-based start, and the end (exclusive), or None when the region runs to the end of the record.
+    """
+    name,sep,span = region.rpartition(":")
+    if not sep:
+        return region,0,None
+    start,dash,end = span.replace(",","").partition("-")
+    if not start.isdigit() or (dash and not end.isdigit()):
+        #The colon is part of the name.
+        return region,0,None
+    return name,max(int(start) - 1,0),int(end) if dash else None
+
+def formatRecord(header,seq,numCharsPerLine=60):
+    """
+    Function : Formats a FASTA record, wrapping the sequence in lines of numCharsPerLine characters.
+    Args     : header - str. The title line, without the leading '>'.
+               seq - str.
+    Returns  : str.
+    """
+    lines = [seq[i:i + numCharsPerLine] for i in range(0,len(seq),numCharsPerLine)]
+    return ">" + header + "\n" + "".join(x + "\n" for x in lines)
+
+#: The number of bytes that records() and windows() read at a time.
+BLOCK_SIZE = 1 << 20
+#: The most bytes that ByteIndex.getRawRecords() reads at once for a run of adjacent records. A larger record is read on its own.
+READ_SIZE = 1 << 22
+#: The bytes that are removed from sequence lines.
+_WHITESPACE = b" \t\r\n"
+
+def _recordParts(fh,blockSize=BLOCK_SIZE):
+    """
+    Function : Reads a FASTA file a block at a time and splits it into title lines and pieces of sequence with the line breaks removed, without
+               splitting the blocks into lines.
+    Args     : fh - A file object opened in binary mode.
+               blockSize - int. The number of bytes to read at a time.
+    Returns  : generator of two item tuples, being (True, title line) at the start of each record, and (False, sequence piece) for its sequence.
+    Raises   : ValueError - The file doesn't start with a title line.
+    """
+    data = fh.read(blockSize)
+    eof = not data
+    #The position in data up to which it has been parsed.
+    i = 0
+    inRecord = False
+    while True:
+        if not inRecord:
+            while i < len(data) and data[i] in _WHITESPACE:
+                i += 1
+            if i == len(data):
+                if eof:
+                    return
+                data = fh.read(blockSize)
+                eof = not data
+                i = 0
+                continue
+            if data[i] != ord(">"):
+                raise ValueError("Invalid FASTA file. Expected first line to start with '>'.")
+            nl = data.find(b"\n",i)
+            if nl == -1 and not eof:
+                block = fh.read(blockSize)
+                eof = not block
+                data = data[i:] + block
+                i = 0
+                continue
+            if nl == -1:
+                nl = len(data)
+            yield True,data[i:nl].rstrip(b"\r")
+            i = nl + 1
+            inRecord = True
+        if data.startswith(b">",i):
+            inRecord = False
+            continue
+        #The next record starts after a newline.
+        pos = data.find(b"\n>",i)
+        if pos != -1:
+            yield False,data[i:pos + 1].translate(None,_WHITESPACE)
+            i = pos + 1
+            inRecord = False
+        elif eof:
+            yield False,data[i:].translate(None,_WHITESPACE)
+            return
+        else:
+            #Keep a trailing newline, since the next block may start with a title line.
+            end = max(len(data) - 1 if data.endswith(b"\n") else len(data),i)
+            yield False,data[i:end].translate(None,_WHITESPACE)
+            block = fh.read(blockSize)
+            eof = not block
+            data = data[end:] + block
+            i = 0
+
+def _splitTitle(title):
+    header = title.decode()
+    return getFastaIdFromHeader(header) if header.strip(">").strip() else "",header
+
+def records(fh,blockSize=BLOCK_SIZE):
+    """
+    Function : A generator over the records of a FASTA file, which reads the file a block at a time rather than line by line, so that files of millions
+               of records stream through in constant memory (apart from the current record). Blank lines are ignored.
+    Args     : fh - A file object opened in binary mode, such as one from codec.openRead().
+               blockSize - int. The number of bytes to read at a time.
+    Returns  : generator of three item tuples, being the record name (str), the title line including the '>' (str), and the sequence with the line
+               breaks removed (bytes).
+    Raises   : ValueError - The file doesn't start with a title line.
+    """
+    title = None
+    parts = []
+    for isTitle,part in _recordParts(fh,blockSize):
+        if isTitle:
+            if title is not None:
+                yield _splitTitle(title) + (b"".join(parts),)
+            title = part
+            parts = []
+        else:
+            parts.append(part)
+    if title is not None:
+        yield _splitTitle(title) + (b"".join(parts),)
+
+def windows(fh,size,step=None,blockSize=BLOCK_SIZE):
+    """
+    Function : A generator over fixed-size windows of the sequences of a FASTA file, so that whole chromosomes can be scanned while holding only about
+               one window and one block in memory. The last window of a record may be shorter than size, and is only given if it holds bases that
+               aren't in the window before it.
+    Args     : fh - A file object opened in binary mode.
+               size - int. The window length.
+               step - int. The distance between the starts of consecutive windows. Defaults to size, for windows that don't overlap.
+               blockSize - int. The number of bytes to read at a time.
+    Returns  : generator of three item tuples, being the record name (str), the 0-based start of the window (int), and its sequence (bytes).
+    """
+    step = size if step is None else step
+    if size <= 0 or step <= 0:
+        raise ValueError("The window size and step must be positive.")
+    #The bases from start onwards that have been read, and the number of bases still to skip when step is longer than size.
+    pending = bytearray()
+    skip = 0
+    name = None
+    for isTitle,part in _recordParts(fh,blockSize):
+        if isTitle:
+            if pending and (not emitted or len(pending) > size - step):
+                yield name,start,bytes(pending)
+            name = _splitTitle(part)[0]
+            pending = bytearray()
+            skip = 0
+            start = 0
+            emitted = False
+            continue
+        if skip:
+            skipped = min(skip,len(part))
+            part = part[skipped:]
+            skip -= skipped
+        pending += part
+        offset = 0
+        while len(pending) - offset >= size:
+            yield name,start,bytes(pending[offset:offset + size])
+            offset += step
+            start += step
+            emitted = True
+        if offset:
+            skip = max(offset - len(pending),0)
+            del pending[:offset]
+    if pending and (not emitted or len(pending) > size - step):
+        yield name,start,bytes(pending)
+
 class ByteIndex:
-    def __init__(self,infile):
-        if infile.endswith(".gz"):
-            self.fh = gzip.open(infile,'r')
+    """
+    Random access to the records of a FASTA file by name, using a samtools compatible .fai index. The index is read from infile + '.fai' when that
+    is at least as new as the FASTA file, and otherwise is built by scanning the file once and written there (if possible) for next time.
+
+    Since the .fai gives the line geometry of each record, fetch() can work out the exact bytes that hold any range of bases and read only those.
+    An uncompressed file is memory-mapped, so a fetch costs about as much as the bytes it returns. The file may also be gzip'd. For a BGZF file
+    (see bgzf.py), the block offsets are kept in a samtools compatible .gzi file next to the .fai, and only the blocks holding the range are
+    inflated. A plain gzip file works too, but every lookup re-inflates the file from the start; use bgzf.recompress() to convert it.
+
+    A record whose lines aren't all the same length (apart from the last) can't be described by a .fai. The file is then indexed by the byte range of
+    each record only, with no .fai written, and such records can be retrieved whole but not by range.
+    """
+    def __init__(self,infile,writeIndex=True):
+        """
+        Args : infile - str. The FASTA file.
+               writeIndex - bool. Whether to write the .fai (and .gzi) files when they had to be built.
+        """
+        self.infile = infile
+        self.faiFile = infile + ".fai"
+        self.gziFile = infile + ".gzi"
+        self.bgzf = bgzf.isBgzf(infile)
+        self.mm = None
+        if self.bgzf:
+            self.fh = bgzf.BgzfReader(infile)
+        elif infile.endswith(".gz"):
+            self.fh = gzip.open(infile,'rb')
         else:
-            self.fh = open(infile,'r')
+            self.fh = open(infile,'rb')
+        indexFiles = [self.faiFile,self.gziFile] if self.bgzf else [self.faiFile]
+        #The byte offset just past the sequence of each record, when known from a scan, and why records lack a regular line layout.
+        seqEnds = None
+        self.irregular = {}
+        if all(self._isCurrent(x) for x in indexFiles):
+            records = readFai(self.faiFile)
+            if self.bgzf:
+                self.fh.readGzi(self.gziFile)
+        else:
+            scanned = scanRecords(self.fh)
+            records = [x[0] for x in scanned]
+            seqEnds = [x[1] for x in scanned]
+            self.irregular = dict((x[0].name,x[2]) for x in scanned if x[2])
+            #A .fai can't describe a record without a regular line layout, so none is written, and the file is scanned each time.
+            if writeIndex and not self.irregular:
+                try:
+                    writeFai(self.faiFile,records)
+                    if self.bgzf:
+                        self.fh.writeGzi(self.gziFile)
+                except OSError:
+                    pass
+        if not self.bgzf and not infile.endswith(".gz") and os.path.getsize(infile):
+            self.mm = mmap.mmap(self.fh.fileno(),0,access=mmap.ACCESS_READ)
+        #: An OrderedDict of each record name to its FaiRecord. The line lengths are None for records in irregular.
+        self.fai = collections.OrderedDict((x.name,x) for x in records)
         # A dict. whose keys are FASTA record names, and each value is a two-item list of the form
-        # [start_byte, end_byte].
-        self.recBytes = self.getByteStart()
-
-    def getByteStart(self):
-        # starts is a list of two item lists of the from [ [record_name, record_start_byte] ].
-        starts = []
-        recByteDict = {}
-        prevTell = 0
-        while 1:
-            line =self.fh.readline()
-            if not line: #then end of file
-                break
-            line = line.strip()
-            curtell = self.fh.tell()
-            if line.startswith(">"):
-                recName = getFastaIdFromHeader(line)
-                starts.append([recName,prevTell])
-            prevTell = curtell
-        for i in range(len(starts) - 1):
-            recname = starts[i][0]
-            recByteDict[recname] = [starts[i][1]] #start byte
-            recByteDict[recname].append(starts[i + 1][1])
-        self.fh.seek(0,2) #go to end of file
-        lastByte = self.fh.tell()
-        lastRecName = starts[-1][0]
-        recByteDict[lastRecName] = [starts[-1][1],lastByte]
-        return recByteDict
+        # [start_byte, end_byte]. A record runs from the end of the previous one's sequence to the end of its own, and the last one to the end of the file.
+        self.recBytes = {}
+        prevEnd = 0
+        for i,rec in enumerate(records):
+            if seqEnds is not None:
+                end = seqEnds[i]
+            else:
+                end = self._seqByte(rec,rec.length)
+                if rec.lineBases and rec.length % rec.lineBases:
+                    end += rec.lineWidth - rec.lineBases
+            self.recBytes[rec.name] = [prevEnd,end]
+            prevEnd = end
+        if records:
+            self.recBytes[records[-1].name][1] = None
+
+    def _isCurrent(self,indexFile):
+        return os.path.exists(indexFile) and os.path.getmtime(indexFile) >= os.path.getmtime(self.infile)
+
+    def _seqByte(self,rec,pos):
+        """
+        Function : Works out the uncompressed byte offset of a base from the line geometry of its record.
+        Args     : rec - FaiRecord.
+                   pos - int. The 0-based position of the base in the record.
+        Returns  : int.
+        """
+        if not rec.lineBases:
+            return rec.offset
+        return rec.offset + (pos // rec.lineBases) * rec.lineWidth + pos % rec.lineBases
+
+    def _readBytes(self,start,end):
+        """
+        Function : Reads the uncompressed bytes in the range [start,end) of the file. end may be None to read to the end of the file.
+        Returns  : bytes.
+        """
+        if self.mm is not None:
+            return self.mm[start:end]
+        if self.bgzf:
+            if end is None:
+                self.fh.seek(self.fh.virtualOffset(start))
+                return self.fh.read()
+            return self.fh.readRange(self.fh.virtualOffset(start),self.fh.virtualOffset(end))
+        self.fh.seek(start)
+        return self.fh.read(-1 if end is None else end - start)
+
+    def _getFai(self,name):
+        try:
+            return self.fai[name]
+        except KeyError:
+            print("Could not find record with name {}.".format(name))
+            raise
+
+    def names(self):
+        """
+        Function : Returns the record names, in file order.
+        Returns  : list.
+        """
+        return list(self.fai)
+
+    def getLength(self,name):
+        """
+        Function : Returns the number of bases in a record.
+        Args     : name - str. Name of the FASTA record.
+        Returns  : int.
+        """
+        return self._getFai(name).length
+
+    def fetch(self,name,start=0,end=None):
+        """
+        Function : Retrieves a range of a record's sequence, reading only the bytes that hold it.
+        Args     : name - str. Name of the FASTA record.
+                   start - int. The 0-based position of the first base.
+                   end - int. The position just past the last base, as in a slice. Defaults to the end of the record, and is clipped to it.
+        Returns  : str.
+        Raises   : ValueError if only part of a record is asked for, and the record's lines differ in length, so that the bytes holding the range can't
+                   be worked out.
+        """
+        rec = self._getFai(name)
+        end = rec.length if end is None else min(end,rec.length)
+        if start < 0 or start > end:
+            raise ValueError("Invalid range {start}-{end} for record {name} of length {length}.".format(start=start,end=end,name=name,length=rec.length))
+        if name in self.irregular:
+            if start or end < rec.length:
+                raise ValueError("Can't fetch a range of record {name}, since its lines aren't all the same length: {why}".format(name=name,why=self.irregular[name]))
+            data = self._readBytes(rec.offset,self.recBytes[name][1])
+        else:
+            data = self._readBytes(self._seqByte(rec,start),self._seqByte(rec,end))
+        return data.translate(None,b"\r\n").decode()
+
+    def fetchRegion(self,region):
+        """
+        Function : Retrieves the sequence of a samtools style region (see parseRegion()). A record name that itself looks like a region is taken as
+                   the whole record.
+        Args     : region - str.
+        Returns  : str.
+        """
+        if region in self.fai:
+            return self.fetch(region)
+        return self.fetch(*parseRegion(region))
 
     def getRawRecord(self,name):
         """
-        Function : Retrieves the raw FASTA record with any leading and trailing white-space removed.
+        Function : Retrieves the raw FASTA record.
         Args     : name - str. Name of the FASTA record.
         Returns  : str.
         """
@@ -64,10 +450,63 @@ class ByteIndex:
         except KeyError:
             print("Could not find record with name {}.".format(name))
             raise
-        start = recCoords[0]
-        length = recCoords[-1] - start
-        self.fh.seek(start)
-        return self.fh.read(length)
+        start,end = recCoords
+        return self._readBytes(start,end).decode()
+
+    def missingNames(self,names):
+        """
+        Function : Finds the names that aren't in the index, so that they can all be reported at once.
+        Args     : names - iterable of str.
+        Returns  : list of the distinct missing names, in the order given.
+        """
+        missing = []
+        seen = set()
+        for name in names:
+            if name not in self.recBytes and name not in seen:
+                seen.add(name)
+                missing.append(name)
+        return missing
+
+    def getRawRecords(self,names,keepOrder=False):
+        """
+        Function : Retrieves many raw FASTA records in one forward pass over the file. The records are sorted by their offsets, and runs of adjacent
+                   records are read together, up to READ_SIZE bytes at a time, so a gzip'd file is never re-inflated by seeking backwards. Names that
+                   aren't in the index are skipped; see missingNames().
+        Args     : names - iterable of str. A name may be given more than once.
+                   keepOrder - bool. True means that the records are given in the order of names, by holding back those read ahead of their turn.
+                               Otherwise they are given in file order.
+        Returns  : generator of two item tuples of the name and the raw record (str).
+        """
+        names = list(names)
+        requests = sorted((self.recBytes[name][0],i) for i,name in enumerate(names) if name in self.recBytes)
+        #Coalesce the requests into groups whose bytes are read together.
+        groups = []
+        for start,i in requests:
+            end = self.recBytes[names[i]][1]
+            end = float("inf") if end is None else end
+            if groups:
+                groupStart,groupEnd,members = groups[-1]
+                if start <= groupEnd and (end <= groupEnd or end - groupStart <= READ_SIZE):
+                    groups[-1][1] = max(groupEnd,end)
+                    members.append(i)
+                    continue
+            groups.append([start,end,[i]])
+        #The positions of the found names, in the order they are to be given, and the records read ahead of their turn.
+        order = [i for i in range(len(names)) if names[i] in self.recBytes]
+        nextPos = 0
+        held = {}
+        for groupStart,groupEnd,members in groups:
+            data = self._readBytes(groupStart,None if groupEnd == float("inf") else groupEnd)
+            for i in members:
+                start,end = self.recBytes[names[i]]
+                raw = data[start - groupStart:None if end is None else end - groupStart].decode()
+                if not keepOrder:
+                    yield names[i],raw
+                    continue
+                held[i] = raw
+                while nextPos < len(order) and order[nextPos] in held:
+                    yield names[order[nextPos]],held.pop(order[nextPos])
+                    nextPos += 1
 
 class Rec:
     def __init__(self,fastaRec):
@@ -98,20 +537,30 @@ class Rec:
 
     def motifCount(self,motif):
         """
-        Function : Counts the number of times a sequence of nucleotides is seen in the FASTA record.
+        Function : Counts the number of times a sequence of nucleotides is seen in the FASTA record, including overlapping occurrences, such as the
+                   two AA's in AAA.
         Args     : motif - str.
         """
         motif = motif.upper()
-        return self.seq.upper().count(motif)
+        seq = self.seq.upper()
+        count = 0
+        pos = seq.find(motif)
+        while pos != -1:
+            count += 1
+            pos = seq.find(motif,pos + 1)
+        return count
 
     def dinucleotideFreqs(self):
-        combos = ["AA","AC","AG","AT","CC","CA","CT","CT","GG","GA","GC","GT","TT","TA","TC","TG"]
-        dico = {}
-        for i in combos:
-            dico[i] = str(self.motifCount(i))
-        return dico
+        """
+        Function : Counts the overlapping occurrences of each of the 16 dinucleotides in one pass over the sequence (see composition.Composition).
+        Returns  : dict of each dinucleotide to its count, as a str.
+        """
+        #Imported here since composition imports this module.
+        from gbsc_utils.fasta import composition
+        return dict((dinucleotide,str(count)) for dinucleotide,count in composition.composition(self.seq).freqs(2).items())
 
 if __name__ == "__main__":
     index = ByteIndex(sys.argv[1])
     recTxt = index.getRawRecord(sys.argv[2])
+    rec = Rec(recTxt)
     rec.printRecord()
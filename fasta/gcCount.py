@@ -1,24 +1,39 @@
-import fasta
 from argparse import ArgumentParser
-from operator import itemgetter
+import sys
 
-description = ""
+from gbsc_utils import kmers
+from gbsc_utils.fasta import composition
+from gbsc_utils.fasta import fasta
+from gbsc_utils.fasta import twobit
+
+description = "Counts the dinucleotides (or k-mers of another length) of a record in a FASTA file, and prints them from most to least common. Run as python -m gbsc_utils.fasta.gcCount."
 parser = ArgumentParser(description)
-parser.add_argument('-i','--infile',required=True,help="Input FASTA file")
-parser.add_argument('-n','--name',required=True,help="The record name in the FASTQ file for which motif frequencies are to be calculated.")
-parser.add_argument('-d','--dinucleotide',action="store_true",help="Presence of this option indicates that all dinucleotide frequencies will be calculated for --name in --infile.")
+parser.add_argument('-i','--infile',required=True,help="Input FASTA file, or a .2bit file built with python -m gbsc_utils.fasta.twobit.")
+parser.add_argument('-n','--name',required=True,help="The record name in the FASTA file for which motif frequencies are to be calculated. May also be a samtools style region, such as chr1:1001-1200, in which case only the bases of the region are read.")
+parser.add_argument('-d','--dinucleotide',action="store_true",help="Deprecated, and ignored. The k-mers of length --k, by default the dinucleotides, are always counted.")
+parser.add_argument('-k','--k',type=int,default=2,help="The k-mer length. Default is %(default)s, for dinucleotides.")
+parser.add_argument('-c','--composition',action="store_true",help="Also print the GC content and CpG observed/expected ratio before the k-mer counts. For a windowed GC track of a whole genome, see python -m gbsc_utils.fasta.composition.")
 
 args = parser.parse_args()
 recName = args.name
 infile = args.infile
-index = fasta.ByteIndex(infile)
-rawRecord = index.getRawRecord(recName)
-record = fasta.Rec(rawRecord)
-#record.printRecord(recName,50)
-dico = record.dinucleotideFreqs()
-for i in sorted(dico.items(),key=itemgetter(1),reverse=True):
-	print(i[0] + ": " + str(i[1]))
-
-
-
-
+if infile.endswith(".2bit"):
+	seq = twobit.TwoBitFile(infile).fetchRegion(recName)
+else:
+	seq = fasta.ByteIndex(infile).fetchRegion(recName).encode()
+if args.dinucleotide:
+	print("-d/--dinucleotide is deprecated, and ignored.",file=sys.stderr)
+if args.k <= 3:
+	#Composition counts k-mers up to trinucleotides along with the GC content, in one pass.
+	comp = composition.composition(seq)
+	counts = [x for x in comp.freqs(args.k).items() if x[1]]
+else:
+	counter = kmers.KmerCounter(args.k).addSeqs([seq])
+	codes,codeCounts = counter.counts()
+	counts = [(kmers.decode(code,args.k),int(count)) for code,count in zip(codes,codeCounts)]
+if args.composition:
+	comp = comp if args.k <= 3 else composition.composition(seq)
+	print("GC content: {}".format(comp.gcContent()))
+	print("CpG observed/expected: {}".format(comp.cpgObservedExpected()))
+for kmer,count in sorted(counts,key=lambda x: -x[1]):
+	print(kmer + ": " + str(count))
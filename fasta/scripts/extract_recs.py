@@ -7,10 +7,18 @@
 ###
 
 """
-Given a multi-FASTA file, extracts records of interest into a new FASTA file.
+Given a multi-FASTA file, extracts records of interest into a new FASTA file. Regions of records can be
+extracted too; these are read straight from the bytes that hold them using the file's .fai index, which is
+built the first time the file is used.
+
+Records are read in one forward pass in the order they appear in the input file, with adjacent records read
+together, which also keeps a gzip'd input from being re-inflated for every record. Use --keep-order to write
+them in the order they were asked for instead. Names that aren't found are all reported at the end, and the
+exit status is then 1.
 """
 
 import argparse
+import sys
 
 from gbsc_utils.fasta import fasta
 
@@ -25,12 +33,23 @@ def get_parser():
         >Chr1 chromosome, then the name of the record is 'Chr1'.""")
     group.add_argument("-f", "--names-file", help="""Input file containing one or more record names 
         (one per line).  The name format is the same as described above for the --record option.""")
+    group.add_argument("-r", "--regions", nargs="+", help="""One or more regions in samtools format, i.e.
+        name:start-end with 1-based inclusive positions, such as Chr1:1001-1200. Each is written as a
+        record titled with the region.""")
+    parser.add_argument("-k", "--keep-order", action="store_true", help="""Write the records in the order
+        of the given names, rather than in the order of the input file.""")
     return parser
 
 def main():
     parser = get_parser()
     args = parser.parse_args()
     fout = open(args.outfile, "w")
+    index = fasta.ByteIndex(args.infile)
+    if args.regions:
+        for region in args.regions:
+            fout.write(fasta.formatRecord(region, index.fetchRegion(region)))
+        fout.close()
+        return
     if args.name:
         names = [args.name]
     else:
@@ -43,10 +62,14 @@ def main():
             names.append(line)
         rfh.close()
 
-    index = fasta.ByteIndex(args.infile)
-    for i in names:
-        fout.write(index.getRawRecord(i))
+    for name, raw in index.getRawRecords(names, keepOrder=args.keep_order):
+        fout.write(raw)
     fout.close()
+    missing = index.missingNames(names)
+    if missing:
+        sys.stderr.write("Could not find {} record(s) with the name(s):\n".format(len(missing)))
+        sys.stderr.write("".join(name + "\n" for name in missing))
+        sys.exit(1)
 
 if __name__ == "__main__":
     main() 
@@ -0,0 +1,89 @@
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from gbsc_utils.fasta import composition
+from gbsc_utils.fasta import fasta
+from gbsc_utils.fasta import twobit
+
+def bruteForce(seq,k):
+    counts = {}
+    for i in range(len(seq) - k + 1):
+        kmer = seq[i:i + k].upper()
+        if not kmer.strip("ACGT"):
+            counts[kmer] = counts.get(kmer,0) + 1
+    return counts
+
+class TestComposition(unittest.TestCase):
+
+    def test_counts(self):
+        rand = random.Random(11)
+        seq = "".join(rand.choice("ACGTacgN") for i in range(3000))
+        chunkSize = composition.CHUNK_SIZE
+        composition.CHUNK_SIZE = 100
+        try:
+            comp = composition.composition(seq)
+        finally:
+            composition.CHUNK_SIZE = chunkSize
+        for k in (1,2,3):
+            freqs = comp.freqs(k)
+            self.assertEqual(len(freqs),4 ** k)
+            self.assertEqual(dict((x,y) for x,y in freqs.items() if y),bruteForce(seq,k))
+        self.assertEqual(comp.length(),3000)
+        upper = seq.upper()
+        numACGT = comp.numACGT()
+        self.assertAlmostEqual(comp.gcContent(),(upper.count("G") + upper.count("C")) / float(numACGT))
+        self.assertAlmostEqual(comp.cpgObservedExpected(),bruteForce(seq,2)["CG"] * numACGT / float(upper.count("C") * upper.count("G")))
+
+    def test_edges(self):
+        comp = composition.composition(b"AAA").merge(composition.composition("AAANA"))
+        self.assertEqual((comp.freqs(2)["AA"],comp.freqs(3)["AAA"],comp.length()),(4,2,8))
+        self.assertEqual((comp.gcContent(),comp.cpgObservedExpected()),(0.0,None))
+        self.assertIsNone(composition.composition("NN").gcContent())
+        self.assertEqual(fasta.Rec(">a\nAAAC\nAA\n").motifCount("aa"),3)
+
+class TestGcTrack(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rand = random.Random(12)
+        self.seqs = [("chr1","".join(rand.choice("ACGT") for i in range(1050))),("chr2","N" * 250 + "ACGCGT" * 20),("chr3","")]
+        self.faFile = os.path.join(self.tmpdir,"ref.fa")
+        with open(self.faFile,'w') as fout:
+            for name,seq in self.seqs:
+                fout.write(">" + name + "\n" + "".join(seq[i:i + 60] + "\n" for i in range(0,len(seq),60)))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def expected(self,size,step,value):
+        lines = []
+        for name,seq in self.seqs:
+            for start in range(0,len(seq),step):
+                comp = composition.composition(seq[start:start + size])
+                x = comp.gcContent() if value == "gc" else comp.cpgObservedExpected()
+                if x is not None:
+                    lines.append("{}\t{}\t{}\t{:.4f}\n".format(name,start,min(start + size,len(seq)),x))
+        return "".join(lines)
+
+    def test_track(self):
+        twoBitFile = os.path.join(self.tmpdir,"ref.2bit")
+        twobit.build(self.faFile,twoBitFile)
+        chunkSize = composition.CHUNK_SIZE
+        composition.CHUNK_SIZE = 200
+        try:
+            for infile,size,step,value,numProcs in ((self.faFile,100,None,"gc",2),(twoBitFile,100,30,"cpg",1),(self.faFile,30,100,"gc",1)):
+                out = io.StringIO()
+                composition.gcTrack(infile,out,size,step,value,numProcs=numProcs)
+                self.assertEqual(out.getvalue(),self.expected(size,step or size,value))
+        finally:
+            composition.CHUNK_SIZE = chunkSize
+        out = io.StringIO()
+        composition.gcTrack(self.faFile,out,500,names=["chr2"],numProcs=1)
+        self.assertEqual(out.getvalue(),"chr2\t0\t370\t0.6667\n")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+import gzip
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from gbsc_utils import bgzf
+from gbsc_utils.fasta import fasta
+
+class TestByteIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.faFile = os.path.join(self.tmpdir,"seqs.fa")
+        self.recs = []
+        for i in range(300):
+            seq = "ACGTTGCA" * (i + 1)
+            lines = [seq[j:j + 60] for j in range(0,len(seq),60)]
+            self.recs.append(">seq{i} description\n".format(i=i) + "\n".join(lines) + "\n")
+        with open(self.faFile,'w') as fout:
+            fout.write("".join(self.recs))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_getRawRecord(self):
+        index = fasta.ByteIndex(self.faFile)
+        self.assertEqual(index.getRawRecord("seq0"),self.recs[0])
+        self.assertEqual(index.getRawRecord("seq299"),self.recs[299])
+
+    def test_bgzf(self):
+        bgzfFile = self.faFile + ".gz"
+        bgzf.recompress(self.faFile,bgzfFile)
+        index = fasta.ByteIndex(bgzfFile)
+        self.assertTrue(index.bgzf)
+        for i in (299,0,150,151):
+            self.assertEqual(index.getRawRecord("seq{}".format(i)),self.recs[i])
+        self.assertTrue(os.path.exists(bgzfFile + ".gzi"))
+        index = fasta.ByteIndex(bgzfFile)
+        seq = "ACGTTGCA" * 300
+        self.assertEqual(index.fetch("seq299",1000,2345),seq[1000:2345])
+        self.assertEqual(index.fetch("seq150",0,5),"ACGTT")
+        self.assertEqual(index.getRawRecord("seq299"),self.recs[299])
+
+    def test_fai(self):
+        index = fasta.ByteIndex(self.faFile)
+        self.assertEqual(fasta.readFai(self.faFile + ".fai")[:2],[("seq0",8,18,8,9),("seq1",16,45,16,17)])
+        self.assertEqual(index.fai["seq8"],("seq8",72,459,60,61))
+        self.assertEqual(index.names()[-1],"seq299")
+        self.assertEqual(index.getLength("seq299"),2400)
+        #Reloaded from the .fai.
+        index = fasta.ByteIndex(self.faFile)
+        seq = "ACGTTGCA" * 300
+        for start,end in ((0,2400),(59,61),(60,120),(1234,1300),(2399,3000),(5,5)):
+            self.assertEqual(index.fetch("seq299",start,end),seq[start:end])
+        self.assertEqual(index.fetchRegion("seq299:60-61"),seq[59:61])
+        self.assertEqual(index.fetchRegion("seq1"),"ACGTTGCA" * 2)
+        self.assertEqual(index.getRawRecord("seq150"),self.recs[150])
+        self.assertRaises(ValueError,index.fetch,"seq1",10,5)
+        self.assertRaises(KeyError,index.fetch,"seq300")
+
+    def test_getRawRecords(self):
+        names = ["seq5","seq299","missing","seq0","seq6","seq5","seq150","other","missing"]
+        for infile in (self.faFile,self.faFile + ".gz"):
+            if infile.endswith(".gz"):
+                with open(self.faFile,'rb') as fh:
+                    data = fh.read()
+                with gzip.open(infile,'wb') as fout:
+                    fout.write(data)
+            index = fasta.ByteIndex(infile)
+            readSize = fasta.READ_SIZE
+            fasta.READ_SIZE = 200
+            try:
+                inOrder = list(index.getRawRecords(names,keepOrder=True))
+                fileOrder = list(index.getRawRecords(names))
+            finally:
+                fasta.READ_SIZE = readSize
+            found = [x for x in names if not x.startswith(("missing","other"))]
+            self.assertEqual(inOrder,[(x,self.recs[int(x[3:])]) for x in found])
+            self.assertEqual(fileOrder,sorted(inOrder,key=lambda x: int(x[0][3:])))
+            self.assertEqual(index.missingNames(names),["missing","other"])
+
+    def test_line_lengths(self):
+        with open(self.faFile,'w') as fout:
+            fout.write(">a\nACGT\nAC\nACGTAC\n>b\nGG\n>c\nACG\nACGT\n")
+        self.assertRaises(ValueError,fasta.buildFai,open(self.faFile,'rb'))
+        index = fasta.ByteIndex(self.faFile)
+        self.assertFalse(os.path.exists(self.faFile + ".fai"))
+        self.assertEqual(sorted(index.irregular),["a","c"])
+        self.assertEqual(index.getRawRecord("b"),">b\nGG\n")
+        self.assertEqual([index.fetch(x) for x in "abc"],["ACGTACACGTAC","GG","ACGACGT"])
+        self.assertEqual(index.fetch("b",1),"G")
+        self.assertEqual(index.getLength("c"),7)
+        self.assertRaises(ValueError,index.fetch,"a",1,3)
+        with open(self.faFile,'w') as fout:
+            fout.write(">a\nACGT\r\nAC\r\n>b x\n>c\nA")
+        index = fasta.ByteIndex(self.faFile,writeIndex=False)
+        self.assertFalse(os.path.exists(self.faFile + ".fai"))
+        self.assertEqual([index.fetch(x) for x in "abc"],["ACGTAC","","A"])
+        self.assertEqual(index.fetch("a",3,5),"TA")
+        self.assertEqual(index.getRawRecord("b"),">b x\n")
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        rand = random.Random(3)
+        self.seqs = [("r{}".format(i),"".join(rand.choice("ACGTN") for j in range(rand.randrange(0,300)))) for i in range(200)]
+        lines = []
+        for i,(name,seq) in enumerate(self.seqs):
+            lines.append(">{} desc {}".format(name,i))
+            width = rand.choice((1,7,60))
+            lines.extend(seq[j:j + width] for j in range(0,len(seq),width))
+            if i % 10 == 0:
+                lines.append("")
+        self.text = ("\n" + "\r\n".join(lines)).encode()
+
+    def test_records(self):
+        for blockSize in (1,5,64,1 << 20):
+            recs = list(fasta.records(io.BytesIO(self.text),blockSize))
+            self.assertEqual([(x[0],x[2].decode()) for x in recs],self.seqs)
+            self.assertEqual(recs[3][1],">r3 desc 3")
+        self.assertEqual(list(fasta.records(io.BytesIO(b">a\n>b"))),[("a",">a",b""),("b",">b",b"")])
+        self.assertRaises(ValueError,list,fasta.records(io.BytesIO(b"ACGT\n>a\n")))
+
+    def test_windows(self):
+        for size,step in ((50,50),(50,20),(20,50),(1,1)):
+            expected = []
+            for name,seq in self.seqs:
+                for start in range(0,len(seq),step):
+                    if start + size > len(seq):
+                        #A last, short window, unless the previous window already covers it.
+                        if not expected or expected[-1][0] != name or len(seq) > expected[-1][1] + size:
+                            expected.append((name,start,seq[start:].encode()))
+                        break
+                    expected.append((name,start,seq[start:start + size].encode()))
+            for blockSize in (3,1 << 20):
+                self.assertEqual(list(fasta.windows(io.BytesIO(self.text),size,step,blockSize)),expected)
+        self.assertEqual(list(fasta.windows(io.BytesIO(b">a\nACGTA\nC\n"),4)),[("a",0,b"ACGT"),("a",4,b"AC")])
+
+class TestRegions(unittest.TestCase):
+
+    def test_parseRegion(self):
+        self.assertEqual(fasta.parseRegion("chr1"),("chr1",0,None))
+        self.assertEqual(fasta.parseRegion("chr1:1,001-1,200"),("chr1",1000,1200))
+        self.assertEqual(fasta.parseRegion("chr1:5"),("chr1",4,None))
+        self.assertEqual(fasta.parseRegion("HLA:A*01"),("HLA:A*01",0,None))
+
+    def test_formatRecord(self):
+        self.assertEqual(fasta.formatRecord("a","ACGTA",2),">a\nAC\nGT\nA\n")
+        self.assertEqual(fasta.formatRecord("a",""),">a\n")
+
+if __name__ == "__main__":
+    unittest.main()
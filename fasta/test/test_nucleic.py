@@ -0,0 +1,34 @@
+import unittest
+
+import numpy as np
+
+from gbsc_utils import nucleic
+
+class TestReverseComplement(unittest.TestCase):
+
+	def test_types(self):
+		self.assertEqual(nucleic.reverseComplement("ACCTGn"),"nCAGGT")
+		self.assertEqual(nucleic.reverseComplement(b"ACCTGn"),b"nCAGGT")
+		self.assertEqual(nucleic.reverseComplement(bytearray(b"AAC")),bytearray(b"GTT"))
+		self.assertEqual(nucleic.dnaRevComp("ACCTG"),"CAGGT")
+
+	def test_iupac(self):
+		self.assertEqual(nucleic.complement("MRWSYKVHDBNU-"),"KYWSRMBDHVNA-")
+		self.assertEqual(nucleic.complement("mrwsykvhdbnu"),"kywsrmbdhvna")
+
+	def test_batch(self):
+		self.assertEqual(nucleic.reverseComplementAll(["AAC","","GGTa"]),["GTT","","tACC"])
+		self.assertEqual(nucleic.reverseComplementAll([b"AC"]),[b"GT"])
+		self.assertEqual(nucleic.reverseComplementAll([]),[])
+		rcs = nucleic.reverseComplementAll(np.array([b"AAC",b"",b"GGTAC"]))
+		self.assertEqual(rcs.dtype,np.dtype("S5"))
+		self.assertEqual(list(rcs),[b"GTT",b"",b"GTACC"])
+		codes = np.frombuffer(b"AACGTTTT",dtype=np.uint8).reshape(2,4)
+		self.assertEqual(nucleic.reverseComplementAll(codes).tobytes(),b"CGTTAAAA")
+		self.assertRaises(ValueError,nucleic.reverseComplementAll,np.zeros(3))
+
+	def test_baseCodes(self):
+		self.assertEqual(b"ACGTacgtNU-".translate(nucleic.BASE_CODES),bytes([0,1,2,3,0,1,2,3,4,4,4]))
+
+if __name__ == "__main__":
+	unittest.main()
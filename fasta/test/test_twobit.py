@@ -0,0 +1,65 @@
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import unittest
+
+from gbsc_utils import kmers
+from gbsc_utils.fasta import twobit
+
+class TestTwoBit(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rand = random.Random(7)
+        self.seqs = {}
+        for name,length in (("chr1",1001),("chr2",0),("chrM",37),("chr3",4000)):
+            self.seqs[name] = "".join(rand.choice("ACGTACGTacgtNNnRy") for i in range(length))
+        self.seqs["chrM"] = "N" * 10 + "acgtACGT" * 3 + "NNN"
+        self.faFile = os.path.join(self.tmpdir,"ref.fa")
+        with open(self.faFile,'w') as fout:
+            for name,seq in self.seqs.items():
+                fout.write(">" + name + " x\n" + "".join(seq[i:i + 50] + "\n" for i in range(0,len(seq),50)))
+        self.twoBitFile = os.path.join(self.tmpdir,"ref.2bit")
+        chunkSize = twobit.CHUNK_SIZE
+        twobit.CHUNK_SIZE = 64
+        try:
+            twobit.build(self.faFile,self.twoBitFile)
+        finally:
+            twobit.CHUNK_SIZE = chunkSize
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def expected(self,name,start=0,end=None):
+        seq = self.seqs[name][start:end]
+        return "".join(x if x.upper() in "ACGT" else ("N" if x.isupper() else "n") for x in seq).encode()
+
+    def test_fetch(self):
+        store = twobit.TwoBitFile(self.twoBitFile)
+        self.assertEqual(store.names(),list(self.seqs))
+        self.assertEqual(store.getLength("chr3"),4000)
+        for name in self.seqs:
+            self.assertEqual(store.fetch(name),self.expected(name))
+        for start,end in ((0,1),(63,65),(1,1000),(999,1001),(500,500)):
+            self.assertEqual(store.fetch("chr1",start,end),self.expected("chr1",start,end))
+            self.assertEqual(store.fetch("chr1",start,end,mask=False),self.expected("chr1",start,end).upper())
+        self.assertEqual(store.fetchRegion("chrM:9-14"),b"NNacgt")
+        self.assertEqual(store.fetchArray("chrM",8,14).tolist(),[4,4,0,1,2,3])
+        self.assertEqual(store.fetchArray("chr3",10,200).tolist(),kmers.encode(self.expected("chr3",10,200)).tolist())
+        self.assertRaises(ValueError,store.fetch,"chr1",5,4)
+        self.assertRaises(KeyError,store.fetch,"chr4")
+        store = pickle.loads(pickle.dumps(store))
+        self.assertEqual(store.fetch("chr3",3990),self.expected("chr3",3990))
+
+    def test_layout(self):
+        #Packed bases, plus the header, index and run tables.
+        store = twobit.TwoBitFile(self.twoBitFile)
+        self.assertEqual(store.fetch("chrM",0,12),b"NNNNNNNNNNac")
+        length,nStarts,nEnds,maskStarts,maskEnds,dnaStart = store._record("chrM")
+        self.assertEqual((nStarts.tolist(),nEnds.tolist(),maskStarts.tolist(),maskEnds.tolist()),([0,34],[10,37],[10,18,26],[14,22,30]))
+        self.assertEqual(twobit.packSeq(b"TCAGg"),bytes([0b00011011,0b11000000]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,274 @@
+"""
+A packed reference genome store in the UCSC .2bit format, which holds 2 bits per base plus, for each record, a table of the runs of N and a table of the
+runs of soft-masked (lower case) bases. Any base other than ACGT is stored as an N, as UCSC's faToTwoBit does. A whole human genome takes about 800 MB.
+
+TwoBitFile memory-maps the file read-only, so all the processes on a node that open the same file share one copy in the page cache, and nothing but the
+requested range is unpacked. It is picklable, so it can be passed to pool workers, which map the file again. Ranges can be fetched as bytes, or as a
+NumPy array of base codes in the encoding of kmers.encode().
+
+Build a .2bit file from a FASTA file with 'python -m gbsc_utils.fasta.twobit'.
+"""
+
+from argparse import ArgumentParser
+import struct
+
+import numpy as np
+
+from gbsc_utils import nucleic
+from gbsc_utils.fasta import fasta
+
+SIGNATURE = 0x1A412743
+#: The number of bases that are fetched from the FASTA file and packed at a time when building. A multiple of 4.
+CHUNK_SIZE = 1 << 24
+
+#: Maps each byte to its 2-bit code in the .2bit format, in which T, C, A and G are 0 to 3. Other bases get 0, and are covered by an N run.
+_PACK_CODES = np.array([2,1,3,0,0],dtype=np.uint8)[np.frombuffer(nucleic.BASE_CODES,dtype=np.uint8)]
+#: Whether each byte is one of ACGT, in either case.
+_IS_ACGT = np.frombuffer(nucleic.BASE_CODES,dtype=np.uint8) < 4
+#: Maps each packed byte to its four bases as codes in the encoding of kmers.encode(), i.e. A, C, G and T as 0 to 3.
+_UNPACK = np.array([[[3,1,0,2][(byte >> shift) & 3] for shift in (6,4,2,0)] for byte in range(256)],dtype=np.uint8)
+#: Maps the codes of kmers.encode() to bases.
+_BASES = np.frombuffer(b"ACGTN",dtype=np.uint8)
+
+def runs(mask,offset=0):
+    """
+    Function : Finds the runs of True values in a boolean array.
+    Args     : mask - bool numpy.ndarray.
+               offset - int. Added to the starts.
+    Returns  : tuple of int64 numpy.ndarrays of the starts and sizes of the runs.
+    """
+    edges = np.diff(np.concatenate([[0],mask.view(np.int8),[0]]))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return starts + offset,ends - starts
+
+def _appendRuns(allRuns,starts,sizes):
+    """
+    Function : Adds the runs of a chunk to the runs of the preceding chunks, joining a run that spans the boundary between them.
+    Args     : allRuns - list of two lists, of the starts and sizes found so far. Modified in place.
+    """
+    prevStarts,prevSizes = allRuns
+    if len(starts) and prevStarts and prevStarts[-1] + prevSizes[-1] == starts[0]:
+        prevSizes[-1] += int(sizes[0])
+        starts = starts[1:]
+        sizes = sizes[1:]
+    prevStarts.extend(starts.tolist())
+    prevSizes.extend(sizes.tolist())
+
+def packSeq(seq):
+    """
+    Function : Packs a sequence at 2 bits per base, 4 bases per byte with the first in the highest bits.
+    Args     : seq - bytes.
+    Returns  : bytes.
+    """
+    codes = _PACK_CODES[np.frombuffer(seq,dtype=np.uint8)]
+    pad = -len(codes) % 4
+    if pad:
+        codes = np.concatenate([codes,np.zeros(pad,dtype=np.uint8)])
+    codes = codes.reshape(-1,4)
+    return ((codes[:,0] << 6) | (codes[:,1] << 4) | (codes[:,2] << 2) | codes[:,3]).astype(np.uint8).tobytes()
+
+def _packRecord(index,name):
+    """
+    Function : Reads a FASTA record in chunks and packs it.
+    Args     : index - fasta.ByteIndex.
+               name - str.
+    Returns  : bytes of the record, as laid out in a .2bit file.
+    """
+    length = index.getLength(name)
+    nRuns = [[],[]]
+    maskRuns = [[],[]]
+    packed = []
+    for start in range(0,length,CHUNK_SIZE):
+        seq = index.fetch(name,start,start + CHUNK_SIZE).encode()
+        chars = np.frombuffer(seq,dtype=np.uint8)
+        _appendRuns(nRuns,*runs(~_IS_ACGT[chars],start))
+        _appendRuns(maskRuns,*runs(chars >= ord("a"),start))
+        packed.append(packSeq(seq))
+    fields = [length,len(nRuns[0])] + nRuns[0] + nRuns[1] + [len(maskRuns[0])] + maskRuns[0] + maskRuns[1] + [0]
+    return struct.pack("<{}I".format(len(fields)),*fields) + b"".join(packed)
+
+def build(infile,outfile):
+    """
+    Function : Builds a .2bit file from a FASTA file, which is read through a fasta.ByteIndex so that it may also be gzip'd or BGZF. Records are packed
+               one at a time, and only CHUNK_SIZE bases of a record are held as text at once.
+    Args     : infile - str. The FASTA file.
+               outfile - str. The .2bit file.
+    """
+    index = fasta.ByteIndex(infile)
+    names = index.names()
+    #Version 1 has 64-bit record offsets, for files over 4 GB.
+    version = 1 if sum(index.getLength(x) for x in names) // 4 >= 1 << 31 else 0
+    offsetFormat = "<Q" if version else "<I"
+    with open(outfile,'wb') as fout:
+        fout.write(struct.pack("<IIII",SIGNATURE,version,len(names),0))
+        offsetPositions = []
+        for name in names:
+            encoded = name.encode()
+            fout.write(struct.pack("<B",len(encoded)) + encoded)
+            offsetPositions.append(fout.tell())
+            fout.write(struct.pack(offsetFormat,0))
+        offsets = []
+        for name in names:
+            offsets.append(fout.tell())
+            fout.write(_packRecord(index,name))
+        for pos,offset in zip(offsetPositions,offsets):
+            fout.seek(pos)
+            fout.write(struct.pack(offsetFormat,offset))
+
+class TwoBitFile:
+    """
+    Read-only random access to a memory-mapped .2bit file.
+    """
+    def __init__(self,infile):
+        self.infile = infile
+        self._open()
+
+    def _open(self):
+        self.data = np.memmap(self.infile,dtype=np.uint8,mode='r')
+        signature = struct.unpack_from("<I",self.data)[0]
+        if signature == SIGNATURE:
+            self.byteOrder = "<"
+        elif signature == struct.unpack(">I",struct.pack("<I",SIGNATURE))[0]:
+            self.byteOrder = ">"
+        else:
+            raise ValueError("{infile} isn't a .2bit file.".format(infile=self.infile))
+        version,seqCount = struct.unpack_from(self.byteOrder + "II",self.data,4)
+        offsetFormat = self.byteOrder + ("Q" if version else "I")
+        #: A dict of each record name to the offset of its record.
+        self.offsets = {}
+        self._names = []
+        pos = 16
+        for i in range(seqCount):
+            nameSize = int(self.data[pos])
+            name = self.data[pos + 1:pos + 1 + nameSize].tobytes().decode()
+            pos += 1 + nameSize
+            self.offsets[name] = struct.unpack_from(offsetFormat,self.data,pos)[0]
+            pos += struct.calcsize(offsetFormat)
+            self._names.append(name)
+        self._records = {}
+
+    def __getstate__(self):
+        return {"infile": self.infile}
+
+    def __setstate__(self,state):
+        self.infile = state["infile"]
+        self._open()
+
+    def __contains__(self,name):
+        return name in self.offsets
+
+    def _u32s(self,pos,count):
+        return np.frombuffer(self.data,dtype=self.byteOrder + "u4",count=count,offset=pos)
+
+    def _record(self,name):
+        """
+        Function : Parses the header of a record, i.e. its length and its N and mask run tables.
+        Returns  : tuple of the length, the N run starts, ends, mask run starts, ends, and the offset of the packed bases.
+        """
+        try:
+            return self._records[name]
+        except KeyError:
+            pass
+        try:
+            pos = self.offsets[name]
+        except KeyError:
+            print("Could not find record with name {}.".format(name))
+            raise
+        length,nCount = self._u32s(pos,2)
+        pos += 8
+        nStarts = self._u32s(pos,nCount).astype(np.int64)
+        nEnds = nStarts + self._u32s(pos + 4 * nCount,nCount)
+        pos += 8 * nCount
+        maskCount = self._u32s(pos,1)[0]
+        pos += 4
+        maskStarts = self._u32s(pos,maskCount).astype(np.int64)
+        maskEnds = maskStarts + self._u32s(pos + 4 * maskCount,maskCount)
+        #The mask tables are followed by a reserved word.
+        pos += 8 * maskCount + 4
+        record = (int(length),nStarts,nEnds,maskStarts,maskEnds,pos)
+        self._records[name] = record
+        return record
+
+    def names(self):
+        """
+        Function : Returns the record names, in file order.
+        Returns  : list.
+        """
+        return list(self._names)
+
+    def getLength(self,name):
+        """
+        Function : Returns the number of bases in a record.
+        Returns  : int.
+        """
+        return self._record(name)[0]
+
+    def _range(self,name,start,end):
+        length = self._record(name)[0]
+        end = length if end is None else min(end,length)
+        if start < 0 or start > end:
+            raise ValueError("Invalid range {start}-{end} for record {name} of length {length}.".format(start=start,end=end,name=name,length=length))
+        return start,end
+
+    @staticmethod
+    def _overlapping(starts,ends,start,end):
+        """
+        Function : Finds the parts of the runs that overlap [start,end), relative to start.
+        Returns  : tuple of int64 numpy.ndarrays of the clipped starts and ends.
+        """
+        first = np.searchsorted(ends,start,side='right')
+        last = np.searchsorted(starts,end,side='left')
+        return np.maximum(starts[first:last],start) - start,np.minimum(ends[first:last],end) - start
+
+    def fetchArray(self,name,start=0,end=None):
+        """
+        Function : Retrieves a range of a record's sequence as base codes, unpacking only the bytes that hold it.
+        Args     : name - str.
+                   start - int. The 0-based position of the first base.
+                   end - int. The position just past the last base, as in a slice. Defaults to the end of the record, and is clipped to it.
+        Returns  : uint8 numpy.ndarray in the encoding of kmers.encode(), i.e. A, C, G and T as 0 to 3, and N as 4.
+        """
+        start,end = self._range(name,start,end)
+        length,nStarts,nEnds,maskStarts,maskEnds,dnaStart = self._record(name)
+        packed = self.data[dnaStart + start // 4:dnaStart + (end + 3) // 4]
+        codes = _UNPACK[packed].ravel()[start % 4:start % 4 + end - start]
+        for runStart,runEnd in zip(*self._overlapping(nStarts,nEnds,start,end)):
+            codes[runStart:runEnd] = 4
+        return codes
+
+    def fetch(self,name,start=0,end=None,mask=True):
+        """
+        Function : Retrieves a range of a record's sequence.
+        Args     : name - str.
+                   start - int. The 0-based position of the first base.
+                   end - int. The position just past the last base, as in a slice. Defaults to the end of the record, and is clipped to it.
+                   mask - bool. True means that soft-masked bases are returned in lower case.
+        Returns  : bytes.
+        """
+        start,end = self._range(name,start,end)
+        seq = _BASES[self.fetchArray(name,start,end)]
+        if mask:
+            length,nStarts,nEnds,maskStarts,maskEnds,dnaStart = self._record(name)
+            for runStart,runEnd in zip(*self._overlapping(maskStarts,maskEnds,start,end)):
+                seq[runStart:runEnd] |= 0x20
+        return seq.tobytes()
+
+    def fetchRegion(self,region,mask=True):
+        """
+        Function : Retrieves the sequence of a samtools style region (see fasta.parseRegion()).
+        Args     : region - str.
+        Returns  : bytes.
+        """
+        if region in self.offsets:
+            return self.fetch(region,mask=mask)
+        name,start,end = fasta.parseRegion(region)
+        return self.fetch(name,start,end,mask=mask)
+
+if __name__ == "__main__":
+    description = "Builds a .2bit file from a FASTA file, storing 2 bits per base plus tables of the runs of N and of soft-masked bases. Run as python -m gbsc_utils.fasta.twobit."
+    parser = ArgumentParser(description=description)
+    parser.add_argument('-i','--infile',required=True,help="The FASTA file. May be gzip'd.")
+    parser.add_argument('-o','--outfile',required=True,help="The .2bit file to write.")
+    args = parser.parse_args()
+    build(args.infile,args.outfile)
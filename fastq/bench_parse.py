@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+###
+#Throughput benchmark of fastq_utils.blockparse() against the line-at-a-time fastq_utils.indexparse().
+###
+
+from argparse import ArgumentParser
+import os
+import random
+import tempfile
+import time
+
+from gbsc_utils.fastq import fastq_utils
+
+def writeSyntheticFastq(outfile,numReads,readLen):
+	"""
+	Function : Writes a FASTQ file of random reads with Illumina Casava 1.8 style title lines.
+	Args     : outfile - str. The output file name.
+	           numReads - int. The number of reads to write.
+	           readLen - int. The length of each read.
+	"""
+	rand = random.Random(0)
+	fout = open(outfile,'w')
+	for i in range(numReads):
+		seq = "".join(rand.choice("ACGTN") for _ in range(readLen))
+		qual = "".join(rand.choice("#<FFJJ") for _ in range(readLen))
+		fout.write("@BENCH:1:FC:1:1101:{x}:{y} 1:N:0:ACGTACGT\n{seq}\n+\n{qual}\n".format(x=i % 30000,y=i,seq=seq,qual=qual))
+	fout.close()
+
+def timeParser(name,fqFile,parser):
+	fh = open(fqFile,'rb' if name.endswith("(bytes)") else 'r')
+	start = time.time()
+	count = 0
+	for rec in parser(fh):
+		count += 1
+	elapsed = time.time() - start
+	fh.close()
+	mb = os.path.getsize(fqFile) / 1024.0 / 1024.0
+	print("{name:<25}{count:>12,} reads{elapsed:>10.2f}s{rate:>10.1f} MB/s".format(name=name,count=count,elapsed=elapsed,rate=mb / elapsed))
+
+description = "Compares the read throughput of fastq_utils.blockparse() with that of fastq_utils.indexparse(). If no input file is given, a synthetic FASTQ file is generated in a temporary directory."
+parser = ArgumentParser(description=description)
+parser.add_argument('-i','--infile',help="An uncompressed FASTQ file to parse.")
+parser.add_argument('-n','--num-reads',type=int,default=500000,help="The number of reads in the synthetic FASTQ file. Default is %(default)s.")
+parser.add_argument('-l','--read-length',type=int,default=150,help="The read length in the synthetic FASTQ file. Default is %(default)s.")
+args = parser.parse_args()
+
+tmpdir = None
+infile = args.infile
+if not infile:
+	tmpdir = tempfile.mkdtemp()
+	infile = os.path.join(tmpdir,"bench.fastq")
+	writeSyntheticFastq(infile,args.num_reads,args.read_length)
+
+timeParser("indexparse",infile,lambda fh: fastq_utils.indexparse(fh=fh,index=False))
+timeParser("blockparse",infile,lambda fh: fastq_utils.blockparse(fh=fh))
+timeParser("blockparse (bytes)",infile,lambda fh: fastq_utils.blockparse(fh=fh))
+timeParser("blockparse multiline",infile,lambda fh: fastq_utils.blockparse(fh=fh,multiline=True))
+
+if tmpdir:
+	os.remove(infile)
+	os.rmdir(tmpdir)
@@ -1,31 +1,24 @@
-import fastq_utils
+from gbsc_utils import kmers
 
 from argparse import ArgumentParser
 
-description="hi"
+description="Counts the reads in a FASTQ file by the first two bases of their sequence."
 parser = ArgumentParser(description=description)
-parser.add_argument('-i','--infile',required=True,help="Input FASTQ file. Can be gzip'd with a .gz extension.")
+parser.add_argument('-i','--infile',required=True,help="Input FASTQ file. Can be gzip'd with a .gz extension; a BGZF file can be read in parallel.")
 parser.add_argument('-o','--outfile',required=True,help="Output file name.")
+parser.add_argument('-p','--procs',type=int,help="The number of processes to use. Defaults to the number of CPUs.")
 
 args = parser.parse_args()
 infile = args.infile
 outfile = args.outfile
-index = fastq_utils.parse(infile)
-dico = {}
-for rec in index:
-	key = rec[1][:2] #the first two bases of the sequence
-	if key not in dico:
-		dico[key] = 0
-	dico[key] += 1
+counter = kmers.scanFastq(infile,2,prefixLength=2,numProcs=args.procs)
 
-totReads = sum(dico.values())
+totReads = counter.numSeqs
 fout = open(outfile,'w')
 fout.write("Dinucleotide\tCount\n")
-for key in sorted(dico.keys()):
-	fout.write("{key}\t{val}\n".format(key=key,val=dico[key]))	
+counter.writeCounts(fout)
 
 fout.write("\n")
 fout.write("Total Reads: {totReads}\n".format(totReads=totReads))
 fout.close()
 	
-
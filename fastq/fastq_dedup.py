@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+
+"""
+Finds duplicate reads, or read pairs, before alignment, in one streaming pass. The key of a read (pair) is the first prefixLen bases of the read, or of
+each mate, and a read is a duplicate if an earlier read has the same key. Optionally, the deduplicated reads are written out, keeping the first read of
+each set of duplicates.
+
+Exact duplicates are found by hashing the keys to 64-bit values, which are kept in a HashSet of sorted NumPy arrays at 8 bytes per distinct key. To cap
+memory, the hash space is divided into PARTITIONS ranges, and when the set holds more than maxHashes values, the hashes of the largest range are spilled to
+disk. Later reads whose hashes fall in a spilled range can't be checked right away, so their records are set aside in a temporary file, and they are
+checked against the spilled hashes at the end of the input, one range at a time. Deduplicated output is therefore in input order, except for the reads
+that were set aside, which come last.
+
+Near duplicates, i.e. reads whose keys are the same length and differ by at most a few mismatches, are found with NearDuplicateIndex, which spills to
+disk by hash partition in the same way. It needs the whole input before it can tell which reads are duplicates, so the input is read twice, and the
+output is in input order.
+"""
+
+from argparse import ArgumentParser
+import hashlib
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+from gbsc_utils import codec
+from gbsc_utils.fastq import fastq_utils
+
+#: The default number of bases from the start of each mate that make up the key of a read (pair).
+PREFIX_LEN = 50
+#: The default maximum number of hashes held in memory before a partition is spilled to disk (8 bytes each).
+MAX_HASHES = 50000000
+#: The number of leading hash bits that select a partition.
+PARTITION_BITS = 4
+PARTITIONS = 1 << PARTITION_BITS
+#: The default number of reads between the points of the duplication curve.
+CURVE_STEP = 1000000
+#: The number of reads (pairs) processed at a time.
+BATCH_SIZE = 10000
+
+def keyHash(key):
+	"""
+	Function : Hashes a key to a 64-bit int.
+	Args     : key - bytes.
+	Returns  : int.
+	"""
+	return int.from_bytes(hashlib.blake2b(key,digest_size=8).digest(),"big")
+
+def readKey(unit,prefixLen):
+	"""
+	Function : Builds the key of a read or read pair from the sequence prefixes of its mates.
+	Args     : unit - tuple of records, one per mate, in the four item tuple form of fastq_utils.blockparse() with bytes items.
+	           prefixLen - int. The number of bases to take from each mate.
+	Returns  : bytes.
+	"""
+	return b"\x00".join([rec[1][:prefixLen] for rec in unit])
+
+class HashSet:
+	"""
+	A set of 64-bit hashes, kept in a few sorted uint64 arrays whose sizes at least double from newest to oldest, so that adding a batch of hashes only
+	re-sorts the small arrays in most cases (as in a log-structured merge tree). Since the arrays are sorted, the hashes of a partition are a contiguous
+	slice of each array, which is what lets popPartition() take them out cheaply.
+	"""
+	def __init__(self):
+		self.levels = []
+
+	def __len__(self):
+		return sum(len(x) for x in self.levels)
+
+	def __contains__(self,value):
+		return bool(self.contains(np.array([value],dtype=np.uint64))[0])
+
+	def contains(self,hashes):
+		"""
+		Function : Tests which of an array of hashes are in the set.
+		Args     : hashes - 1D uint64 array.
+		Returns  : 1D bool array.
+		"""
+		found = np.zeros(len(hashes),dtype=bool)
+		for level in self.levels:
+			pos = np.minimum(np.searchsorted(level,hashes),len(level) - 1)
+			found |= level[pos] == hashes
+		return found
+
+	def add(self,hashes):
+		"""
+		Function : Adds an array of hashes to the set.
+		Args     : hashes - 1D uint64 array.
+		Returns  : 1D bool array that is True at the first occurrence of each hash that wasn't already in the set.
+		"""
+		isNew = np.zeros(len(hashes),dtype=bool)
+		if not len(hashes):
+			return isNew
+		uniq,firstIdx = np.unique(hashes,return_index=True)
+		absent = ~self.contains(uniq)
+		isNew[firstIdx[absent]] = True
+		newLevel = uniq[absent]
+		while self.levels and len(self.levels[-1]) <= 2 * len(newLevel):
+			newLevel = np.sort(np.concatenate((self.levels.pop(),newLevel)),kind="mergesort")
+		if len(newLevel):
+			self.levels.append(newLevel)
+		return isNew
+
+	def partitionSizes(self):
+		"""
+		Function : Counts the hashes in each partition.
+		Returns  : 1D int array of length PARTITIONS.
+		"""
+		sizes = np.zeros(PARTITIONS,dtype=np.int64)
+		for level in self.levels:
+			sizes += np.bincount((level >> np.uint64(64 - PARTITION_BITS)).astype(np.int64),minlength=PARTITIONS)
+		return sizes
+
+	def popPartition(self,partition):
+		"""
+		Function : Removes the hashes of a partition from the set.
+		Args     : partition - int.
+		Returns  : 1D sorted uint64 array of the removed hashes.
+		"""
+		lo = np.uint64(partition << (64 - PARTITION_BITS))
+		popped = []
+		for i,level in enumerate(self.levels):
+			start = np.searchsorted(level,lo)
+			end = len(level) if partition == PARTITIONS - 1 else np.searchsorted(level,np.uint64((partition + 1) << (64 - PARTITION_BITS)))
+			popped.append(level[start:end])
+			self.levels[i] = np.concatenate((level[:start],level[end:]))
+		self.levels = [x for x in self.levels if len(x)]
+		return np.sort(np.concatenate(popped)) if popped else np.zeros(0,dtype=np.uint64)
+
+def _mix(hashes):
+	"""
+	Function : Scrambles an array of 64-bit values with the splitmix64 finalizer, so that their leading bits are evenly spread for partitioning.
+	Args     : hashes - 1D uint64 array. Modified in place.
+	Returns  : hashes.
+	"""
+	hashes ^= hashes >> np.uint64(30)
+	hashes *= np.uint64(0xbf58476d1ce4e5b9)
+	hashes ^= hashes >> np.uint64(27)
+	hashes *= np.uint64(0x94d049bb133111eb)
+	hashes ^= hashes >> np.uint64(31)
+	return hashes
+
+class NearDuplicateIndex:
+	"""
+	Finds the reads whose keys are within a number of mismatches of the key of an earlier read of the same length, with locality-sensitive hashing by the
+	pigeonhole principle: each key is cut into mismatches + 1 segments, and two keys with at most that many mismatches share at least one identical segment.
+	A read is a near duplicate when its key is close enough to any earlier read's, whether or not that read is itself a duplicate, so that partitions can
+	be checked independently.
+
+	It works in two passes with capped memory. In the first, add() stores the key of each read, and an entry of (segment hash, read index) per segment.
+	Entries are partitioned by the leading bits of their hashes, as in HashSet, and when more than maxEntries are held, they are all spilled to a file per
+	partition, and the keys to a file of fixed-width rows. In the second, duplicates() takes one partition at a time, splitting any that holds more than
+	maxEntries by the next bits of the hashes. It sorts the entries into buckets of equal segment hash, and compares the keys of the reads in each bucket
+	pairwise as NumPy arrays, a batch of pairs at a time. Reads with identical keys are collapsed first, so exact duplicates cost no comparisons.
+
+	Low-complexity segments, such as the poly-G of a run of reads that ran off their fragment, put many distinct keys in one bucket, and comparing all of
+	them pairwise is quadratic. So in a bucket, each read is compared with only the MAX_BUCKET reads before it (after collapsing identical keys). A near
+	duplicate that shares no other segment with its earlier read, and is further from it in such a bucket, is missed.
+	"""
+	#: The number of key pairs that are compared at a time.
+	PAIR_BATCH = 1 << 18
+	#: The number of earlier reads in its bucket that a read is compared with.
+	MAX_BUCKET = 128
+
+	def __init__(self,mismatches,keyWidth,maxEntries=MAX_HASHES,workdir=None):
+		"""
+		Args : mismatches - int.
+		       keyWidth - int. The length of the longest key.
+		       maxEntries - int. The number of entries to hold in memory (16 bytes each, mismatches + 1 per read) before spilling to disk.
+		       workdir - str. The directory in which to spill. Defaults to a temporary directory, which duplicates() removes.
+		"""
+		self.mismatches = mismatches
+		self.keyWidth = keyWidth
+		self.maxEntries = maxEntries
+		self.workdir = workdir
+		self._ownWorkdir = False
+		self.numReads = 0
+		#Held keys, as 2D uint8 arrays whose rows are the key length (2 bytes) and the key padded with zeros, and the held entries of each partition.
+		self._keys = []
+		self._entries = [[] for i in range(PARTITIONS)]
+		self._numEntries = 0
+		self._spilled = False
+
+	def _path(self,name):
+		if self.workdir is None:
+			self.workdir = tempfile.mkdtemp(prefix="neardup")
+			self._ownWorkdir = True
+		return os.path.join(self.workdir,name)
+
+	def _keyRows(self,keys):
+		"""
+		Function : Lays out keys as fixed-width rows.
+		Returns  : tuple of the 2D uint8 array of rows, and the 1D array of the key lengths.
+		"""
+		lengths = np.fromiter((len(x) for x in keys),dtype=np.int64,count=len(keys))
+		if len(keys) and lengths.max() > self.keyWidth:
+			raise ValueError("A key is longer than the key width of {width}.".format(width=self.keyWidth))
+		rows = np.zeros((len(keys),self.keyWidth + 2),dtype=np.uint8)
+		rows[:,2:] = np.frombuffer(b"".join([x.ljust(self.keyWidth,b"\x00") for x in keys]),dtype=np.uint8).reshape(len(keys),self.keyWidth)
+		rows[:,0] = lengths & 255
+		rows[:,1] = lengths >> 8
+		return rows,lengths
+
+	def add(self,keys):
+		"""
+		Function : Adds the keys of the next reads.
+		Args     : keys - list of bytes.
+		"""
+		rows,lengths = self._keyRows(keys)
+		readIdx = np.arange(self.numReads,self.numReads + len(keys),dtype=np.uint64)
+		self.numReads += len(keys)
+		if self._spilled:
+			with open(self._path("keys.rows"),'ab') as fout:
+				rows.tofile(fout)
+		else:
+			self._keys.append(rows)
+		for length in np.unique(lengths):
+			group = np.flatnonzero(lengths == length)
+			bounds = [2 + length * i // (self.mismatches + 1) for i in range(self.mismatches + 2)]
+			for seg in range(self.mismatches + 1):
+				#A polynomial hash of the segment's bases, seeded with the key length and segment number.
+				hashes = np.full(len(group),(int(length) << 8 | seg) * 0x9e3779b97f4a7c15 % (1 << 64),dtype=np.uint64)
+				for col in range(bounds[seg],bounds[seg + 1]):
+					hashes = hashes * np.uint64(0x100000001b3) + rows[group,col]
+				hashes = _mix(hashes)
+				partitions = (hashes >> np.uint64(64 - PARTITION_BITS)).astype(np.int64)
+				entries = np.column_stack((hashes,readIdx[group]))
+				for partition in np.unique(partitions):
+					self._entries[partition].append(entries[partitions == partition])
+				self._numEntries += len(group)
+		if self._numEntries > self.maxEntries:
+			self._spill()
+
+	def _spill(self):
+		if not self._spilled:
+			with open(self._path("keys.rows"),'wb') as fout:
+				for rows in self._keys:
+					rows.tofile(fout)
+			self._keys = []
+			self._spilled = True
+		for partition,entries in enumerate(self._entries):
+			if entries:
+				with open(self._path("entries{}".format(partition)),'ab') as fout:
+					for x in entries:
+						x.tofile(fout)
+		self._entries = [[] for i in range(PARTITIONS)]
+		self._numEntries = 0
+
+	def _partitions(self):
+		"""
+		Function : A generator over the entries of each partition, as 2D uint64 arrays of (hash, read index) rows, with no more than maxEntries at a time
+		           unless they share a hash.
+		"""
+		if not self._spilled:
+			for entries in self._entries:
+				if entries:
+					yield np.concatenate(entries)
+			return
+		self._spill()
+		pending = [(self._path("entries{}".format(x)),PARTITION_BITS) for x in range(PARTITIONS)]
+		while pending:
+			path,bits = pending.pop()
+			if not os.path.exists(path):
+				continue
+			entries = np.memmap(path,dtype=np.uint64,mode='r').reshape(-1,2)
+			if len(entries) <= self.maxEntries or bits >= 64:
+				yield np.array(entries)
+				del entries
+				os.remove(path)
+				continue
+			#Split by the next bits of the hashes, a slice at a time.
+			subPaths = ["{path}.{i}".format(path=path,i=i) for i in range(PARTITIONS)]
+			for start in range(0,len(entries),self.maxEntries):
+				chunk = entries[start:start + self.maxEntries]
+				subParts = ((chunk[:,0] >> np.uint64(64 - bits - PARTITION_BITS)) & np.uint64(PARTITIONS - 1)).astype(np.int64)
+				for i in np.unique(subParts):
+					with open(subPaths[i],'ab') as fout:
+						chunk[subParts == i].tofile(fout)
+			del entries,chunk
+			os.remove(path)
+			pending.extend((x,bits + PARTITION_BITS) for x in subPaths)
+
+	def duplicates(self):
+		"""
+		Function : Finds the near duplicates among all the reads added.
+		Returns  : 1D bool array, True for each read that is a near duplicate of an earlier one.
+		"""
+		if self._spilled:
+			keys = np.memmap(self._path("keys.rows"),dtype=np.uint8,mode='r').reshape(-1,self.keyWidth + 2)
+		else:
+			keys = np.concatenate(self._keys) if self._keys else np.zeros((0,self.keyWidth + 2),dtype=np.uint8)
+		isDup = np.zeros(self.numReads,dtype=bool)
+		try:
+			for entries in self._partitions():
+				self._checkPartition(entries,keys,isDup)
+		finally:
+			del keys
+			if self._ownWorkdir:
+				shutil.rmtree(self.workdir,ignore_errors=True)
+		return isDup
+
+	def _checkPartition(self,entries,keys,isDup):
+		"""
+		Function : Marks the reads of one partition's buckets that are near duplicates of earlier reads in the same bucket.
+		"""
+		order = np.lexsort((entries[:,1],entries[:,0]))
+		hashes = entries[order,0]
+		readIdx = entries[order,1].astype(np.int64)
+		rows = keys[readIdx]
+		#Collapse identical keys within a bucket onto the earliest read with the key, by a hash of the whole row.
+		rowHashes = np.zeros(len(rows),dtype=np.uint64)
+		for col in range(rows.shape[1]):
+			rowHashes = rowHashes * np.uint64(0x100000001b3) + rows[:,col]
+		order = np.lexsort((readIdx,_mix(rowHashes),hashes))
+		hashes,readIdx,rows,rowHashes = hashes[order],readIdx[order],rows[order],rowHashes[order]
+		repeat = np.zeros(len(hashes),dtype=bool)
+		repeat[1:] = (hashes[1:] == hashes[:-1]) & (rowHashes[1:] == rowHashes[:-1])
+		isDup[readIdx[repeat]] = True
+		keep = ~repeat
+		hashes,readIdx,rows = hashes[keep],readIdx[keep],rows[keep]
+		order = np.lexsort((readIdx,hashes))
+		hashes,readIdx,rows = hashes[order],readIdx[order],rows[order]
+		#Pair each read with the earlier reads in its bucket, up to MAX_BUCKET of them.
+		newBucket = np.ones(len(hashes),dtype=bool)
+		newBucket[1:] = hashes[1:] != hashes[:-1]
+		bucketStart = np.maximum.accumulate(np.where(newBucket,np.arange(len(hashes)),0))
+		numEarlier = np.minimum(np.arange(len(hashes)) - bucketStart,self.MAX_BUCKET)
+		candidates = np.flatnonzero(numEarlier)
+		pairEnds = np.cumsum(numEarlier[candidates])
+		first = 0
+		while first < len(candidates):
+			last = max(np.searchsorted(pairEnds,(pairEnds[first - 1] if first else 0) + self.PAIR_BATCH,side='right'),first + 1)
+			later = candidates[first:last]
+			counts = numEarlier[later]
+			laterIdx = np.repeat(later,counts)
+			offsets = np.arange(len(laterIdx)) - np.repeat(np.cumsum(counts) - counts,counts)
+			earlierIdx = np.repeat(later - counts,counts) + offsets
+			#Keys of different lengths never match, whatever their bases.
+			mismatches = (rows[laterIdx,2:] != rows[earlierIdx,2:]).sum(axis=1)
+			close = (mismatches <= self.mismatches) & (rows[laterIdx,0] == rows[earlierIdx,0]) & (rows[laterIdx,1] == rows[earlierIdx,1])
+			isDup[readIdx[laterIdx[close]]] = True
+			first = last
+
+class DedupStats:
+	"""
+	Counts of the duplicate reads (or pairs) found by dedupFiles().
+
+	Attributes : numReads - int. The number of reads (pairs).
+	             numUnique - int. The number that aren't duplicates of an earlier read.
+	             curveStep - int. The number of reads between the points of the duplication curve.
+	             uniquePerStep - list of the number of unique reads among each curveStep reads.
+	"""
+	def __init__(self,curveStep):
+		self.numReads = 0
+		self.numUnique = 0
+		self.curveStep = curveStep
+		self.uniquePerStep = []
+
+	def addUnique(self,readIndexes):
+		"""
+		Function : Counts unique reads into the steps of the duplication curve.
+		Args     : readIndexes - 1D int array of the (0-based) positions in the input of unique reads.
+		"""
+		counts = np.bincount(readIndexes // self.curveStep)
+		if len(counts) > len(self.uniquePerStep):
+			self.uniquePerStep.extend([0] * (len(counts) - len(self.uniquePerStep)))
+		for i in np.flatnonzero(counts):
+			self.uniquePerStep[i] += int(counts[i])
+		self.numUnique += len(readIndexes)
+
+	def duplicationRate(self):
+		"""
+		Function : Returns the fraction of the reads that are duplicates.
+		"""
+		return 1 - self.numUnique / self.numReads if self.numReads else 0.0
+
+	def curve(self):
+		"""
+		Function : Computes the duplication curve, i.e. the number of unique reads and the duplication rate after every curveStep reads, and at the end.
+		           The curve flattening out means the library is close to saturation.
+		Returns  : list of three item tuples (reads, unique reads, duplication rate).
+		"""
+		points = []
+		unique = 0
+		for i in range((self.numReads + self.curveStep - 1) // self.curveStep):
+			unique += self.uniquePerStep[i] if i < len(self.uniquePerStep) else 0
+			reads = min((i + 1) * self.curveStep,self.numReads)
+			points.append((reads,unique,1 - unique / reads))
+		return points
+
+	def writeReport(self,fout):
+		"""
+		Function : Writes the counts and the duplication curve as tab-delimited lines to a text file handle.
+		"""
+		fout.write("Total\t{numReads}\n".format(numReads=self.numReads))
+		fout.write("Unique\t{numUnique}\n".format(numUnique=self.numUnique))
+		fout.write("Duplication rate\t{rate:.4f}\n\n".format(rate=self.duplicationRate()))
+		fout.write("#Duplication curve\nReads\tUnique\tDuplicationRate\n")
+		for reads,unique,rate in self.curve():
+			fout.write("{reads}\t{unique}\t{rate:.4f}\n".format(reads=reads,unique=unique,rate=rate))
+
+def _units(infiles):
+	"""
+	Function : A generator over the reads of one FASTQ file, or the pairs of reads of mate files, as tuples of records.
+	Raises   : ValueError - The mates aren't in the same order.
+	"""
+	fhs = [fastq_utils.getFastqReadFileHandle(x,binary=True) for x in infiles]
+	for unit in itertools.zip_longest(*[fastq_utils.blockparse(fh) for fh in fhs]):
+		if None in unit:
+			raise ValueError("The input files have different numbers of reads.")
+		if len(unit) > 1:
+			key = fastq_utils.mateKey(unit[0][0])
+			if any(fastq_utils.mateKey(rec[0]) != key for rec in unit[1:]):
+				raise ValueError("Mates out of order: {first} is paired with {second}.".format(first=unit[0][0].decode(),second=unit[1][0].decode()))
+		yield unit
+	for fh in fhs:
+		fh.close()
+
+def dedupFiles(infiles,outfiles=None,prefixLen=PREFIX_LEN,mismatches=0,maxHashes=MAX_HASHES,curveStep=CURVE_STEP,tmpdir=None,batchSize=BATCH_SIZE):
+	"""
+	Function : Finds the duplicate reads of a FASTQ file, or the duplicate pairs of mate FASTQ files, and optionally writes out the rest.
+	Args     : infiles - list of one FASTQ file, or of mate FASTQ files whose mates are in the same order. May be compressed.
+	           outfiles - list of output files, one per input file, or None to only count duplicates. Compressed according to the extension (see
+	                      codec.openWrite()).
+	           prefixLen - int. The number of bases from the start of each mate that make up the key.
+	           mismatches - int. With more than 0, reads whose keys differ by up to this many mismatches are duplicates (see NearDuplicateIndex).
+	           maxHashes - int. The number of hashes to hold in memory before spilling a partition to disk. With mismatches, the number of segment
+	                       entries (see NearDuplicateIndex), of which there are mismatches + 1 per read.
+	           curveStep - int. The number of reads between the points of the duplication curve.
+	           tmpdir - str. The directory in which to spill. Defaults to the system temporary directory.
+	           batchSize - int. The number of reads (pairs) to process at a time.
+	Returns  : DedupStats.
+	"""
+	if outfiles and len(outfiles) != len(infiles):
+		raise ValueError("There must be one output file per input file.")
+	stats = DedupStats(curveStep)
+	fouts = [codec.BackgroundWriter(codec.openWrite(x)) for x in outfiles] if outfiles else []
+	workdir = tempfile.mkdtemp(prefix="dedup",dir=tmpdir)
+	try:
+		if mismatches:
+			_dedupNear(infiles,fouts,prefixLen,mismatches,maxHashes,stats,workdir,batchSize)
+		else:
+			_dedupExact(infiles,fouts,prefixLen,maxHashes,stats,workdir,batchSize)
+	finally:
+		for fout in fouts:
+			fout.close()
+		shutil.rmtree(workdir,ignore_errors=True)
+	return stats
+
+def _writeUnits(fouts,units):
+	for i,fout in enumerate(fouts):
+		fastq_utils.writeViews(fout,[unit[i] for unit in units])
+
+def _dedupNear(infiles,fouts,prefixLen,mismatches,maxHashes,stats,workdir,batchSize):
+	index = NearDuplicateIndex(mismatches,prefixLen * len(infiles) + len(infiles) - 1,maxHashes,workdir)
+	units = _units(infiles)
+	while True:
+		batch = list(itertools.islice(units,batchSize))
+		if not batch:
+			break
+		index.add([readKey(unit,prefixLen) for unit in batch])
+	isDup = index.duplicates()
+	stats.numReads = len(isDup)
+	stats.addUnique(np.flatnonzero(~isDup))
+	if not fouts:
+		return
+	#The second pass over the input writes out the reads that aren't duplicates, in order.
+	units = _units(infiles)
+	start = 0
+	while True:
+		batch = list(itertools.islice(units,batchSize))
+		if not batch:
+			break
+		_writeUnits(fouts,[batch[i] for i in np.flatnonzero(~isDup[start:start + len(batch)])])
+		start += len(batch)
+
+def _dedupExact(infiles,fouts,prefixLen,maxHashes,stats,workdir,batchSize):
+	hashSet = HashSet()
+	spilled = np.zeros(PARTITIONS,dtype=bool)
+	#The records of the reads set aside for spilled partitions, one file per mate, and for each spilled partition, a file of (hash, read index, set-aside
+	#index) rows for those reads.
+	asideFiles = [os.path.join(workdir,"aside{}.fastq".format(i)) for i in range(len(infiles))]
+	asideFouts = None
+	numAside = 0
+	units = _units(infiles)
+	while True:
+		batch = list(itertools.islice(units,batchSize))
+		if not batch:
+			break
+		hashes = np.fromiter((keyHash(readKey(unit,prefixLen)) for unit in batch),dtype=np.uint64,count=len(batch))
+		partitions = (hashes >> np.uint64(64 - PARTITION_BITS)).astype(np.int64)
+		aside = spilled[partitions]
+		live = np.flatnonzero(~aside)
+		isNew = np.zeros(len(batch),dtype=bool)
+		isNew[live] = hashSet.add(hashes[live])
+		kept = np.flatnonzero(isNew)
+		stats.addUnique(stats.numReads + kept)
+		_writeUnits(fouts,[batch[i] for i in kept])
+		asideIdx = np.flatnonzero(aside)
+		if len(asideIdx):
+			if asideFouts is None:
+				asideFouts = [open(x,'wb') for x in asideFiles]
+			_writeUnits(asideFouts,[batch[i] for i in asideIdx])
+			rows = np.column_stack((hashes[asideIdx],(stats.numReads + asideIdx).astype(np.uint64),np.arange(numAside,numAside + len(asideIdx),dtype=np.uint64)))
+			for partition in np.unique(partitions[asideIdx]):
+				fh = open(os.path.join(workdir,"aside{}.rows".format(partition)),'ab')
+				rows[partitions[asideIdx] == partition].tofile(fh)
+				fh.close()
+			numAside += len(asideIdx)
+		stats.numReads += len(batch)
+		if len(hashSet) > maxHashes:
+			sizes = hashSet.partitionSizes()
+			partition = int(np.argmax(sizes))
+			hashSet.popPartition(partition).tofile(os.path.join(workdir,"spill{}.hashes".format(partition)))
+			spilled[partition] = True
+	if not numAside:
+		return
+	for fh in asideFouts:
+		fh.close()
+	#Check the reads set aside against the spilled hashes, one partition at a time, and then write out the unique ones.
+	keepAside = np.zeros(numAside,dtype=bool)
+	for partition in np.flatnonzero(spilled):
+		rowsFile = os.path.join(workdir,"aside{}.rows".format(partition))
+		if not os.path.exists(rowsFile):
+			continue
+		rows = np.fromfile(rowsFile,dtype=np.uint64).reshape(-1,3)
+		partSet = HashSet()
+		partSet.add(np.fromfile(os.path.join(workdir,"spill{}.hashes".format(partition)),dtype=np.uint64))
+		isNew = partSet.add(rows[:,0])
+		keepAside[rows[isNew,2].astype(np.int64)] = True
+		stats.addUnique(rows[isNew,1].astype(np.int64))
+	if fouts:
+		fhs = [open(x,'rb') for x in asideFiles]
+		asideUnits = zip(*[fastq_utils.blockparse(fh) for fh in fhs])
+		for i,unit in enumerate(asideUnits):
+			if keepAside[i]:
+				_writeUnits(fouts,[unit])
+		for fh in fhs:
+			fh.close()
+
+if __name__ == "__main__":
+	description = "Finds duplicate reads in a FASTQ file, or duplicate read pairs in mate FASTQ files, by the first bases of each read, and reports the duplication rate and the duplication curve (unique reads versus reads sequenced). Optionally writes out the reads with the duplicates removed."
+	parser = ArgumentParser(description=description)
+	parser.add_argument('-i','--infiles',nargs="+",required=True,help="One FASTQ file, or the R1 and R2 files of paired-end reads.")
+	parser.add_argument('-o','--outfiles',nargs="+",help="One deduplicated output file per input file. Compressed according to the extension ('.gz' is written as BGZF).")
+	parser.add_argument('-l','--prefix-length',type=int,default=PREFIX_LEN,help="The number of bases from the start of each read that are compared. Default is %(default)s.")
+	parser.add_argument('-k','--mismatches',type=int,default=0,help="Count reads that differ by at most this many mismatches as duplicates. The input is then read twice. Default is %(default)s.")
+	parser.add_argument('-m','--max-hashes',type=int,default=MAX_HASHES,help="The number of distinct reads to hold in memory (8 bytes each) before spilling to disk. With --mismatches, the number of read segments (16 bytes each, mismatches + 1 per read). Default is %(default)s.")
+	parser.add_argument('-s','--curve-step',type=int,default=CURVE_STEP,help="The number of reads between the points of the duplication curve. Default is %(default)s.")
+	parser.add_argument('-r','--report',help="The file to write the report to. Defaults to stdout.")
+	parser.add_argument('--tmpdir',help="The directory in which to spill. Defaults to the system temporary directory.")
+	args = parser.parse_args()
+	stats = dedupFiles(args.infiles,args.outfiles,prefixLen=args.prefix_length,mismatches=args.mismatches,maxHashes=args.max_hashes,curveStep=args.curve_step,tmpdir=args.tmpdir)
+	fout = open(args.report,'w') if args.report else sys.stdout
+	stats.writeReport(fout)
+	if args.report:
+		fout.close()
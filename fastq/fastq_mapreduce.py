@@ -0,0 +1,307 @@
+"""
+A map/reduce engine for full-file scans of a FASTQ file across multiple processes. The file is split into chunks at record boundaries (see chunks()),
+and each chunk is scanned by a worker in a process pool. Uncompressed and BGZF files can be split; other compressed files are scanned as one chunk.
+
+scan() runs a mapper over each record (or each batch of records), folds the mapped values into a per-chunk accumulator with a reducer, and merges the
+per-chunk accumulators in file order. countKeys() is a shortcut for the common case of counting the keys that a mapper returns, as for histograms.
+filterFile() writes the records that pass a predicate into one output shard per chunk, and concatenates the shards in order. writeChunks() does the
+same for any worker that writes a chunk's output to a shard.
+
+Records are the four item tuples of bytes yielded by fastq_utils.blockparse(), or for filterFile(views=True), the memoryview tuples yielded by
+fastq_utils.viewparse(). Mappers, reducers and predicates are sent to the worker processes and
+must therefore be picklable, i.e. module-level functions, or functools.partial objects of module-level functions.
+"""
+
+import os
+import copy
+import shutil
+import tempfile
+import collections
+import multiprocessing
+
+from gbsc_utils import bgzf
+from gbsc_utils import codec
+from gbsc_utils.fastq import fastq_utils
+
+#: Number of chunks per worker process, so that a slow chunk doesn't hold up the others for long.
+CHUNKS_PER_PROC = 4
+#: Number of records that filterFile() workers test and write at a time.
+WRITE_BATCH_SIZE = 10000
+
+def chunks(fqFile,numChunks):
+	"""
+	Function : Splits a FASTQ file into chunks that start at record boundaries. The split points are found by jumping to evenly spaced offsets and reading
+	           forward to the next line that begins a record, i.e. a line that starts with '@' and is followed by a sequence line, a line starting with
+	           '+', and a quality line as long as the sequence. For a BGZF file, the offsets are virtual offsets and the jumps are to block starts.
+	Args     : fqFile - A FASTQ file.
+	           numChunks - int. The desired number of chunks. Fewer are returned for small files, and just one for compressed files other than BGZF.
+	Returns  : list of two item tuples of (start,end) offsets, where end is None for the last chunk.
+	"""
+	fmt = codec.detectFormat(fqFile)
+	if fmt in (codec.GZIP,codec.BZ2):
+		return [(0,None)]
+	isBgzf = fmt == codec.BGZF
+	size = os.path.getsize(fqFile)
+	starts = [0]
+	if isBgzf:
+		fh = bgzf.BgzfReader(fqFile)
+	else:
+		fh = open(fqFile,'rb')
+	for i in range(1,numChunks):
+		offset = size * i // numChunks
+		if isBgzf:
+			blockStart = bgzf.findBlockStart(fqFile,offset)
+			if blockStart is None:
+				break
+			fh.seek(bgzf.makeVirtualOffset(blockStart,0))
+		else:
+			fh.seek(offset)
+		start = _findRecordStart(fh)
+		if start is None:
+			break
+		if start > starts[-1]:
+			starts.append(start)
+	fh.close()
+	return list(zip(starts,starts[1:] + [None]))
+
+def _findRecordStart(fh):
+	"""
+	Function : Reads forward from the current position, which may be in the middle of a line, to the start of the next record.
+	Args     : fh - A binary file handle with readline() and tell(), such as a bgzf.BgzfReader.
+	Returns  : The position of the next record, or None if there isn't one.
+	"""
+	fh.readline() #the partial line
+	window = collections.deque(maxlen=4)
+	while True:
+		pos = fh.tell()
+		line = fh.readline()
+		if not line:
+			return None
+		window.append((pos,line.rstrip()))
+		if len(window) == 4:
+			(pos0,att),(pos1,seq),(pos2,plus),(pos3,qual) = window
+			if att.startswith(b"@") and plus.startswith(b"+") and len(seq) == len(qual):
+				return pos0
+
+class _RangeReader:
+	"""
+	A file-like object over the range of an uncompressed file between two byte offsets.
+	"""
+	def __init__(self,fqFile,start,end):
+		self.fh = open(fqFile,'rb')
+		self.fh.seek(start)
+		self.remaining = None if end is None else end - start
+
+	def read(self,size=-1):
+		if self.remaining is None:
+			return self.fh.read(size)
+		if size < 0 or size > self.remaining:
+			size = self.remaining
+		data = self.fh.read(size)
+		self.remaining -= len(data)
+		return data
+
+	def close(self):
+		self.fh.close()
+
+class _BgzfRangeReader:
+	"""
+	A file-like object over the range of a BGZF file between two virtual offsets.
+	"""
+	def __init__(self,fqFile,start,end):
+		self.fh = bgzf.BgzfReader(fqFile)
+		self.fh.seek(start)
+		self.end = end
+
+	def read(self,size=-1):
+		chunks = []
+		numBytes = 0
+		while size < 0 or numBytes < size:
+			data = self.fh.readBlock(self.end)
+			if not data:
+				break
+			chunks.append(data)
+			numBytes += len(data)
+		return b"".join(chunks)
+
+	def close(self):
+		self.fh.close()
+
+def openChunk(fqFile,start,end):
+	"""
+	Function : Opens one chunk of a FASTQ file, as returned by chunks(), for reading its raw bytes.
+	Args     : fqFile - A FASTQ file.
+	           start - The offset of the first record in the chunk.
+	           end - The offset just past the last record in the chunk, or None to read to the end of the file.
+	Returns  : A file-like object with read() and close(), over the uncompressed bytes of the chunk.
+	"""
+	fmt = codec.detectFormat(fqFile)
+	if fmt == codec.BGZF:
+		return _BgzfRangeReader(fqFile,start,end)
+	elif fmt != codec.PLAIN:
+		return fastq_utils.getFastqReadFileHandle(fqFile,binary=True)
+	return _RangeReader(fqFile,start,end)
+
+def iterChunk(fqFile,start,end,views=False):
+	"""
+	Function : A generator over the records in one chunk of a FASTQ file, as returned by chunks().
+	Args     : fqFile - A FASTQ file.
+	           start - The offset of the first record in the chunk.
+	           end - The offset just past the last record in the chunk, or None to read to the end of the file.
+	           views - bool. True means to yield the records as memoryview slices (see fastq_utils.viewparse()) rather than as bytes.
+	Returns  : generator of four item tuples of bytes, or of memoryviews.
+	"""
+	fh = openChunk(fqFile,start,end)
+	parser = fastq_utils.viewparse if views else fastq_utils.blockparse
+	for rec in parser(fh):
+		yield rec
+	fh.close()
+
+def _batches(recs,batchSize):
+	batch = []
+	for rec in recs:
+		batch.append(rec)
+		if len(batch) == batchSize:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+def _scanChunk(job):
+	"""
+	Function : Worker for scan(). Folds the mapped values of the records in one chunk into a fresh copy of the initial accumulator.
+	"""
+	fqFile,start,end,mapper,reducer,initial,batchSize = job
+	acc = copy.deepcopy(initial)
+	recs = iterChunk(fqFile,start,end)
+	items = _batches(recs,batchSize) if batchSize else recs
+	for item in items:
+		acc = reducer(acc,mapper(item))
+	return acc
+
+def _runJobs(worker,jobs,numProcs):
+	"""
+	Function : Runs a worker over a list of jobs, in a process pool when there is more than one job and process.
+	Returns  : list of the worker's results, in the order of the jobs.
+	"""
+	if numProcs == 1 or len(jobs) == 1:
+		return [worker(job) for job in jobs]
+	pool = multiprocessing.Pool(min(numProcs,len(jobs)))
+	try:
+		results = pool.map(worker,jobs,chunksize=1)
+	finally:
+		pool.close()
+		pool.join()
+	return results
+
+def scan(fqFile,mapper,reducer,initial,merge=None,batchSize=None,numProcs=None):
+	"""
+	Function : Scans a FASTQ file in parallel. Within each chunk, acc = reducer(acc,mapper(item)) is computed for each record (or batch of records),
+	           starting from a copy of initial. The chunk accumulators are then combined in file order with merge.
+	Args     : fqFile - A FASTQ file.
+	           mapper - function taking a record, or a list of records when batchSize is set.
+	           reducer - function taking the accumulator and a mapped value, and returning the updated accumulator.
+	           initial - The initial accumulator. Deep copied for each chunk.
+	           merge - function taking two accumulators, and returning the combined accumulator. Defaults to reducer.
+	           batchSize - int. If set, mapper is called with lists of up to this many records rather than with each record.
+	           numProcs - int. The number of worker processes. Defaults to the number of CPUs.
+	Returns  : The combined accumulator.
+	"""
+	numProcs = numProcs or multiprocessing.cpu_count()
+	merge = merge or reducer
+	jobs = [(fqFile,start,end,mapper,reducer,initial,batchSize) for start,end in chunks(fqFile,numProcs * CHUNKS_PER_PROC)]
+	result = copy.deepcopy(initial)
+	for acc in _runJobs(_scanChunk,jobs,numProcs):
+		result = merge(result,acc)
+	return result
+
+def countReducer(counter,key):
+	"""
+	Function : A reducer for scan() that counts the keys returned by the mapper, skipping None.
+	"""
+	if key is not None:
+		counter[key] += 1
+	return counter
+
+def mergeCounters(counter,other):
+	"""
+	Function : A merge function for scan() that adds up two collections.Counter accumulators.
+	"""
+	counter.update(other)
+	return counter
+
+def countKeys(fqFile,keyFunc,numProcs=None):
+	"""
+	Function : Counts, in parallel, the keys returned by keyFunc for each record of a FASTQ file. Records for which keyFunc returns None aren't counted.
+	Args     : fqFile - A FASTQ file.
+	           keyFunc - function taking a record and returning a hashable key.
+	           numProcs - int. The number of worker processes. Defaults to the number of CPUs.
+	Returns  : collections.Counter.
+	"""
+	return scan(fqFile,keyFunc,countReducer,collections.Counter(),merge=mergeCounters,numProcs=numProcs)
+
+def _filterChunk(job):
+	"""
+	Function : Worker for filterFile(). Writes the records in one chunk that pass the predicate to a shard file.
+	Returns  : two item tuple being the number of records and the number that passed.
+	"""
+	fqFile,start,end,shardFile,predicate,views = job
+	#One compression thread, since there is already a worker process per CPU.
+	fout = codec.openWrite(shardFile,threads=1)
+	numRecs = 0
+	numPassed = 0
+	for batch in _batches(iterChunk(fqFile,start,end,views=views),WRITE_BATCH_SIZE):
+		numRecs += len(batch)
+		passed = [rec for rec in batch if predicate(rec)]
+		numPassed += len(passed)
+		fastq_utils.writeViews(fout,passed)
+	fout.close()
+	return numRecs,numPassed
+
+def writeChunks(fqFile,worker,args,outfile,numProcs=None,tmpdir=None):
+	"""
+	Function : Runs a worker over the chunks of a FASTQ file in parallel, each writing its output to a shard file, and concatenates the shards in order
+	           into one output file. If outfile has a compression extension (see codec.WRITE_EXTENSIONS), the shards are named with it so that workers
+	           can compress them, and the concatenation of the shards is itself a valid compressed file.
+	Args     : fqFile - A FASTQ file.
+	           worker - function taking a job tuple of (fqFile, start, end, shard file) followed by args, and returning a picklable result.
+	           args - tuple of further items for each job.
+	           outfile - str. The output file.
+	           numProcs - int. The number of worker processes. Defaults to the number of CPUs.
+	           tmpdir - str. The directory in which to write the shards. Defaults to the directory of outfile.
+	Returns  : list of the worker's results, in file order.
+	"""
+	numProcs = numProcs or multiprocessing.cpu_count()
+	#Compressed shards are named with the extension of outfile, so that they're compressed the same way.
+	ext = os.path.splitext(outfile)[1] if codec.formatFromExtension(outfile) != codec.PLAIN else ""
+	workdir = tempfile.mkdtemp(prefix="writeChunks",dir=tmpdir or os.path.dirname(os.path.abspath(outfile)))
+	try:
+		jobs = []
+		for i,(start,end) in enumerate(chunks(fqFile,numProcs * CHUNKS_PER_PROC)):
+			jobs.append((fqFile,start,end,os.path.join(workdir,"shard{i}.fastq{ext}".format(i=i,ext=ext))) + tuple(args))
+		results = _runJobs(worker,jobs,numProcs)
+		fout = open(outfile,'wb')
+		for job in jobs:
+			shard = open(job[3],'rb')
+			shutil.copyfileobj(shard,fout,fastq_utils.BLOCK_SIZE)
+			shard.close()
+		fout.close()
+	finally:
+		shutil.rmtree(workdir,ignore_errors=True)
+	return results
+
+def filterFile(fqFile,predicate,outfile,numProcs=None,tmpdir=None,views=False):
+	"""
+	Function : Writes the records of a FASTQ file that pass a predicate to an output file, in parallel and in the original order. Each worker writes its chunk
+	           to a shard file, and the shards are concatenated (see writeChunks()). With a '.gz' outfile, the output is BGZF.
+	Args     : fqFile - A FASTQ file.
+	           predicate - function taking a record and returning True to keep it.
+	           outfile - str. The output FASTQ file.
+	           numProcs - int. The number of worker processes. Defaults to the number of CPUs.
+	           tmpdir - str. The directory in which to write the shards. Defaults to the directory of outfile.
+	           views - bool. True means that the predicate is given records as memoryview slices (see fastq_utils.viewparse()), which are written out
+	                   without being copied. Faster when the predicate only needs e.g. lengths or single bytes.
+	Returns  : two item tuple being the number of records and the number that passed.
+	"""
+	results = writeChunks(fqFile,_filterChunk,(predicate,views),outfile,numProcs,tmpdir)
+	return sum(x[0] for x in results),sum(x[1] for x in results)
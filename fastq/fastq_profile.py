@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+"""
+A FastQC-like profile of the reads in one or more FASTQ files, consisting of the per-cycle base composition, the per-cycle quality histogram, the read
+length distribution, and the distribution of per-read GC content. The counts are kept in NumPy arrays and are updated a batch of reads at a time, by
+viewing the concatenated sequence and quality bytes of the batch as arrays with numpy.frombuffer().
+
+Since a profile is nothing but counts, profiles merge exactly: the profile of a lane is the merge of the profiles of its FASTQ files, and that of a run
+is the merge of the profiles of its lanes. Profiles can be saved to and loaded from .npz files to build such reports without re-reading the FASTQ.
+"""
+
+from argparse import ArgumentParser
+
+import numpy as np
+
+from gbsc_utils import nucleic
+from gbsc_utils.fastq import fastq_mapreduce
+
+#: The bases that are counted per cycle. Anything else is counted as N.
+BASES = "ACGTN"
+#: The Phred offset of the quality strings.
+PHRED_OFFSET = 33
+#: The number of distinct quality scores, i.e. printable characters after the offset.
+NUM_QUALS = 94
+#: The number of reads that profileFile() adds to a profile at a time.
+BATCH_SIZE = 10000
+
+#: Maps each byte to the index of its base in BASES, with anything other than ACGT counted as N.
+_BASE_CODES = np.frombuffer(nucleic.BASE_CODES,dtype=np.uint8)
+
+class Profile:
+	"""
+	Counts that profile a set of reads. The arrays grow as longer reads are added.
+
+	Attributes : numReads - int. The number of reads added.
+	             baseCounts - 2D array of shape (cycles, len(BASES)) with the number of each base at each cycle.
+	             qualCounts - 2D array of shape (cycles, NUM_QUALS) with the number of each quality score at each cycle.
+	             lengthCounts - 1D array with the number of reads of each length.
+	             gcCounts - 1D array of 101 counts of the reads with each GC percentage (rounded to the nearest whole percent).
+	"""
+	def __init__(self):
+		self.numReads = 0
+		self.baseCounts = np.zeros((0,len(BASES)),dtype=np.int64)
+		self.qualCounts = np.zeros((0,NUM_QUALS),dtype=np.int64)
+		self.lengthCounts = np.zeros(1,dtype=np.int64)
+		self.gcCounts = np.zeros(101,dtype=np.int64)
+
+	def __eq__(self,other):
+		return self.numReads == other.numReads and all(np.array_equal(getattr(self,x),getattr(other,x)) for x in ("baseCounts","qualCounts","lengthCounts","gcCounts"))
+
+	def _grow(self,numCycles):
+		"""
+		Function : Pads the per-cycle and length arrays out to the given number of cycles.
+		"""
+		if numCycles <= len(self.baseCounts):
+			return
+		extra = numCycles - len(self.baseCounts)
+		self.baseCounts = np.pad(self.baseCounts,((0,extra),(0,0)))
+		self.qualCounts = np.pad(self.qualCounts,((0,extra),(0,0)))
+		self.lengthCounts = np.pad(self.lengthCounts,(0,numCycles + 1 - len(self.lengthCounts)))
+
+	def addBatch(self,recs):
+		"""
+		Function : Adds a batch of reads to the profile.
+		Args     : recs - list of FASTQ records, in the four item tuple form of fastq_utils.blockparse() with bytes items.
+		"""
+		if not recs:
+			return
+		seqs = b"".join([rec[1] for rec in recs])
+		quals = b"".join([rec[3] for rec in recs])
+		lengths = np.fromiter((len(rec[1]) for rec in recs),dtype=np.int64,count=len(recs))
+		maxLen = int(lengths.max())
+		self._grow(maxLen)
+		numCycles = len(self.baseCounts)
+		self.numReads += len(recs)
+		self.lengthCounts += np.bincount(lengths,minlength=len(self.lengthCounts))
+		if not seqs:
+			self.gcCounts[0] += len(recs)
+			return
+		starts = np.zeros(len(recs),dtype=np.int64)
+		np.cumsum(lengths[:-1],out=starts[1:])
+		#The cycle (0-based position in the read) of each base in the batch.
+		cycles = np.arange(len(seqs),dtype=np.int64) - np.repeat(starts,lengths)
+		codes = _BASE_CODES[np.frombuffer(seqs,dtype=np.uint8)]
+		self.baseCounts += np.bincount(cycles * len(BASES) + codes,minlength=numCycles * len(BASES)).reshape(numCycles,len(BASES))
+		qualScores = np.clip(np.frombuffer(quals,dtype=np.uint8).astype(np.int64) - PHRED_OFFSET,0,NUM_QUALS - 1)
+		self.qualCounts += np.bincount(cycles * NUM_QUALS + qualScores,minlength=numCycles * NUM_QUALS).reshape(numCycles,NUM_QUALS)
+		isGC = ((codes == 1) | (codes == 2)).astype(np.int64)
+		#The GC count of each read is the difference of the running total at the read's end and start.
+		gcTotals = np.concatenate(([0],np.cumsum(isGC)))
+		gc = gcTotals[starts + lengths] - gcTotals[starts]
+		gcPerc = np.zeros(len(recs),dtype=np.int64)
+		nonEmpty = lengths > 0
+		gcPerc[nonEmpty] = np.rint(gc[nonEmpty] * 100.0 / lengths[nonEmpty]).astype(np.int64)
+		self.gcCounts += np.bincount(gcPerc,minlength=101)
+
+	def merge(self,other):
+		"""
+		Function : Adds the counts of another profile into this one.
+		Returns  : This profile.
+		"""
+		self._grow(len(other.baseCounts))
+		other._grow(len(self.baseCounts))
+		self.numReads += other.numReads
+		self.baseCounts += other.baseCounts
+		self.qualCounts += other.qualCounts
+		self.lengthCounts += other.lengthCounts
+		self.gcCounts += other.gcCounts
+		return self
+
+	def meanQuals(self):
+		"""
+		Function : Computes the mean quality score at each cycle.
+		Returns  : 1D float array.
+		"""
+		totals = self.qualCounts.sum(axis=1)
+		return (self.qualCounts * np.arange(NUM_QUALS)).sum(axis=1) / np.maximum(totals,1)
+
+	def save(self,outfile):
+		"""
+		Function : Saves the profile to a NumPy .npz file.
+		"""
+		np.savez(outfile,numReads=self.numReads,baseCounts=self.baseCounts,qualCounts=self.qualCounts,lengthCounts=self.lengthCounts,gcCounts=self.gcCounts)
+
+	@classmethod
+	def load(cls,infile):
+		"""
+		Function : Loads a profile saved with save().
+		Returns  : Profile.
+		"""
+		profile = cls()
+		data = np.load(infile)
+		profile.numReads = int(data["numReads"])
+		for name in ("baseCounts","qualCounts","lengthCounts","gcCounts"):
+			setattr(profile,name,data[name])
+		return profile
+
+	def writeReport(self,outfile):
+		"""
+		Function : Writes the profile as a tab-delimited text report, with a section for each distribution. Each section begins with a line starting with '#'.
+		"""
+		fout = open(outfile,'w')
+		fout.write("Total Reads: {numReads}\n\n".format(numReads=self.numReads))
+		fout.write("#Per-cycle base composition (%)\n")
+		fout.write("Cycle\t" + "\t".join(BASES) + "\tMeanQuality\n")
+		totals = np.maximum(self.baseCounts.sum(axis=1),1)
+		meanQuals = self.meanQuals()
+		for cycle in range(len(self.baseCounts)):
+			percs = ["{:.2f}".format(x) for x in self.baseCounts[cycle] * 100.0 / totals[cycle]]
+			fout.write("{cycle}\t{percs}\t{qual:.2f}\n".format(cycle=cycle + 1,percs="\t".join(percs),qual=meanQuals[cycle]))
+		fout.write("\n#Read length distribution\nLength\tCount\n")
+		for length in np.nonzero(self.lengthCounts)[0]:
+			fout.write("{length}\t{count}\n".format(length=length,count=self.lengthCounts[length]))
+		fout.write("\n#GC content distribution\nGC%\tCount\n")
+		for perc in range(len(self.gcCounts)):
+			fout.write("{perc}\t{count}\n".format(perc=perc,count=self.gcCounts[perc]))
+		fout.close()
+
+def _profileBatch(recs):
+	profile = Profile()
+	profile.addBatch(recs)
+	return profile
+
+def _mergeProfiles(profile,other):
+	return profile.merge(other)
+
+def profileFile(fqFile,batchSize=BATCH_SIZE,numProcs=None):
+	"""
+	Function : Profiles the reads of a FASTQ file, in parallel when it is uncompressed or BGZF (see fastq_mapreduce.scan()).
+	Args     : fqFile - A FASTQ file.
+	           batchSize - int. The number of reads to add to a profile at a time.
+	           numProcs - int. The number of worker processes. Defaults to the number of CPUs.
+	Returns  : Profile.
+	"""
+	return fastq_mapreduce.scan(fqFile,_profileBatch,_mergeProfiles,Profile(),batchSize=batchSize,numProcs=numProcs)
+
+if __name__ == "__main__":
+	description = "Profiles the per-cycle base composition and quality, read lengths, and GC content of the reads in one or more FASTQ files. Profiles saved from earlier runs (.npz files) can be given as input too, in which case they're merged without re-reading the FASTQ files that they came from, e.g. to build a run-level report from lane-level profiles."
+	parser = ArgumentParser(description=description)
+	parser.add_argument('-i','--infiles',nargs="+",required=True,help="FASTQ files and/or .npz profile files. All are merged into one profile.")
+	parser.add_argument('-o','--outfile',help="The text report to write.")
+	parser.add_argument('-s','--save',help="A .npz file to save the merged profile to.")
+	parser.add_argument('-p','--procs',type=int,help="The number of processes to use per FASTQ file. Defaults to the number of CPUs.")
+	args = parser.parse_args()
+	if not args.outfile and not args.save:
+		parser.error("You must supply at least one of the --outfile and --save options!")
+	profile = Profile()
+	for infile in args.infiles:
+		if infile.endswith(".npz"):
+			profile.merge(Profile.load(infile))
+		else:
+			profile.merge(profileFile(infile,numProcs=args.procs))
+	if args.save:
+		profile.save(args.save)
+	if args.outfile:
+		profile.writeReport(args.outfile)
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+
+"""
+Trims the 3' ends of reads in FASTQ files: poly-G tails, low quality tails, and adapter read-through, in that order, then discards reads (or pairs) that are
+left too short.
+
+The trimming is done a batch of reads at a time with NumPy, on the concatenated sequences and quality scores of the batch (see readfilter.Batch). Each
+read's 3' end is a contiguous segment of these arrays, and trimming only ever shortens the segments:
+
+* Poly-G trimming removes a run of G's at the 3' end, which two-colour chemistry (NextSeq, NovaSeq) calls when there is no signal.
+* Quality trimming uses the algorithm of BWA's -q option (also that of cutadapt), which removes the 3' end that maximizes the sum of (threshold - quality)
+  over the removed bases.
+* Adapter trimming finds the position where the rest of the read best aligns to the start of an adapter (a semi-global alignment in which the adapter
+  may run past the end of the read) with at most errorRate errors per aligned base, counting mismatches, insertions and deletions. The edit distances at
+  all positions of all reads in the batch are found at once with a bit-parallel (Myers) alignment, in one vectorized pass per read position.
+"""
+
+from argparse import ArgumentParser
+import itertools
+import sys
+
+import numpy as np
+
+from gbsc_utils import codec
+from gbsc_utils import readfilter
+from gbsc_utils.fastq import fastq_utils
+
+#: Adapter sequences as they're read through at the 3' end of reads. The TruSeq ones are the start of the TruSeq adapters in
+#: illumina/Adapters/TruSeq, preceded by the A of the A-tail.
+ADAPTER_SETS = {
+	"TruSeq": (b"AGATCGGAAGAGCACACGTCTGAACTCCAGTCAC",b"AGATCGGAAGAGCGTCGTGTAGGGAAAGAGTGT"),
+	"Nextera": (b"CTGTCTCTTATACACATCTCCGAGCCCACGAGAC",b"CTGTCTCTTATACACATCTGACGCTGCCGACGA"),
+	"smallRNA": (b"TGGAATTCTCGGGTGCCAAGG",b"GATCGTCGGACTGTAGAACTCTGAACGTGTAGATCTCGGTGGTCGCCGTATCATT"),
+}
+#: The default maximum number of mismatches per aligned adapter base.
+ERROR_RATE = 0.1
+#: The default minimum number of adapter bases that must overlap the 3' end of a read to trim it.
+MIN_OVERLAP = 3
+#: The default minimum length of a poly-G tail to trim it.
+MIN_POLY_G = 10
+#: The number of reads (pairs) trimmed at a time.
+BATCH_SIZE = 10000
+
+#: Maps each byte to its upper case.
+_UPPER = np.arange(256,dtype=np.uint8)
+_UPPER[ord("a"):ord("z") + 1] -= 32
+
+def readAdapterFile(adapterFile):
+	"""
+	Function : Reads adapter sequences from a file, with one per line, or in FASTA format, or in the format of the TruSeq adapter files in
+	           illumina/Adapters/TruSeq, in which each sequence is on a line starting with 5’. Lines that aren't sequences are skipped.
+	Args     : adapterFile - str.
+	Returns  : list of bytes.
+	"""
+	adapters = []
+	fh = open(adapterFile,'r',encoding="utf-8")
+	for line in fh:
+		line = line.strip()
+		if line.startswith("5’") or line.startswith("5'"):
+			line = line[2:].strip()
+		line = line.upper()
+		if line and not line.strip("ACGTN"):
+			adapters.append(line.encode())
+	fh.close()
+	return adapters
+
+def _firstInSegments(mask,starts,lengths):
+	"""
+	Function : Finds the first set position of a mask in each of a list of segments.
+	Args     : mask - 1D bool array.
+	           starts - 1D int array of the segment starts in mask.
+	           lengths - 1D int array of the segment lengths.
+	Returns  : 1D int array of the offsets of the first set position in each segment, or of the segment length where none is set.
+	"""
+	positions = np.flatnonzero(mask)
+	if not len(positions):
+		return lengths.copy()
+	idx = np.searchsorted(positions,starts)
+	first = positions[np.minimum(idx,len(positions) - 1)]
+	found = (idx < len(positions)) & (first < starts + lengths)
+	return np.where(found,first - starts,lengths)
+
+def _reversedSegments(starts,lengths):
+	"""
+	Function : Builds the index that gathers segments of an array reversed and packed together, so that the 3' end of each read comes first.
+	Returns  : three item tuple of 1D int arrays: the gather index, the starts of the packed segments, and the segment number of each packed position.
+	"""
+	segment = np.repeat(np.arange(len(starts)),lengths)
+	packedStarts = np.zeros(len(starts),dtype=np.int64)
+	np.cumsum(lengths[:-1],out=packedStarts[1:])
+	posInSegment = np.arange(len(segment)) - packedStarts[segment]
+	return (starts + lengths - 1)[segment] - posInSegment,packedStarts,segment
+
+def polyGLengths(seqs,starts,lengths,minRun=MIN_POLY_G):
+	"""
+	Function : Trims 3' runs of G of at least minRun bases.
+	Args     : seqs - 1D uint8 array of the concatenated, upper case sequences.
+	           starts - 1D int array of the read starts in seqs.
+	           lengths - 1D int array of the current read lengths.
+	           minRun - int.
+	Returns  : 1D int array of the trimmed lengths.
+	"""
+	index,packedStarts,segment = _reversedSegments(starts,lengths)
+	run = _firstInSegments(seqs[index] != ord("G"),packedStarts,lengths)
+	return np.where(run >= minRun,lengths - run,lengths)
+
+def qualityLengths(quals,starts,lengths,threshold):
+	"""
+	Function : Trims 3' ends of low quality as BWA does. Going from the 3' end, the running sum of (threshold - quality) is computed until it goes negative,
+	           and the read is cut before the base where the sum is greatest, if it is positive.
+	Args     : quals - 1D int array of the concatenated quality scores.
+	           starts - 1D int array of the read starts in quals.
+	           lengths - 1D int array of the current read lengths.
+	           threshold - int.
+	Returns  : 1D int array of the trimmed lengths.
+	"""
+	if not lengths.any():
+		return lengths.copy()
+	index,packedStarts,segment = _reversedSegments(starts,lengths)
+	diffs = threshold - quals[index].astype(np.int64)
+	sums = np.cumsum(diffs)
+	#Restart the running sum at each read.
+	sums -= (sums - diffs)[packedStarts[segment]]
+	firstNegative = _firstInSegments(sums < 0,packedStarts,lengths)
+	posInSegment = np.arange(len(segment)) - packedStarts[segment]
+	sums[posInSegment >= firstNegative[segment]] = -1
+	nonEmpty = lengths > 0
+	best = np.full(len(lengths),-1,dtype=np.int64)
+	best[nonEmpty] = np.maximum.reduceat(sums,packedStarts[nonEmpty])
+	bestPos = _firstInSegments((sums == best[segment]) & (best[segment] > 0),packedStarts,lengths)
+	return np.where(best > 0,lengths - bestPos - 1,lengths)
+
+def adapterLengths(seqs,starts,lengths,adapter,errorRate=ERROR_RATE,minOverlap=MIN_OVERLAP):
+	"""
+	Function : Trims an adapter from the 3' ends of reads. A read is cut at position p when the rest of the read aligns to the start of the adapter, or the
+	           whole adapter aligns to the read from p on, with at most errorRate errors (mismatches, insertions and deletions) per aligned base, i.e. per
+	           base of the read from p up to the length of the adapter, of which there must be at least minOverlap. Of the positions that qualify, the
+	           read is cut at the one whose alignment scores best, with +1 per aligned base and -2 per error, and at the leftmost of equally good ones.
+
+	           The edit distance of every position of every read is found at once with Myers' bit-vector algorithm, in the search form that lets the
+	           alignment end anywhere in the text, run on each read reversed against the reversed adapter. Each read is preceded (i.e. followed, before it's
+	           reversed) by as many wildcard bases as the adapter has, which match any base, so that an adapter running past the 3' end costs nothing. The
+	           bit vectors of all reads are updated together, one read position per step. Only the first 64 bases of an adapter are used.
+	Args     : seqs - 1D uint8 array of the concatenated, upper case sequences.
+	           starts - 1D int array of the read starts in seqs.
+	           lengths - 1D int array of the current read lengths.
+	           adapter - bytes. Upper case.
+	           errorRate - float.
+	           minOverlap - int.
+	Returns  : 1D int array of the trimmed lengths.
+	"""
+	adapter = adapter[:64]
+	adapterLen = len(adapter)
+	if not len(lengths) or not adapterLen:
+		return lengths.copy()
+	#The pattern bits of each text byte, with bit i set where the reversed adapter has that base, and all bits set for the wildcard, 0.
+	mask = np.uint64((1 << adapterLen) - 1)
+	peq = np.zeros(256,dtype=np.uint64)
+	for i,base in enumerate(reversed(adapter)):
+		peq[base] |= np.uint64(1 << i)
+	peq[0] = mask
+	highBit = np.uint64(1 << (adapterLen - 1))
+	#The reversed reads, after adapterLen wildcards, as the rows of a matrix.
+	text = np.zeros((len(lengths),adapterLen + int(lengths.max())),dtype=np.uint8)
+	index,packedStarts,segment = _reversedSegments(starts,lengths)
+	text[segment,adapterLen + np.arange(len(segment)) - packedStarts[segment]] = seqs[index]
+	pv = np.full(len(lengths),mask,dtype=np.uint64)
+	mv = np.zeros(len(lengths),dtype=np.uint64)
+	score = np.full(len(lengths),adapterLen,dtype=np.int64)
+	bestScore = np.full(len(lengths),np.iinfo(np.int64).min,dtype=np.int64)
+	trimmed = lengths.copy()
+	for col in range(text.shape[1]):
+		eq = peq[text[:,col]]
+		xv = eq | mv
+		xh = (((eq & pv) + pv) ^ pv) | eq
+		ph = mv | (~(xh | pv) & mask)
+		mh = pv & xh
+		score += (ph & highBit != 0).astype(np.int64) - (mh & highBit != 0).astype(np.int64)
+		ph = (ph << np.uint64(1)) & mask
+		mh = (mh << np.uint64(1)) & mask
+		pv = mh | (~(xv | ph) & mask)
+		mv = ph & xv
+		#An alignment ending here starts in the read at lengths - numRead, where numRead is the number of read bases in this column and the ones before.
+		numRead = col + 1 - adapterLen
+		if numRead < minOverlap:
+			continue
+		overlap = min(numRead,adapterLen)
+		alignScore = overlap - 2 * score
+		better = (numRead <= lengths) & (score <= int(np.floor(errorRate * overlap))) & (alignScore >= bestScore)
+		bestScore[better] = alignScore[better]
+		trimmed[better] = lengths[better] - numRead
+	return trimmed
+
+class Trimmer:
+	"""
+	The trimming steps applied to the reads of one FASTQ file.
+	"""
+	def __init__(self,adapters=(),errorRate=ERROR_RATE,minOverlap=MIN_OVERLAP,qualThreshold=None,minPolyG=None):
+		"""
+		Args : adapters - iterable of adapter sequences, as str or bytes.
+		       errorRate - float. See adapterLengths().
+		       minOverlap - int. See adapterLengths().
+		       qualThreshold - int. The quality threshold for quality trimming, or None to not trim by quality.
+		       minPolyG - int. The minimum poly-G run to trim, or None to not trim poly-G tails.
+		"""
+		self.adapters = [(x.encode() if isinstance(x,str) else x).upper() for x in adapters]
+		self.errorRate = errorRate
+		self.minOverlap = minOverlap
+		self.qualThreshold = qualThreshold
+		self.minPolyG = minPolyG
+
+	def trimLengths(self,batch,counts=None):
+		"""
+		Function : Computes the trimmed length of each read in a batch.
+		Args     : batch - readfilter.Batch of FASTQ reads.
+		           counts - dict of step name to the number of reads trimmed by the step, to update.
+		Returns  : 1D int array.
+		"""
+		lengths = batch.lengths
+		if not len(batch.seqs):
+			return lengths.copy()
+		seqs = _UPPER[batch.seqs]
+		steps = []
+		if self.minPolyG:
+			steps.append(("poly-G",lambda x: polyGLengths(seqs,batch.starts,x,self.minPolyG)))
+		if self.qualThreshold is not None:
+			steps.append(("quality",lambda x: qualityLengths(batch.quals,batch.starts,x,self.qualThreshold)))
+		if self.adapters:
+			steps.append(("adapter",lambda x: np.min([adapterLengths(seqs,batch.starts,x,adapter,self.errorRate,self.minOverlap) for adapter in self.adapters],axis=0)))
+		for name,step in steps:
+			trimmed = step(lengths)
+			if counts is not None:
+				counts[name] = counts.get(name,0) + int(np.count_nonzero(trimmed < lengths))
+			lengths = trimmed
+		return lengths
+
+class TrimStats:
+	"""
+	Counts of the reads (or pairs) trimmed by trimFiles().
+
+	Attributes : numReads - int. The number of reads (pairs) read.
+	             numWritten - int. The number written, i.e. that weren't too short after trimming.
+	             basesIn - int. The number of bases read.
+	             basesOut - int. The number of bases written.
+	             trimmed - dict mapping each trimming step to the number of reads (mates counted separately) that it trimmed.
+	"""
+	def __init__(self):
+		self.numReads = 0
+		self.numWritten = 0
+		self.basesIn = 0
+		self.basesOut = 0
+		self.trimmed = {}
+
+	def writeReport(self,fout):
+		"""
+		Function : Writes the counts as tab-delimited lines to a text file handle.
+		"""
+		fout.write("Total\t{numReads}\n".format(numReads=self.numReads))
+		fout.write("Written\t{numWritten}\n".format(numWritten=self.numWritten))
+		fout.write("Too short\t{numShort}\n".format(numShort=self.numReads - self.numWritten))
+		fout.write("Bases in\t{basesIn}\nBases out\t{basesOut}\n".format(basesIn=self.basesIn,basesOut=self.basesOut))
+		for name,count in self.trimmed.items():
+			fout.write("Trimmed ({name})\t{count}\n".format(name=name,count=count))
+
+def trimFiles(infiles,outfiles,trimmers,minLength=0,batchSize=BATCH_SIZE,threads=None):
+	"""
+	Function : Trims the reads of a FASTQ file, or of mate FASTQ files, and writes out those (pairs) that are at least minLength long after trimming.
+	Args     : infiles - list of FASTQ files, such as the R1 and R2 files of a run, whose reads are mates in the same order. May be compressed.
+	           outfiles - list of output files, one per input file. Compressed according to the extension (see codec.openWrite()).
+	           trimmers - list of Trimmer objects, one per input file.
+	           minLength - int. A read (pair) is discarded if it (or either mate) is shorter than this after trimming.
+	           batchSize - int. The number of reads (pairs) to trim at a time.
+	           threads - int. The number of BGZF compression threads per output file. Defaults to the number of CPUs.
+	Returns  : TrimStats.
+	Raises   : ValueError - The mates in the input files aren't in the same order, or the files have different numbers of reads.
+	"""
+	if not len(infiles) == len(outfiles) == len(trimmers):
+		raise ValueError("There must be one output file and one trimmer per input file.")
+	fhs = [fastq_utils.getFastqReadFileHandle(x,binary=True) for x in infiles]
+	units = itertools.zip_longest(*[fastq_utils.blockparse(fh) for fh in fhs])
+	fouts = [codec.BackgroundWriter(codec.openWrite(x,threads=threads)) for x in outfiles]
+	stats = TrimStats()
+	try:
+		while True:
+			chunk = list(itertools.islice(units,batchSize))
+			if not chunk:
+				break
+			if None in chunk[-1]:
+				raise ValueError("The input files have different numbers of reads.")
+			batches = [readfilter.Batch(list(recs),True) for recs in zip(*chunk)]
+			if len(batches) > 1 and any(batch.ids != batches[0].ids for batch in batches[1:]):
+				raise ValueError("The mates in the input files aren't in the same order.")
+			lengths = [trimmer.trimLengths(batch,stats.trimmed) for trimmer,batch in zip(trimmers,batches)]
+			keep = np.flatnonzero(np.logical_and.reduce([x >= minLength for x in lengths]))
+			stats.numReads += len(chunk)
+			stats.numWritten += len(keep)
+			for fout,batch,trimmed in zip(fouts,batches,lengths):
+				stats.basesIn += int(batch.lengths.sum())
+				stats.basesOut += int(trimmed[keep].sum())
+				recs = []
+				for i in keep:
+					rec = batch.recs[i]
+					cut = trimmed[i]
+					recs.append((rec[0],rec[1][:cut],rec[2],rec[3][:cut]))
+				fastq_utils.writeViews(fout,recs)
+	finally:
+		for fh in fhs + fouts:
+			fh.close()
+	return stats
+
+if __name__ == "__main__":
+	description = "Trims poly-G tails, low quality 3' ends, and 3' adapters from the reads of a FASTQ file, or of R1 and R2 files together, and discards reads (or pairs) that are too short after trimming."
+	parser = ArgumentParser(description=description)
+	parser.add_argument('-i','--infiles',nargs="+",required=True,help="One FASTQ file, or the R1 and R2 files of paired-end reads. May be compressed.")
+	parser.add_argument('-o','--outfiles',nargs="+",required=True,help="One output file per input file. Compressed according to the extension ('.gz' is written as BGZF).")
+	parser.add_argument('-a','--adapters',nargs="+",default=[],help="Adapter sequences to trim from R1 (or single-end) reads.")
+	parser.add_argument('-A','--adapters2',nargs="+",default=[],help="Adapter sequences to trim from R2 reads.")
+	parser.add_argument('--adapter-set',choices=sorted(ADAPTER_SETS),help="Trim the R1 and R2 adapters of a kit, in addition to any given with --adapters and --adapters2.")
+	parser.add_argument('--adapter-file',help="A file of adapter sequences to trim from all reads. See readAdapterFile() for the formats.")
+	parser.add_argument('-e','--error-rate',type=float,default=ERROR_RATE,help="The maximum number of errors (mismatches, insertions and deletions) per aligned adapter base. Default is %(default)s.")
+	parser.add_argument('--min-overlap',type=int,default=MIN_OVERLAP,help="The minimum number of adapter bases at the 3' end to trim them. Default is %(default)s.")
+	parser.add_argument('-q','--quality',type=int,help="Trim low quality 3' ends, with this quality threshold, as BWA's -q option does.")
+	parser.add_argument('--poly-g',type=int,nargs="?",const=MIN_POLY_G,help="Trim 3' poly-G runs of at least this many bases (default %(const)s when given without a value).")
+	parser.add_argument('-m','--min-length',type=int,default=0,help="Discard reads (pairs) in which a read is shorter than this after trimming. Default is %(default)s.")
+	parser.add_argument('-r','--report',help="The file to write the trimming counts to. Defaults to stdout.")
+	parser.add_argument('-t','--threads',type=int,help="The number of compression threads per output file. Defaults to the number of CPUs.")
+	args = parser.parse_args()
+	common = readAdapterFile(args.adapter_file) if args.adapter_file else []
+	adapters = [args.adapters + common,args.adapters2 + common]
+	if args.adapter_set:
+		for i,adapter in enumerate(ADAPTER_SETS[args.adapter_set]):
+			adapters[i].append(adapter)
+	trimmers = [Trimmer(adapters[min(i,1)],errorRate=args.error_rate,minOverlap=args.min_overlap,qualThreshold=args.quality,minPolyG=args.poly_g) for i in range(len(args.infiles))]
+	stats = trimFiles(args.infiles,args.outfiles,trimmers,minLength=args.min_length,threads=args.threads)
+	fout = open(args.report,'w') if args.report else sys.stdout
+	stats.writeReport(fout)
+	if args.report:
+		fout.close()
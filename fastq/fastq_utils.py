@@ -1,47 +1,818 @@
 import re
+import os
 import gzip
-import bzip2
+import mmap
+import struct
+import hashlib
+import array
+import heapq
+import shutil
+import tempfile
+import itertools
+import collections
+
+from gbsc_utils import bgzf
+from gbsc_utils import codec
 wsReg = re.compile(r'\s+')
 
+#: Number of bytes (characters for text-mode file handles) that blockparse() reads from the input at a time.
+BLOCK_SIZE = 8 * 1024 * 1024
+
+#: File extension of the sidecar offset index written by Index.
+FQI_EXT = ".fqi"
+FQI_MAGIC = b"FQI1"
+#: Sidecar header: magic, size of the FASTQ file, modification time of the FASTQ file in ns, number of records.
+FQI_HEADER = struct.Struct(">4sQQQ")
+#: Sidecar entry: seqid hash, start byte, end byte.
+FQI_ENTRY = struct.Struct(">QQQ")
+
+#: Default number of unpaired reads that syncPairs() holds in memory before spilling the oldest ones to disk.
+MAX_BUFFERED_READS = 100000
+
+#: Default number of read pairs that deinterleave() and interleave() hand to the output files at a time.
+PAIR_BATCH_SIZE = 10000
+
 class Index:
-	def __init__(self,fqFile):
-		self.fh = open(fqFile,'r')
-		self.index = self._indexReads()	
+	"""
+	Random access to the records of a FASTQ file by sequence ID. The offsets of the records can be kept in a sidecar index file named after the FASTQ file
+	with a '.fqi' extension added (see FQI_EXT), like the .fai of fasta.ByteIndex. The sidecar is written on first use, unless writeSidecar is False, and
+	thereafter memory-mapped on open, so that a lookup is a binary search over sorted seqid hashes instead of a full pass through the FASTQ file. A sidecar is
+	ignored (and rewritten) whenever the size or modification time of the FASTQ file no longer matches what is recorded in it. If the sidecar can't be
+	written, for example because the directory is read-only, the index is kept in memory instead.
+
+	The sidecar layout is a fixed header (see FQI_HEADER) followed by one fixed-width entry per record (see FQI_ENTRY) of the form
+	(seqid hash, start byte, end byte), sorted by hash. All integers are unsigned 64-bit big-endian.
+
+	The FASTQ file can be uncompressed or gzip'd. For a BGZF file (see bgzf.py), the start and end are virtual offsets, so that fetching a record only inflates
+	the one or two blocks that it lies in. A plain gzip file works too, but every lookup re-inflates the file from the start; use bgzf.recompress() to convert it.
+
+	An Index holds the FASTQ file open until close() is called, or the 'with' block that it's used in ends.
+	"""
+	def __init__(self,fqFile,sidecar=True,writeSidecar=True):
+		"""
+		Args : fqFile - A FASTQ file, uncompressed or gzip'd.
+		       sidecar - bool. False means to build the index in memory only, without reading or writing the .fqi file.
+		       writeSidecar - bool. False means to read a current .fqi file but not to write one, e.g. to leave the directory of the FASTQ file untouched.
+		"""
+		self.fqFile = fqFile
+		self.bgzf = bgzf.isBgzf(fqFile)
+		if self.bgzf:
+			self.fh = bgzf.BgzfReader(fqFile)
+		elif fqFile.endswith(".gz"):
+			self.fh = gzip.open(fqFile,'rb')
+		else:
+			#No newline translation, so that the number of characters read matches the number of bytes in the index.
+			self.fh = open(fqFile,'r',newline="")
+		self.fqiFile = fqFile + FQI_EXT
+		self.index = None
+		if sidecar:
+			self.index = self._loadSidecar()
+		if self.index is None:
+			self.index = self._indexReads()
+			if sidecar and writeSidecar:
+				self._writeSidecar()
+		self.numRecs = (len(self.index) - FQI_HEADER.size) // FQI_ENTRY.size
 
 	def __iter__(self):
-		return iter(self.index)
+		fh = getFastqReadFileHandle(self.fqFile)
+		for rec in blockparse(fh):
+			yield getSeqIdFromAttLine(rec[0])
+		fh.close()
 
 	def __len__(self):
-		return len(self.index)
+		return self.numRecs
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*exc):
+		self.close()
+
+	def close(self):
+		self.fh.close()
+		if isinstance(self.index,mmap.mmap):
+			self.index.close()
 
 	def __getitem__(self,seqid):
-		return self.index[seqid]
+		return self._find(seqid)[0]
+
+	def __contains__(self,seqid):
+		try:
+			self[seqid]
+		except KeyError:
+			return False
+		return True
+
+	def _fileStamp(self):
+		"""
+		Function : Returns the size and modification time (in nanoseconds) of the FASTQ file, which are stored in the sidecar header to detect a stale index.
+		"""
+		st = os.stat(self.fqFile)
+		return st.st_size,st.st_mtime_ns
+
+	def _loadSidecar(self):
+		"""
+		Function : Memory-maps the sidecar index file if it exists and is current.
+		Returns  : mmap.mmap, or None if there isn't a usable sidecar.
+		"""
+		if not os.path.exists(self.fqiFile):
+			return None
+		size,mtime = self._fileStamp()
+		fh = open(self.fqiFile,'rb')
+		try:
+			mm = mmap.mmap(fh.fileno(),0,access=mmap.ACCESS_READ)
+		except ValueError: #empty file
+			fh.close()
+			return None
+		fh.close()
+		if len(mm) < FQI_HEADER.size:
+			mm.close()
+			return None
+		magic,fqiSize,fqiMtime,numRecs = FQI_HEADER.unpack_from(mm,0)
+		if magic != FQI_MAGIC or fqiSize != size or fqiMtime != mtime or len(mm) != FQI_HEADER.size + numRecs * FQI_ENTRY.size:
+			mm.close()
+			return None
+		return mm
+
+	def _writeSidecar(self):
+		"""
+		Function : Writes the in-memory index out to the sidecar file. The file is written under a temporary name and then renamed, so that a concurrent reader
+		           never sees a partial index. Failure to write is not an error; the in-memory index continues to be used.
+		"""
+		tmpFile = "{fqi}.{pid}.tmp".format(fqi=self.fqiFile,pid=os.getpid())
+		try:
+			fout = open(tmpFile,'wb')
+			fout.write(self.index)
+			fout.close()
+			os.replace(tmpFile,self.fqiFile)
+		except OSError:
+			if os.path.exists(tmpFile):
+				os.remove(tmpFile)
 
 	def _indexReads(self):
-		dico = {}
-		for key,val in indexparse(fh=self.fh,index=True):
-			dico[key] = val
-		return dico
-	
-	def getRec(self,seqid):	
-		start,end = self[seqid]	
-		numBytes = end - start
+		"""
+		Function : Makes a full pass through the FASTQ file to build the index.
+		Returns  : bytes in the sidecar file layout.
+		"""
+		size,mtime = self._fileStamp()
+		entries = [FQI_ENTRY.pack(seqidHash(seqid),start,end) for seqid,(start,end) in recordOffsets(self.fqFile)]
+		#Big-endian packing means that sorting the packed entries sorts them by hash.
+		entries.sort()
+		return FQI_HEADER.pack(FQI_MAGIC,size,mtime,len(entries)) + b"".join(entries)
+
+	def _candidates(self,seqid):
+		"""
+		Function : Binary searches the index for the entries whose hash matches that of seqid. Since hashes can collide, there can be more than one.
+		Returns  : generator of (start,end) byte offset tuples.
+		"""
+		h = seqidHash(seqid)
+		lo = 0
+		hi = self.numRecs
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if FQI_ENTRY.unpack_from(self.index,FQI_HEADER.size + mid * FQI_ENTRY.size)[0] < h:
+				lo = mid + 1
+			else:
+				hi = mid
+		while lo < self.numRecs:
+			entryHash,start,end = FQI_ENTRY.unpack_from(self.index,FQI_HEADER.size + lo * FQI_ENTRY.size)
+			if entryHash != h:
+				break
+			yield start,end
+			lo += 1
+
+	def _find(self,seqid):
+		"""
+		Function : Looks up a record, checking the seqid on its title line to rule out hash collisions.
+		Returns  : two item tuple being the (start,end) offsets of the record and the record text.
+		Raises   : KeyError - there isn't a record with the given seqid.
+		"""
+		for start,end in self._candidates(seqid):
+			rec = self._read(start,end)
+			if getSeqIdFromAttLine(rec) == seqid:
+				return (start,end),rec
+		raise KeyError(seqid)
+
+	def _read(self,start,end):
+		"""
+		Function : Reads the text between two offsets in the index.
+		Returns  : str.
+		"""
+		if self.bgzf:
+			return self.fh.readRange(start,end).decode()
 		self.fh.seek(start)
-		return self.fh.read(numBytes)
+		data = self.fh.read(end - start)
+		if isinstance(data,bytes):
+			data = data.decode()
+		return data
+
+	def getRec(self,seqid):	
+		return self._find(seqid)[1]
+
+def seqidHash(seqid):
+	"""
+	Function : Computes the stable 64-bit hash of a sequence ID that is used as the key in the .fqi sidecar index.
+	Args     : seqid - str or bytes.
+	Returns  : int.
+	"""
+	if isinstance(seqid,str):
+		seqid = seqid.encode()
+	return int.from_bytes(hashlib.blake2b(seqid,digest_size=8).digest(),"big")
+
+class _CountingReader:
+	"""
+	Wraps a binary file handle to count the number of bytes read through it with read().
+	"""
+	def __init__(self,fh):
+		self.fh = fh
+		self.numBytes = 0
+
+	def read(self,size=-1):
+		data = self.fh.read(size)
+		self.numBytes += len(data)
+		return data
+
+def recordOffsets(fqFile):
+	"""
+	Function : Finds the offsets of each record in a FASTQ file. The file is read with blockparse() in binary mode and the offsets are computed from the record
+	           lengths. Uncompressed files for which the lengths don't add up, such as those with Windows line endings or blank lines between records, are handed
+	           to the slower indexparse() instead. For a BGZF file, the offsets are converted into virtual offsets.
+	Args     : fqFile - A FASTQ file, uncompressed or gzip'd.
+	Returns  : list of two item tuples, in file order, of the form that indexparse() yields when index is True, i.e. (seqid,(start,end)).
+	Raises   : ValueError - The lengths don't add up in a compressed file.
+	"""
+	isBgzf = bgzf.isBgzf(fqFile)
+	if isBgzf:
+		fh = bgzf.BgzfReader(fqFile)
+	elif fqFile.endswith(".gz"):
+		fh = gzip.open(fqFile,'rb')
+	else:
+		fh = open(fqFile,'rb')
+	counter = _CountingReader(fh)
+	offsets = []
+	pos = 0
+	try:
+		for attLine,seq,plusLine,qual in blockparse(counter):
+			end = pos + len(attLine) + len(seq) + len(plusLine) + len(qual) + 4
+			offsets.append((getSeqIdFromAttLine(attLine.decode()),(pos,end)))
+			pos = end
+		#pos is one past the end of the data when the file lacks a final newline.
+		exact = pos in (counter.numBytes,counter.numBytes + 1)
+		if not exact and not isBgzf and not fqFile.endswith(".gz"):
+			fh.seek(pos)
+			exact = not fh.read(4096).strip() and not fh.read(1)
+		if exact and isBgzf:
+			size = counter.numBytes
+			offsets = [(seqid,(fh.virtualOffset(start),fh.virtualOffset(min(end,size)))) for seqid,(start,end) in offsets]
+	except ValueError:
+		exact = False
+	fh.close()
+	if not exact:
+		if isBgzf or fqFile.endswith(".gz"):
+			raise ValueError("Can't index {fqFile}; compressed FASTQ files must have four-line records with Unix line endings.".format(fqFile=fqFile))
+		fh = open(fqFile,'r')
+		offsets = list(indexparse(fh=fh,index=True))
+		fh.close()
+	return offsets
 
-def parse(fqFile):
+def parse(fqFile,multiline=False):
+	"""
+	Function : A generator over the records of a FASTQ file. See blockparse() for details.
+	Args     : fqFile - A FASTQ file. May be gzip'd or bz2'd.
+	           multiline - bool. True means to tolerate records whose sequence or quality spans multiple lines (slower).
+	"""
 	fh = getFastqReadFileHandle(fqFile)
-	for attLine,seq,plusLine,qual in indexparse(fqFile,index=False):
+	for attLine,seq,plusLine,qual in blockparse(fh=fh,multiline=multiline):
 		yield attLine,seq,plusLine,qual
+	fh.close()
 
 def mem(fqFile):
 	dico = {}
 	fh = getFastqReadFileHandle(fqFile)
-	for attLine,seq,plusLine,qual in indexparse(fh=fh,index=False):
+	for attLine,seq,plusLine,qual in blockparse(fh=fh):
 			seqid = getSeqIdFromAttLine(attLine)
 			dico[seqid] = [attLine,seq,plusLine,qual]
+	fh.close()
 	return dico
 
+def memStore(fqFile):
+	"""
+	Function : Like mem(), loads all records of a FASTQ file into memory keyed by seqid, but into a compact RecordStore rather than a dict of lists.
+	Args     : fqFile - A FASTQ file. May be gzip'd or bz2'd.
+	Returns  : RecordStore.
+	"""
+	store = RecordStore()
+	fh = getFastqReadFileHandle(fqFile,binary=True)
+	for attLine,seq,plusLine,qual in blockparse(fh=fh):
+		store.add(attLine,seq,plusLine,qual)
+	fh.close()
+	return store
+
+class StoredRecord:
+	"""
+	A lightweight view of one record in a RecordStore. It behaves like the four item (attLine, seq, plusLine, qual) tuple of bytes that blockparse() yields,
+	but only holds a reference to the store and the record's position, and slices the fields out of the store's buffers on access.
+	"""
+	__slots__ = ("store","i")
+
+	def __init__(self,store,i):
+		self.store = store
+		self.i = i
+
+	def __len__(self):
+		return 4
+
+	def __iter__(self):
+		yield self.attLine
+		yield self.seq
+		yield self.plusLine
+		yield self.qual
+
+	def __getitem__(self,i):
+		return tuple(self)[i]
+
+	def __eq__(self,other):
+		return tuple(self) == tuple(other)
+
+	def __repr__(self):
+		return "StoredRecord({})".format(tuple(self))
+
+	@property
+	def attLine(self):
+		offsets = self.store.attOffsets
+		return bytes(self.store.atts[offsets[self.i]:offsets[self.i + 1]])
+
+	@property
+	def seq(self):
+		offsets = self.store.seqOffsets
+		return bytes(self.store.seqs[offsets[self.i]:offsets[self.i + 1]])
+
+	@property
+	def plusLine(self):
+		offsets = self.store.plusOffsets
+		return bytes(self.store.pluses[offsets[self.i]:offsets[self.i + 1]])
+
+	@property
+	def qual(self):
+		offsets = self.store.seqOffsets
+		return bytes(self.store.quals[offsets[self.i]:offsets[self.i + 1]])
+
+class RecordStore:
+	"""
+	A columnar, in-memory container of FASTQ records that can stand in for the dict returned by mem(): it maps seqids to records, where each record is
+	a StoredRecord view. Each field is kept in its own contiguous bytearray, with an array of end offsets for locating a record's slice (the sequence
+	and quality share one offset array since they're the same length). Seqids are looked up through an open-addressed hash table of record positions
+	with linear probing. This costs around 50 bytes per read on top of the read's own data, versus several hundred for a dict of lists of str.
+
+	Keys can be given as str or bytes, and are yielded as str when iterating. Adding a record with a seqid that is already present replaces the earlier
+	record, as with a dict, although the earlier record's bytes stay in the buffers.
+	"""
+	def __init__(self):
+		self.atts = bytearray()
+		self.seqs = bytearray()
+		self.pluses = bytearray()
+		self.quals = bytearray()
+		self.attOffsets = array.array("Q",[0])
+		self.seqOffsets = array.array("Q",[0])
+		self.plusOffsets = array.array("Q",[0])
+		#Open-addressed hash table of record position + 1, where 0 marks an empty slot. The size is always a power of 2.
+		self._table = array.array("q",bytes(8 * 1024))
+		self._numKeys = 0
+
+	def __len__(self):
+		return self._numKeys
+
+	def __iter__(self):
+		for i in range(len(self.attOffsets) - 1):
+			key = self._key(i)
+			#Skip records that were replaced by a later one with the same seqid.
+			if self._slot(key)[1] == i:
+				yield key.decode()
+
+	def __contains__(self,seqid):
+		return self._slot(self._encode(seqid))[1] is not None
+
+	def __getitem__(self,seqid):
+		i = self._slot(self._encode(seqid))[1]
+		if i is None:
+			raise KeyError(seqid)
+		return StoredRecord(self,i)
+
+	def get(self,seqid,default=None):
+		try:
+			return self[seqid]
+		except KeyError:
+			return default
+
+	def keys(self):
+		return iter(self)
+
+	def items(self):
+		for key in self:
+			yield key,self[key]
+
+	def record(self,i):
+		"""
+		Function : Returns the record at the given position in the order that records were added, including any that were later replaced.
+		Returns  : StoredRecord.
+		"""
+		if not 0 <= i < len(self.attOffsets) - 1:
+			raise IndexError(i)
+		return StoredRecord(self,i)
+
+	def add(self,attLine,seq,plusLine,qual):
+		"""
+		Function : Adds a record to the store.
+		Args     : attLine, seq, plusLine, qual - str or bytes. The fields of the FASTQ record.
+		"""
+		attLine,seq,plusLine,qual = [self._encode(x) for x in (attLine,seq,plusLine,qual)]
+		if len(seq) != len(qual):
+			raise ValueError("Sequence length does not match quality length for FASTQ record {attLine}.".format(attLine=attLine))
+		i = len(self.attOffsets) - 1
+		self.atts += attLine
+		self.seqs += seq
+		self.pluses += plusLine
+		self.quals += qual
+		self.attOffsets.append(len(self.atts))
+		self.seqOffsets.append(len(self.seqs))
+		self.plusOffsets.append(len(self.pluses))
+		slot,existing = self._slot(self._key(i))
+		self._table[slot] = i + 1
+		if existing is None:
+			self._numKeys += 1
+			if self._numKeys * 2 > len(self._table):
+				self._resize()
+
+	def _encode(self,x):
+		if isinstance(x,str):
+			return x.encode()
+		return bytes(x)
+
+	def _key(self,i):
+		"""
+		Function : Returns the seqid of the record at the given position, parsed from its title line as in getSeqIdFromAttLine().
+		"""
+		return bytes(self.atts[self.attOffsets[i] + 1:self.attOffsets[i + 1]]).split(None,1)[0]
+
+	def _slot(self,key):
+		"""
+		Function : Probes the hash table for a seqid.
+		Returns  : two item tuple being the slot at which the seqid is or would be stored, and the position of its record or None when absent.
+		"""
+		mask = len(self._table) - 1
+		slot = hash(key) & mask
+		while True:
+			entry = self._table[slot]
+			if not entry:
+				return slot,None
+			if self._key(entry - 1) == key:
+				return slot,entry - 1
+			slot = (slot + 1) & mask
+
+	def _resize(self):
+		"""
+		Function : Doubles the size of the hash table and reinserts the current records.
+		"""
+		oldTable = self._table
+		self._table = array.array("q",bytes(len(oldTable) * 2 * 8))
+		mask = len(self._table) - 1
+		for entry in oldTable:
+			if not entry:
+				continue
+			slot = hash(self._key(entry - 1)) & mask
+			while self._table[slot]:
+				slot = (slot + 1) & mask
+			self._table[slot] = entry
+
+def mateKey(attLine):
+	"""
+	Function : Parses the key that is shared by both mates of a pair out of a title line. This is the seqid, without any trailing '/1' or '/2' 
+	           read number suffix of the pre-Casava 1.8 format.
+	Args     : attLine - str or bytes.
+	Returns  : str or bytes, matching the type of attLine.
+	"""
+	key = attLine[1:].split(None,1)[0]
+	if key[-2:] in ("/1","/2",b"/1",b"/2"):
+		key = key[:-2]
+	return key
+
+def syncPairs(forwardFile,reverseFile,maxBuffered=MAX_BUFFERED_READS,tmpdir=None):
+	"""
+	Function : A generator that pairs up the reads of a forward and a reverse reads FASTQ file in a single streaming pass, dropping singletons. It assumes that 
+	           the mates are mostly in the same order in both files. Reads are taken from both files in lockstep, and a read whose mate hasn't been seen yet is
+	           buffered in memory until its mate comes along. When more than maxBuffered reads are buffered, the least recently buffered half is sorted by 
+	           seqid and spilled to a temporary run file. After the input is exhausted, the runs and the reads still buffered are merged by seqid to pair up 
+	           the remainder. Memory use is thus bounded by maxBuffered regardless of the size of the input.
+
+	           Pairs are yielded in input order, except for those that went through the external merge, which come last in seqid order.
+	Args     : forwardFile - The forward reads FASTQ file.
+	           reverseFile - The reverse reads FASTQ file.
+	           maxBuffered - int. The maximum number of unpaired reads to hold in memory.
+	           tmpdir - str. The directory in which to create the temporary run files. Defaults to the system temporary directory.
+	Returns  : generator of two item tuples being the forward and reverse records, each in the bytes form that blockparse() yields.
+	"""
+	ffh = getFastqReadFileHandle(forwardFile,binary=True)
+	rfh = getFastqReadFileHandle(reverseFile,binary=True)
+	#Unpaired forward reads and unpaired reverse reads, each keyed by mate key in the order they were buffered.
+	pending = (collections.OrderedDict(),collections.OrderedDict())
+	runs = ([],[])
+	workdir = tempfile.mkdtemp(prefix="syncPairs",dir=tmpdir)
+	try:
+		for frec,rrec in itertools.zip_longest(blockparse(ffh),blockparse(rfh)):
+			fkey = frec and mateKey(frec[0])
+			rkey = rrec and mateKey(rrec[0])
+			if frec and rrec and fkey == rkey:
+				yield frec,rrec
+				continue
+			if frec:
+				mate = pending[1].pop(fkey,None)
+				if mate:
+					yield frec,mate
+				else:
+					pending[0][fkey] = frec
+			if rrec:
+				mate = pending[0].pop(rkey,None)
+				if mate:
+					yield mate,rrec
+				else:
+					pending[1][rkey] = rrec
+			if len(pending[0]) + len(pending[1]) > maxBuffered:
+				_spillPending(pending,runs,workdir)
+		ffh.close()
+		rfh.close()
+		streams = []
+		for side in (0,1):
+			inMemory = sorted(pending[side].items())
+			pending[side].clear()
+			streams.append(heapq.merge(inMemory,*[_readRun(run) for run in runs[side]],key=lambda x: x[0]))
+		fwd,rev = streams
+		fitem = next(fwd,None)
+		ritem = next(rev,None)
+		while fitem and ritem:
+			if fitem[0] == ritem[0]:
+				yield fitem[1],ritem[1]
+				fitem = next(fwd,None)
+				ritem = next(rev,None)
+			elif fitem[0] < ritem[0]:
+				fitem = next(fwd,None)
+			else:
+				ritem = next(rev,None)
+	finally:
+		shutil.rmtree(workdir,ignore_errors=True)
+
+def _spillPending(pending,runs,workdir):
+	"""
+	Function : Moves the least recently buffered half of the unpaired reads of syncPairs() into sorted run files, one per side.
+	"""
+	for side in (0,1):
+		numSpill = len(pending[side]) - len(pending[side]) // 2
+		if not numSpill:
+			continue
+		spilled = sorted(pending[side].popitem(last=False) for i in range(numSpill))
+		runFile = os.path.join(workdir,"run{side}_{num}.fastq".format(side=side,num=len(runs[side])))
+		fout = open(runFile,'wb')
+		for key,rec in spilled:
+			fout.write(b"\n".join(rec) + b"\n")
+		fout.close()
+		runs[side].append(runFile)
+
+def _readRun(runFile):
+	"""
+	Function : Reads back a run file written by _spillPending().
+	Returns  : generator of (mate key, record) tuples, in sorted order.
+	"""
+	fh = open(runFile,'rb')
+	for rec in blockparse(fh):
+		yield mateKey(rec[0]),rec
+	fh.close()
+
+def readHash(attLine,seed=0):
+	"""
+	Function : Hashes the mate key (see mateKey()) of a read into a number in [0,1). Since both mates of a pair have the same mate key, they get the same value,
+	           which makes sampling on this value mate-consistent. The value is stable across runs for a given seed.
+	Args     : attLine - str or bytes. The title line of the read.
+	           seed - int. Different seeds give independent values.
+	Returns  : float.
+	"""
+	key = mateKey(attLine)
+	if isinstance(key,str):
+		key = key.encode()
+	digest = hashlib.blake2b(key,digest_size=8,salt=struct.pack("<Q",seed & 0xffffffffffffffff)).digest()
+	return int.from_bytes(digest,"big") / 2.0 ** 64
+
+def _unitAttLine(unit):
+	"""
+	Function : Returns the title line of a sampling unit, which is either a record or a tuple of records (the mates of a pair).
+	"""
+	if isinstance(unit[0],(str,bytes)):
+		return unit[0]
+	return unit[0][0]
+
+def sampleFraction(units,fraction,seed=0):
+	"""
+	Function : A generator that yields each record, or each pair of records, independently with probability fraction (Bernoulli sampling). Whether a read is 
+	           kept is decided by readHash(), so the same reads are kept from R1 and R2 even when they are sampled separately.
+	Args     : units - iterable of records, or of tuples of records (one per mate).
+	           fraction - float. The fraction of reads to keep.
+	           seed - int.
+	"""
+	for unit in units:
+		if readHash(_unitAttLine(unit),seed) < fraction:
+			yield unit
+
+def sampleCount(units,count,seed=0):
+	"""
+	Function : Picks a fixed number of records, or pairs of records, uniformly at random in one pass (reservoir sampling). The reads kept are those with the
+	           count smallest readHash() values, held in a heap, so that the sample is mate-consistent like that of sampleFraction().
+	Args     : units - iterable of records, or of tuples of records (one per mate).
+	           count - int. The number of records to keep.
+	           seed - int.
+	Returns  : list of the sampled units, in input order.
+	"""
+	heap = []
+	for i,unit in enumerate(units):
+		#A max-heap on the hash, by negating it.
+		priority = -readHash(_unitAttLine(unit),seed)
+		if len(heap) < count:
+			heapq.heappush(heap,(priority,i,unit))
+		elif priority > heap[0][0]:
+			heapq.heapreplace(heap,(priority,i,unit))
+	return [x[2] for x in sorted(heap,key=lambda x: x[1])]
+
+def sampleHead(units,count):
+	"""
+	Function : Returns a generator over the first count records, or pairs of records.
+	"""
+	return itertools.islice(units,count)
+
+def subsampleFiles(infiles,outfiles,fraction=None,count=None,head=None,seed=0):
+	"""
+	Function : Subsamples a FASTQ file, or a pair of mate FASTQ files in step, in a single streaming pass. Exactly one of fraction, count, and head must be given.
+	Args     : infiles - list of one or two FASTQ files. With two, they are the R1 and R2 files, whose mates must be in the same order.
+	           outfiles - list of output files, one per input file. Compressed according to the extension (see codec.openWrite()).
+	           fraction - float. Keep each read (pair) with this probability. See sampleFraction().
+	           count - int. Keep this many reads (pairs). See sampleCount().
+	           head - int. Keep the first this many reads (pairs).
+	           seed - int. The seed for fraction and count sampling.
+	Returns  : int. The number of reads (pairs) written.
+	Raises   : ValueError - The mates in the two input files aren't in the same order, or the files have different numbers of reads.
+	"""
+	if len([x for x in (fraction,count,head) if x is not None]) != 1:
+		raise ValueError("Exactly one of fraction, count, and head must be given.")
+	if len(infiles) != len(outfiles):
+		raise ValueError("There must be one output file per input file.")
+	fhs = [getFastqReadFileHandle(x,binary=True) for x in infiles]
+	units = itertools.zip_longest(*[blockparse(fh) for fh in fhs])
+	if len(fhs) > 1:
+		units = _checkedPairs(units)
+	if fraction is not None:
+		sample = sampleFraction(units,fraction,seed)
+	elif count is not None:
+		sample = sampleCount(units,count,seed)
+	else:
+		sample = sampleHead(units,head)
+	fouts = [codec.openWrite(x) for x in outfiles]
+	numWritten = 0
+	for unit in sample:
+		numWritten += 1
+		for fout,rec in zip(fouts,unit):
+			fout.write(b"\n".join(rec) + b"\n")
+	for fh in fhs + fouts:
+		fh.close()
+	return numWritten
+
+def _checkedPairs(pairs):
+	"""
+	Function : Passes through tuples of mate records, checking that the mates have the same mate key.
+	Args     : pairs - iterable of tuples of records, as made by itertools.zip_longest(), with None for the mates missing from files that ran out of reads.
+	Raises   : ValueError - the mate keys differ, or a file ran out of reads before the others.
+	"""
+	for pair in pairs:
+		if None in pair:
+			raise ValueError("The input files have different numbers of reads.")
+		key = mateKey(pair[0][0])
+		for rec in pair[1:]:
+			if mateKey(rec[0]) != key:
+				raise ValueError("Mates out of order: {first} is paired with {second}.".format(first=pair[0][0].decode(),second=rec[0].decode()))
+		yield pair
+
+def readNumber(attLine):
+	"""
+	Function : Determines whether a read is the forward or the reverse read of a pair from its title line, with a few byte comparisons rather than by 
+	           parsing the line. The read number is the first character of the second token in the Casava 1.8+ format (e.g. '@M1:7:FC:1:1:2:3 2:N:0:ACGT'),
+	           or the '/1' or '/2' suffix of the seqid in the older format (e.g. '@HWI-1:1:1:2:3#0/2').
+	Args     : attLine - bytes.
+	Returns  : int being 1 or 2, or None if the title line has no read number.
+	"""
+	end = attLine.find(b" ")
+	if end == -1:
+		end = attLine.find(b"\t")
+	if end != -1 and attLine[end + 2:end + 3] == b":" and attLine[end + 1] in (49,50): #'1','2'
+		return attLine[end + 1] - 48
+	if end == -1:
+		end = len(attLine)
+	if end >= 2 and attLine[end - 2] == 47 and attLine[end - 1] in (49,50): #'/1','/2'
+		return attLine[end - 1] - 48
+	return None
+
+def deinterleave(infile,forwardFiles,reverseFiles,batchSize=PAIR_BATCH_SIZE,verify=True,threads=None):
+	"""
+	Function : Splits an interleaved FASTQ file, in which the mates of each pair are adjacent, into forward and reverse reads files in a single pass. 
+	           Which mate is which is determined with readNumber(). When the title lines have no read number, as in some SRA dumps, the first mate of
+	           each pair is taken to be the forward read.
+
+	           The records are parsed with viewparse() and aren't copied. They are handed to the output files in batches of batchSize pairs, and each
+	           output file is written (and compressed) in its own background thread (see codec.BackgroundWriter). When several pairs of output files
+	           are given, the batches are dealt out to them in turn, e.g. to feed parallel downstream jobs.
+	Args     : infile - The interleaved FASTQ file. May be compressed.
+	           forwardFiles - list of output files for the forward reads. Compressed according to the extension (see codec.openWrite()).
+	           reverseFiles - list of output files for the reverse reads, one per forward reads file.
+	           batchSize - int. The number of pairs per batch.
+	           verify - bool. True means to check that the mates of each pair have the same mate key (see mateKey()).
+	           threads - int. The number of BGZF compression threads per output file. Defaults to the number of CPUs.
+	Returns  : int. The number of pairs written.
+	Raises   : ValueError - Adjacent records aren't mates, or the last record has no mate.
+	"""
+	if len(forwardFiles) != len(reverseFiles) or not forwardFiles:
+		raise ValueError("There must be one reverse reads file per forward reads file.")
+	fouts = [(codec.BackgroundWriter(codec.openWrite(x,threads=threads)),codec.BackgroundWriter(codec.openWrite(y,threads=threads))) for x,y in zip(forwardFiles,reverseFiles)]
+	fh = getFastqReadFileHandle(infile,binary=True)
+	recs = viewparse(fh)
+	nl = b"\n"
+	numPairs = 0
+	try:
+		for shard in itertools.cycle(fouts):
+			forward = []
+			reverse = []
+			for first in itertools.islice(recs,batchSize):
+				second = next(recs,None)
+				firstAtt = bytes(first[0])
+				if second is None:
+					raise ValueError("Read {first} is the last in the file and has no mate.".format(first=firstAtt.decode()))
+				secondAtt = bytes(second[0])
+				numbers = (readNumber(firstAtt),readNumber(secondAtt))
+				if numbers[0] == 2:
+					first,second = second,first
+				if verify and (mateKey(firstAtt) != mateKey(secondAtt) or (numbers[0] is not None and numbers[0] == numbers[1])):
+					raise ValueError("Reads {first} and {second} aren't mates.".format(first=firstAtt.decode(),second=secondAtt.decode()))
+				forward.extend((first[0],nl,first[1],nl,first[2],nl,first[3],nl))
+				reverse.extend((second[0],nl,second[1],nl,second[2],nl,second[3],nl))
+			if not forward:
+				break
+			numPairs += len(forward) // 8
+			shard[0].writelines(forward)
+			shard[1].writelines(reverse)
+	finally:
+		fh.close()
+		for fout in itertools.chain.from_iterable(fouts):
+			fout.close()
+	return numPairs
+
+def interleave(forwardFile,reverseFile,outfile,fmt=None,batchSize=PAIR_BATCH_SIZE,checkEvery=1,threads=None):
+	"""
+	Function : Interleaves the reads of a forward and a reverse reads FASTQ file, whose mates are in the same order, into one file in which each forward read
+	           is followed by its mate, e.g. for 'bwa mem -p'. This is the inverse of deinterleave(). The records are parsed with viewparse() and aren't copied.
+	           They are handed in batches of batchSize pairs to the output file, which is written (and compressed) in a background thread (see 
+	           codec.BackgroundWriter).
+	Args     : forwardFile - The forward reads FASTQ file. May be compressed.
+	           reverseFile - The reverse reads FASTQ file. May be compressed.
+	           outfile - The output FASTQ file.
+	           fmt - str. The codec to write outfile with (see codec.openWrite()). Defaults to the one implied by the extension of outfile.
+	           batchSize - int. The number of pairs per batch.
+	           checkEvery - int. Check that the mates of every checkEvery-th pair have the same mate key (see mateKey()), starting with the first pair.
+	                        1 checks every pair, and 0 disables the check. Checking a sample of the pairs is enough to catch files that aren't in the same
+	                        order, and saves copying the title lines out of the records.
+	           threads - int. The number of BGZF compression threads. Defaults to the number of CPUs.
+	Returns  : int. The number of pairs written.
+	Raises   : ValueError - A checked pair has different mate keys, or one file has more reads than the other.
+	"""
+	fhs = [getFastqReadFileHandle(x,binary=True) for x in (forwardFile,reverseFile)]
+	forwardRecs = viewparse(fhs[0])
+	reverseRecs = viewparse(fhs[1])
+	fout = codec.BackgroundWriter(codec.openWrite(outfile,fmt=fmt,threads=threads))
+	nl = b"\n"
+	numPairs = 0
+	try:
+		while True:
+			lines = []
+			for forward in itertools.islice(forwardRecs,batchSize):
+				reverse = next(reverseRecs,None)
+				if reverse is None:
+					raise ValueError("{forwardFile} has more reads than {reverseFile}.".format(forwardFile=forwardFile,reverseFile=reverseFile))
+				if checkEvery and numPairs % checkEvery == 0 and mateKey(bytes(forward[0])) != mateKey(bytes(reverse[0])):
+					raise ValueError("Mates out of order: {forward} is paired with {reverse}.".format(forward=bytes(forward[0]).decode(),reverse=bytes(reverse[0]).decode()))
+				numPairs += 1
+				lines.extend((forward[0],nl,forward[1],nl,forward[2],nl,forward[3],nl,reverse[0],nl,reverse[1],nl,reverse[2],nl,reverse[3],nl))
+			if not lines:
+				if next(reverseRecs,None) is not None:
+					raise ValueError("{reverseFile} has more reads than {forwardFile}.".format(forwardFile=forwardFile,reverseFile=reverseFile))
+				break
+			fout.writelines(lines)
+	finally:
+		for fh in fhs + [fout]:
+			fh.close()
+	return numPairs
+
 def fileseek_hash(fqFile):
 	fh = getFastqReadFileHandle(fqFile)
 	seeks = {}
@@ -119,7 +890,7 @@ def indexparse(fh,index=True):
 				seq += wsReg.sub("",line)
 		if attLine and seq and plusLine and qual:
 			if not len(seq) == len(qual):
-				raise ValueError("Error in file {fqFile}: Sequence length does not match quality length for FASTQ record {attLine}.  \nSequence is: '{seq}\nQual is: '{qual}'".format(fqFile=fqFile,attLine=attLine,seq=seq,qual=qual))
+				raise ValueError("Error in file {fqFile}: Sequence length does not match quality length for FASTQ record {attLine}.  \nSequence is: '{seq}\nQual is: '{qual}'".format(fqFile=getattr(fh,"name",fh),attLine=attLine,seq=seq,qual=qual))
 			else:
 				if INDEX:
 					yield seqid,(startTell,curTell)
@@ -131,14 +902,204 @@ def indexparse(fh,index=True):
 				plusLineSeen = False
 				qual = ""
 
-def getFastqReadFileHandle(fqFile):
-	if fqFile.endswith(".gz"):
-		fh = gzip.open(fqFile,'r')
-	elif fqFile.endswith(".bz2"):
-		fh = bzip2.BZ2File(fqFile,'r')
+def blockparse(fh,blockSize=BLOCK_SIZE,multiline=False):
+	"""
+	Function : A generator that steps through each record (in order) in the input FASTQ file, yielding the same four item tuple as indexparse() does when index is
+	           False, that is (attLine, seq, plusLine, qual). Instead of calling readline() and tell() for each line, the input is read in blocks of blockSize and 
+	           each block is split on its newline offsets. Only whole records are yielded from a block; a trailing partial record is carried over into the next block.
+	           Records must be in the standard four-line format, and each is checked for a leading '@' and '+' and for equal sequence and quality lengths,
+	           after trailing spaces and tabs are stripped from them.
+	           Records whose sequence or quality is wrapped over several lines are handled by setting multiline to True, which reads line by line and is much slower.
+	Args     : fh - A file handle open for reading, in either text or binary mode. Lines are yielded as str or bytes, respectively.
+	           blockSize - int. The number of bytes (characters for a text-mode handle) to read at a time.
+	           multiline - bool. True means to tolerate multi-line records.
+	Raises   : ValueError - A malformed or truncated record was encountered.
+	"""
+	if multiline:
+		for rec in _multilineRecords(fh):
+			yield rec
+		return
+	block = fh.read(blockSize)
+	if not block:
+		return
+	if isinstance(block,bytes):
+		nl,cr,at,plus = b"\n",b"\r",b"@",b"+"
 	else:
-		fh = open(fqFile,'r')
-	return fh
+		nl,cr,at,plus = "\n","\r","@","+"
+	empty = block[:0]
+	carry = empty
+	while block:
+		if cr in block:
+			block = block.replace(cr,empty)
+		block = carry + block
+		lastNl = block.rfind(nl)
+		if lastNl == -1:
+			carry = block
+		else:
+			lines = block[:lastNl].split(nl)
+			numLines = len(lines) - len(lines) % 4
+			carry = block[lastNl + 1:]
+			if numLines < len(lines):
+				#At most three lines of an incomplete record, which are put back in front of the partial last line.
+				carry = nl.join(lines[numLines:]) + nl + carry
+				del lines[numLines:]
+			for rec in _checkedRecords(lines,at,plus):
+				yield rec
+		block = fh.read(blockSize)
+	lines = carry.split(nl)
+	while lines and not lines[-1].strip():
+		lines.pop()
+	if len(lines) % 4:
+		raise ValueError("Truncated FASTQ record at end of file, starting with line '{line}'.".format(line=lines[len(lines) - len(lines) % 4]))
+	for rec in _checkedRecords(lines,at,plus):
+		yield rec
+
+def viewparse(fh,blockSize=BLOCK_SIZE):
+	"""
+	Function : A zero-copy generator over the records of a FASTQ file open in binary mode. Like blockparse(), the input is read in blocks, but instead of splitting
+	           each block into new bytes objects, each record is yielded as a four item tuple (attLine, seq, plusLine, qual) of memoryview slices of the block, 
+	           found by searching for the newline offsets. Nothing is decoded or copied per record, so this is the fastest way to pass records through to 
+	           writeViews() in tools that inspect little of each record, such as filters and (de)interleavers. Use bytes(view) to get a copy of a field.
+
+	           The views stay valid after iteration moves on, but keep their whole block in memory while they're referenced. Records must be in the 
+	           standard four-line format with Unix line endings.
+	Args     : fh - A file handle open for reading in binary mode.
+	           blockSize - int. The number of bytes to read at a time.
+	Raises   : ValueError - A malformed or truncated record, or a Windows line ending, was encountered.
+	"""
+	carry = b""
+	while True:
+		data = fh.read(blockSize)
+		buf = carry + data if carry else data
+		if not data:
+			if not buf.strip():
+				return
+			if not buf.endswith(b"\n"):
+				buf += b"\n"
+		if b"\r" in data:
+			raise ValueError("Windows line endings aren't supported by viewparse(). Use blockparse() instead.")
+		view = memoryview(buf)
+		find = buf.find
+		pos = 0
+		while True:
+			e1 = find(b"\n",pos)
+			if e1 == -1:
+				break
+			e2 = find(b"\n",e1 + 1)
+			if e2 == -1:
+				break
+			e3 = find(b"\n",e2 + 1)
+			if e3 == -1:
+				break
+			e4 = find(b"\n",e3 + 1)
+			if e4 == -1:
+				break
+			#Checked on the ints at the first byte of the title and '+' lines.
+			if buf[pos] != 64 or buf[e2 + 1] != 43 or e2 - e1 != e4 - e3:
+				raise ValueError("Malformed FASTQ record {attLine}.".format(attLine=buf[pos:e1].decode(errors="replace")))
+			yield view[pos:e1],view[e1 + 1:e2],view[e2 + 1:e3],view[e3 + 1:e4]
+			pos = e4 + 1
+		carry = buf[pos:]
+		if not data:
+			if carry.strip():
+				raise ValueError("Truncated FASTQ record at end of file, starting with '{line}'.".format(line=carry.split(b"\n")[0].decode(errors="replace")))
+			return
+
+def parseViews(fqFile):
+	"""
+	Function : A generator over the records of a FASTQ file as memoryview slices. See viewparse() for details.
+	Args     : fqFile - A FASTQ file. May be compressed.
+	"""
+	fh = getFastqReadFileHandle(fqFile,binary=True)
+	for rec in viewparse(fh):
+		yield rec
+	fh.close()
+
+def writeViews(fh,recs):
+	"""
+	Function : Writes FASTQ records to a binary file handle with a single writelines() call over the record fields, without joining them into new strings first.
+	Args     : fh - A file handle open for writing in binary mode.
+	           recs - iterable of four item records of bytes-like objects, such as the memoryview records yielded by viewparse().
+	"""
+	nl = b"\n"
+	fh.writelines([field for rec in recs for field in (rec[0],nl,rec[1],nl,rec[2],nl,rec[3],nl)])
+
+def _multilineRecords(fh):
+	"""
+	Function : Steps through a FASTQ file whose records may have the sequence and quality wrapped over several lines. The sequence lines are those up to the '+' line, and
+	           the quality lines are read until they are as long as the sequence; a quality line may therefore start with an '@'. Blank lines between records are skipped. 
+	           Used by blockparse() when multiline is True.
+	Args     : fh - A file handle open for reading, in either text or binary mode.
+	Raises   : ValueError - A malformed or truncated record was encountered.
+	"""
+	line = fh.readline()
+	if not line:
+		return
+	if isinstance(line,bytes):
+		at,plus,empty = b"@",b"+",b""
+	else:
+		at,plus,empty = "@","+",""
+	while line:
+		attLine = line.strip()
+		if not attLine:
+			line = fh.readline()
+			continue
+		if not attLine.startswith(at):
+			raise ValueError("Malformed FASTQ record. Expected a title line starting with '@' but got '{line}'.".format(line=attLine))
+		seqParts = []
+		line = fh.readline()
+		while line and not line.startswith(plus):
+			seqParts.append(line.strip())
+			line = fh.readline()
+		if not line:
+			raise ValueError("Truncated FASTQ record {attLine} at end of file.".format(attLine=attLine))
+		plusLine = line.strip()
+		seq = empty.join(seqParts)
+		qualParts = []
+		qualLen = 0
+		while qualLen < len(seq):
+			line = fh.readline()
+			if not line:
+				raise ValueError("Truncated FASTQ record {attLine} at end of file.".format(attLine=attLine))
+			line = line.strip()
+			qualParts.append(line)
+			qualLen += len(line)
+		qual = empty.join(qualParts)
+		if len(seq) != len(qual):
+			raise ValueError("Sequence length does not match quality length for FASTQ record {attLine}.  \nSequence is: '{seq}\nQual is: '{qual}'".format(attLine=attLine,seq=seq,qual=qual))
+		yield attLine,seq,plusLine,qual
+		line = fh.readline()
+
+def _checkedRecords(lines,at,plus):
+	"""
+	Function : Groups a list of FASTQ lines into four-line records, validating each one. Trailing spaces and tabs are stripped from the sequence and quality
+	           lines, as indexparse() did. Used by blockparse().
+	Args     : lines - list of lines without newline characters. The length must be a multiple of four.
+	           at - The '@' character, as either str or bytes to match the type of the lines.
+	           plus - The '+' character, as either str or bytes to match the type of the lines.
+	Raises   : ValueError - A record doesn't have a valid title line or '+' line, or its sequence and quality lengths differ.
+	"""
+	blanks = b" \t" if isinstance(at,bytes) else " \t"
+	it = iter(lines)
+	for attLine,seq,plusLine,qual in zip(it,it,it,it):
+		seq = seq.rstrip(blanks)
+		qual = qual.rstrip(blanks)
+		if not attLine.startswith(at) or not plusLine.startswith(plus):
+			raise ValueError("Malformed FASTQ record {attLine}. Use multiline=True if records span more than four lines.".format(attLine=attLine))
+		if len(seq) != len(qual):
+			raise ValueError("Sequence length does not match quality length for FASTQ record {attLine}.  \nSequence is: '{seq}\nQual is: '{qual}'".format(attLine=attLine,seq=seq,qual=qual))
+		yield attLine,seq,plusLine,qual
+
+def getFastqReadFileHandle(fqFile,binary=False):
+	"""
+	Function : Opens a FASTQ file for reading. The compression, if any, is detected from the file's magic bytes, and compressed files are decompressed 
+	           in a background read-ahead thread (see codec.openRead()). The handle is in text mode unless binary is set, whether or not the file is compressed.
+	Args     : fqFile - A FASTQ file. May be gzip'd (including BGZF) or bz2'd.
+	           binary - bool. True means to open the file in binary mode.
+	"""
+	if codec.detectFormat(fqFile) == codec.PLAIN:
+		return open(fqFile,'rb' if binary else 'r')
+	return codec.openRead(fqFile,text=not binary)
 
 def getSeqIdFromAttLine(attLine):
 	attLine = attLine.lstrip("@")
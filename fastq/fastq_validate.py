@@ -0,0 +1,351 @@
+"""
+Validates FASTQ files, and the concordance of mate files (e.g. R1 and R2, and I1 and I2), in one parallel streaming pass, and writes a JSON report.
+
+Each file is split into chunks with fastq_mapreduce.chunks(), and the chunks of all the files are checked in a process pool. A chunk is read in blocks,
+and the records of a block are checked as a batch: the title lines, sequences and quality strings are each joined into one buffer and viewed with
+numpy.frombuffer(), so that the alphabet, the quality range, the title and '+' line syntax, and the sequence and quality lengths are checked with
+array operations rather than per character. A malformed line that breaks the four-line structure ends the checking of its chunk.
+
+For the concordance of mate files, each chunk folds the CRC-32 of the mate key (see fastq_utils.mateKey()) of each of its records into a polynomial
+digest, and the chunk digests are chained in file order into a digest of the whole file's sequence of read IDs. Mate files are concordant when their read
+counts and digests are equal. Only if they aren't are the files read again in step, to find the first pair of records whose IDs differ.
+
+Run the command-line interface as 'python -m gbsc_utils.fastq.fastq_validate'.
+"""
+
+from argparse import ArgumentParser
+import itertools
+import json
+import multiprocessing
+import sys
+import zlib
+
+import numpy as np
+
+from gbsc_utils import codec
+from gbsc_utils.fastq import fastq_utils
+from gbsc_utils.fastq import fastq_mapreduce
+
+#: The number of bytes read at a time.
+BLOCK_SIZE = 1 << 20
+#: The number of example records kept for each kind of error.
+MAX_EXAMPLES = 5
+#: The default alphabet of the sequences.
+ALPHABET = b"ACGTN"
+#: The default highest quality score, for Phred+33 encoded quality strings.
+MAX_QUAL = 45
+#: The Phred offset of the quality strings.
+PHRED_OFFSET = 33
+#: The multiplier of the read ID digest. Any odd number would do.
+DIGEST_BASE = 0x100000001b3
+_MASK = (1 << 64) - 1
+
+#: Error kinds.
+TITLE_LINE = "title line"
+PLUS_LINE = "plus line"
+LENGTH_MISMATCH = "sequence and quality lengths differ"
+ALPHABET_ERROR = "sequence alphabet"
+QUALITY_RANGE = "quality range"
+CR_LINE_ENDINGS = "CR line endings"
+TRUNCATED = "truncated record"
+MALFORMED = "malformed record"
+
+_WHITESPACE = np.zeros(256,dtype=bool)
+_WHITESPACE[list(b" \t\n\r\x0b\x0c")] = True
+
+class FileStats:
+	"""
+	The results of checking a FASTQ file, or a chunk of one. The stats of the chunks of a file are merged in order.
+	"""
+	def __init__(self,fqFile):
+		self.fqFile = fqFile
+		self.numReads = 0
+		self.numBases = 0
+		self.minLength = None
+		self.maxLength = None
+		self.minQual = None
+		self.maxQual = None
+		#: dict of error kind to the number of records with it, or 1 for CR line endings.
+		self.errors = {}
+		#: list of three item lists of (error kind,record number from 0,title line) for up to MAX_EXAMPLES records per kind of error.
+		self.examples = []
+		#: Polynomial digest of the CRC-32s of the read IDs in order.
+		self.digest = 0
+		#: True if a chunk couldn't be checked to its end because of a malformed record.
+		self.incomplete = False
+
+	def addError(self,kind,recordNums,attLines):
+		"""
+		Function : Records an error in some records.
+		Args     : kind - str. The error kind.
+		           recordNums - list of the record numbers, relative to the stats' first record.
+		           attLines - list of the title lines of the records.
+		"""
+		if not len(recordNums):
+			return
+		self.errors[kind] = self.errors.get(kind,0) + len(recordNums)
+		numExamples = sum(1 for x in self.examples if x[0] == kind)
+		for num,attLine in list(zip(recordNums,attLines))[:MAX_EXAMPLES - numExamples]:
+			self.examples.append([kind,int(num),attLine.decode(errors="replace")])
+
+	def merge(self,other):
+		"""
+		Function : Adds the stats of the chunk that follows this one.
+		Returns  : self.
+		"""
+		self.digest = (self.digest + pow(DIGEST_BASE,self.numReads,1 << 64) * other.digest) & _MASK
+		for kind,num,attLine in other.examples:
+			if sum(1 for x in self.examples if x[0] == kind) < MAX_EXAMPLES:
+				self.examples.append([kind,num + self.numReads,attLine])
+		for kind,count in other.errors.items():
+			if kind == CR_LINE_ENDINGS:
+				#Reported once per file rather than per record.
+				self.errors[kind] = 1
+			else:
+				self.errors[kind] = self.errors.get(kind,0) + count
+		self.numReads += other.numReads
+		self.numBases += other.numBases
+		self.minLength = _min(self.minLength,other.minLength)
+		self.maxLength = _max(self.maxLength,other.maxLength)
+		self.minQual = _min(self.minQual,other.minQual)
+		self.maxQual = _max(self.maxQual,other.maxQual)
+		self.incomplete = self.incomplete or other.incomplete
+		return self
+
+	def encoding(self):
+		"""
+		Function : Guesses the quality encoding from the range of the quality characters. Phred+64 is only guessed when there are no characters below '@'
+		           and some above the Phred+33 range, which are also reported as quality range errors.
+		Returns  : str. 'Phred+33', 'Phred+64', or None if there are no qualities.
+		"""
+		if self.minQual is None:
+			return None
+		return "Phred+64" if self.minQual >= 64 and self.maxQual > PHRED_OFFSET + MAX_QUAL else "Phred+33"
+
+	def toDict(self):
+		return {
+			"file": self.fqFile,
+			"reads": self.numReads,
+			"bases": self.numBases,
+			"length_range": [self.minLength,self.maxLength],
+			"quality_char_range": [self.minQual,self.maxQual],
+			"encoding": self.encoding(),
+			"errors": self.errors,
+			"examples": self.examples,
+			"complete": not self.incomplete,
+		}
+
+def _min(x,y):
+	return y if x is None else x if y is None else min(x,y)
+
+def _max(x,y):
+	return y if x is None else x if y is None else max(x,y)
+
+def _starts(lengths):
+	"""
+	Function : Gets the offsets of the items of a buffer of items joined with a one byte separator.
+	"""
+	starts = np.zeros(len(lengths),dtype=np.int64)
+	np.cumsum(lengths[:-1] + 1,out=starts[1:])
+	return starts
+
+def _lengths(items):
+	return np.fromiter(map(len,items),dtype=np.int64,count=len(items))
+
+def _recordsOf(positions,lengths):
+	"""
+	Function : Gets the distinct records that byte positions fall in, for a buffer of the records' items joined without a separator.
+	"""
+	return np.unique(np.searchsorted(np.cumsum(lengths),positions,side="right"))
+
+def checkBatch(stats,lines,allowed,maxQual):
+	"""
+	Function : Checks a batch of four-line records, and adds the results to stats.
+	Args     : stats - FileStats. The record numbers are relative to stats.numReads.
+	           lines - list of bytes lines without newline characters. The length must be a multiple of four.
+	           allowed - bool numpy.ndarray of 256, True for the bytes allowed in the sequences.
+	           maxQual - int. The highest allowed quality score.
+	"""
+	attLines,seqs,plusLines,quals = lines[0::4],lines[1::4],lines[2::4],lines[3::4]
+	numRecs = len(attLines)
+	if not numRecs:
+		return
+	first = stats.numReads
+	attLengths = _lengths(attLines)
+	attBuf = np.frombuffer(b"\n".join(attLines) + b"\n\n",dtype=np.uint8)
+	attStarts = _starts(attLengths)
+	#A title line starts with '@', followed by a read ID.
+	badTitles = (attBuf[attStarts] != ord("@")) | _WHITESPACE[attBuf[attStarts + 1]]
+	plusLengths = _lengths(plusLines)
+	plusBuf = np.frombuffer(b"\n".join(plusLines) + b"\n",dtype=np.uint8)
+	badPlus = plusBuf[_starts(plusLengths)] != ord("+")
+	#A '+' line with more than the '+' must repeat the title line.
+	for i in np.flatnonzero((plusLengths > 1) & ~badPlus):
+		badPlus[i] = plusLines[i][1:] != attLines[i][1:]
+	seqLengths = _lengths(seqs)
+	qualLengths = _lengths(quals)
+	badLengths = seqLengths != qualLengths
+	seqBuf = np.frombuffer(b"".join(seqs),dtype=np.uint8)
+	qualBuf = np.frombuffer(b"".join(quals),dtype=np.uint8)
+	badBases = _recordsOf(np.flatnonzero(~allowed[seqBuf]),seqLengths)
+	badQuals = _recordsOf(np.flatnonzero((qualBuf < PHRED_OFFSET) | (qualBuf > PHRED_OFFSET + maxQual)),qualLengths)
+	for kind,recs in ((TITLE_LINE,np.flatnonzero(badTitles)),(PLUS_LINE,np.flatnonzero(badPlus)),(LENGTH_MISMATCH,np.flatnonzero(badLengths)),(ALPHABET_ERROR,badBases),(QUALITY_RANGE,badQuals)):
+		stats.addError(kind,first + recs,[attLines[i] for i in recs[:MAX_EXAMPLES]])
+	crcs = np.fromiter((zlib.crc32(fastq_utils.mateKey(x)) if x[1:2].strip() else 0 for x in attLines),dtype=np.uint64,count=numRecs)
+	powers = np.ones(numRecs,dtype=np.uint64)
+	np.cumprod(np.full(numRecs - 1,DIGEST_BASE,dtype=np.uint64),out=powers[1:])
+	batchDigest = int((crcs * powers).sum(dtype=np.uint64))
+	stats.digest = (stats.digest + pow(DIGEST_BASE,stats.numReads,1 << 64) * batchDigest) & _MASK
+	stats.numReads += numRecs
+	stats.numBases += int(seqLengths.sum())
+	stats.minLength = _min(stats.minLength,int(seqLengths.min()))
+	stats.maxLength = _max(stats.maxLength,int(seqLengths.max()))
+	if len(qualBuf):
+		stats.minQual = _min(stats.minQual,int(qualBuf.min()))
+		stats.maxQual = _max(stats.maxQual,int(qualBuf.max()))
+
+def _checkStructure(stats,lines):
+	"""
+	Function : Finds the first record of a batch whose title or '+' line is so malformed that the lines after it can't be grouped into records, as when
+	           a record is missing a line.
+	Returns  : int. The number of lines that are in well-formed four-line groups.
+	"""
+	for i in range(0,len(lines) - 3,4):
+		if not lines[i].startswith(b"@") or not lines[i + 2].startswith(b"+"):
+			stats.addError(MALFORMED,[stats.numReads + i // 4],[lines[i]])
+			stats.incomplete = True
+			return i
+	return len(lines) - len(lines) % 4
+
+def checkChunk(job):
+	"""
+	Function : Checks one chunk of a FASTQ file. Runs in a worker process.
+	Args     : job - tuple of (fqFile,start,end,alphabet,maxQual), where start and end are as returned by fastq_mapreduce.chunks().
+	Returns  : FileStats.
+	"""
+	fqFile,start,end,alphabet,maxQual = job
+	allowed = np.zeros(256,dtype=bool)
+	allowed[list(alphabet)] = True
+	stats = FileStats(fqFile)
+	fh = fastq_mapreduce.openChunk(fqFile,start,end)
+	carry = b""
+	try:
+		block = fh.read(BLOCK_SIZE)
+		while block:
+			if b"\r" in block:
+				if CR_LINE_ENDINGS not in stats.errors:
+					stats.addError(CR_LINE_ENDINGS,[stats.numReads],[b""])
+				block = block.replace(b"\r",b"")
+			block = carry + block
+			lastNl = block.rfind(b"\n")
+			if lastNl == -1:
+				carry = block
+			else:
+				lines = block[:lastNl].split(b"\n")
+				carry = block[lastNl + 1:]
+				numLines = _checkStructure(stats,lines)
+				checkBatch(stats,lines[:numLines],allowed,maxQual)
+				if stats.incomplete:
+					return stats
+				if numLines < len(lines):
+					#At most three lines of an incomplete record, which are put back in front of the partial last line.
+					carry = b"\n".join(lines[numLines:]) + b"\n" + carry
+			block = fh.read(BLOCK_SIZE)
+		lines = carry.split(b"\n")
+		while lines and not lines[-1].strip():
+			lines.pop()
+		numLines = _checkStructure(stats,lines)
+		checkBatch(stats,lines[:numLines],allowed,maxQual)
+		if not stats.incomplete and numLines < len(lines):
+			stats.addError(TRUNCATED,[stats.numReads],[lines[numLines]])
+	finally:
+		fh.close()
+	return stats
+
+def _titleLines(fqFile):
+	"""
+	Function : A generator over the title lines of a FASTQ file, i.e. every fourth line, without checking the records.
+	"""
+	with codec.openRead(fqFile) as fh:
+		for i,line in enumerate(fh):
+			if i % 4 == 0:
+				line = line.rstrip(b"\r\n")
+				if not line:
+					return
+				yield line
+
+def firstDiscordant(fqFiles):
+	"""
+	Function : Reads mate files in step to find the first record whose mates' read IDs differ, or that is missing from a file.
+	Args     : fqFiles - list of FASTQ files.
+	Returns  : dict with the keys 'record', the record number from 0, and 'titles', the title lines of the record in each file (None for a missing one),
+	           or None if all the read IDs agree.
+	"""
+	titles = [_titleLines(x) for x in fqFiles]
+	for num,atts in enumerate(itertools.zip_longest(*titles)):
+		keys = set(fastq_utils.mateKey(x) if x is not None and x[1:2].strip() else None for x in atts)
+		if len(keys) > 1 or None in keys:
+			return {"record": num,"titles": [x.decode(errors="replace") if x is not None else None for x in atts]}
+	return None
+
+def validateFiles(fqFiles,alphabet=ALPHABET,maxQual=MAX_QUAL,numProcs=None):
+	"""
+	Function : Validates FASTQ files, and when there are several, checks that they are mate files with the same read IDs in the same order.
+	Args     : fqFiles - list of FASTQ files. May be compressed; uncompressed and BGZF files are checked in several chunks at once.
+	           alphabet - bytes. The characters allowed in the sequences.
+	           maxQual - int. The highest allowed Phred+33 quality score.
+	           numProcs - int. The number of worker processes. Defaults to the number of CPUs.
+	Returns  : dict. The report, with the keys 'valid', 'files', which has the stats of each file (see FileStats.toDict()), and for several files,
+	           'mates', which has the key 'concordant', and 'first_discordant' when the mates aren't concordant (see firstDiscordant()).
+	"""
+	numProcs = numProcs or multiprocessing.cpu_count()
+	jobs = []
+	for fqFile in fqFiles:
+		for start,end in fastq_mapreduce.chunks(fqFile,numProcs * fastq_mapreduce.CHUNKS_PER_PROC):
+			jobs.append((fqFile,start,end,alphabet,maxQual))
+	if numProcs == 1 or len(jobs) == 1:
+		results = [checkChunk(job) for job in jobs]
+	else:
+		pool = multiprocessing.Pool(min(numProcs,len(jobs)))
+		try:
+			results = pool.map(checkChunk,jobs,chunksize=1)
+		finally:
+			pool.close()
+			pool.join()
+	stats = dict((x,FileStats(x)) for x in fqFiles)
+	for result in results:
+		stats[result.fqFile].merge(result)
+	stats = [stats[x] for x in fqFiles]
+	valid = all(not x.errors and not x.incomplete for x in stats)
+	report = {"files": [x.toDict() for x in stats]}
+	if len(fqFiles) > 1:
+		concordant = all((x.numReads,x.digest) == (stats[0].numReads,stats[0].digest) for x in stats[1:])
+		report["mates"] = {"concordant": concordant}
+		if not concordant:
+			report["mates"]["first_discordant"] = firstDiscordant(fqFiles)
+		valid = valid and concordant
+	report["valid"] = valid
+	return report
+
+def writeReport(fout,report):
+	"""
+	Function : Writes a report returned by validateFiles() as one line of JSON.
+	"""
+	json.dump(report,fout,sort_keys=True,separators=(",",":"))
+	fout.write("\n")
+
+if __name__ == "__main__":
+	description = "Validates FASTQ files, such as the R1 and R2 files of a lane, in one parallel pass. Checks that the sequence and quality lengths agree, the sequence alphabet, the quality range, the title and '+' lines, and that mate files have the same read IDs in the same order. Writes a one-line JSON report, and exits with status 1 if any check failed."
+	parser = ArgumentParser(description=description)
+	parser.add_argument('-i','--infiles',nargs="+",required=True,help="One FASTQ file, or mate files. May be compressed.")
+	parser.add_argument('-a','--alphabet',default=ALPHABET.decode(),help="The characters allowed in the sequences. Default is %(default)s.")
+	parser.add_argument('-q','--max-qual',type=int,default=MAX_QUAL,help="The highest allowed Phred+33 quality score. Default is %(default)s.")
+	parser.add_argument('-o','--outfile',help="The file to write the JSON report to. Defaults to stdout.")
+	parser.add_argument('-p','--procs',type=int,help="The number of processes to use. Defaults to the number of CPUs.")
+	args = parser.parse_args()
+	report = validateFiles(args.infiles,args.alphabet.encode(),args.max_qual,args.procs)
+	fout = open(args.outfile,'w') if args.outfile else sys.stdout
+	writeReport(fout,report)
+	if args.outfile:
+		fout.close()
+	sys.exit(0 if report["valid"] else 1)
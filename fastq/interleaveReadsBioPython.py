@@ -4,9 +4,10 @@
 
 
 from argparse import ArgumentParser
-from Bio import SeqIO
-import sys,os
-import gzip,bz2
+import os
+
+from gbsc_utils import codec
+from gbsc_utils.fastq import fastq_utils
 
 def fileExists(path):
 	if not os.path.exists(path):
@@ -14,20 +15,22 @@ def fileExists(path):
 	return path
 
 def interleave(iter1, iter2) :
-	while True :
-		yield iter1.next()
-		yield iter2.next()
+	for rec1,rec2 in zip(iter1,iter2):
+		yield rec1
+		yield rec2
 
 GZIP="gzip"
 BZ2="bz2"
 
-description = "Interleaves paired-end reads using BioPython. Accepts one forward read file (F) and one reverse read file (R). Reads are interleaved based on the order they appear - F1 with R1, F2 with R2, and so on. Accepts uncompressed input as well as gzip (file extension must be either .gz or .gzip) and bz2 (file extension must be .bz2) compressed input."
+description = "Interleaves paired-end reads. Accepts one forward read file (F) and one reverse read file (R). Reads are interleaved based on the order they appear - F1 with R1, F2 with R2, and so on. FASTQ input is interleaved natively, checking that the mates of each pair have the same ID. FASTA input is read with BioPython. Accepts uncompressed input as well as gzip and bz2 compressed input, which is recognized by its contents."
 parser = ArgumentParser(description=description)
 parser.add_argument('--forward',required=True,help="The forward reads file.")
 parser.add_argument('--reverse',required=True,help="The reverse reads file.")
 parser.add_argument('--format',choices=("fasta","fastq"),default="fastq",help="The format of the input reads. Default is %(default)s.")
 parser.add_argument('--outfile',required=True,help="Interleaved output filename.")
-parser.add_argument('--compress-output',choices=(GZIP,BZ2),help="Compress the output with selected method.")
+parser.add_argument('--compress-output',choices=(GZIP,BZ2),help="Compress the output with selected method. gzip output is written as BGZF.")
+parser.add_argument('--threads',type=int,help="The number of threads to use for gzip compression. Defaults to the number of CPUs.")
+parser.add_argument('--check-every',type=int,default=1,help="FASTQ only. Check the IDs of only every Nth pair, or of no pairs when 0. Default is %(default)s.")
 
 args = parser.parse_args()
 left = fileExists(args.forward.strip())
@@ -36,16 +39,21 @@ outfile = args.outfile
 format = args.format
 
 compress = args.compress_output
-if compress:
-	if compress == GZIP:
-		fout = gzip.open(outfile,'w')
-	elif compress == BZ2:
-		fout = bz2.BZFile(outfile,'w')
+if compress == GZIP:
+	fmt = codec.BGZF
+elif compress == BZ2:
+	fmt = codec.BZ2
 else:
-	fout = open(args.outfile,'w')
+	fmt = codec.PLAIN
 
-records = interleave(SeqIO.parse(left, format), SeqIO.parse(right, format))
-count = SeqIO.write(records, fout, format)
-fout.close()
+if format == "fastq":
+	count = 2 * fastq_utils.interleave(left,right,outfile,fmt=fmt,checkEvery=args.check_every,threads=args.threads)
+else:
+	from Bio import SeqIO
+	fout = codec.openWrite(outfile,fmt=fmt,text=True,threads=args.threads)
+	#Compressed input is decompressed in background threads.
+	records = interleave(SeqIO.parse(codec.openRead(left,text=True), format), SeqIO.parse(codec.openRead(right,text=True), format))
+	count = SeqIO.write(records, fout, format)
+	fout.close()
 
 print("Interleaved {count} sequence records.".format(count=count))
@@ -3,28 +3,40 @@ from argparse import ArgumentParser
 import fastq_utils as f
 import os
 
+from gbsc_utils import codec
+
 #Illumina FASTQ format is 
 # @<instrument-name>:<run ID>:<flowcell ID>:<lane>:<tile>:<x-pos>:<y-pos> <read number>:<is filtered>:<control number>:<barcode sequence>
 
-def compressWriteFh(outfileName,format):
+def compressWriteFh(outfileName,format,threads=None):
 	"""
-	Function : Creates an output file handle that is either a regular stream, a GZIP stream, or a BZ2 stream, depending on the value of the format field.
+	Function : Creates a binary output file handle that is either a regular stream, a GZIP stream, or a BZ2 stream, depending on the value of the format field.
 		         Will add the appropriate compression extension if it doesn't exist already to the outfileName, which for GZIP is '.gzip' and for 
- 						 BZ2 is '.bz2'.
+ 						 BZ2 is '.bz2'. GZIP output is written as BGZF, with the blocks compressed in a pool of threads.
 	Args     : format - one of [gzip,bz2]
+	           threads - int. The number of GZIP compression threads. Defaults to the number of CPUs.
 	"""
 	if format == "gzip":
 		if not outfileName.endswith(".gzip"):
 			outfileName += ".gzip"
-		fout = gzip.open(outfileName,'w')
-	elif compress == "bz2":
+		fout = codec.openWrite(outfileName,fmt=codec.BGZF,threads=threads)
+	elif format == "bz2":
 		if not outfileName.endswith(".bz2"):
 			outfileName += ".bz2"
-		fout = bz2.BZFile(outfileName,'w')
+		fout = codec.openWrite(outfileName,fmt=codec.BZ2)
 	else:
-		fout = open(outfileName,'w')
+		fout = codec.openWrite(outfileName,fmt=codec.PLAIN)
 	return fout
 
+def writeRec(fout,rec):
+	"""
+	Function : Writes a FASTQ record to a binary output file handle.
+	Args     : rec - A four item FASTQ record, with either str or bytes items.
+	"""
+	if isinstance(rec[0],str):
+		rec = [x.encode() for x in rec]
+	fout.write(b"\n".join(rec) + b"\n")
+
 
 description="Given two paired-end reads files in FASTQ format, where one contains the forward reads and the other the reverse, outputs either an interleaved FASTQ file or two separate ordered FASTQ files. There are two reasons for wanting to do the latter: 1) To get rid of the singleton reads, and 2) The reads are out of order. Out of order means that the ordering of reads in one FASTQ file isn't the same as those in the other FASTQ file."
 parser = ArgumentParser(description=description)
@@ -35,6 +47,10 @@ parser.add_argument('--rout',help="The reverse reads output file name. When usin
 parser.add_argument('--iout',help="The interleaved output file name. Can't be used with either of the --fout or --rout options.")
 #parser.add_argument('--format',choices=("fasta","fastq"),default="fastq",help="The format of the input reads. Default is %(default)s.")
 parser.add_argument('-c','--compress-output',choices=("gzip","bz2"),help="Compress the output with selected method.")
+parser.add_argument('-t','--threads',type=int,help="The number of threads to use for gzip compression. Defaults to the number of CPUs.")
+parser.add_argument('--streaming',action="store_true",help="Pair up the reads in a single streaming pass rather than loading both files into memory. Works best when the mates are mostly in the same order in both files. Reads whose mates haven't been seen yet are buffered in memory, up to --max-buffered reads, and beyond that are spilled to sorted temporary files that are merged at the end. Pairs that go through that merge are written last.")
+parser.add_argument('--max-buffered',type=int,default=f.MAX_BUFFERED_READS,help="With --streaming, the maximum number of unpaired reads to hold in memory. Default is %(default)s.")
+parser.add_argument('--tmpdir',help="With --streaming, the directory in which to write temporary files. Defaults to the system temporary directory.")
 
 args = parser.parse_args()
 if not args.fout and not args.rout and not args.iout:
@@ -66,27 +82,33 @@ else:
 
 outfileHandles = {}
 for outfile in outfileNames:
-	if compressFormat:
-		outfileHandles[outfile] = compressWriteFh(outfileNames[outfile],compressFormat)
-	else:
-		outfileHandles[outfile] = open(outfileNames[outfile],'w')
+	outfileHandles[outfile] = compressWriteFh(outfileNames[outfile],compressFormat,threads=args.threads)
 
-forwardIndex = f.mem(forward)
-reverseIndex = f.mem(reverse)
+def pairs():
+	"""
+	Function : Generates the (forward record, reverse record) pairs to output.
+	"""
+	if args.streaming:
+		for pair in f.syncPairs(forward,reverse,maxBuffered=args.max_buffered,tmpdir=args.tmpdir):
+			yield pair
+	else:
+		forwardIndex = f.memStore(forward)
+		reverseIndex = f.memStore(reverse)
+		for seqid in forwardIndex:
+			if seqid in reverseIndex:
+				yield forwardIndex[seqid],reverseIndex[seqid]
 
 if not interleavedOut:
 	forwardFout = outfileHandles['fout']
 	reverseFout = outfileHandles['rout']
-	for seqid in forwardIndex:
-		if seqid in reverseIndex:
-			forwardFout.write(forwardIndex[seqid])
-			reverseFout.write(reverseIndex[seqid])
+	for forwardRec,reverseRec in pairs():
+		writeRec(forwardFout,forwardRec)
+		writeRec(reverseFout,reverseRec)
 	forwardFout.close()
 	reverseFout.close()
 else:
 	interleavedFout = outfileHandles['iout']
-	for seqid in forwardIndex:
-		if seqid in reverseIndex:
-			interleavedFout.write(forwardIndex[seqid])
-			interleavedFout.write(reverseIndex[seqid])
+	for forwardRec,reverseRec in pairs():
+		writeRec(interleavedFout,forwardRec)
+		writeRec(interleavedFout,reverseRec)
 	interleavedFout.close()
@@ -10,6 +10,7 @@ parser = ArgumentParser(description=description)
 parser.add_argument('-i','--infile',required=True,help="The white-space delimited input file where the first two columns are the forward read file name and the reverse the reverse read fastq file name. If the --interleave option is used, then the 3rd column must be the interleaved output file name.")
 parser.add_argument('-c','--compress-output',choices=("gzip","bz2"),help="Compress the output with selected method. For GZIP compression, the extension will be set to '.gzip', and for BZ2 it will be '.bz2'.")
 parser.add_argument('--interleave',action="store_true",help="Presence of this option indicates to interleave each pair of forward and reverse read files. In this case, the 3rd column in the input file must be the interleave output file name.")
+parser.add_argument('--streaming',action="store_true",help="Presence of this option indicates to pass --streaming to outputPairedEndReads.py, which pairs up the reads in a single pass with bounded memory instead of loading both read files into memory. Jobs submitted with --qsub then request much less memory.")
 parser.add_argument('--qsub',action="store_true",help="Presence of this option indicates to run the jobs through qsub. Also set --notify argument when using this.")
 parser.add_argument('-n','--notify',help="An email address for OGE notifications for job end and abort. Only makes sense to use with the --qsub argument, and is required to use this argument with --qsub.")
 parser.add_argument('--outdir',required=True,help="The output directory (must already exist); also the working directory to use with QSUB when --qsub is specified where all stdout and stderr files will be written too. Technially this option isn't needed when --interleave is specified and --qsub isn't, since the input file in this case will specify the output file names; however, for simplicity it's required at this time.")
@@ -21,6 +22,9 @@ args = parser.parse_args()
 interleave = args.interleave
 infile = args.infile
 qsub = args.qsub
+streaming = args.streaming
+#The memory to request per job with --qsub.
+h_vmem = "4G" if streaming else "32G"
 notify = args.notify
 outdir = args.outdir
 if not os.path.exists(outdir):
@@ -49,8 +53,10 @@ for line in fh:
 		rout = os.path.basename(r).rsplit(".")[0] + peExt
 		rout = os.path.join(outdir,rout)
 		cmd += "--fout {fout} --rout {rout} ".format(fout=fout,rout=rout)
+	if streaming:
+		cmd += "--streaming "
 	if qsub:
-		cmd = "qsub -v PYTHONPATH={PYTHONPATH} -R y -l h_vmem=32G -m ea -M {notify} -wd {outdir} {cmd}".format(notify=notify,outdir=outdir,cmd=cmd,PYTHONPATH=os.getenv('PYTHONPATH'))
+		cmd = "qsub -v PYTHONPATH={PYTHONPATH} -R y -l h_vmem={h_vmem} -m ea -M {notify} -wd {outdir} {cmd}".format(h_vmem=h_vmem,notify=notify,outdir=outdir,cmd=cmd,PYTHONPATH=os.getenv('PYTHONPATH'))
 		print(cmd)
 		subprocess.Popen(cmd,shell=True)
 	else:
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+
+from gbsc_utils.fastq import fastq_utils
+
+description = "Subsamples the reads of a FASTQ file, or the read pairs of a pair of R1/R2 FASTQ files, in a single streaming pass. The reads to keep are chosen by hashing the read IDs with the given seed, so that the same reads are chosen from R1 and R2 and the sample is reproducible. Input may be compressed; output is compressed according to its extension (.gz or .bz2)."
+parser = ArgumentParser(description=description)
+parser.add_argument('-i','--infiles',nargs="+",required=True,help="One FASTQ file, or the R1 and R2 FASTQ files of a paired-end run.")
+parser.add_argument('-o','--outfiles',nargs="+",required=True,help="The output FASTQ files, one per input file.")
+group = parser.add_mutually_exclusive_group(required=True)
+group.add_argument('-f','--fraction',type=float,help="Keep each read (pair) with this probability.")
+group.add_argument('-n','--count',type=int,help="Keep this many reads (pairs), chosen uniformly at random.")
+group.add_argument('--head',type=int,help="Keep the first this many reads (pairs).")
+parser.add_argument('-s','--seed',type=int,default=0,help="The seed for --fraction and --count. Default is %(default)s.")
+args = parser.parse_args()
+
+if len(args.infiles) > 2:
+	parser.error("At most two input files can be given!")
+if len(args.outfiles) != len(args.infiles):
+	parser.error("You must supply one output file per input file!")
+if args.fraction is not None and not 0 <= args.fraction <= 1:
+	parser.error("--fraction must be between 0 and 1!")
+
+numWritten = fastq_utils.subsampleFiles(args.infiles,args.outfiles,fraction=args.fraction,count=args.count,head=args.head,seed=args.seed)
+print("Wrote {num} reads{pairs}.".format(num=numWritten,pairs=" pairs" if len(args.infiles) == 2 else ""))
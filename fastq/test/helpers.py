@@ -0,0 +1,38 @@
+"""
+Helpers shared by the tests of the tools that read and write FASTQ files.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+def fastqText(recs):
+	"""
+	Function : Formats records as FASTQ text.
+	Args     : recs - iterable of four item tuples of str (attLine, seq, plusLine, qual).
+	Returns  : str.
+	"""
+	return "".join("\n".join(rec) + "\n" for rec in recs)
+
+class TempDirTestCase(unittest.TestCase):
+	"""
+	A test case with a temporary directory, self.tmpdir, that is made before each test and removed after it.
+	"""
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir)
+
+	def write(self,name,recs):
+		"""
+		Function : Writes a file in the temporary directory.
+		Args     : name - str. The file name.
+		           recs - iterable of FASTQ records, as for fastqText(), or str of the text to write as is.
+		Returns  : str. The path of the file.
+		"""
+		path = os.path.join(self.tmpdir,name)
+		with open(path,'w') as fout:
+			fout.write(recs if isinstance(recs,str) else fastqText(recs))
+		return path
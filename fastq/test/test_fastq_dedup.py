@@ -0,0 +1,147 @@
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from gbsc_utils import codec
+from gbsc_utils.fastq import fastq_dedup
+from gbsc_utils.fastq import fastq_utils
+from gbsc_utils.fastq.test import helpers
+
+class TestHashSet(unittest.TestCase):
+
+	def test_add_and_partitions(self):
+		rand = np.random.default_rng(1)
+		values = rand.integers(0,2 ** 64,size=5000,dtype=np.uint64)
+		hashSet = fastq_dedup.HashSet()
+		isNew = np.concatenate([hashSet.add(values[i:i + 300]) for i in range(0,5000,300)])
+		self.assertTrue(isNew.all())
+		self.assertFalse(hashSet.add(values[:10]).any())
+		#Repeats within a batch are new only the first time.
+		self.assertEqual(list(hashSet.add(np.array([1,1,2],dtype=np.uint64))),[True,False,True])
+		self.assertEqual(len(hashSet),5002)
+		self.assertEqual(hashSet.partitionSizes().sum(),5002)
+		last = hashSet.popPartition(fastq_dedup.PARTITIONS - 1)
+		self.assertTrue((last >> np.uint64(60) == 15).all())
+		self.assertEqual(len(hashSet),5002 - len(last))
+		self.assertNotIn(int(last[0]),hashSet)
+		self.assertIn(1,hashSet)
+
+class TestNearDuplicateIndex(unittest.TestCase):
+
+	def test_mismatches(self):
+		index = fastq_dedup.NearDuplicateIndex(2,12)
+		index.add([b"ACGTACGTACGT",b"ACGAACGTACGA"])
+		index.add([b"TTTAACGTACGA",b"ACGTACGTACG",b"ACGTACGTACGT"])
+		self.assertEqual(list(index.duplicates()),[False,True,False,False,True])
+
+	def test_spill(self):
+		#Mutated copies of a few keys, checked against all earlier keys by brute force, with the entries spilled and the partitions split.
+		rand = random.Random(5)
+		originals = [bytes(rand.choice(b"ACGT") for j in range(20)) for i in range(50)]
+		keys = []
+		for i in range(600):
+			key = bytearray(originals[rand.randrange(50)])
+			for j in range(rand.randrange(4)):
+				key[rand.randrange(20)] = rand.choice(b"ACGT")
+			keys.append(bytes(key[:rand.choice([19,20,20])]))
+		expected = [any(len(x) == len(key) and sum(a != b for a,b in zip(x,key)) <= 2 for x in keys[:i]) for i,key in enumerate(keys)]
+		workdir = tempfile.mkdtemp()
+		try:
+			index = fastq_dedup.NearDuplicateIndex(2,20,maxEntries=40,workdir=workdir)
+			for i in range(0,600,70):
+				index.add(keys[i:i + 70])
+			self.assertTrue(os.path.exists(os.path.join(workdir,"keys.rows")))
+			self.assertEqual(list(index.duplicates()),expected)
+			self.assertEqual(os.listdir(workdir),["keys.rows"])
+		finally:
+			shutil.rmtree(workdir)
+
+	def test_poly_g(self):
+		#Keys whose second half is poly-G all fall in one bucket. Each original is followed by a copy with a mismatch in the first half, which only the
+		#poly-G segment can catch, and then one with a mismatch in the second half.
+		rand = random.Random(7)
+		keys = []
+		for i in range(5000):
+			key = bytearray(rand.choice(b"ACGT") for j in range(25)) + b"G" * 25
+			keys.append(bytes(key))
+			for pos in (rand.randrange(25),25 + rand.randrange(25)):
+				copy = bytearray(key)
+				copy[pos] = ord("T") if copy[pos] != ord("T") else ord("A")
+				keys.append(bytes(copy))
+		index = fastq_dedup.NearDuplicateIndex(1,50)
+		index.add(keys)
+		isDup = index.duplicates()
+		self.assertEqual(isDup.sum(),10000)
+		self.assertFalse(isDup[::3].any())
+
+class TestDedupFiles(helpers.TempDirTestCase):
+
+	def setUp(self):
+		super().setUp()
+		rand = random.Random(3)
+		self.seqs = ["".join(rand.choice("ACGT") for i in range(30)) for j in range(400)]
+		#Each read's sequence is picked from 400, so that many are duplicates.
+		self.picks = [rand.randrange(400) for i in range(3000)]
+		self.infiles = []
+		for num in (1,2):
+			recs = [("@r{i} {num}:N:0:A".format(i=i,num=num),self.seqs[x][::3 - 2 * num],"+","I" * 30) for i,x in enumerate(self.picks)]
+			self.infiles.append(self.write("r{}.fq".format(num),recs))
+
+	def expectedIds(self):
+		seen = set()
+		ids = []
+		for i,x in enumerate(self.picks):
+			if x not in seen:
+				seen.add(x)
+				ids.append(i)
+		return ids
+
+	def readIds(self,path):
+		with codec.openRead(path) as fh:
+			return [int(rec[0].split()[0][2:]) for rec in fastq_utils.blockparse(fh)]
+
+	def test_in_memory(self):
+		outfiles = [os.path.join(self.tmpdir,x) for x in ("o1.fq","o2.fq.gz")]
+		stats = fastq_dedup.dedupFiles(self.infiles,outfiles,curveStep=1000)
+		expected = self.expectedIds()
+		self.assertEqual((stats.numReads,stats.numUnique),(3000,len(expected)))
+		self.assertEqual(self.readIds(outfiles[0]),expected)
+		self.assertEqual(self.readIds(outfiles[1]),expected)
+		curve = stats.curve()
+		self.assertEqual([x[0] for x in curve],[1000,2000,3000])
+		self.assertEqual(curve[0][1],len([i for i in expected if i < 1000]))
+		self.assertEqual(curve[-1][1],len(expected))
+
+	def test_spilled(self):
+		outfiles = [os.path.join(self.tmpdir,x) for x in ("o1.fq","o2.fq")]
+		stats = fastq_dedup.dedupFiles(self.infiles,outfiles,maxHashes=100,curveStep=1000,tmpdir=self.tmpdir,batchSize=128)
+		expected = self.expectedIds()
+		self.assertEqual(stats.numUnique,len(expected))
+		#The reads set aside for spilled partitions come last, so compare as sets, and the mates stay in sync.
+		ids = self.readIds(outfiles[0])
+		self.assertEqual(sorted(ids),expected)
+		self.assertEqual(self.readIds(outfiles[1]),ids)
+		self.assertEqual(stats.curve()[0][1],len([i for i in expected if i < 1000]))
+		self.assertEqual(sorted(os.listdir(self.tmpdir)),["o1.fq","o2.fq","r1.fq","r2.fq"])
+
+	def test_near(self):
+		#A single mismatch makes a near duplicate but not an exact one.
+		infile = self.write("near.fq",[("@a","ACGTACGTAC","+","I" * 10),("@b","ACGTACCTAC","+","I" * 10),("@c","TTTTTTTTTT","+","I" * 10)])
+		self.assertEqual(fastq_dedup.dedupFiles([infile]).numUnique,3)
+		stats = fastq_dedup.dedupFiles([infile],mismatches=1)
+		self.assertEqual(stats.numUnique,2)
+		report = io.StringIO()
+		stats.writeReport(report)
+		self.assertIn("Duplication rate\t0.3333\n",report.getvalue())
+		outfile = os.path.join(self.tmpdir,"out.fq")
+		fastq_dedup.dedupFiles([infile],[outfile],mismatches=1,maxHashes=1,tmpdir=self.tmpdir)
+		self.assertEqual(open(outfile).read(),"@a\nACGTACGTAC\n+\nIIIIIIIIII\n@c\nTTTTTTTTTT\n+\nIIIIIIIIII\n")
+		self.assertEqual(sorted(os.listdir(self.tmpdir)),["near.fq","out.fq","r1.fq","r2.fq"])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,72 @@
+import collections
+import functools
+import gzip
+import os
+import unittest
+
+from gbsc_utils import bgzf
+from gbsc_utils.fastq import fastq_mapreduce
+from gbsc_utils.fastq.test import helpers
+
+def seqLength(rec):
+	return len(rec[1])
+
+def firstBase(rec):
+	return rec[1][:1]
+
+def batchLength(batch):
+	return sum(len(rec[1]) for rec in batch)
+
+def add(x,y):
+	return x + y
+
+def minLength(length,rec):
+	return len(rec[1]) >= length
+
+class TestMapReduce(helpers.TempDirTestCase):
+
+	def setUp(self):
+		super().setUp()
+		#Quality strings that start with '@' make the record boundaries harder to find.
+		self.recs = [("@read{}".format(i),"ACGT"[i % 4] * (20 + i % 50),"+","@" * (20 + i % 50)) for i in range(5000)]
+		self.fqFile = self.write("reads.fastq",self.recs)
+		self.bgzfFile = self.fqFile + ".gz"
+		bgzf.recompress(self.fqFile,self.bgzfFile)
+
+	def test_chunks_cover_file(self):
+		for infile in (self.fqFile,self.bgzfFile):
+			chunks = fastq_mapreduce.chunks(infile,7)
+			self.assertGreater(len(chunks),1)
+			recs = []
+			for start,end in chunks:
+				recs.extend(fastq_mapreduce.iterChunk(infile,start,end))
+			self.assertEqual([rec[0].decode() for rec in recs],[rec[0] for rec in self.recs])
+
+	def test_countKeys(self):
+		expected = collections.Counter(rec[1][:1].encode() for rec in self.recs)
+		for infile in (self.fqFile,self.bgzfFile):
+			self.assertEqual(fastq_mapreduce.countKeys(infile,firstBase,numProcs=3),expected)
+
+	def test_scan_batches(self):
+		total = sum(len(rec[1]) for rec in self.recs)
+		self.assertEqual(fastq_mapreduce.scan(self.fqFile,seqLength,add,0,numProcs=2),total)
+		self.assertEqual(fastq_mapreduce.scan(self.bgzfFile,batchLength,add,0,batchSize=100,numProcs=2),total)
+
+	def test_filterFile(self):
+		outfile = os.path.join(self.tmpdir,"out.fastq.gz")
+		numRecs,numPassed = fastq_mapreduce.filterFile(self.bgzfFile,functools.partial(minLength,60),outfile,numProcs=3)
+		expected = [rec for rec in self.recs if len(rec[1]) >= 60]
+		self.assertEqual((numRecs,numPassed),(5000,len(expected)))
+		with gzip.open(outfile,'rt') as fh:
+			self.assertEqual(fh.read(),"".join("\n".join(rec) + "\n" for rec in expected))
+
+	def test_filterFile_views(self):
+		outfile = os.path.join(self.tmpdir,"out.fastq")
+		numRecs,numPassed = fastq_mapreduce.filterFile(self.fqFile,functools.partial(minLength,60),outfile,numProcs=3,views=True)
+		expected = [rec for rec in self.recs if len(rec[1]) >= 60]
+		self.assertEqual((numRecs,numPassed),(5000,len(expected)))
+		with open(outfile) as fh:
+			self.assertEqual(fh.read(),"".join("\n".join(rec) + "\n" for rec in expected))
+
+if __name__ == "__main__":
+	unittest.main()
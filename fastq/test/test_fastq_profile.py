@@ -0,0 +1,68 @@
+import os
+import random
+import unittest
+
+from gbsc_utils.fastq import fastq_profile
+from gbsc_utils.fastq.test import helpers
+
+class TestProfile(helpers.TempDirTestCase):
+
+	def setUp(self):
+		super().setUp()
+		rand = random.Random(0)
+		self.recs = []
+		for i in range(500):
+			length = rand.choice([0,1,35,50,76])
+			seq = "".join(rand.choice("ACGTNacgt") for _ in range(length))
+			qual = "".join(chr(33 + rand.randrange(42)) for _ in range(length))
+			self.recs.append((b"@r",seq.encode(),b"+",qual.encode()))
+
+	def expected(self,recs):
+		maxLen = max(len(rec[1]) for rec in recs)
+		baseCounts = [[0] * 5 for _ in range(maxLen)]
+		qualCounts = [[0] * fastq_profile.NUM_QUALS for _ in range(maxLen)]
+		lengthCounts = [0] * (maxLen + 1)
+		gcCounts = [0] * 101
+		for rec in recs:
+			seq = rec[1].decode().upper()
+			lengthCounts[len(seq)] += 1
+			for cycle,base in enumerate(seq):
+				baseCounts[cycle]["ACGTN".index(base)] += 1
+				qualCounts[cycle][rec[3][cycle] - 33] += 1
+			gc = seq.count("G") + seq.count("C")
+			gcCounts[int(round(gc * 100.0 / len(seq))) if seq else 0] += 1
+		return baseCounts,qualCounts,lengthCounts,gcCounts
+
+	def test_addBatch(self):
+		profile = fastq_profile.Profile()
+		for i in range(0,len(self.recs),64):
+			profile.addBatch(self.recs[i:i + 64])
+		baseCounts,qualCounts,lengthCounts,gcCounts = self.expected(self.recs)
+		self.assertEqual(profile.numReads,500)
+		self.assertEqual(profile.baseCounts.tolist(),baseCounts)
+		self.assertEqual(profile.qualCounts.tolist(),qualCounts)
+		self.assertEqual(profile.lengthCounts.tolist(),lengthCounts)
+		self.assertEqual(profile.gcCounts.tolist(),gcCounts)
+
+	def test_merge_is_exact(self):
+		whole = fastq_profile.Profile()
+		whole.addBatch(self.recs)
+		short = fastq_profile.Profile()
+		short.addBatch([rec for rec in self.recs if len(rec[1]) < 50])
+		long = fastq_profile.Profile()
+		long.addBatch([rec for rec in self.recs if len(rec[1]) >= 50])
+		self.assertEqual(short.merge(long),whole)
+
+	def test_profileFile_and_save(self):
+		fqFile = self.write("reads.fastq",[[x.decode() for x in rec] for rec in self.recs])
+		profile = fastq_profile.profileFile(fqFile,batchSize=50,numProcs=2)
+		whole = fastq_profile.Profile()
+		whole.addBatch(self.recs)
+		self.assertEqual(profile,whole)
+		npzFile = os.path.join(self.tmpdir,"profile.npz")
+		profile.save(npzFile)
+		self.assertEqual(fastq_profile.Profile.load(npzFile),whole)
+		profile.writeReport(os.path.join(self.tmpdir,"report.txt"))
+
+if __name__ == "__main__":
+	unittest.main()
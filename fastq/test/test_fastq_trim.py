@@ -0,0 +1,91 @@
+import io
+import os
+import unittest
+
+import numpy as np
+
+from gbsc_utils import readfilter
+from gbsc_utils.fastq import fastq_trim
+from gbsc_utils.fastq.test import helpers
+
+ADAPTER = "AGATCGGAAGAGCACACGTCT"
+
+def batch(seqs,quals=None):
+	quals = quals or ["I" * len(x) for x in seqs]
+	return readfilter.Batch([("@r{}".format(i).encode(),seq.encode(),b"+",qual.encode()) for i,(seq,qual) in enumerate(zip(seqs,quals))],True)
+
+class TestSteps(unittest.TestCase):
+
+	def test_adapter(self):
+		insert = "TTGCCATGACCGTAAC"
+		seqs = [
+			insert + ADAPTER,               #full adapter
+			insert + ADAPTER[:5],           #partial adapter at the 3' end
+			insert + "AGTTCGGAAGAG",        #one mismatch in 12 bases
+			insert + "AGTTCGGTAGAG",        #two mismatches in 12 bases is too many
+			insert + ADAPTER[:2],           #shorter than the minimum overlap
+			ADAPTER.lower(),                #all adapter
+			"",
+			insert + ADAPTER[:4] + ADAPTER[5:] + "CC",  #a deletion, followed by other bases
+			insert + ADAPTER[:12] + "T" + ADAPTER[12:], #an insertion
+		]
+		lengths = fastq_trim.Trimmer([ADAPTER]).trimLengths(batch(seqs))
+		self.assertEqual(list(lengths),[16,16,16,28,18,0,0,16,16])
+
+	def test_quality(self):
+		#With threshold 20, the running sums from the 3' end are 18, 36, 26, 41, 21, 1, then negative, so 4 bases are cut.
+		quals = ["IIIII" + "".join(chr(33 + q) for q in (5,30,2,2))]
+		trimmer = fastq_trim.Trimmer(qualThreshold=20)
+		self.assertEqual(list(trimmer.trimLengths(batch(["ACGTACGTA"],quals))),[5])
+		self.assertEqual(list(trimmer.trimLengths(batch(["ACGT","A",""],["IIII","#",""]))),[4,0,0])
+
+	def test_quality_matches_loop(self):
+		rand = np.random.default_rng(2)
+		quals = ["".join(chr(33 + q) for q in rand.integers(0,41,size=n)) for n in rand.integers(0,60,size=200)]
+		def bwaLength(qual,threshold):
+			total = best = 0
+			cut = len(qual)
+			for i in range(len(qual) - 1,-1,-1):
+				total += threshold - (ord(qual[i]) - 33)
+				if total < 0:
+					break
+				if total > best:
+					best = total
+					cut = i
+			return cut
+		lengths = fastq_trim.Trimmer(qualThreshold=25).trimLengths(batch(["A" * len(x) for x in quals],quals))
+		self.assertEqual(list(lengths),[bwaLength(x,25) for x in quals])
+
+	def test_poly_g_then_adapter(self):
+		seqs = ["ACGTACGTAC" + "G" * 12,"ACGTACGTAC" + "G" * 5,"ACGTACGTAC" + ADAPTER[:8] + "G" * 10]
+		counts = {}
+		lengths = fastq_trim.Trimmer([ADAPTER],minPolyG=10).trimLengths(batch(seqs),counts)
+		self.assertEqual(list(lengths),[10,15,10])
+		self.assertEqual(counts,{"poly-G": 2,"adapter": 1})
+
+class TestTrimFiles(helpers.TempDirTestCase):
+
+	def test_pairs(self):
+		r1 = [("@a/1","ACGTACGTAC" + ADAPTER,"+","I" * 31),("@b/1","ACG" + ADAPTER,"+","I" * 24),("@c/1","ACGTACGTAC","+","IIIIIIIIII")]
+		r2 = [("@a/2","TTTTTTTTTT","+","IIIIIIIIII"),("@b/2","CCCCCCCCCC","+","IIIIIIIIII"),("@c/2","GGGGGAAAAA","+","IIIII#####")]
+		infiles = [self.write("r1.fq",r1),self.write("r2.fq",r2)]
+		outfiles = [os.path.join(self.tmpdir,x) for x in ("o1.fq","o2.fq")]
+		trimmers = [fastq_trim.Trimmer([ADAPTER]),fastq_trim.Trimmer(qualThreshold=20)]
+		stats = fastq_trim.trimFiles(infiles,outfiles,trimmers,minLength=5)
+		#Pair b is discarded for its short R1, though its R2 is long enough.
+		self.assertEqual(open(outfiles[0]).read(),helpers.fastqText([("@a/1","ACGTACGTAC","+","I" * 10),r1[2]]))
+		self.assertEqual(open(outfiles[1]).read(),helpers.fastqText([r2[0],("@c/2","GGGGG","+","IIIII")]))
+		self.assertEqual((stats.numReads,stats.numWritten),(3,2))
+		self.assertEqual(stats.trimmed,{"adapter": 2,"quality": 1})
+		report = io.StringIO()
+		stats.writeReport(report)
+		self.assertIn("Too short\t1\n",report.getvalue())
+
+	def test_readAdapterFile(self):
+		path = os.path.join(self.tmpdir,"adapters.txt")
+		with open(path,'w',encoding="utf-8") as fout:
+			fout.write("TruSeq Universal Adapter\n5’ AATGATACGG\n>x\nacgtn\n\n")
+		self.assertEqual(fastq_trim.readAdapterFile(path),[b"AATGATACGG",b"ACGTN"])
+
+if __name__ == "__main__":
+	unittest.main()
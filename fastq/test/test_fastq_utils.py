@@ -0,0 +1,353 @@
+import io
+import os
+import shutil
+import tempfile
+import random
+import unittest
+import gzip
+
+from gbsc_utils import bgzf
+from gbsc_utils import codec
+from gbsc_utils.fastq import fastq_utils
+from gbsc_utils.fastq.test import helpers
+
+RECS = [
+	("@r1 1:N:0:ACGT","ACGTN","+","FFFF#"),
+	("@r2 1:N:0:ACGT","GGCC","+r2","JJJJ"),
+	("@r3 1:N:0:ACGT","T","+","@"),
+]
+
+class TestBlockparse(unittest.TestCase):
+
+	def test_text(self):
+		fh = io.StringIO(helpers.fastqText(RECS))
+		self.assertEqual(list(fastq_utils.blockparse(fh)),RECS)
+
+	def test_bytes(self):
+		fh = io.BytesIO(helpers.fastqText(RECS).encode())
+		expected = [tuple(x.encode() for x in rec) for rec in RECS]
+		self.assertEqual(list(fastq_utils.blockparse(fh)),expected)
+
+	def test_small_blocks(self):
+		#Records straddle many block boundaries.
+		for blockSize in range(1,12):
+			fh = io.StringIO(helpers.fastqText(RECS * 5))
+			self.assertEqual(list(fastq_utils.blockparse(fh,blockSize=blockSize)),RECS * 5)
+
+	def test_crlf_and_no_final_newline(self):
+		fh = io.StringIO(helpers.fastqText(RECS).replace("\n","\r\n").rstrip())
+		self.assertEqual(list(fastq_utils.blockparse(fh,blockSize=7)),RECS)
+
+	def test_matches_indexparse(self):
+		text = helpers.fastqText(RECS * 3)
+		self.assertEqual(list(fastq_utils.blockparse(io.StringIO(text))),list(fastq_utils.indexparse(io.StringIO(text),index=False)))
+
+	def test_multiline(self):
+		fh = io.StringIO("@r1\nACG\nTN\n+\nFFF\nF#\n")
+		self.assertEqual(list(fastq_utils.blockparse(fh,multiline=True)),[("@r1","ACGTN","+","FFFF#")])
+
+	def test_multiline_qual_starting_with_at(self):
+		fh = io.StringIO("@r1\nACGT\n+\nFF\n@F\n\n@r2\nA\n+\nF\n")
+		self.assertEqual(list(fastq_utils.blockparse(fh,multiline=True)),[("@r1","ACGT","+","FF@F"),("@r2","A","+","F")])
+
+	def test_trailing_blanks(self):
+		text = "@r1\nACGT \n+\nIIII\n@r2\nAC\t\n+\nII \t\n"
+		expected = [("@r1","ACGT","+","IIII"),("@r2","AC","+","II")]
+		self.assertEqual(list(fastq_utils.blockparse(io.StringIO(text))),expected)
+		self.assertEqual(list(fastq_utils.blockparse(io.BytesIO(text.encode()))),[tuple(x.encode() for x in rec) for rec in expected])
+
+	def test_length_mismatch(self):
+		fh = io.StringIO("@r1\nACGT\n+\nFFF\n")
+		self.assertRaises(ValueError,list,fastq_utils.blockparse(fh))
+
+	def test_truncated(self):
+		fh = io.StringIO(helpers.fastqText(RECS)[:-8])
+		self.assertRaises(ValueError,list,fastq_utils.blockparse(fh))
+
+class TestViewparse(unittest.TestCase):
+
+	def setUp(self):
+		self.expected = [tuple(x.encode() for x in rec) for rec in RECS]
+
+	def test_views(self):
+		recs = list(fastq_utils.viewparse(io.BytesIO(helpers.fastqText(RECS).encode())))
+		self.assertTrue(all(isinstance(x,memoryview) for rec in recs for x in rec))
+		self.assertEqual([tuple(bytes(x) for x in rec) for rec in recs],self.expected)
+
+	def test_small_blocks(self):
+		for blockSize in range(1,12):
+			fh = io.BytesIO(helpers.fastqText(RECS * 5).encode().rstrip())
+			recs = fastq_utils.viewparse(fh,blockSize=blockSize)
+			self.assertEqual([tuple(bytes(x) for x in rec) for rec in recs],self.expected * 5)
+
+	def test_writeViews_roundtrip(self):
+		text = helpers.fastqText(RECS * 2).encode()
+		fout = io.BytesIO()
+		fastq_utils.writeViews(fout,fastq_utils.viewparse(io.BytesIO(text),blockSize=10))
+		self.assertEqual(fout.getvalue(),text)
+
+	def test_malformed(self):
+		for text in (b"@r1\nACGT\n+\nFFF\n",b"r1\nA\n+\nF\n",helpers.fastqText(RECS).encode()[:-8],b"@r1\r\nA\r\n+\r\nF\r\n"):
+			self.assertRaises(ValueError,list,fastq_utils.viewparse(io.BytesIO(text)))
+
+class TestGetFastqReadFileHandle(helpers.TempDirTestCase):
+
+	def test_compressed(self):
+		recs = RECS * 20000
+		for name in ("reads.fq.gz","reads.fq.bz2","reads.fq"):
+			outfile = os.path.join(self.tmpdir,name)
+			fout = codec.openWrite(outfile,threads=4)
+			fout.write(helpers.fastqText(recs).encode())
+			fout.close()
+			fh = fastq_utils.getFastqReadFileHandle(outfile,binary=True)
+			self.assertEqual(len(list(fastq_utils.blockparse(fh))),len(recs))
+			fh.close()
+		self.assertEqual(codec.detectFormat(os.path.join(self.tmpdir,"reads.fq.gz")),codec.BGZF)
+		self.assertEqual(list(fastq_utils.parse(os.path.join(self.tmpdir,"reads.fq")))[:3],RECS)
+
+	def test_mem_gz(self):
+		plain = self.write("reads.fq",RECS)
+		gzFile = os.path.join(self.tmpdir,"reads.fq.gz")
+		with gzip.open(gzFile,'wt') as fout:
+			fout.write(helpers.fastqText(RECS))
+		self.assertEqual(list(fastq_utils.parse(gzFile)),RECS)
+		self.assertEqual(fastq_utils.mem(gzFile),fastq_utils.mem(plain))
+
+class TestIndex(helpers.TempDirTestCase):
+
+	def setUp(self):
+		super().setUp()
+		self.fqFile = self.write("reads.fastq",RECS)
+
+	def test_getRec(self):
+		with fastq_utils.Index(self.fqFile,writeSidecar=False) as index:
+			self.assertEqual(len(index),3)
+			self.assertEqual(index.getRec("r2"),"\n".join(RECS[1]) + "\n")
+			self.assertEqual(list(index),["r1","r2","r3"])
+			self.assertNotIn("r4",index)
+		self.assertTrue(index.fh.closed)
+		self.assertFalse(os.path.exists(self.fqFile + fastq_utils.FQI_EXT))
+
+	def test_sidecar_reused(self):
+		fastq_utils.Index(self.fqFile).close()
+		self.assertTrue(os.path.exists(self.fqFile + fastq_utils.FQI_EXT))
+		with fastq_utils.Index(self.fqFile) as index:
+			self.assertIsNotNone(index._loadSidecar())
+			self.assertEqual(index.getRec("r3"),"\n".join(RECS[2]) + "\n")
+
+	def test_sidecar_invalidated(self):
+		fastq_utils.Index(self.fqFile).close()
+		with open(self.fqFile,'a') as fout:
+			fout.write("@r4\nAC\n+\nFF\n")
+		index = fastq_utils.Index(self.fqFile)
+		self.assertEqual(len(index),4)
+		self.assertEqual(index.getRec("r4"),"@r4\nAC\n+\nFF\n")
+
+	def test_crlf(self):
+		with open(self.fqFile,'w',newline="") as fout:
+			fout.write(helpers.fastqText(RECS).replace("\n","\r\n"))
+		index = fastq_utils.Index(self.fqFile,sidecar=False)
+		self.assertEqual(index.getRec("r2"),"\r\n".join(RECS[1]) + "\r\n")
+
+	def test_bgzf(self):
+		#Enough reads to span several BGZF blocks.
+		recs = [("@read{}".format(i),"ACGT" * 30,"+","FFFF" * 30) for i in range(2000)]
+		self.write("reads.fastq",recs)
+		bgzfFile = self.fqFile + ".gz"
+		bgzf.recompress(self.fqFile,bgzfFile)
+		self.assertTrue(bgzf.isBgzf(bgzfFile))
+		with gzip.open(bgzfFile,'rt') as fh:
+			self.assertEqual(fh.read(),helpers.fastqText(recs))
+		index = fastq_utils.Index(bgzfFile)
+		self.assertEqual(len(index),2000)
+		for i in (1999,0,1234,555):
+			self.assertEqual(index.getRec("read{}".format(i)),"\n".join(recs[i]) + "\n")
+		#Reopened from the sidecar.
+		index = fastq_utils.Index(bgzfFile)
+		self.assertEqual(index.getRec("read1000"),"\n".join(recs[1000]) + "\n")
+
+	def test_plain_gzip(self):
+		gzFile = self.fqFile + ".gz"
+		with gzip.open(gzFile,'wt') as fout:
+			fout.write(helpers.fastqText(RECS))
+		self.assertFalse(bgzf.isBgzf(gzFile))
+		index = fastq_utils.Index(gzFile,sidecar=False)
+		self.assertEqual(index.getRec("r3"),"\n".join(RECS[2]) + "\n")
+		self.assertEqual(index.getRec("r1"),"\n".join(RECS[0]) + "\n")
+
+class TestRecordStore(unittest.TestCase):
+
+	def test_lookup(self):
+		store = fastq_utils.RecordStore()
+		recs = [("@read{} 1:N:0:ACGT".format(i),"ACGT" * (i % 5),"+","FFFF" * (i % 5)) for i in range(3000)]
+		for rec in recs:
+			store.add(*rec)
+		self.assertEqual(len(store),3000)
+		self.assertEqual(list(store)[:3],["read0","read1","read2"])
+		for i in (0,1,2999,1500):
+			self.assertEqual(store["read{}".format(i)],tuple(x.encode() for x in recs[i]))
+		self.assertEqual(store[b"read7"].seq,b"ACGT" * 2)
+		self.assertIn("read42",store)
+		self.assertNotIn("read3000",store)
+		self.assertRaises(KeyError,store.__getitem__,"nope")
+
+	def test_replace(self):
+		store = fastq_utils.RecordStore()
+		store.add("@a","A","+","F")
+		store.add("@b","C","+","F")
+		store.add("@a x","G","+","#")
+		self.assertEqual(len(store),2)
+		self.assertEqual(list(store),["b","a"])
+		self.assertEqual(store["a"].seq,b"G")
+
+	def test_memStore(self):
+		tmpdir = tempfile.mkdtemp()
+		fqFile = os.path.join(tmpdir,"reads.fastq")
+		with open(fqFile,'w') as fout:
+			fout.write(helpers.fastqText(RECS))
+		store = fastq_utils.memStore(fqFile)
+		shutil.rmtree(tmpdir)
+		self.assertEqual(sorted(store),["r1","r2","r3"])
+		self.assertEqual(store["r2"],tuple(x.encode() for x in RECS[1]))
+
+class TestSubsample(helpers.TempDirTestCase):
+
+	def setUp(self):
+		super().setUp()
+		self.infiles = []
+		for readNum in (1,2):
+			path = os.path.join(self.tmpdir,"reads_R{}.fastq.gz".format(readNum))
+			with gzip.open(path,'wt') as fout:
+				fout.write(helpers.fastqText([("@r{i} {num}:N:0:ACGT".format(i=i,num=readNum),"ACGT","+","FFFF") for i in range(2000)]))
+			self.infiles.append(path)
+		self.outfiles = [os.path.join(self.tmpdir,"out_R{}.fastq".format(x)) for x in (1,2)]
+
+	def readIds(self,path):
+		return [fastq_utils.getSeqIdFromAttLine(rec[0]) for rec in fastq_utils.parse(path)]
+
+	def test_fraction_mate_consistent(self):
+		num = fastq_utils.subsampleFiles(self.infiles,self.outfiles,fraction=0.1,seed=7)
+		r1 = self.readIds(self.outfiles[0])
+		self.assertEqual(r1,self.readIds(self.outfiles[1]))
+		self.assertEqual(len(r1),num)
+		self.assertTrue(100 < num < 300)
+		#Sampling R1 alone gives the same reads.
+		fastq_utils.subsampleFiles(self.infiles[:1],self.outfiles[:1],fraction=0.1,seed=7)
+		self.assertEqual(self.readIds(self.outfiles[0]),r1)
+
+	def test_count(self):
+		self.assertEqual(fastq_utils.subsampleFiles(self.infiles,self.outfiles,count=50,seed=1),50)
+		r1 = self.readIds(self.outfiles[0])
+		self.assertEqual(r1,self.readIds(self.outfiles[1]))
+		self.assertEqual(r1,sorted(r1,key=lambda x: int(x[1:])))
+		fastq_utils.subsampleFiles(self.infiles,self.outfiles,count=50,seed=2)
+		self.assertNotEqual(self.readIds(self.outfiles[0]),r1)
+
+	def test_head(self):
+		fastq_utils.subsampleFiles(self.infiles[1:],self.outfiles[1:],head=3)
+		self.assertEqual(self.readIds(self.outfiles[1]),["r0","r1","r2"])
+
+	def test_mates_out_of_order(self):
+		with gzip.open(self.infiles[1],'wt') as fout:
+			fout.write(helpers.fastqText([("@x{}".format(i),"A","+","F") for i in range(5)]))
+		self.assertRaises(ValueError,fastq_utils.subsampleFiles,self.infiles,self.outfiles,head=5)
+
+	def test_unequal_lengths(self):
+		with gzip.open(self.infiles[1],'wt') as fout:
+			fout.write(helpers.fastqText([("@r{} 2:N:0:ACGT".format(i),"ACGT","+","FFFF") for i in range(1999)]))
+		self.assertRaises(ValueError,fastq_utils.subsampleFiles,self.infiles,self.outfiles,fraction=0.5)
+
+class TestSyncPairs(helpers.TempDirTestCase):
+
+	def mates(self,n,readNum):
+		return [("@r{i}/{num}".format(i=i,num=readNum),"ACGT","+","FFFF") for i in range(n)]
+
+	def test_in_order(self):
+		fwd = self.write("f.fq",self.mates(50,1))
+		rev = self.write("r.fq",self.mates(50,2))
+		pairs = list(fastq_utils.syncPairs(fwd,rev))
+		self.assertEqual([p[0][0] for p in pairs],[("@r{}/1".format(i)).encode() for i in range(50)])
+		self.assertEqual([p[1][0] for p in pairs],[("@r{}/2".format(i)).encode() for i in range(50)])
+
+	def test_shuffled_with_spill_and_singletons(self):
+		fwdRecs = self.mates(500,1)
+		revRecs = self.mates(500,2)
+		random.Random(1).shuffle(revRecs)
+		del fwdRecs[10]
+		del revRecs[20]
+		fwd = self.write("f.fq",fwdRecs)
+		rev = self.write("r.fq",revRecs)
+		pairs = list(fastq_utils.syncPairs(fwd,rev,maxBuffered=16,tmpdir=self.tmpdir))
+		for frec,rrec in pairs:
+			self.assertEqual(fastq_utils.mateKey(frec[0]),fastq_utils.mateKey(rrec[0]))
+		fkeys = set(fastq_utils.mateKey(x[0].encode()) for x in fwdRecs)
+		rkeys = set(fastq_utils.mateKey(x[0].encode()) for x in revRecs)
+		self.assertEqual(sorted(fastq_utils.mateKey(p[0][0]) for p in pairs),sorted(fkeys & rkeys))
+		#Only the temporary directory's own files remain.
+		self.assertEqual(sorted(os.listdir(self.tmpdir)),["f.fq","r.fq"])
+
+class TestDeinterleave(helpers.TempDirTestCase):
+
+	def test_readNumber(self):
+		self.assertEqual(fastq_utils.readNumber(b"@M1:7:FC:1:1:2:3 2:N:0:ACGT"),2)
+		self.assertEqual(fastq_utils.readNumber(b"@M1:7:FC:1:1:2:3\t1:Y:0:1"),1)
+		self.assertEqual(fastq_utils.readNumber(b"@HWI-1:1:1:2:3#0/2"),2)
+		self.assertEqual(fastq_utils.readNumber(b"@r1/1 extra"),1)
+		self.assertIsNone(fastq_utils.readNumber(b"@SRR1.1 1 length=4"))
+		self.assertIsNone(fastq_utils.readNumber(b"@r1"))
+		for attLine in (b"",b"@",b"2",b" 2"):
+			self.assertIsNone(fastq_utils.readNumber(attLine))
+
+	def test_shards_and_mate_order(self):
+		recs = []
+		for i in range(25):
+			pair = [("@r{i} {num}:N:0:ACGT".format(i=i,num=num),"ACGT"[num:],"+","FFFF"[num:]) for num in (1,2)]
+			#Some pairs have the reverse read first.
+			recs.extend(pair[::-1] if i % 3 == 0 else pair)
+		infile = self.write("il.fastq",recs)
+		fwd = [os.path.join(self.tmpdir,"f{}.fastq.gz".format(i)) for i in range(2)]
+		rev = [os.path.join(self.tmpdir,"r{}.fastq".format(i)) for i in range(2)]
+		self.assertEqual(fastq_utils.deinterleave(infile,fwd,rev,batchSize=4),25)
+		#Batches of 4 pairs alternate between the shards.
+		shardOf = [(i // 4) % 2 for i in range(25)]
+		for shard in range(2):
+			for num,path in ((1,fwd[shard]),(2,rev[shard])):
+				with codec.openRead(path) as fh:
+					titles = [rec[0].decode() for rec in fastq_utils.blockparse(fh)]
+				self.assertEqual(titles,["@r{i} {num}:N:0:ACGT".format(i=i,num=num) for i in range(25) if shardOf[i] == shard])
+
+	def test_positional(self):
+		infile = self.write("il.fastq",[("@s.1 1 length=1","A","+","F"),("@s.1 1 length=1","C","+","F")])
+		fwd,rev = os.path.join(self.tmpdir,"f.fq"),os.path.join(self.tmpdir,"r.fq")
+		fastq_utils.deinterleave(infile,[fwd],[rev])
+		self.assertEqual(open(rev).read(),"@s.1 1 length=1\nC\n+\nF\n")
+
+	def test_not_mates(self):
+		fwd,rev = [os.path.join(self.tmpdir,"f.fq")],[os.path.join(self.tmpdir,"r.fq")]
+		for recs in ([("@a/1","A","+","F"),("@b/2","A","+","F")],[("@a/1","A","+","F"),("@a/1","A","+","F")],[("@a/1","A","+","F")]):
+			self.assertRaises(ValueError,fastq_utils.deinterleave,self.write("il.fq",recs),fwd,rev)
+		fastq_utils.deinterleave(self.write("il.fq",[("@a/1","A","+","F"),("@b/2","A","+","F")]),fwd,rev,verify=False)
+
+	def test_interleave_roundtrip(self):
+		fwd = self.write("f.fq",[("@r{}/1".format(i),"ACGT","+","FFFF") for i in range(30)])
+		rev = self.write("r.fq",[("@r{}/2".format(i),"GG","+","##") for i in range(30)])
+		outfile = os.path.join(self.tmpdir,"il.fastq.gz")
+		self.assertEqual(fastq_utils.interleave(fwd,rev,outfile,batchSize=7),30)
+		fwdOut,revOut = os.path.join(self.tmpdir,"f2.fq"),os.path.join(self.tmpdir,"r2.fq")
+		self.assertEqual(fastq_utils.deinterleave(outfile,[fwdOut],[revOut]),30)
+		self.assertEqual(open(fwdOut).read(),open(fwd).read())
+		self.assertEqual(open(revOut).read(),open(rev).read())
+
+	def test_interleave_checks(self):
+		outfile = os.path.join(self.tmpdir,"il.fq")
+		fwd = self.write("f.fq",[("@a{}".format(i),"A","+","F") for i in range(10)])
+		rev = self.write("r.fq",[("@a{}".format(i),"A","+","F") for i in range(9)] + [("@x","A","+","F")])
+		self.assertRaises(ValueError,fastq_utils.interleave,fwd,rev,outfile)
+		#The mismatched last pair isn't among those sampled.
+		self.assertEqual(fastq_utils.interleave(fwd,rev,outfile,checkEvery=4),10)
+		short = self.write("s.fq",[("@a0","A","+","F")])
+		self.assertRaises(ValueError,fastq_utils.interleave,fwd,short,outfile)
+		self.assertRaises(ValueError,fastq_utils.interleave,short,fwd,outfile)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,79 @@
+import io
+import json
+import unittest
+
+from gbsc_utils import bgzf
+from gbsc_utils.fastq import fastq_validate
+from gbsc_utils.fastq.test import helpers
+
+class TestValidateFiles(helpers.TempDirTestCase):
+
+	def setUp(self):
+		super().setUp()
+		self.r1 = [("@r{} 1:N:0:ACGT".format(i),"ACGTN"[i % 5] * 20,"+","I" * 20) for i in range(3000)]
+		self.r2 = [("@r{} 2:N:0:ACGT".format(i),"ACGT"[i % 4] * 15,"+","#" * 15) for i in range(3000)]
+
+	def test_valid_pair(self):
+		files = [self.write("r1.fq",self.r1),self.write("r2.fq",self.r2)]
+		bgzf.recompress(files[1],files[1] + ".gz")
+		blockSize = fastq_validate.BLOCK_SIZE
+		fastq_validate.BLOCK_SIZE = 1000
+		try:
+			report = fastq_validate.validateFiles([files[0],files[1] + ".gz"],numProcs=3)
+		finally:
+			fastq_validate.BLOCK_SIZE = blockSize
+		self.assertTrue(report["valid"])
+		self.assertEqual(report["mates"],{"concordant": True})
+		r1,r2 = report["files"]
+		self.assertEqual((r1["reads"],r1["bases"],r1["length_range"],r1["quality_char_range"]),(3000,60000,[20,20],[73,73]))
+		self.assertEqual((r2["reads"],r2["length_range"],r2["encoding"],r2["errors"]),(3000,[15,15],"Phred+33",{}))
+		out = io.StringIO()
+		fastq_validate.writeReport(out,report)
+		self.assertEqual(json.loads(out.getvalue()),report)
+		self.assertEqual(out.getvalue().count("\n"),1)
+
+	def test_errors(self):
+		self.r1[10] = ("@r10","ACGTX","+","IIIII")
+		self.r1[20] = ("@r20","ACGT","+","III")
+		self.r1[30] = ("@r30","ACGT","+","II\x7fI")
+		self.r1[40] = ("@ r40","ACGT","+r41","IIII")
+		self.r1[2500] = ("@r2500","ACGT","+","I I ")
+		report = fastq_validate.validateFiles([self.write("r1.fq",self.r1)],numProcs=2)
+		self.assertFalse(report["valid"])
+		errors = report["files"][0]["errors"]
+		self.assertEqual(errors,{"sequence alphabet": 1,"sequence and quality lengths differ": 1,"quality range": 2,"title line": 1,"plus line": 1})
+		examples = dict((tuple(x[:2]),x[2]) for x in report["files"][0]["examples"])
+		self.assertEqual(examples[("sequence alphabet",10)],"@r10")
+		self.assertEqual(examples[("quality range",2500)],"@r2500")
+
+	def test_structure(self):
+		path = self.write("r1.fq",self.r1[:5])
+		with open(path,'a') as fout:
+			fout.write("@r5\nACGT\n+\n")
+		report = fastq_validate.validateFiles([path],numProcs=1)
+		self.assertEqual(report["files"][0]["errors"],{"truncated record": 1})
+		self.assertEqual(report["files"][0]["reads"],5)
+		path = self.write("r1.fq",self.r1[:5] + [("@r5","ACGT","IIII","@r6")] + self.r1[6:8])
+		report = fastq_validate.validateFiles([path],numProcs=1)
+		self.assertEqual(report["files"][0]["errors"],{"malformed record": 1})
+		self.assertFalse(report["files"][0]["complete"])
+		with open(path,'wb') as fout:
+			fout.write(helpers.fastqText(self.r1[:3]).replace("\n","\r\n").encode())
+		report = fastq_validate.validateFiles([path],numProcs=1)
+		self.assertEqual((report["files"][0]["errors"],report["files"][0]["reads"]),({"CR line endings": 1},3))
+
+	def test_discordant(self):
+		self.r2[1234] = ("@x 2:N:0:ACGT","A","+","I")
+		files = [self.write("r1.fq",self.r1),self.write("r2.fq",self.r2)]
+		report = fastq_validate.validateFiles(files,numProcs=2)
+		self.assertFalse(report["valid"])
+		self.assertEqual(report["mates"]["first_discordant"],{"record": 1234,"titles": ["@r1234 1:N:0:ACGT","@x 2:N:0:ACGT"]})
+		files[1] = self.write("r2.fq",self.r2[:-1])
+		self.assertEqual(fastq_validate.validateFiles(files,numProcs=2)["mates"]["first_discordant"]["record"],1234)
+		self.r2[1234] = ("@r1234/2","A","+","I")
+		files[1] = self.write("r2.fq",self.r2[:-1])
+		report = fastq_validate.validateFiles(files,numProcs=2)
+		self.assertEqual(report["mates"]["first_discordant"],{"record": 2999,"titles": ["@r2999 1:N:0:ACGT",None]})
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,104 @@
+import collections
+import io
+import pickle
+import random
+import unittest
+
+from gbsc_utils import kmers
+from gbsc_utils import nucleic
+from gbsc_utils.fasta import fasta
+from gbsc_utils.fastq.test import helpers
+
+def bruteForce(seqs,k,canonical=False):
+	counts = collections.Counter()
+	for seq in seqs:
+		for i in range(len(seq) - k + 1):
+			kmer = seq[i:i + k].upper()
+			if kmer.strip("ACGT"):
+				continue
+			if canonical:
+				kmer = min(kmer,nucleic.reverseComplement(kmer))
+			counts[kmer] += 1
+	return counts
+
+def counterDict(counter):
+	codes,counts = counter.counts()
+	return dict((kmers.decode(code,counter.k),int(count)) for code,count in zip(codes,counts))
+
+class TestKmerCounter(unittest.TestCase):
+
+	def setUp(self):
+		rand = random.Random(5)
+		self.seqs = ["".join(rand.choice("ACGTacgtN") for i in range(rand.randrange(0,80))) for j in range(200)]
+
+	def test_matches_brute_force(self):
+		for k,canonical in ((1,False),(3,True),(5,False),(15,False),(15,True)):
+			counter = kmers.KmerCounter(k,canonical)
+			for i in range(0,200,30):
+				counter.addSeqs([x.encode() for x in self.seqs[i:i + 30]])
+			self.assertEqual(counterDict(counter),bruteForce(self.seqs,k,canonical))
+			self.assertEqual(counter.numSeqs,200)
+
+	def test_long_sequence(self):
+		chunkSize = kmers.CHUNK_SIZE
+		kmers.CHUNK_SIZE = 64
+		try:
+			seq = self.seqs[0] * 10 + "".join(self.seqs[:20])
+			counter = kmers.KmerCounter(7).addSeqs([seq.encode()])
+		finally:
+			kmers.CHUNK_SIZE = chunkSize
+		self.assertEqual(counterDict(counter),bruteForce([seq],7))
+
+	def test_merge_and_spectrum(self):
+		counter = kmers.KmerCounter(3,canonical=True).addSeqs([b"AAAA",b"TTT"])
+		other = kmers.KmerCounter(3,canonical=True).addSeqs([b"ACGNACG"])
+		counter.merge(other)
+		self.assertEqual(counter["AAA"],3)
+		self.assertEqual(counter["TTT"],3)
+		self.assertEqual(counter["CGT"],2)
+		self.assertEqual(counter["CCC"],0)
+		self.assertEqual(counter.spectrum(),[(2,1),(3,1)])
+		self.assertEqual(counter.total(),5)
+		out = io.StringIO()
+		counter.writeCounts(out,top=1)
+		self.assertEqual(out.getvalue(),"AAA\t3\n")
+		self.assertRaises(ValueError,counter.merge,kmers.KmerCounter(3))
+
+	def test_pickle(self):
+		counter = kmers.KmerCounter(12).addSeqs([x.encode() for x in self.seqs])
+		state = pickle.loads(pickle.dumps(counter))
+		self.assertIsNone(state.dense)
+		self.assertEqual(counterDict(state),counterDict(counter))
+		merged = kmers.KmerCounter(12).merge(state).merge(counter).addSeqs([b"ACGTACGTACGT"])
+		self.assertEqual(merged["ACGTACGTACGT"],2 * counter["ACGTACGTACGT"] + 1)
+
+	def test_prefix(self):
+		counter = kmers.KmerCounter(2).addSeqs([b"ACGT",b"AC",b"A",b"NA"],prefixLength=2)
+		self.assertEqual(counterDict(counter),{"AC": 2})
+		self.assertEqual(counter.numSeqs,4)
+		self.assertEqual(counter.otherPrefixes,{"A": 1,"NA": 1})
+		counter.merge(kmers.KmerCounter(2).addSeqs([b"NAC"],prefixLength=2))
+		out = io.StringIO()
+		counter.writeCounts(out)
+		self.assertEqual(out.getvalue(),"A\t1\nAC\t2\nNA\t2\n")
+
+	def test_dinucleotideFreqs(self):
+		freqs = fasta.Rec(">a\nAAAC\nGT\n").dinucleotideFreqs()
+		self.assertEqual(len(freqs),16)
+		self.assertEqual((freqs["AA"],freqs["CG"],freqs["TT"]),("2","1","0"))
+
+class TestCountFiles(helpers.TempDirTestCase):
+
+	def test_files(self):
+		rand = random.Random(6)
+		seqs = ["".join(rand.choice("ACGT") for i in range(50)) for j in range(300)]
+		fq = self.write("reads.fq",[("@r{}".format(i),x,"+","I" * len(x)) for i,x in enumerate(seqs[:200])])
+		fa = self.write("seqs.fa","".join(">s{}\n{}\n{}\n".format(i,x[:30],x[30:]) for i,x in enumerate(seqs[200:])))
+		counter = kmers.countFiles([fq,fa],4,canonical=True,batchSize=17,numProcs=2)
+		self.assertEqual(counterDict(counter),bruteForce(seqs,4,True))
+		self.assertEqual(counter.numSeqs,300)
+		counter = kmers.scanFastq(fq,2,prefixLength=2,batchSize=17,numProcs=2)
+		self.assertEqual(counterDict(counter),collections.Counter(x[:2] for x in seqs[:200]))
+
+if __name__ == "__main__":
+	unittest.main()
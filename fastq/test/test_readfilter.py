@@ -0,0 +1,94 @@
+import io
+import os
+import unittest
+
+from gbsc_utils import codec
+from gbsc_utils import readfilter
+from gbsc_utils.fastq.test import helpers
+
+def batch(recs):
+	return readfilter.Batch([tuple(x.encode() for x in rec) for rec in recs],True)
+
+class TestPredicates(unittest.TestCase):
+
+	def setUp(self):
+		self.batch = batch([
+			("@r0/1","ACGTACGTAC","+","IIIIIIIIII"),
+			("@r1/1","NNNNA","+","#####"),
+			("@r2/1","","+",""),
+			("@r3/1","AAAAAAAAAAAAAAAAAAAA","+","IIIII#IIIIIIIIIIIIII"),
+		])
+
+	def test_length(self):
+		self.assertEqual(list(readfilter.LengthRange(5)(self.batch)),[True,True,False,True])
+		self.assertEqual(list(readfilter.LengthRange(1,10)(self.batch)),[True,True,False,False])
+
+	def test_quality(self):
+		self.assertEqual(list(readfilter.MeanQuality(30)(self.batch)),[True,False,False,True])
+		self.assertEqual(list(readfilter.MinQuality(30)(self.batch)),[True,False,True,False])
+
+	def test_n_fraction(self):
+		self.assertEqual(list(readfilter.MaxNFraction(0.5)(self.batch)),[True,False,True,True])
+
+	def test_dust(self):
+		#18 AAA trinucleotides score 18 * 17 / 2 / 17 = 9. ACGTACGTAC has 4 distinct trinucleotides, each twice, scoring 4 / 7.
+		self.assertEqual(list(readfilter.MaxDustScore(1)(self.batch)),[True,True,True,False])
+		self.assertEqual(list(readfilter.MaxDustScore(9)(self.batch)),[True,True,True,True])
+
+	def test_ids(self):
+		self.assertEqual(list(readfilter.IdSet(["r0","r3/2"])(self.batch)),[True,False,False,True])
+		self.assertEqual(list(readfilter.IdSet([b"r1"],exclude=True)(self.batch)),[True,False,True,True])
+
+	def test_record_predicate(self):
+		pred = readfilter.RecordPredicate("starts with A",lambda rec: rec[1].startswith(b"A"))
+		self.assertEqual(list(pred(self.batch)),[True,False,False,True])
+
+class TestFilterReads(helpers.TempDirTestCase):
+
+	def test_pairs_in_sync(self):
+		r1 = [("@r{} 1:N:0:A".format(i),"ACGT" * (i % 5),"+","I" * (4 * (i % 5))) for i in range(50)]
+		r2 = [("@r{} 2:N:0:A".format(i),"ACGTN"[i % 5] * 8,"+","I" * 8) for i in range(50)]
+		infiles = [self.write("r1.fq",r1),self.write("r2.fq",r2)]
+		outfiles = [os.path.join(self.tmpdir,"o1.fq"),os.path.join(self.tmpdir,"o2.fq.gz")]
+		preds = [readfilter.LengthRange(4),readfilter.MaxNFraction(0.1)]
+		stats = readfilter.filterReads(infiles,outfiles,preds,batchSize=7)
+		kept = [i for i in range(50) if i % 5 and i % 5 != 4]
+		self.assertEqual((stats.numReads,stats.numPassed),(50,len(kept)))
+		self.assertEqual(stats.rejects,{"length": 10,"N fraction": 10})
+		self.assertEqual(open(outfiles[0]).read(),helpers.fastqText([r1[i] for i in kept]))
+		with codec.openRead(outfiles[1],text=True) as fh:
+			self.assertEqual(fh.read(),helpers.fastqText([r2[i] for i in kept]))
+		report = io.StringIO()
+		stats.writeReport(report)
+		self.assertIn("Rejected (length)\t10\n",report.getvalue())
+
+	def test_parallel(self):
+		recs = [("@r{}".format(i),"ACGTN"[i % 5] * (i % 7),"+","I" * (i % 7)) for i in range(3000)]
+		infile = self.write("r1.fq",recs)
+		preds = [readfilter.LengthRange(2),readfilter.MaxNFraction(0.1)]
+		kept = [rec for i,rec in enumerate(recs) if i % 7 >= 2 and (i % 5 != 4 or not i % 7)]
+		for outfile in (os.path.join(self.tmpdir,"o.fq"),os.path.join(self.tmpdir,"o.fq.gz")):
+			stats = readfilter.filterReads([infile],[outfile],preds,batchSize=100,numProcs=3)
+			self.assertEqual((stats.numReads,stats.numPassed),(3000,len(kept)))
+			self.assertEqual(stats.rejects["length"],sum(1 for i in range(3000) if i % 7 < 2))
+			with codec.openRead(outfile,text=True) as fh:
+				self.assertEqual(fh.read(),helpers.fastqText(kept))
+
+	def test_mates_out_of_order(self):
+		infiles = [self.write("r1.fq","@a\nA\n+\nI\n@b\nA\n+\nI\n"),self.write("r2.fq","@b\nA\n+\nI\n@a\nA\n+\nI\n")]
+		outfiles = [os.path.join(self.tmpdir,x) for x in ("o1.fq","o2.fq")]
+		self.assertRaises(ValueError,readfilter.filterReads,infiles,outfiles,[])
+		infiles[1] = self.write("r2.fq","@a\nA\n+\nI\n")
+		self.assertRaises(ValueError,readfilter.filterReads,infiles,outfiles,[])
+
+	def test_fasta(self):
+		#The last record is kept, and the line wrapping is preserved.
+		infile = self.write("in.fa",">a desc\nACGT\nAC\n\n>b\nACG\n>c\nACGT\nAC")
+		outfile = os.path.join(self.tmpdir,"out.fa")
+		stats = readfilter.filterReads([infile],[outfile],[readfilter.LengthRange(6,6)])
+		self.assertEqual((stats.numReads,stats.numPassed),(3,2))
+		self.assertEqual(open(outfile).read(),">a desc\nACGT\nAC\n>c\nACGT\nAC\n")
+		self.assertRaises(ValueError,readfilter.filterReads,[infile],[outfile],[readfilter.MinQuality(20)])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -55,6 +55,41 @@ def getBarcodeFromSampleNumber(sampleSheet,sampleNumber):
 			return barcode
 
 
+def readSampleSheet(sampleSheet):
+	"""
+	Function : Reads the [Data] section of a sample sheet formatted for the v2 (bcl2fastq) demultiplexer. Only the section's header line is relied upon,
+	           so the columns may come in any order and the other sections are ignored. Missing columns are read as empty.
+	Args     : sampleSheet - path to the SampleSheet.
+	Returns  : list of dicts, one per sample row, in sample sheet order. Each has the keys Sample_Project, Lane, Sample_ID, Sample_Name, index and index2,
+	           along with any other columns. The indices are upper cased, and Lane is an int, or None if the sample sheet has no lanes.
+	"""
+	with open(sampleSheet) as fh:
+		lines = [line.strip() for line in fh]
+	try:
+		start = next(i for i,line in enumerate(lines) if line.startswith("[Data]")) + 1
+	except StopIteration:
+		raise ValueError("SampleSheet {ss} doesn't have a [Data] section.".format(ss=sampleSheet))
+	rows = []
+	header = None
+	for line in lines[start:]:
+		if line.startswith("["):
+			break
+		if not line.strip(","):
+			continue
+		fields = [x.strip() for x in line.split(",")]
+		if header is None:
+			header = fields
+			continue
+		row = dict(zip(header,fields))
+		for column in ("Sample_Project","Lane","Sample_ID","Sample_Name","index","index2"):
+			row.setdefault(column,"")
+		row["index"] = row["index"].upper()
+		row["index2"] = row["index2"].upper()
+		row["Lane"] = int(row["Lane"]) if row["Lane"] else None
+		rows.append(row)
+	return rows
+
+
 if __name__ == "__main__":
 	import sys
 	getBarcodeFromSampleNumber(sys.argv[1], sys.argv[2])
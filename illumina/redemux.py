@@ -0,0 +1,395 @@
+"""
+Re-demultiplexes FASTQ files, such as the Undetermined files of a bcl2fastq2 run, against the samples of a v2 sample sheet (see demux.readSampleSheet()),
+with a chosen mismatch tolerance. The index reads are read from the ends of the title lines (e.g. '1:N:0:ACGTACGT+TTGCCAAG'), or from I1 and I2 files.
+
+For each lane, an IndexLookup is built for each index read, holding every variant of each of the lane's index sequences within the mismatch tolerance.
+As with bcl2fastq2, the tolerance is per index read. A variant that is within the tolerance of two index sequences would make the assignment ambiguous,
+so it is rejected when the lookup is built. Assigning a read is then a dict lookup per index. The reads are read in batches in this process, and the
+batches are assigned and gzip compressed in a process pool. The compressed batches are appended to the per-sample output files, which are named and
+placed as V2 in demultiplexing.py expects, i.e. <Sample_Project>/<SampleName>_S1_L001_R1_001.fastq.gz.
+"""
+
+import os
+import gzip
+import itertools
+import collections
+import multiprocessing
+
+from gbsc_utils import codec
+from gbsc_utils.fastq import fastq_utils
+from gbsc_utils.illumina import demux
+
+#: Highest mismatch tolerance per index read.
+MAX_MISMATCHES = 2
+#: Number of reads per batch.
+BATCH_SIZE = 20000
+#: gzip compression level of the output files.
+COMPRESS_LEVEL = 4
+#: Sample index of the undetermined reads.
+UNDETERMINED = -1
+
+def indexVariants(index,mismatches):
+	"""
+	Function : Generates the variants of an index sequence that have up to the given number of mismatches, where a mismatch is a substitution by
+	           another of A, C, G, T and N.
+	Args     : index - bytes.
+	           mismatches - int.
+	Returns  : generator of two item tuples of (variant,number of mismatches), starting with (index,0).
+	"""
+	for numMismatches in range(mismatches + 1):
+		for positions in itertools.combinations(range(len(index)),numMismatches):
+			choices = [[x for x in b"ACGTN" if x != index[pos]] for pos in positions]
+			for bases in itertools.product(*choices):
+				variant = bytearray(index)
+				for pos,base in zip(positions,bases):
+					variant[pos] = base
+				yield bytes(variant),numMismatches
+
+class IndexLookup:
+	"""
+	A lookup of the variants of the distinct index sequences of one index read. Variants within the tolerance of two index sequences are rejected, so that
+	reads with them are undetermined. An index sequence itself is never rejected, though it may be within the tolerance of another.
+	"""
+	def __init__(self,indexes,mismatches=1,strict=False):
+		"""
+		Args : indexes - list of distinct str index sequences, all of the same length.
+		       mismatches - int. The mismatch tolerance, at most MAX_MISMATCHES.
+		       strict - bool. True means to raise a ValueError if any variants collide, as bcl2fastq2 does, rather than rejecting them.
+		"""
+		if not 0 <= mismatches <= MAX_MISMATCHES:
+			raise ValueError("The mismatch tolerance must be between 0 and {}, not {}.".format(MAX_MISMATCHES,mismatches))
+		self.indexes = [x.upper().encode() for x in indexes]
+		lengths = set(len(x) for x in self.indexes)
+		if len(lengths) != 1:
+			raise ValueError("The index sequences {} don't all have the same length.".format(", ".join(indexes)))
+		self.length = lengths.pop()
+		#: dict of variant to a two item tuple of (position in self.indexes,number of mismatches).
+		self.table = dict((x,(pos,0)) for pos,x in enumerate(self.indexes))
+		if len(self.table) != len(self.indexes):
+			raise ValueError("The index sequences {} aren't distinct.".format(", ".join(indexes)))
+		#: dict of each rejected variant (or index sequence within the tolerance of another) to the set of positions of the index sequences it is close to.
+		self.collisions = {}
+		for pos,index in enumerate(self.indexes):
+			for variant,numMismatches in itertools.islice(indexVariants(index,mismatches),1,None):
+				hit = self.table.get(variant)
+				if hit is None:
+					self.table[variant] = (pos,numMismatches)
+				elif hit[0] != pos:
+					self.collisions.setdefault(variant,set([hit[0]])).add(pos)
+		for variant in self.collisions:
+			if self.table[variant][1]:
+				del self.table[variant]
+		if strict and self.collisions:
+			pairs = sorted(set(tuple(sorted(x)) for x in self.collisions.values()))
+			raise ValueError("Index sequences collide with {} mismatches: {}.".format(mismatches,", ".join(" and ".join(self.indexes[i].decode() for i in x) for x in pairs)))
+
+	def get(self,index):
+		"""
+		Function : Looks up the index read of a read. It is trimmed to the length of the index sequences first, as bcl2fastq2 does.
+		Args     : index - bytes.
+		Returns  : two item tuple of (position in self.indexes,number of mismatches), or None.
+		"""
+		return self.table.get(index[:self.length])
+
+class SampleLookup:
+	"""
+	Assigns reads to the samples of one lane by their index reads.
+	"""
+	def __init__(self,samples,mismatches=(1,1),strict=False):
+		"""
+		Args : samples - list of two item tuples of (sample,row), where sample is a number that identifies the sample and row is its sample sheet row.
+		       mismatches - two item tuple of the mismatch tolerances of the first and second index reads.
+		       strict - bool. See IndexLookup.
+		"""
+		self.default = None
+		self.index1 = None
+		self.index2 = None
+		self.pairs = {}
+		if len(samples) == 1 and not samples[0][1]["index"]:
+			#An unindexed lane, whose reads all belong to its sample.
+			self.default = samples[0][0]
+			return
+		if not all(row["index"] for sample,row in samples):
+			raise ValueError("A lane with more than one sample can't have samples without an index.")
+		dual = set(bool(row["index2"]) for sample,row in samples)
+		if len(dual) != 1:
+			raise ValueError("The samples of a lane must either all have an index2 or none have.")
+		index1 = list(collections.OrderedDict.fromkeys(row["index"] for sample,row in samples))
+		self.index1 = IndexLookup(index1,mismatches[0],strict)
+		if dual.pop():
+			index2 = list(collections.OrderedDict.fromkeys(row["index2"] for sample,row in samples))
+			self.index2 = IndexLookup(index2,mismatches[1],strict)
+		for sample,row in samples:
+			key = (index1.index(row["index"]),index2.index(row["index2"]) if self.index2 else None)
+			if key in self.pairs:
+				raise ValueError("Samples {} and {} have the same indices.".format(self.pairs[key],sample))
+			self.pairs[key] = sample
+
+	def assign(self,index1,index2=b""):
+		"""
+		Function : Assigns a read to a sample.
+		Args     : index1 - bytes. The first index read.
+		           index2 - bytes. The second index read.
+		Returns  : two item tuple of (sample,number of mismatches), where sample is UNDETERMINED if the read can't be assigned.
+		"""
+		if self.default is not None:
+			return self.default,0
+		hit1 = self.index1.get(index1)
+		if hit1 is None:
+			return UNDETERMINED,0
+		if self.index2 is None:
+			return self.pairs[(hit1[0],None)],hit1[1]
+		hit2 = self.index2.get(index2)
+		if hit2 is None:
+			return UNDETERMINED,0
+		return self.pairs.get((hit1[0],hit2[0]),UNDETERMINED),hit1[1] + hit2[1]
+
+def headerLane(attLine):
+	"""
+	Function : Parses the lane out of a Casava 1.8+ title line, e.g. 6 for '@MONK:315:C2PWKACXX:6:1101:1458:1967 1:N:0:CGTACTAG'.
+	Returns  : int, or None if the title line doesn't have a lane.
+	"""
+	fields = attLine.split(b":",4)
+	if len(fields) == 5 and fields[3].isdigit():
+		return int(fields[3])
+	return None
+
+def headerIndexes(attLine):
+	"""
+	Function : Parses the index reads out of the end of a Casava 1.8+ title line, e.g. (b'ACGTACGT',b'TTGCCAAG') for '... 1:N:0:ACGTACGT+TTGCCAAG'.
+	Returns  : two item tuple of bytes. The second is empty for a single-indexed read.
+	"""
+	indexes = attLine.rstrip().rsplit(b":",1)[-1].split(b"+")
+	return indexes[0],indexes[1] if len(indexes) > 1 else b""
+
+class Demultiplexer:
+	"""
+	Demultiplexes the reads of a run, one lane or several, against a sample sheet. The samples are numbered as bcl2fastq2 numbers them, in the order
+	that their Sample_IDs first appear in the sample sheet, with S0 for the undetermined reads and unindexed samples.
+	"""
+	def __init__(self,sampleSheet,mismatches=1,strict=False):
+		"""
+		Args : sampleSheet - path to the v2 sample sheet.
+		       mismatches - int, or two item tuple of int. The mismatch tolerance of each index read.
+		       strict - bool. See IndexLookup.
+		"""
+		if isinstance(mismatches,int):
+			mismatches = (mismatches,mismatches)
+		self.rows = demux.readSampleSheet(sampleSheet)
+		sampleNumbers = {}
+		self.numbers = []
+		for row in self.rows:
+			if not row["index"]:
+				self.numbers.append(0)
+			else:
+				self.numbers.append(sampleNumbers.setdefault(row["Sample_ID"],len(sampleNumbers) + 1))
+		lanes = collections.OrderedDict()
+		for sample,row in enumerate(self.rows):
+			lanes.setdefault(row["Lane"],[]).append((sample,row))
+		#: dict of lane (None for a sample sheet without lanes) to its SampleLookup.
+		self.lookups = dict((lane,SampleLookup(samples,mismatches,strict)) for lane,samples in lanes.items())
+
+	def lookup(self,lane):
+		"""
+		Function : Gets the SampleLookup of a lane.
+		Returns  : SampleLookup, or None if the sample sheet has no samples in the lane.
+		"""
+		return self.lookups.get(lane,self.lookups.get(None))
+
+	def fastqPath(self,outdir,sample,lane,read):
+		"""
+		Function : Gets the path to a FASTQ file of a sample, named and placed as V2 in demultiplexing.py expects. The file is in the Sample_Project directory,
+		           in a subdirectory named after the Sample_ID if the Sample_Name is different, in which case the file is named after the Sample_ID.
+		Args     : outdir - The output directory.
+		           sample - int. The sample's row in self.rows, or UNDETERMINED.
+		           lane - int. The lane, or None for lane 1.
+		           read - str. R1, R2, I1 or I2.
+		Returns  : str.
+		"""
+		suffix = "_L{lane:03d}_{read}_001.fastq.gz".format(lane=lane or 1,read=read)
+		if sample == UNDETERMINED:
+			return os.path.join(outdir,"Undetermined_S0" + suffix)
+		row = self.rows[sample]
+		path = os.path.join(outdir,row["Sample_Project"])
+		name = row["Sample_Name"]
+		if row["Sample_ID"] != name:
+			path = os.path.join(path,row["Sample_ID"])
+			name = row["Sample_ID"]
+		return os.path.join(path,"{name}_S{num}{suffix}".format(name=name,num=self.numbers[sample],suffix=suffix))
+
+class DemuxStats:
+	"""
+	Per-lane counts of the reads assigned to each sample.
+	"""
+	def __init__(self):
+		#: collections.Counter of (lane,sample,number of mismatches) to reads.
+		self.counts = collections.Counter()
+
+	def update(self,counts):
+		self.counts.update(counts)
+
+	def writeReport(self,fout,demultiplexer):
+		"""
+		Function : Writes a tab-delimited report with a row for each sample and lane, with the undetermined reads last in each lane.
+		Args     : fout - A text file handle.
+		           demultiplexer - The Demultiplexer whose samples were counted.
+		"""
+		laneTotals = collections.Counter()
+		samples = collections.defaultdict(collections.Counter)
+		for (lane,sample,numMismatches),count in self.counts.items():
+			laneTotals[lane] += count
+			samples[(lane,sample)][numMismatches] += count
+		fout.write("Lane\tSample_Project\tSample_ID\tBarcode\tReads\t% of lane\t% perfect barcode\t% one mismatch barcode\n")
+		for lane in sorted(laneTotals,key=lambda x: (x is None,x)):
+			keys = sorted((key for key in samples if key[0] == lane),key=lambda x: (x[1] == UNDETERMINED,x[1]))
+			for key in keys:
+				counts = samples[key]
+				total = sum(counts.values())
+				if key[1] == UNDETERMINED:
+					fields = ["","Undetermined","unknown"]
+				else:
+					row = demultiplexer.rows[key[1]]
+					fields = [row["Sample_Project"],row["Sample_ID"],"+".join(x for x in (row["index"],row["index2"]) if x)]
+				percents = ["{:.2f}".format(100.0 * x / y) for x,y in ((total,laneTotals[lane]),(counts[0],total),(counts[1],total))]
+				fout.write("\t".join([str(lane or "")] + fields + [str(total)] + percents) + "\n")
+
+_worker = {}
+
+def _initWorker(demultiplexer,lane,level):
+	_worker["demultiplexer"] = demultiplexer
+	_worker["lane"] = lane
+	_worker["level"] = level
+
+def _demuxBatch(batch):
+	"""
+	Function : Assigns a batch of reads to samples and gzip compresses them. Runs in a worker process set up by _initWorker().
+	Args     : batch - two item tuple of the list of read tuples, each with a record per reads file, and the list of the index read tuples, each with a
+	           record per index read file (or empty, to read the indexes from the title lines).
+	Returns  : two item tuple of the dict of (lane,sample) to a list of the compressed records for each reads file, and a collections.Counter of
+	           (lane,sample,number of mismatches) to reads.
+	"""
+	reads,indexReads = batch
+	demultiplexer = _worker["demultiplexer"]
+	fixedLane = _worker["lane"]
+	groups = collections.defaultdict(list)
+	counts = collections.Counter()
+	lookups = {}
+	for i,recs in enumerate(reads):
+		attLine = recs[0][0]
+		lane = fixedLane or headerLane(attLine)
+		if lane not in lookups:
+			lookups[lane] = demultiplexer.lookup(lane)
+		lookup = lookups[lane]
+		if lookup is None:
+			sample,numMismatches = UNDETERMINED,0
+		elif indexReads:
+			sample,numMismatches = lookup.assign(*[x[1] for x in indexReads[i]])
+		else:
+			sample,numMismatches = lookup.assign(*headerIndexes(attLine))
+		groups[(lane,sample)].append(i)
+		counts[(lane,sample,numMismatches)] += 1
+	nl = b"\n"
+	level = _worker["level"]
+	compressed = {}
+	for key,positions in groups.items():
+		outputs = []
+		for readNum in range(len(reads[0])):
+			outputs.append(gzip.compress(b"".join(nl.join(reads[i][readNum]) + nl for i in positions),level))
+		for readNum in range(len(indexReads[0]) if indexReads else 0):
+			outputs.append(gzip.compress(b"".join(nl.join(indexReads[i][readNum]) + nl for i in positions),level))
+		compressed[key] = outputs
+	return compressed,counts
+
+def _batches(readFiles,indexFiles,batchSize):
+	"""
+	Function : Reads the reads and index read files in step, and yields them in batches for _demuxBatch().
+	Raises   : ValueError - The files don't have the same number of records.
+	"""
+	handles = [codec.openRead(x) for x in readFiles + indexFiles]
+	try:
+		recs = itertools.zip_longest(*[fastq_utils.blockparse(fh) for fh in handles])
+		numReadFiles = len(readFiles)
+		while True:
+			batch = list(itertools.islice(recs,batchSize))
+			if not batch:
+				return
+			if None in batch[-1]:
+				raise ValueError("The files {} don't have the same number of records.".format(", ".join(readFiles + indexFiles)))
+			yield [x[:numReadFiles] for x in batch],[x[numReadFiles:] for x in batch] if indexFiles else []
+	finally:
+		for fh in handles:
+			fh.close()
+
+def demultiplex(demultiplexer,readFiles,outdir,indexFiles=None,lane=None,numProcs=None,batchSize=BATCH_SIZE,level=COMPRESS_LEVEL):
+	"""
+	Function : Demultiplexes the reads of one or more reads files that are in step, e.g. R1 and R2, into a gzip compressed FASTQ file per sample and lane
+	           and reads file. Reads that can't be assigned go to Undetermined_S0 files. Output files are only made for the samples that have reads.
+	           The index read files, if given, are also split by sample, and named with I1 and I2.
+	Args     : demultiplexer - Demultiplexer.
+	           readFiles - list of FASTQ files, e.g. R1 and R2.
+	           outdir - The output directory.
+	           indexFiles - list of one or two FASTQ files of the index reads. If not set, the index reads are read from the ends of the title lines.
+	           lane - int. The lane of the reads. If not set, the lane of each read is read from its title line.
+	           numProcs - int. The number of worker processes. Defaults to the number of CPUs.
+	           batchSize - int. The number of reads per batch.
+	           level - int. The gzip compression level.
+	Returns  : DemuxStats.
+	"""
+	indexFiles = indexFiles or []
+	readNames = ["R{}".format(i + 1) for i in range(len(readFiles))] + ["I{}".format(i + 1) for i in range(len(indexFiles))]
+	numProcs = numProcs or multiprocessing.cpu_count()
+	stats = DemuxStats()
+	fouts = {}
+	batches = _batches(readFiles,indexFiles,batchSize)
+	pool = None
+	if numProcs == 1:
+		_initWorker(demultiplexer,lane,level)
+		results = map(_demuxBatch,batches)
+	else:
+		pool = multiprocessing.Pool(numProcs,initializer=_initWorker,initargs=(demultiplexer,lane,level))
+		results = pool.imap(_demuxBatch,batches)
+	try:
+		for compressed,counts in results:
+			stats.update(counts)
+			for (readLane,sample),outputs in compressed.items():
+				for readName,data in zip(readNames,outputs):
+					key = (readLane,sample,readName)
+					if key not in fouts:
+						path = demultiplexer.fastqPath(outdir,sample,readLane,readName)
+						if not os.path.isdir(os.path.dirname(path)):
+							os.makedirs(os.path.dirname(path))
+						fouts[key] = open(path,'wb')
+					fouts[key].write(data)
+	finally:
+		if pool is not None:
+			pool.terminate()
+			pool.join()
+		for fout in fouts.values():
+			fout.close()
+	return stats
+
+if __name__ == "__main__":
+	import sys
+	from argparse import ArgumentParser
+	parser = ArgumentParser(description="Demultiplexes FASTQ files, such as the Undetermined files of a run, against a bcl2fastq2 sample sheet, into per-sample gzip compressed FASTQ files named as bcl2fastq2 names them. Run as python -m gbsc_utils.illumina.redemux.")
+	parser.add_argument('-s','--samplesheet',required=True,help="The v2 sample sheet.")
+	parser.add_argument('-r','--reads',required=True,nargs="+",help="The reads FASTQ files, e.g. R1 and R2, whose reads are in the same order.")
+	parser.add_argument('-i','--index',nargs="+",default=[],help="The I1 (and I2) index read FASTQ files. By default, the index reads are read from the ends of the title lines.")
+	parser.add_argument('-o','--outdir',required=True,help="The output directory.")
+	parser.add_argument('-m','--barcode-mismatches',default="1",help="The mismatch tolerance of the index reads, at most 2. Give two comma-separated values for different tolerances for index and index2. Default is %(default)s.")
+	parser.add_argument('-l','--lane',type=int,help="The lane of the reads. By default, the lane is read from the title line of each read.")
+	parser.add_argument('--strict',action="store_true",help="Fail if index sequences are close enough to collide, as bcl2fastq2 does, rather than leaving the reads with colliding index reads undetermined.")
+	parser.add_argument('-p','--procs',type=int,help="The number of worker processes. Defaults to the number of CPUs.")
+	parser.add_argument('--stats',help="The file to write the per-lane assignment stats to. Defaults to stdout.")
+	args = parser.parse_args()
+	if len(args.index) > 2:
+		parser.error("At most two index read files can be given.")
+	mismatches = tuple(int(x) for x in args.barcode_mismatches.split(","))
+	if len(mismatches) == 1:
+		mismatches = mismatches * 2
+	demultiplexer = Demultiplexer(args.samplesheet,mismatches,args.strict)
+	stats = demultiplex(demultiplexer,args.reads,args.outdir,indexFiles=args.index,lane=args.lane,numProcs=args.procs)
+	fout = open(args.stats,'w') if args.stats else sys.stdout
+	stats.writeReport(fout,demultiplexer)
+	if args.stats:
+		fout.close()
@@ -0,0 +1,112 @@
+import gzip
+import io
+import os
+import unittest
+
+from gbsc_utils.fastq.test import helpers
+from gbsc_utils.illumina import redemux
+
+SAMPLE_SHEET = """[Header]
+Date,2016-03-11
+
+[Data]
+Sample_Project,Lane,Sample_ID,Sample_Name,index,index2
+P1,1,s1,s1,AAAAAA,CCCC
+P1,1,s2,s2,AAAAAA,GGGG
+P2,1,s3,name3,TTTTTT,CCCC
+P1,2,s1,s1,AAAAAA,CCCC
+"""
+
+class TestIndexLookup(unittest.TestCase):
+
+	def test_variants(self):
+		variants = list(redemux.indexVariants(b"ACGT",2))
+		self.assertEqual(variants[0],(b"ACGT",0))
+		self.assertEqual(len(variants),1 + 4 * 4 + 6 * 16)
+		self.assertEqual(len(set(variants)),len(variants))
+
+	def test_collisions(self):
+		lookup = redemux.IndexLookup(["AAAAAA","AAAATT"],mismatches=1)
+		self.assertEqual(lookup.get(b"AAAAAC"),(0,1))
+		self.assertEqual(lookup.get(b"AAAATTGG"),(1,0))
+		#AAAAAT is one mismatch from both.
+		self.assertIsNone(lookup.get(b"AAAAAT"))
+		self.assertEqual(lookup.collisions,{b"AAAAAT": {0,1},b"AAAATA": {0,1}})
+		self.assertRaises(ValueError,redemux.IndexLookup,["AAAAAA","AAAATT"],1,True)
+		lookup = redemux.IndexLookup(["AAAAAA","AAAATT"],mismatches=0,strict=True)
+		self.assertIsNone(lookup.get(b"AAAAAC"))
+
+	def test_sample_lookup(self):
+		rows = [{"index": "AAAAAA","index2": "CCCC"},{"index": "AAAAAA","index2": "GGGG"},{"index": "TTTTTT","index2": "CCCC"}]
+		lookup = redemux.SampleLookup(list(enumerate(rows)),mismatches=(1,1))
+		self.assertEqual(lookup.assign(b"AAAAAA",b"GGGA"),(1,1))
+		self.assertEqual(lookup.assign(b"TTTTTA",b"CCCA"),(2,2))
+		self.assertEqual(lookup.assign(b"TTTTTT",b"GGGG"),(redemux.UNDETERMINED,0))
+		self.assertEqual(lookup.assign(b"AAAAAA"),(redemux.UNDETERMINED,0))
+		rows[1]["index2"] = "CCCC"
+		self.assertRaises(ValueError,redemux.SampleLookup,list(enumerate(rows)))
+
+class TestDemultiplex(helpers.TempDirTestCase):
+
+	def setUp(self):
+		super().setUp()
+		self.outdir = os.path.join(self.tmpdir,"out")
+		self.sampleSheet = self.write("SampleSheet.csv",SAMPLE_SHEET)
+		self.reads = [
+			(1,"AAAAAA","CCCC"),
+			(1,"AAAAAT","CCCC"),
+			(1,"AAAAAA","GGGC"),
+			(1,"TTTTTT","CCCC"),
+			(1,"GGGGGG","CCCC"),
+			(2,"AAAAAA","CCCC"),
+			(2,"TTTTTT","CCCC"),
+			(1,"AAAAAA","CCCC"),
+		]
+
+	def records(self,readNum,indexes):
+		recs = []
+		for i,(lane,index1,index2) in enumerate(self.reads):
+			attLine = "@M:1:FC:{lane}:1:1:{i} {num}:N:0:{index}".format(lane=lane,i=i,num=readNum,index=index1 + "+" + index2 if indexes else "1")
+			recs.append((attLine,"ACGT"[i % 4] * 5,"+","IIIII"))
+		return recs
+
+	def ids(self,path):
+		with gzip.open(path,'rt') as fh:
+			return [int(line.split()[0].rsplit(":",1)[-1]) for line in fh.readlines()[::4]]
+
+	def test_headers(self):
+		readFiles = [self.write("r1.fq",self.records(1,True)),self.write("r2.fq",self.records(2,True))]
+		demultiplexer = redemux.Demultiplexer(self.sampleSheet,mismatches=1)
+		stats = redemux.demultiplex(demultiplexer,readFiles,self.outdir,numProcs=2,batchSize=3)
+		self.assertEqual(self.ids(os.path.join(self.outdir,"P1","s1_S1_L001_R1_001.fastq.gz")),[0,1,7])
+		self.assertEqual(self.ids(os.path.join(self.outdir,"P1","s1_S1_L001_R2_001.fastq.gz")),[0,1,7])
+		self.assertEqual(self.ids(os.path.join(self.outdir,"P1","s2_S2_L001_R1_001.fastq.gz")),[2])
+		#Sample_ID and Sample_Name differ, so the files are in a Sample_ID directory and are named after it.
+		self.assertEqual(self.ids(os.path.join(self.outdir,"P2","s3","s3_S3_L001_R1_001.fastq.gz")),[3])
+		self.assertEqual(self.ids(os.path.join(self.outdir,"Undetermined_S0_L001_R1_001.fastq.gz")),[4])
+		self.assertEqual(self.ids(os.path.join(self.outdir,"P1","s1_S1_L002_R1_001.fastq.gz")),[5])
+		self.assertEqual(self.ids(os.path.join(self.outdir,"Undetermined_S0_L002_R2_001.fastq.gz")),[6])
+		report = io.StringIO()
+		stats.writeReport(report,demultiplexer)
+		lines = report.getvalue().splitlines()
+		self.assertEqual(lines[1],"1\tP1\ts1\tAAAAAA+CCCC\t3\t50.00\t66.67\t33.33")
+		self.assertEqual(lines[4],"1\t\tUndetermined\tunknown\t1\t16.67\t100.00\t0.00")
+		self.assertEqual(len(lines),7)
+
+	def test_index_files(self):
+		readFiles = [self.write("r1.fq",self.records(1,False))]
+		indexFiles = []
+		for num in (1,2):
+			recs = [("@i{}".format(i),x[num],"+","I" * len(x[num])) for i,x in enumerate(self.reads)]
+			indexFiles.append(self.write("i{}.fq".format(num),recs))
+		demultiplexer = redemux.Demultiplexer(self.sampleSheet,mismatches=0)
+		stats = redemux.demultiplex(demultiplexer,readFiles,self.outdir,indexFiles=indexFiles,lane=1,numProcs=1)
+		self.assertEqual(self.ids(os.path.join(self.outdir,"P1","s1_S1_L001_R1_001.fastq.gz")),[0,5,7])
+		self.assertEqual(self.ids(os.path.join(self.outdir,"Undetermined_S0_L001_R1_001.fastq.gz")),[1,2,4])
+		with gzip.open(os.path.join(self.outdir,"P1","s1_S1_L001_I2_001.fastq.gz"),'rt') as fh:
+			self.assertEqual(fh.read().splitlines()[1],"CCCC")
+		self.assertEqual(sum(stats.counts.values()),8)
+		self.assertRaises(ValueError,redemux.demultiplex,demultiplexer,readFiles,self.outdir,indexFiles[:1] + [self.write("short.fq",[("@a","A","+","I")])])
+
+if __name__ == "__main__":
+	unittest.main()
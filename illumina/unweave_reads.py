@@ -9,12 +9,17 @@
 from argparse import ArgumentParser
 import os
 
+from gbsc_utils import codec
 from gbsc_utils.fastq import fastq_utils
 
-description = "De-interleaves an interleaved Illumina FASTQ file. The separated files will be written to the specified output directory. The forward reads file will be named the same as the interleaved file, but with '_1' added prior to the file suffix. The reverse reads FASTQ file will have '_2' added prior to the file extension."
+description = "De-interleaves an interleaved Illumina FASTQ file, in which each read is adjacent to its mate. Which mate is the forward read is determined from the read number in the title line (the '1' or '2' of a Casava 1.8+ title line, or a '/1' or '/2' seqid suffix), or by position when the title lines have no read number. The separated files will be written to the specified output directory. The forward reads file will be named the same as the interleaved file, but with '_1' added prior to the file suffix. The reverse reads FASTQ file will have '_2' added prior to the file extension. Output files are compressed when the input file is, or with --gzip."
 parser = ArgumentParser(description=description)
-parser.add_argument('-i',"--infile",required=True,help="The interleaved FASTQ file.")
+parser.add_argument('-i',"--infile",required=True,help="The interleaved FASTQ file. May be compressed.")
 parser.add_argument('-o',"--outdir",required=True,help="The output directory. If the directory doesn't already exist, it will be recursively created.")
+parser.add_argument('-n',"--shards",type=int,default=1,help="The number of pairs of output files to split the reads into. With more than one, '_<shard number>' is added prior to the '_1' and '_2'. Default is %(default)s.")
+parser.add_argument('-z',"--gzip",action="store_true",help="gzip (BGZF) the output files even if the input file isn't compressed.")
+parser.add_argument('-t',"--threads",type=int,help="The number of compression threads per output file. Defaults to the number of CPUs.")
+parser.add_argument("--no-verify",action="store_true",help="Don't check that adjacent reads are mates.")
 
 args = parser.parse_args()
 outdir = args.outdir
@@ -22,42 +27,20 @@ if not os.path.isdir(outdir):
 	os.makedirs(outdir)
 
 infile = args.infile
-infile_basename = os.path.basename(infile)
-infile_ext = os.path.splitext(infile_basename)[1]
-
-forward_outfile = os.path.splitext(infile_basename)[0] + "_1" + infile_ext
-forward_outfile = os.path.join(outdir,forward_outfile)
-forward_fout = open(forward_outfile,'w')
-reverse_outfile = os.path.splitext(infile_basename)[0] + "_2" + infile_ext
-reverse_outfile = os.path.join(outdir,reverse_outfile)
-reverse_fout = open(reverse_outfile,'w')
-
-read_num_cycle = 0
-
-def processRec(rec):
-	global forward_fout
-	global reverse_fout
-	global read_num_cycle
-	att_line_dict = fastq_utils.parseIlluminaFastqAttLine(rec[0])
-	read_num = int(att_line_dict["readNumber"])
-	if read_num_cycle == read_num:
-		raise Exception("Read {att_line} with read number {read_num} was preceeded by a record with the same read number.".format(att_line=rec[0],read_num=read_num))
-	read_num_cycle = read_num
-	if read_num == 1:
-		forward_fout.write("".join(rec))
-	else:
-		reverse_fout.write("".join(rec))
-
-line_count = 0
-rec = []
-fh = open(infile,'r')
-for line in fh:
-	line_count += 1
-	rec.append(line)
-	if line_count == 4:
-		line_count = 0
-		processRec(rec)
-		rec = []
-	
-forward_fout.close()
-reverse_fout.close()
+infile_basename,infile_ext = os.path.splitext(os.path.basename(infile))
+if infile_ext in codec.WRITE_EXTENSIONS:
+	#Add the suffixes before the FASTQ extension too, i.e. reads_1.fastq.gz rather than reads.fastq_1.gz.
+	infile_basename,fastq_ext = os.path.splitext(infile_basename)
+	infile_ext = fastq_ext + infile_ext
+elif args.gzip:
+	infile_ext += ".gz"
+
+forward_outfiles = []
+reverse_outfiles = []
+for shard in range(args.shards):
+	prefix = infile_basename if args.shards == 1 else "{base}_{shard}".format(base=infile_basename,shard=shard + 1)
+	forward_outfiles.append(os.path.join(outdir,prefix + "_1" + infile_ext))
+	reverse_outfiles.append(os.path.join(outdir,prefix + "_2" + infile_ext))
+
+num_pairs = fastq_utils.deinterleave(infile,forward_outfiles,reverse_outfiles,verify=not args.no_verify,threads=args.threads)
+print("Wrote {num_pairs} read pairs to {outdir}.".format(num_pairs=num_pairs,outdir=outdir))
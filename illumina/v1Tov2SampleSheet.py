@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+from gbsc_utils import nucleic
+
 
 #platforms are defined in the RAILS helper solexa_sequencer_type.rb in UHTS
 HISEQ2000 = "hiseq2000"
@@ -9,25 +11,6 @@ HISEQ4000 = "hiseq4000"
 PLATFORMS = [HISEQ2000,HISEQ4000,MISEQ]
 
 
-def revcomp(dna):
-	"""
-	Function : Reverse complement DNA.
-	Args     : dna - str.
-	Returns  : str.
-	"""
-	#define converstion table ct
-	dna = dna.upper()
-	ct = {
-		"A": "T",
-		"C": "G",
-		"G": "C",
-		"T": "A"
-	}
-	rc = ""
-	for i in dna[::-1]:
-		rc += ct[i]
-	return rc
-		
 def convertLine(platform,line):
 	"""
 	Function : Converts a v1 line to a v2 line.
@@ -49,7 +32,7 @@ def convertLine(platform,line):
 	newSampleId = sampleId + "_" + index
 	if index2:
 		if platform == HISEQ4000:
-			index2 = revcomp(index2)
+			index2 = nucleic.reverseComplement(index2.upper())
 		newSampleId += "_" + index2
 
 	return 	",".join([project,lane,newSampleId,newSampleId,index,index2])
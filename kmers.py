@@ -0,0 +1,391 @@
+"""
+k-mer counting for FASTQ and FASTA files. Sequences are encoded at 2 bits per base into NumPy arrays, and the k-mers of a whole batch of sequences are
+computed at once: the batch is joined into one buffer with an N between sequences, and each k-mer code is built by shifting in the k bases of its window
+as whole-array operations. Windows that contain an N or any other base than ACGT are skipped. Counting can be canonical, i.e. a k-mer and its reverse
+complement are counted together under the lesser of their two codes.
+
+A KmerCounter keeps a dense array of counts for k up to DENSE_MAX_K, and otherwise sorted arrays of the distinct k-mer codes and their counts, to which
+each batch's counts are merged. Counters can be merged, so files are counted in a process pool and their counters combined. A counter is pickled with
+only the k-mers it has seen, so a worker doesn't send back a whole dense array. The spectrum of a counter
+is the number of distinct k-mers seen each number of times.
+
+Run the command-line interface as 'python -m gbsc_utils.kmers'.
+"""
+
+from argparse import ArgumentParser
+import collections
+import heapq
+import itertools
+import multiprocessing
+import sys
+
+import numpy as np
+
+from gbsc_utils import codec
+from gbsc_utils import nucleic
+from gbsc_utils import readfilter
+from gbsc_utils.fastq import fastq_utils
+from gbsc_utils.fastq import fastq_mapreduce
+
+#: Longest k that can be 2-bit encoded in a uint64.
+MAX_K = 32
+#: Counts are held in a dense array of 4 ** k counts up to this k (512 MB at k = 13).
+DENSE_MAX_K = 13
+#: The number of sequences that are read and counted at a time.
+BATCH_SIZE = 10000
+#: The number of bases that are encoded at a time. Longer sequences, such as chromosomes, are counted in overlapping pieces.
+CHUNK_SIZE = 1 << 22
+#: Number of codes a sparse KmerCounter buffers before merging them into its counts.
+COMPACT_SIZE = 1 << 23
+
+#: Maps each byte to a 2-bit base code, or to 4 for anything other than ACGT.
+_BASE_CODES = np.frombuffer(nucleic.BASE_CODES,dtype=np.uint8)
+
+def encode(seq):
+	"""
+	Function : Encodes a sequence at 2 bits per base.
+	Args     : seq - bytes, or str.
+	Returns  : uint8 numpy.ndarray of A, C, G, T as 0 to 3, and 4 for other bases.
+	"""
+	if isinstance(seq,str):
+		seq = seq.encode()
+	return _BASE_CODES[np.frombuffer(seq,dtype=np.uint8)]
+
+def decode(code,k):
+	"""
+	Function : Decodes a k-mer code.
+	Returns  : str.
+	"""
+	code = int(code)
+	return "".join("ACGT"[(code >> (2 * i)) & 3] for i in range(k - 1,-1,-1))
+
+def kmerCodes(bases,k,canonical=False):
+	"""
+	Function : Computes the codes of the k-mers of an encoded sequence, with the first base in the highest bits. Windows with a base that isn't ACGT are skipped.
+	Args     : bases - uint8 numpy.ndarray returned by encode().
+	           k - int. At most MAX_K.
+	           canonical - bool. True means that each k-mer is given the lesser of its own code and the code of its reverse complement.
+	Returns  : uint64 numpy.ndarray of the codes of the valid windows, in sequence order.
+	"""
+	numWindows = len(bases) - k + 1
+	if numWindows <= 0:
+		return np.zeros(0,dtype=np.uint64)
+	invalid = np.concatenate([[0],np.cumsum(bases > 3)])
+	valid = invalid[k:] == invalid[:-k]
+	bases = np.minimum(bases,3).astype(np.uint64)
+	codes = np.zeros(numWindows,dtype=np.uint64)
+	for i in range(k):
+		codes <<= np.uint64(2)
+		codes |= bases[i:i + numWindows]
+	if canonical:
+		rcCodes = np.zeros(numWindows,dtype=np.uint64)
+		complement = np.uint64(3) - bases
+		for i in range(k):
+			rcCodes |= complement[i:i + numWindows] << np.uint64(2 * i)
+		np.minimum(codes,rcCodes,out=codes)
+	return codes[valid]
+
+def sequences(infile):
+	"""
+	Function : A generator over the sequences of a FASTQ or FASTA file, which may be compressed. The format is told by the first character.
+	Returns  : generator of bytes.
+	"""
+	with codec.openRead(infile) as fh:
+		first = fh.peek(1)[:1]
+		if first == b">":
+			for rec in readfilter.fastaRecords(fh):
+				yield rec[1]
+		elif first in (b"@",b""):
+			for rec in fastq_utils.blockparse(fh):
+				yield rec[1]
+		else:
+			raise ValueError("Unrecognized file format for {}. Expected a FASTQ or FASTA file.".format(infile))
+
+class KmerCounter:
+	"""
+	Counts of the k-mers of one k. Counters are picklable, so workers can count and return them to be merged.
+	"""
+	def __init__(self,k,canonical=False):
+		"""
+		Args : k - int. At most MAX_K.
+		       canonical - bool. True means that a k-mer and its reverse complement are counted together.
+		"""
+		if not 0 < k <= MAX_K:
+			raise ValueError("k must be between 1 and {}, not {}.".format(MAX_K,k))
+		self.k = k
+		self.canonical = canonical
+		#: The number of sequences counted.
+		self.numSeqs = 0
+		#: When counting by prefix, counts of the prefixes that are shorter than k or have a base other than ACGT, keyed by the prefix as str, so that
+		#: with a prefixLength of k every sequence is counted once, either as a k-mer or here.
+		self.otherPrefixes = collections.Counter()
+		self.isDense = k <= DENSE_MAX_K
+		#: The dense array of 4 ** k counts, allocated by _table() when first needed. An unpickled counter holds its counts in _codes and _counts
+		#: until then.
+		self.dense = None
+		self._codes = np.zeros(0,dtype=np.uint64)
+		self._counts = np.zeros(0,dtype=np.int64)
+		self._pending = []
+		self._numPending = 0
+
+	def addSeqs(self,seqs,prefixLength=None):
+		"""
+		Function : Counts the k-mers of a batch of sequences.
+		Args     : seqs - iterable of bytes.
+		           prefixLength - int. If set, only the k-mers within the first prefixLength bases of each sequence are counted, e.g. 2 with k = 2 to
+		                          count the reads by their first two bases. As elsewhere, k-mers with an N aren't counted; prefixes that are
+		                          shorter than k or have a base other than ACGT are counted as they are in otherPrefixes.
+		Returns  : self.
+		"""
+		pieces = []
+		numBases = 0
+		for seq in seqs:
+			self.numSeqs += 1
+			if prefixLength is not None:
+				seq = seq[:prefixLength]
+				if len(seq) < self.k or seq.translate(None,b"ACGTacgt"):
+					self.otherPrefixes[seq.decode()] += 1
+			for start in range(0,max(len(seq) - self.k + 1,1),CHUNK_SIZE):
+				piece = seq[start:start + CHUNK_SIZE + self.k - 1]
+				pieces.append(piece)
+				numBases += len(piece) + 1
+				if numBases >= CHUNK_SIZE:
+					self._addPieces(pieces)
+					pieces = []
+					numBases = 0
+		self._addPieces(pieces)
+		return self
+
+	def _addPieces(self,pieces):
+		if pieces:
+			self.addCodes(kmerCodes(encode(b"N".join(pieces)),self.k,self.canonical))
+
+	def addCodes(self,codes):
+		"""
+		Function : Counts k-mer codes, such as returned by kmerCodes().
+		Args     : codes - uint64 numpy.ndarray.
+		"""
+		if not len(codes):
+			return
+		if self.isDense:
+			counts = np.bincount(codes.astype(np.intp))
+			self._table()[:len(counts)] += counts
+			return
+		distinct,counts = np.unique(codes,return_counts=True)
+		self._addCounts(distinct,counts.astype(np.int64))
+
+	def _table(self):
+		if self.dense is None:
+			self.dense = np.zeros(4 ** self.k,dtype=np.int64)
+			self.dense[self._codes.astype(np.intp)] += self._counts
+			self._codes = np.zeros(0,dtype=np.uint64)
+			self._counts = np.zeros(0,dtype=np.int64)
+		return self.dense
+
+	def _addCounts(self,codes,counts):
+		self._pending.append((codes,counts))
+		self._numPending += len(codes)
+		if self._numPending > COMPACT_SIZE:
+			self._compact()
+
+	def _compact(self):
+		if not self._pending:
+			return
+		codes = np.concatenate([self._codes] + [x[0] for x in self._pending])
+		counts = np.concatenate([self._counts] + [x[1] for x in self._pending])
+		order = np.argsort(codes,kind="stable")
+		codes = codes[order]
+		starts = np.flatnonzero(np.concatenate([[len(codes) > 0],codes[1:] != codes[:-1]]))
+		self._codes = codes[starts]
+		self._counts = np.add.reduceat(counts[order],starts)
+		self._pending = []
+		self._numPending = 0
+
+	def __getstate__(self):
+		codes,counts = self.counts()
+		state = self.__dict__.copy()
+		state["_codes"],state["_counts"] = codes,counts
+		state["dense"] = None
+		return state
+
+	def merge(self,other):
+		"""
+		Function : Adds the counts of another counter with the same k and canonical setting.
+		Returns  : self.
+		"""
+		if (other.k,other.canonical) != (self.k,self.canonical):
+			raise ValueError("Can't merge counters of different k or canonical settings.")
+		self.numSeqs += other.numSeqs
+		self.otherPrefixes.update(other.otherPrefixes)
+		if self.isDense:
+			if other.dense is not None:
+				self._table()[:] += other.dense
+			else:
+				self._table()[other._codes.astype(np.intp)] += other._counts
+		else:
+			self._addCounts(*other.counts())
+		return self
+
+	def counts(self):
+		"""
+		Function : Gets the k-mers that were seen and their counts.
+		Returns  : two item tuple of the sorted uint64 numpy.ndarray of k-mer codes, and the int64 numpy.ndarray of their counts.
+		"""
+		if self.dense is not None:
+			codes = np.flatnonzero(self.dense)
+			return codes.astype(np.uint64),self.dense[codes]
+		self._compact()
+		return self._codes,self._counts
+
+	def __getitem__(self,kmer):
+		"""
+		Function : Gets the count of a k-mer, given as a str. With canonical counting, a k-mer and its reverse complement have the same count.
+		"""
+		codes = kmerCodes(encode(kmer),self.k,self.canonical)
+		if len(kmer) != self.k or len(codes) != 1:
+			raise KeyError(kmer)
+		allCodes,counts = self.counts()
+		pos = np.searchsorted(allCodes,codes[0])
+		if pos < len(allCodes) and allCodes[pos] == codes[0]:
+			return int(counts[pos])
+		return 0
+
+	def total(self):
+		"""
+		Function : Gets the number of k-mers counted.
+		Returns  : int.
+		"""
+		return int(self.counts()[1].sum())
+
+	def spectrum(self):
+		"""
+		Function : Computes the k-mer spectrum.
+		Returns  : list of two item tuples of (multiplicity,number of distinct k-mers seen that many times), for each multiplicity seen.
+		"""
+		histogram = np.bincount(self.counts()[1])
+		return [(int(x),int(histogram[x])) for x in np.flatnonzero(histogram)]
+
+	def writeCounts(self,fout,minCount=1,top=None):
+		"""
+		Function : Writes the k-mers and their counts, tab-delimited and in k-mer order, or by descending count when top is set. The other prefixes, if
+		           any, are written among them.
+		Args     : fout - A text file handle.
+		           minCount - int. k-mers seen fewer times are left out.
+		           top - int. If set, only this many of the most common k-mers are written.
+		"""
+		codes,counts = self.counts()
+		keep = counts >= minCount
+		codes,counts = codes[keep],counts[keep]
+		others = sorted(x for x in self.otherPrefixes.items() if x[1] >= minCount)
+		if top is not None:
+			rows = [(decode(codes[i],self.k),counts[i]) for i in np.argsort(-counts,kind="stable")[:top]]
+			rows = sorted(rows + others,key=lambda x: -x[1])[:top]
+		else:
+			rows = heapq.merge(((decode(codes[i],self.k),counts[i]) for i in range(len(codes))),others)
+		fout.writelines("{}\t{}\n".format(*x) for x in rows)
+
+	def writeSpectrum(self,fout):
+		"""
+		Function : Writes the k-mer spectrum, tab-delimited.
+		"""
+		fout.write("Multiplicity\tDistinct k-mers\n")
+		fout.writelines("{}\t{}\n".format(*x) for x in self.spectrum())
+
+def countFile(infile,k,canonical=False,prefixLength=None,batchSize=BATCH_SIZE):
+	"""
+	Function : Counts the k-mers of the sequences of a FASTQ or FASTA file.
+	Args     : infile - The FASTQ or FASTA file. May be compressed.
+	           k, canonical - See KmerCounter.
+	           prefixLength - int. See KmerCounter.addSeqs().
+	           batchSize - int. The number of sequences counted at a time.
+	Returns  : KmerCounter.
+	"""
+	counter = KmerCounter(k,canonical)
+	seqs = sequences(infile)
+	while True:
+		batch = list(itertools.islice(seqs,batchSize))
+		if not batch:
+			return counter
+		counter.addSeqs(batch,prefixLength)
+
+def _batchSeqs(recs):
+	"""
+	Function : A mapper for fastq_mapreduce.scan() that takes the sequences of a batch of records.
+	"""
+	return [rec[1] for rec in recs]
+
+class _BatchCounter:
+	"""
+	A picklable reducer for fastq_mapreduce.scan() that counts the k-mers of a batch of sequences into the chunk's counter, so that each chunk fills one
+	counter rather than one per batch.
+	"""
+	def __init__(self,prefixLength):
+		self.prefixLength = prefixLength
+
+	def __call__(self,counter,seqs):
+		return counter.addSeqs(seqs,self.prefixLength)
+
+def mergeCounters(counter,other):
+	"""
+	Function : A merge function for fastq_mapreduce.scan() that adds one KmerCounter to another.
+	"""
+	return counter.merge(other)
+
+def scanFastq(fqFile,k,canonical=False,prefixLength=None,batchSize=BATCH_SIZE,numProcs=None):
+	"""
+	Function : Counts the k-mers of a single FASTQ file in parallel, with the file split into chunks by fastq_mapreduce.scan(). Each chunk has its own
+	           counter, so this is meant for small k; for large k, countFiles() holds fewer counters at once.
+	Args     : numProcs - int. The number of worker processes. Defaults to the number of CPUs.
+	           The other arguments are as for countFile().
+	Returns  : KmerCounter.
+	"""
+	return fastq_mapreduce.scan(fqFile,_batchSeqs,_BatchCounter(prefixLength),KmerCounter(k,canonical),merge=mergeCounters,batchSize=batchSize,numProcs=numProcs)
+
+def _countFile(job):
+	return countFile(*job)
+
+def countFiles(infiles,k,canonical=False,prefixLength=None,batchSize=BATCH_SIZE,numProcs=None):
+	"""
+	Function : Counts the k-mers of several FASTQ or FASTA files in a process pool, one file per worker, and merges the counts.
+	Args     : infiles - list of FASTQ or FASTA files. May be compressed.
+	           numProcs - int. The number of worker processes. Defaults to the number of CPUs.
+	           The other arguments are as for countFile().
+	Returns  : KmerCounter.
+	"""
+	numProcs = min(numProcs or multiprocessing.cpu_count(),len(infiles))
+	jobs = [(x,k,canonical,prefixLength,batchSize) for x in infiles]
+	if numProcs <= 1:
+		counters = map(_countFile,jobs)
+	else:
+		pool = multiprocessing.Pool(numProcs)
+		counters = pool.imap(_countFile,jobs)
+	result = KmerCounter(k,canonical)
+	try:
+		for counter in counters:
+			result.merge(counter)
+	finally:
+		if numProcs > 1:
+			pool.close()
+			pool.join()
+	return result
+
+if __name__ == "__main__":
+	description = "Counts the k-mers of FASTQ or FASTA files, and writes their counts and the k-mer spectrum. Files are counted in parallel and their counts merged."
+	parser = ArgumentParser(description=description)
+	parser.add_argument('-i','--infiles',nargs="+",required=True,help="FASTQ or FASTA files. May be compressed.")
+	parser.add_argument('-k','--k',type=int,required=True,help="The k-mer length, at most {}.".format(MAX_K))
+	parser.add_argument('-c','--canonical',action="store_true",help="Count each k-mer together with its reverse complement.")
+	parser.add_argument('-o','--outfile',help="The file to write the k-mer counts to. Defaults to stdout.")
+	parser.add_argument('-s','--spectrum',help="The file to write the k-mer spectrum to.")
+	parser.add_argument('-m','--min-count',type=int,default=1,help="Leave out k-mers seen fewer times than this. Default is %(default)s.")
+	parser.add_argument('-n','--top',type=int,help="Only write this many of the most common k-mers.")
+	parser.add_argument('-p','--procs',type=int,help="The number of processes to use. Defaults to the number of CPUs.")
+	args = parser.parse_args()
+	counter = countFiles(args.infiles,args.k,args.canonical,numProcs=args.procs)
+	fout = open(args.outfile,'w') if args.outfile else sys.stdout
+	counter.writeCounts(fout,args.min_count,args.top)
+	if args.outfile:
+		fout.close()
+	if args.spectrum:
+		with open(args.spectrum,'w') as fout:
+			counter.writeSpectrum(fout)
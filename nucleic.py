@@ -2,17 +2,79 @@
 #AUTHOR: Nathaniel Watson
 ###
 
+"""
+Complements and reverse complements of nucleic acid sequences with translate tables, so that whole sequences and buffers are converted in C rather than
+letter by letter. The tables cover the IUPAC codes in both cases (U complements to A), and leave other characters, such as '-' and '.', as they are.
+"""
+
+_IUPAC = "ACGTUMRWSYKVHDBN"
+_IUPAC_COMPLEMENT = "TGCAAKYWSRMBDHVN"
+
+#: Table for bytes.translate() and bytearray.translate().
+BYTES_COMPLEMENT = bytes.maketrans((_IUPAC + _IUPAC.lower()).encode(),(_IUPAC_COMPLEMENT + _IUPAC_COMPLEMENT.lower()).encode())
+#: Table for str.translate().
+STR_COMPLEMENT = str.maketrans(_IUPAC + _IUPAC.lower(),_IUPAC_COMPLEMENT + _IUPAC_COMPLEMENT.lower())
+#: Table for bytes.translate() that maps A, C, G and T, in either case, to the 2-bit codes 0 to 3, and any other byte to 4. It's also the lookup table
+#: for encoding sequences as NumPy arrays, as np.frombuffer(BASE_CODES,dtype=np.uint8).
+BASE_CODES = bytes(b"ACGTacgt".index(x) % 4 if x in b"ACGTacgt" else 4 for x in range(256))
+
+def _table(x):
+	return STR_COMPLEMENT if isinstance(x,str) else BYTES_COMPLEMENT
+
+def complement(x):
+	"""
+	Function : Complements a sequence.
+	Args     : x - str, bytes or bytearray.
+	Returns  : The complement, of the same type as x.
+	"""
+	return x.translate(_table(x))
+
+def reverseComplement(x):
+	"""
+	Function : Reverse complements a sequence.
+	Args     : x - str, bytes or bytearray.
+	Returns  : The reverse complement, of the same type as x.
+	Example  : Given that x is ACCTGn, returns nCAGGT.
+	"""
+	return x[::-1].translate(_table(x))
+
 def dnaRevComp(x):
 	"""
-	Function : Returns the reverse complement of a string consisting of the letters A,C,G,T,N.
+	Function : Returns the reverse complement of a string consisting of the letters A,C,G,T,N. Other IUPAC codes and lowercase letters are also complemented.
 	Args     : x - str.
 	Returns  : str.
         Example: Given that x is ACCTG, returns CAGGT
 	"""
-	from string import maketrans
-	x = x[::-1]
-	start="ACGTN"
-	end = "TGCAN"
-	transtab = maketrans(start,end)
-	return x.translate(transtab)
+	return reverseComplement(x)
+
+def reverseComplementAll(seqs):
+	"""
+	Function : Reverse complements a batch of sequences at once. A list of sequences is joined into one buffer with newlines, which is reversed and
+	           translated as a whole, and split again. A NumPy array can be either of fixed-width bytes (dtype 'S'), whose sequences may be shorter than the
+	           width, or a 2D uint8 array of ASCII codes with a sequence per row.
+	Args     : seqs - list of str or bytes (none containing a newline), or numpy.ndarray.
+	Returns  : The reverse complements, as a list or numpy.ndarray of the same type and shape as seqs.
+	"""
+	if hasattr(seqs,"dtype"):
+		return _reverseComplementArray(seqs)
+	if not seqs:
+		return []
+	nl = "\n" if isinstance(seqs[0],str) else b"\n"
+	rcs = reverseComplement(nl.join(seqs)).split(nl)
+	rcs.reverse()
+	return rcs
 
+def _reverseComplementArray(seqs):
+	import numpy as np
+	lut = np.frombuffer(BYTES_COMPLEMENT,dtype=np.uint8)
+	if seqs.dtype == np.uint8 and seqs.ndim == 2:
+		return lut[seqs[:,::-1]]
+	if seqs.dtype.kind != "S":
+		raise ValueError("Can't reverse complement an array of dtype {}.".format(seqs.dtype))
+	width = seqs.dtype.itemsize
+	codes = np.ascontiguousarray(seqs).view(np.uint8).reshape(seqs.shape + (width,))
+	lengths = np.char.str_len(seqs)
+	#Each row is reversed within its length, so that the NUL padding stays at the end.
+	positions = lengths[...,None] - 1 - np.arange(width)
+	rcs = np.where(positions >= 0,lut[np.take_along_axis(codes,np.maximum(positions,0),axis=-1)],0).astype(np.uint8)
+	return rcs.view(seqs.dtype).reshape(seqs.shape)
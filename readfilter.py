@@ -0,0 +1,428 @@
+"""
+A streaming read filter for FASTQ and FASTA files that applies any number of predicates in one pass. The reads are read in batches, and each predicate
+is evaluated on a whole batch at once: the sequences (and quality strings) of a batch are concatenated and viewed as NumPy arrays with numpy.frombuffer(),
+and per-read values are computed with numpy.bincount() over the index of the read that each base belongs to. Predicates that can't be vectorized can be
+wrapped in RecordPredicate.
+
+Mates are filtered together when several files are given: a pair is kept only if all of its mates pass every predicate, so the output files stay in sync.
+Each rejected read (or pair) is attributed to the first predicate that it fails, and the counts are reported by FilterStats. A single FASTQ file can
+also be split into chunks that are filtered in a process pool (see fastq_mapreduce.writeChunks()).
+
+Run the command-line interface as 'python -m gbsc_utils.readfilter'.
+"""
+
+from argparse import ArgumentParser
+import functools
+import itertools
+import sys
+
+import numpy as np
+
+from gbsc_utils import codec
+from gbsc_utils import nucleic
+from gbsc_utils.fastq import fastq_utils
+from gbsc_utils.fastq import fastq_mapreduce
+
+#: The number of reads (or pairs) that are read and filtered at a time.
+BATCH_SIZE = 10000
+#: The Phred offset of the quality strings.
+PHRED_OFFSET = 33
+
+#: Maps each byte to a 2-bit base code, or to 4 for anything other than ACGT.
+_BASE_CODES = np.frombuffer(nucleic.BASE_CODES,dtype=np.uint8)
+
+class Batch:
+	"""
+	A batch of reads from one file. The arrays that predicates work on are computed when first used, and cached, so that predicates share them.
+
+	Attributes : recs - list of records. FASTQ records are the four item tuples of fastq_utils.blockparse(), and FASTA records are the three item tuples
+	                    (header, sequence, raw record) of fastaRecords(). All items are bytes.
+	             isFastq - bool.
+	"""
+	def __init__(self,recs,isFastq):
+		self.recs = recs
+		self.isFastq = isFastq
+
+	def __len__(self):
+		return len(self.recs)
+
+	@functools.cached_property
+	def ids(self):
+		"""
+		list of the mate keys of the reads (see fastq_utils.mateKey()), as bytes.
+		"""
+		return [fastq_utils.mateKey(rec[0]) for rec in self.recs]
+
+	@functools.cached_property
+	def lengths(self):
+		"""
+		1D array of the read lengths.
+		"""
+		return np.fromiter((len(rec[1]) for rec in self.recs),dtype=np.int64,count=len(self.recs))
+
+	@functools.cached_property
+	def starts(self):
+		"""
+		1D array of the offsets of the reads in seqs.
+		"""
+		starts = np.zeros(len(self.recs),dtype=np.int64)
+		np.cumsum(self.lengths[:-1],out=starts[1:])
+		return starts
+
+	@functools.cached_property
+	def readIndex(self):
+		"""
+		1D array of the index of the read that each base in seqs belongs to.
+		"""
+		return np.repeat(np.arange(len(self.recs)),self.lengths)
+
+	@functools.cached_property
+	def seqs(self):
+		"""
+		1D uint8 array of the concatenated sequences.
+		"""
+		return np.frombuffer(b"".join([rec[1] for rec in self.recs]),dtype=np.uint8)
+
+	@functools.cached_property
+	def quals(self):
+		"""
+		1D int16 array of the concatenated quality scores.
+		"""
+		if not self.isFastq:
+			raise ValueError("FASTA reads don't have quality scores.")
+		return np.frombuffer(b"".join([rec[3] for rec in self.recs]),dtype=np.uint8).astype(np.int16) - PHRED_OFFSET
+
+	def countPerRead(self,baseMask):
+		"""
+		Function : Counts the bases of each read that are set in a mask over seqs.
+		Args     : baseMask - 1D bool array the length of seqs.
+		Returns  : 1D int array with a count per read.
+		"""
+		return np.bincount(self.readIndex[baseMask],minlength=len(self.recs))
+
+class LengthRange:
+	"""
+	Keeps reads whose lengths are within a range, inclusive.
+	"""
+	def __init__(self,minLen=0,maxLen=None):
+		self.minLen = minLen
+		self.maxLen = maxLen
+		self.name = "length"
+
+	def __call__(self,batch):
+		mask = batch.lengths >= self.minLen
+		if self.maxLen is not None:
+			mask &= batch.lengths <= self.maxLen
+		return mask
+
+class MeanQuality:
+	"""
+	Keeps reads whose mean quality score is at least minQual. Empty reads are rejected.
+	"""
+	def __init__(self,minQual):
+		self.minQual = minQual
+		self.name = "mean quality"
+
+	def __call__(self,batch):
+		totals = np.bincount(batch.readIndex,weights=batch.quals,minlength=len(batch))
+		return (totals >= self.minQual * batch.lengths) & (batch.lengths > 0)
+
+class MinQuality:
+	"""
+	Keeps reads none of whose bases have a quality score below minQual.
+	"""
+	def __init__(self,minQual):
+		self.minQual = minQual
+		self.name = "min quality"
+
+	def __call__(self,batch):
+		return batch.countPerRead(batch.quals < self.minQual) == 0
+
+class MaxNFraction:
+	"""
+	Keeps reads in which the fraction of bases that are N is at most maxFrac.
+	"""
+	def __init__(self,maxFrac):
+		self.maxFrac = maxFrac
+		self.name = "N fraction"
+
+	def __call__(self,batch):
+		seqs = batch.seqs
+		return batch.countPerRead((seqs == ord("N")) | (seqs == ord("n"))) <= self.maxFrac * batch.lengths
+
+class MaxDustScore:
+	"""
+	Keeps reads whose DUST low-complexity score is at most maxScore. The score of a read is sum(c * (c - 1) / 2) / (l - 1), where c ranges over the counts
+	of each of the 64 trinucleotides in the read, and l is the number of trinucleotides, as in the symmetric DUST algorithm. Trinucleotides containing a base
+	other than ACGT aren't counted. A read of a single repeated base scores about l / 2, while random sequence scores below 1.
+	"""
+	def __init__(self,maxScore):
+		self.maxScore = maxScore
+		self.name = "low complexity"
+
+	def __call__(self,batch):
+		numReads = len(batch)
+		codes = _BASE_CODES[batch.seqs].astype(np.int64)
+		if len(codes) < 3:
+			return np.ones(numReads,dtype=bool)
+		#A trinucleotide starts at each base that is at least 3 bases from the end of its read.
+		posInRead = np.arange(len(codes)) - np.repeat(batch.starts,batch.lengths)
+		valid = posInRead[:-2] <= np.repeat(batch.lengths - 3,batch.lengths)[:-2]
+		valid &= (codes[:-2] < 4) & (codes[1:-1] < 4) & (codes[2:] < 4)
+		trinucs = codes[:-2] * 16 + codes[1:-1] * 4 + codes[2:]
+		counts = np.bincount(batch.readIndex[:-2][valid] * 64 + trinucs[valid],minlength=numReads * 64).reshape(numReads,64)
+		numTrinucs = counts.sum(axis=1)
+		scores = (counts * (counts - 1) // 2).sum(axis=1) / np.maximum(numTrinucs - 1,1)
+		return scores <= self.maxScore
+
+class IdSet:
+	"""
+	Keeps reads whose IDs are in a set, or with exclude, whose IDs aren't. IDs are compared as mate keys (see fastq_utils.mateKey()), so an ID
+	matches both mates of a pair.
+	"""
+	def __init__(self,ids,exclude=False):
+		"""
+		Args : ids - iterable of str or bytes IDs.
+		       exclude - bool. True means to reject the reads in the set rather than keep them.
+		"""
+		self.ids = set()
+		for x in ids:
+			if isinstance(x,str):
+				x = x.encode()
+			self.ids.add(fastq_utils.mateKey(b">" + x))
+		self.exclude = exclude
+		self.name = "excluded ID" if exclude else "ID not allowed"
+
+	def __call__(self,batch):
+		ids = self.ids
+		return np.fromiter(((x in ids) != self.exclude for x in batch.ids),dtype=bool,count=len(batch))
+
+class RecordPredicate:
+	"""
+	Adapts a function that tests one record at a time into a predicate.
+	"""
+	def __init__(self,name,func):
+		"""
+		Args : name - str. The name to report rejections under.
+		       func - function taking a record (see Batch) and returning True to keep it.
+		"""
+		self.name = name
+		self.func = func
+
+	def __call__(self,batch):
+		return np.fromiter((bool(self.func(rec)) for rec in batch.recs),dtype=bool,count=len(batch))
+
+class FilterStats:
+	"""
+	Counts of the reads (or pairs) filtered by filterReads().
+
+	Attributes : numReads - int. The number of reads (pairs) read.
+	             numPassed - int. The number that passed all predicates.
+	             rejects - dict mapping each predicate name to the number of reads (pairs) that failed it first, in the order of the predicates.
+	"""
+	def __init__(self,predicates):
+		self.numReads = 0
+		self.numPassed = 0
+		self.rejects = dict((pred.name,0) for pred in predicates)
+
+	def merge(self,other):
+		"""
+		Function : Adds the counts of another FilterStats for the same predicates.
+		Returns  : self.
+		"""
+		self.numReads += other.numReads
+		self.numPassed += other.numPassed
+		for name,count in other.rejects.items():
+			self.rejects[name] += count
+		return self
+
+	def writeReport(self,fout):
+		"""
+		Function : Writes the counts as tab-delimited lines to a text file handle.
+		"""
+		perc = self.numPassed * 100.0 / self.numReads if self.numReads else 0
+		fout.write("Total\t{numReads}\n".format(numReads=self.numReads))
+		fout.write("Passed\t{numPassed}\t{perc:.2f}%\n".format(numPassed=self.numPassed,perc=perc))
+		for name,count in self.rejects.items():
+			fout.write("Rejected ({name})\t{count}\n".format(name=name,count=count))
+
+def fastaRecords(fh):
+	"""
+	Function : A generator over the records of a FASTA file.
+	Args     : fh - A file handle open for reading in binary mode.
+	Returns  : generator of three item tuples of bytes, being the header line, the sequence with the line breaks removed, and the record as it appears in
+	           the file (without blank lines, and always ending in a newline).
+	Raises   : ValueError - The file doesn't start with a header line.
+	"""
+	header = None
+	lines = []
+	for line in fh:
+		if line.startswith(b">"):
+			if header is not None:
+				yield _fastaRec(header,lines)
+			header = line
+			lines = []
+		elif not line.strip():
+			continue
+		elif header is None:
+			raise ValueError("Invalid FASTA file. Expected first line to start with '>'.")
+		else:
+			lines.append(line)
+	if header is not None:
+		yield _fastaRec(header,lines)
+
+def _fastaRec(header,lines):
+	raw = header + b"".join(lines)
+	if not raw.endswith(b"\n"):
+		raw += b"\n"
+	return header.rstrip(),b"".join([x.strip() for x in lines]),raw
+
+def _isFastq(fh):
+	"""
+	Function : Tells a FASTQ file from a FASTA file by the first character, without consuming it.
+	Args     : fh - A buffered binary file handle.
+	"""
+	first = fh.peek(1)[:1]
+	if first not in (b"@",b">",b""):
+		raise ValueError("Unrecognized file format. Expected a FASTQ or FASTA file.")
+	return first != b">"
+
+def _writeBatch(fout,recs,isFastq):
+	if isFastq:
+		fastq_utils.writeViews(fout,recs)
+	else:
+		fout.writelines([rec[2] for rec in recs])
+
+def _applyPredicates(batches,predicates,stats):
+	"""
+	Function : Tests a batch of reads (or one batch per mate file) against the predicates, and counts the results in stats.
+	Args     : batches - list of Batch objects, one per mate file, holding the same reads.
+	           predicates - list of predicates (see filterReads()).
+	           stats - FilterStats. Updated in place.
+	Returns  : 1D array of the indices of the reads (pairs) to keep.
+	"""
+	keep = np.ones(len(batches[0]),dtype=bool)
+	for pred in predicates:
+		passed = functools.reduce(np.logical_and,[pred(batch) for batch in batches])
+		stats.rejects[pred.name] += int(np.count_nonzero(keep & ~passed))
+		keep &= passed
+	stats.numReads += len(keep)
+	stats.numPassed += int(np.count_nonzero(keep))
+	return np.flatnonzero(keep)
+
+def _filterChunk(job):
+	"""
+	Function : Worker for filterReads() with numProcs. Filters the reads of one chunk of a FASTQ file (see fastq_mapreduce.chunks()) into a shard file.
+	Returns  : FilterStats.
+	"""
+	fqFile,start,end,shardFile,predicates,batchSize = job
+	#One compression thread, since there is already a worker process per CPU.
+	fout = codec.openWrite(shardFile,threads=1)
+	stats = FilterStats(predicates)
+	recs = fastq_mapreduce.iterChunk(fqFile,start,end)
+	while True:
+		batch = Batch(list(itertools.islice(recs,batchSize)),True)
+		if not len(batch):
+			break
+		indices = _applyPredicates([batch],predicates,stats)
+		_writeBatch(fout,[batch.recs[i] for i in indices],True)
+	fout.close()
+	return stats
+
+def filterReads(infiles,outfiles,predicates,batchSize=BATCH_SIZE,threads=None,numProcs=1):
+	"""
+	Function : Writes the reads (or pairs of reads) of FASTQ or FASTA files that pass all of the predicates to output files, in one pass.
+	Args     : infiles - list of FASTQ or FASTA files, such as the R1 and R2 files of a run, whose reads are mates in the same order. May be compressed.
+	           outfiles - list of output files, one per input file. Compressed according to the extension (see codec.openWrite()).
+	           predicates - list of predicates, i.e. objects with a name attribute, which when called with a Batch, return a bool array that is True
+	                        for the reads to keep, such as those of this module.
+	           batchSize - int. The number of reads (pairs) to filter at a time.
+	           threads - int. The number of BGZF compression threads per output file. Defaults to the number of CPUs.
+	           numProcs - int. The number of worker processes, or None for the number of CPUs. With more than one, a single FASTQ file is split into
+	                      chunks that are filtered in parallel (see fastq_mapreduce.writeChunks()), and the predicates must be picklable. Mate files and
+	                      FASTA files are always filtered in one process.
+	Returns  : FilterStats.
+	Raises   : ValueError - The mates in the input files aren't in the same order, or the files have different numbers of reads.
+	"""
+	if len(infiles) != len(outfiles):
+		raise ValueError("There must be one output file per input file.")
+	fhs = [codec.openRead(x) for x in infiles]
+	formats = [_isFastq(fh) for fh in fhs]
+	if numProcs != 1 and len(infiles) == 1 and formats[0]:
+		fhs[0].close()
+		stats = FilterStats(predicates)
+		for chunkStats in fastq_mapreduce.writeChunks(infiles[0],_filterChunk,(predicates,batchSize),outfiles[0],numProcs):
+			stats.merge(chunkStats)
+		return stats
+	gens = [fastq_utils.blockparse(fh) if isFastq else fastaRecords(fh) for fh,isFastq in zip(fhs,formats)]
+	fouts = [codec.BackgroundWriter(codec.openWrite(x,threads=threads)) for x in outfiles]
+	stats = FilterStats(predicates)
+	units = itertools.zip_longest(*gens)
+	try:
+		while True:
+			chunk = list(itertools.islice(units,batchSize))
+			if not chunk:
+				break
+			if None in chunk[-1]:
+				raise ValueError("The input files have different numbers of reads.")
+			batches = [Batch(list(recs),isFastq) for recs,isFastq in zip(zip(*chunk),formats)]
+			if len(batches) > 1 and any(batch.ids != batches[0].ids for batch in batches[1:]):
+				raise ValueError("The mates in the input files aren't in the same order.")
+			indices = _applyPredicates(batches,predicates,stats)
+			for fout,batch in zip(fouts,batches):
+				_writeBatch(fout,[batch.recs[i] for i in indices],batch.isFastq)
+	finally:
+		for fh in fhs + fouts:
+			fh.close()
+	return stats
+
+def _readIds(idFile):
+	fh = open(idFile,'r')
+	ids = [line.strip().lstrip("@>") for line in fh if line.strip()]
+	fh.close()
+	return ids
+
+def buildPredicates(args):
+	"""
+	Function : Builds the list of predicates selected by the command-line options of main().
+	"""
+	predicates = []
+	if args.ids:
+		predicates.append(IdSet(_readIds(args.ids)))
+	if args.exclude_ids:
+		predicates.append(IdSet(_readIds(args.exclude_ids),exclude=True))
+	if args.min_length or args.max_length is not None:
+		predicates.append(LengthRange(args.min_length,args.max_length))
+	if args.max_n_frac is not None:
+		predicates.append(MaxNFraction(args.max_n_frac))
+	if args.min_mean_qual is not None:
+		predicates.append(MeanQuality(args.min_mean_qual))
+	if args.min_qual is not None:
+		predicates.append(MinQuality(args.min_qual))
+	if args.max_dust is not None:
+		predicates.append(MaxDustScore(args.max_dust))
+	return predicates
+
+if __name__ == "__main__":
+	description = "Filters the reads of FASTQ or FASTA files by any combination of length, quality, N content, sequence complexity, and ID. Mate files (e.g. R1 and R2) can be filtered together, in which case a pair is kept only if both mates pass, and the output files stay in sync. The number of reads rejected by each filter is reported at the end."
+	parser = ArgumentParser(description=description)
+	parser.add_argument('-i','--infiles',nargs="+",required=True,help="One input file, or one per mate. FASTQ or FASTA, and may be compressed.")
+	parser.add_argument('-o','--outfiles',nargs="+",required=True,help="One output file per input file. Compressed according to the extension ('.gz' is written as BGZF).")
+	parser.add_argument('--min-length',type=int,default=0,help="Reject reads shorter than this.")
+	parser.add_argument('--max-length',type=int,help="Reject reads longer than this.")
+	parser.add_argument('--min-mean-qual',type=float,help="FASTQ only. Reject reads whose mean quality score is below this.")
+	parser.add_argument('--min-qual',type=int,help="FASTQ only. Reject reads with any base whose quality score is below this.")
+	parser.add_argument('--max-n-frac',type=float,help="Reject reads in which the fraction of N bases is greater than this.")
+	parser.add_argument('--max-dust',type=float,help="Reject reads whose DUST low-complexity score is greater than this. Homopolymers score about half their length, and random sequence below 1.")
+	parser.add_argument('--ids',help="A file of read IDs, one per line, to keep. Other reads are rejected.")
+	parser.add_argument('--exclude-ids',help="A file of read IDs, one per line, to reject.")
+	parser.add_argument('-r','--report',help="The file to write the filtering counts to. Defaults to stdout.")
+	parser.add_argument('-t','--threads',type=int,help="The number of compression threads per output file. Defaults to the number of CPUs.")
+	parser.add_argument('-p','--procs',type=int,default=1,help="The number of processes with which to filter a single FASTQ file, or 0 for the number of CPUs. Default is %(default)s.")
+	args = parser.parse_args()
+	predicates = buildPredicates(args)
+	stats = filterReads(args.infiles,args.outfiles,predicates,threads=args.threads,numProcs=args.procs or None)
+	fout = open(args.report,'w') if args.report else sys.stdout
+	stats.writeReport(fout)
+	if args.report:
+		fout.close()
@@ -4,20 +4,11 @@
 # Takes a file containing a list of sequences and
 # outputs a file with the reverse complements
 
-import StringIO
 from optparse import OptionParser
 
+from gbsc_utils import nucleic
+
 class ReverseComplement:
-    complementDict = {
-        'C': 'G',
-        'c': 'g',
-        'G': 'C',
-        'g': 'c',
-        'A': 'T',
-        'a': 't',
-        'T': 'A',
-        't': 'a',
-        }
 
     def __init__(self, inputFile, outputFile, doPrintLabel):
         self.inputFile = inputFile
@@ -26,29 +17,14 @@ class ReverseComplement:
 
     def reverse(self):
         with open(self.inputFile) as f:
-            with open(self.outputFile, 'w') as o:
-                for rawLine in f.readlines():
-                    lineIn = self._line_strip(rawLine)
-                    lineOut = self._line_reverse_complement(lineIn)\
-                        +self._line_name(lineIn)\
-                        +'\n'
-                    o.write(lineOut)
+            lines = [self._line_strip(rawLine) for rawLine in f]
+        reverseComplements = nucleic.reverseComplementAll(lines)
+        with open(self.outputFile, 'w') as o:
+            o.writelines(rc + self._line_name(line) + '\n' for line, rc in zip(lines, reverseComplements))
 
     def _line_strip(self, line):
         return line.strip()
 
-    def _line_reverse_complement(self, line):
-        return self._line_reverse(self._line_complement(line))
-
-    def _line_reverse(self, line):
-        return line[::-1]
-
-    def _line_complement(self, line):
-        buf = StringIO.StringIO()
-        for letter in line:
-            buf.write(self.complementDict[letter])
-        return buf.getvalue()
-
     def _line_name(self, line):
         if self.doPrintLabel:
             return ' generated_from_barcode_'+line